@@ -1,31 +1,57 @@
 #!/usr/bin/env bash
 # SMASH Cloud Core - Local Backup Script
-# Creates rsync snapshot backups to /mnt/smash_data/backups/YYYYMMDD
+# Deduplicating snapshot of Nextcloud data plus a consistent copy of the
+# Voice AI SQLite database into /mnt/smash_data/backups/repo (scripts/smash_backup.py)
 # Usage: bash scripts/backup_local.sh
+#
+# BACKUP_MODE=rsync keeps the old behaviour: a daily rsync --link-dest tree
+# in /mnt/smash_data/backups/YYYYMMDD.
 
 set -euo pipefail
 
+SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
 SOURCE_DIR=${NEXTCLOUD_DATA:-"/mnt/smash_data/data"}
 BACKUP_ROOT=${DATA_MOUNT:-"/mnt/smash_data"}/backups
-STAMP=$(date +%Y%m%d)
-DEST_DIR="$BACKUP_ROOT/$STAMP"
-LATEST_LINK="$BACKUP_ROOT/latest"
+BACKUP_MODE=${BACKUP_MODE:-dedup}
+SMASH_DB=${SMASH_DB:-"$SCRIPT_DIR/../smash_core/smash_ai.db"}
+KEEP_LAST=${KEEP_LAST:-30}
 
 mkdir -p "$BACKUP_ROOT"
 
-echo "Starting local backup: $SOURCE_DIR -> $DEST_DIR"
+if [[ "$BACKUP_MODE" == "rsync" ]]; then
+  STAMP=$(date +%Y%m%d)
+  DEST_DIR="$BACKUP_ROOT/$STAMP"
+  LATEST_LINK="$BACKUP_ROOT/latest"
 
-if [[ -d "$LATEST_LINK" ]]; then
-  RSYNC_LINK="--link-dest=$LATEST_LINK"
-else
-  RSYNC_LINK=""
+  echo "Starting local backup: $SOURCE_DIR -> $DEST_DIR"
+
+  if [[ -d "$LATEST_LINK" ]]; then
+    RSYNC_LINK="--link-dest=$LATEST_LINK"
+  else
+    RSYNC_LINK=""
+  fi
+
+  rsync -aHAX --delete --numeric-ids \
+    $RSYNC_LINK \
+    "$SOURCE_DIR/" "$DEST_DIR/"
+
+  ln -sfn "$DEST_DIR" "$LATEST_LINK"
+
+  echo "Backup completed: $DEST_DIR"
+  exit 0
 fi
 
-rsync -aHAX --delete --numeric-ids \
-  $RSYNC_LINK \
-  "$SOURCE_DIR/" "$DEST_DIR/"
+REPO="$BACKUP_ROOT/repo"
+SQLITE_ARGS=()
+if [[ -f "$SMASH_DB" ]]; then
+  SQLITE_ARGS=(--sqlite "$SMASH_DB")
+fi
 
-ln -sfn "$DEST_DIR" "$LATEST_LINK"
+echo "Starting local backup: $SOURCE_DIR -> $REPO"
 
-echo "Backup completed: $DEST_DIR"
+python3 "$SCRIPT_DIR/smash_backup.py" --repo "$REPO" backup "$SOURCE_DIR" \
+  "${SQLITE_ARGS[@]}" --exclude "*.part" --exclude "*/cache/*"
+python3 "$SCRIPT_DIR/smash_backup.py" --repo "$REPO" verify latest
+python3 "$SCRIPT_DIR/smash_backup.py" --repo "$REPO" prune --keep-last "$KEEP_LAST"
 
+echo "Backup completed: $REPO"
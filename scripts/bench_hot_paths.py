@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+SMASH Cloud Core - Microbenchmarks for the Voice AI hot paths
+
+Times the in-process functions on every request, in isolation, against a
+throwaway SQLite database filled with synthetic data:
+
+  similarity          DatabaseManager._calculate_similarity
+  learning_match      DatabaseManager.find_learning_match at each --patterns size
+  intent_cascade      JarvisLLM._route_intent (the keyword cascade behind
+                      _generate_response), per branch and for a fall-through
+  generate_response   JarvisLLM._generate_response for a matched intent
+  save_conversation   DatabaseManager.save_conversation (one commit per call)
+  recent_conversations DatabaseManager.get_recent_conversations at each --conversations size
+  voice_activation    VoiceProcessor._is_voice_activated, hit and miss
+
+Each benchmark is calibrated so one sample takes at least --sample-time and is
+repeated for at least --min-time. The JSON report carries environment metadata
+and the git commit; --compare flags benchmarks whose median got slower than
+--threshold and exits non-zero, so it can gate a change.
+
+Run locally:
+  python3 scripts/bench_hot_paths.py --output bench.json
+  python3 scripts/bench_hot_paths.py --patterns 1000 10000 100000 --conversations 100000 1000000
+  python3 scripts/bench_hot_paths.py --only learning_match --compare bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+SMASH_CORE = ROOT / "smash_core"
+
+BENCHMARKS = ("similarity", "learning_match", "intent_cascade", "generate_response",
+              "save_conversation", "recent_conversations", "voice_activation")
+
+# One message per branch of the intent cascade, in cascade order
+INTENT_MESSAGES = {
+    "activation": "hey smash are you there",
+    "system": "show me the system status",
+    "files": "upload the report to storage",
+    "users": "give the new admin access",
+    "learning": "remember that i like short answers",
+    "help": "what can you do for me",
+    "weather_time": "what is the weather like",
+    "greeting": "hello there",
+    "fallthrough": "tell me a story about the server room",
+}
+
+
+def build_vocabulary(size: int, rng: random.Random) -> List[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def synthetic_phrase(vocabulary: List[str], rng: random.Random) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(4, 10)))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def measure(fn: Callable[[], object], sample_time: float, min_time: float, min_samples: int = 5) -> Dict:
+    """Per-call timings: calibrate calls per sample, then sample for min_time"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= sample_time or number >= 1 << 20:
+            break
+        number *= 2
+
+    samples = [elapsed / number]
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_samples or time.perf_counter() < deadline:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) / number)
+
+    ordered = sorted(samples)
+    median = statistics.median(ordered)
+    return {
+        "median_us": round(median * 1e6, 3),
+        "mean_us": round(statistics.fmean(ordered) * 1e6, 3),
+        "min_us": round(ordered[0] * 1e6, 3),
+        "p95_us": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1e6, 3),
+        "stdev_us": round(statistics.stdev(ordered) * 1e6, 3) if len(ordered) > 1 else 0.0,
+        "ops_per_s": round(1 / median, 1) if median else None,
+        "samples": len(ordered),
+        "calls_per_sample": number,
+    }
+
+
+class Suite:
+    """Imports smash_core against a scratch database and runs the benchmarks"""
+
+    def __init__(self, args, workdir: str):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.vocabulary = build_vocabulary(args.vocabulary, self.rng)
+        self.results: List[Dict] = []
+
+        # Settings are read at import time, so configure before importing
+        os.environ.update({
+            "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            "AUDIO_STORE_DIR": os.path.join(workdir, "static"),
+            "TIMESERIES_DIR": os.path.join(workdir, "metrics_history"),
+            "STATE_BACKEND": "memory",
+            "TRACE_LOG_ENABLED": "false",
+            "OPENAI_API_KEY": "",
+        })
+        sys.path.insert(0, str(SMASH_CORE))
+        from core import database
+        from core.config import get_settings
+        from core.llm import jarvis_llm
+        from core.voice_processor import VoiceProcessor
+
+        database.Base.metadata.create_all(bind=database.engine)
+        self.database = database
+        self.db = database.db_manager
+        self.llm = jarvis_llm
+        self.settings = get_settings()
+        self.voice = VoiceProcessor(self.settings)
+
+    def record(self, name: str, params: Dict, fn: Callable[[], object]):
+        stats = measure(fn, self.args.sample_time, self.args.min_time)
+        self.results.append({"name": name, "params": params, **stats})
+        label = " ".join(f"{key}={value}" for key, value in params.items())
+        print(f"{name} {label}: median {stats['median_us']} us ({stats['ops_per_s']} ops/s)", file=sys.stderr)
+
+    def _bulk_insert(self, table, rows: List[Dict]):
+        with self.database.engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+
+    def bench_similarity(self):
+        pairs = [(synthetic_phrase(self.vocabulary, self.rng), synthetic_phrase(self.vocabulary, self.rng))
+                 for _ in range(256)]
+        pairs += [(text, text) for text, _ in pairs[:64]]
+        index = 0
+
+        def call():
+            nonlocal index
+            self.db._calculate_similarity(*pairs[index % len(pairs)])
+            index += 1
+
+        self.record("similarity", {"pairs": len(pairs)}, call)
+
+    def bench_learning_match(self):
+        table = self.database.LearningData.__table__
+        patterns: List[str] = []
+        for size in sorted(self.args.patterns):
+            batch = [synthetic_phrase(self.vocabulary, self.rng) for _ in range(size - len(patterns))]
+            for start in range(0, len(batch), 10000):
+                self._bulk_insert(table, [{"pattern": pattern, "response": "learned response",
+                                           "category": "bench", "confidence": 0.9, "usage_count": 1}
+                                          for pattern in batch[start:start + 10000]])
+            patterns.extend(batch)
+
+            # Stored patterns (hits) and unseen phrases (misses)
+            for outcome, queries in (
+                ("hit", [self.rng.choice(patterns) for _ in range(32)]),
+                ("miss", [synthetic_phrase(self.vocabulary, self.rng) for _ in range(32)]),
+            ):
+                index = 0
+
+                def call():
+                    nonlocal index
+                    self.db.find_learning_match(queries[index & 31], record_usage=False)
+                    index += 1
+
+                self.record("learning_match", {"patterns": size, "query": outcome}, call)
+
+    def bench_intent_cascade(self):
+        address = self.settings.address_user_as
+        for branch, message in INTENT_MESSAGES.items():
+            message_lower = message.lower()
+            self.record("intent_cascade", {"branch": branch},
+                        lambda: self.llm._route_intent(message_lower, address))
+
+    def bench_generate_response(self):
+        loop = asyncio.new_event_loop()
+        try:
+            message = INTENT_MESSAGES["greeting"]
+            self.record("generate_response", {"branch": "greeting"},
+                        lambda: loop.run_until_complete(self.llm._generate_response(message, None, [])))
+        finally:
+            loop.close()
+
+    def bench_save_conversation(self):
+        self.record("save_conversation", {"commit": "per_call"},
+                    lambda: self.db.save_conversation("benchmark question", "benchmark answer",
+                                                      None, 0.8))
+
+    def bench_recent_conversations(self):
+        table = self.database.Conversation.__table__
+        with self.database.engine.connect() as conn:
+            existing = conn.execute(self.database.text("SELECT COUNT(*) FROM conversations")).scalar()
+        started_at = datetime.now() - timedelta(days=365)
+        for size in sorted(self.args.conversations):
+            for start in range(existing, size, 20000):
+                self._bulk_insert(table, [{
+                    "user_message": f"question {i}",
+                    "assistant_response": f"answer {i}",
+                    "user_id": "bench",
+                    "timestamp": started_at + timedelta(seconds=i),
+                    "confidence_score": 0.8,
+                } for i in range(start, min(start + 20000, size))])
+            existing = max(existing, size)
+            for limit in (10, 100):
+                self.record("recent_conversations", {"rows": size, "limit": limit},
+                            lambda: self.db.get_recent_conversations(limit))
+
+    def bench_voice_activation(self):
+        for outcome, text in (("hit", "okay jarvis what is on my calendar today"),
+                              ("miss", "the quarterly numbers look fine to me overall")):
+            self.record("voice_activation", {"text": outcome},
+                        lambda: self.voice._is_voice_activated(text))
+
+    def run(self, names: List[str]) -> List[Dict]:
+        for name in names:
+            getattr(self, f"bench_{name}")()
+        return self.results
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float) -> List[Dict]:
+    """Benchmarks whose median is more than `threshold` slower than the baseline"""
+    baseline = {
+        (entry["name"], json.dumps(entry["params"], sort_keys=True)): entry
+        for entry in json.loads(Path(baseline_path).read_text())["results"]
+    }
+    regressions = []
+    for entry in results:
+        previous = baseline.get((entry["name"], json.dumps(entry["params"], sort_keys=True)))
+        if not previous or not previous["median_us"]:
+            continue
+        ratio = entry["median_us"] / previous["median_us"]
+        entry["baseline_median_us"] = previous["median_us"]
+        entry["ratio"] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append({"name": entry["name"], "params": entry["params"], "ratio": entry["ratio"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SMASH Voice AI hot-path microbenchmarks")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--patterns", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Learned-pattern table sizes for learning_match")
+    parser.add_argument("--conversations", type=int, nargs="+", default=[10000, 1000000],
+                        help="Conversation table sizes for recent_conversations")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="Distinct words in synthetic text")
+    parser.add_argument("--sample-time", type=float, default=0.05, help="Minimum seconds per sample")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Minimum seconds per benchmark")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--compare", help="Baseline JSON report to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown before failing")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        suite = Suite(args, workdir)
+        import sqlalchemy
+        report = {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "platform": platform.platform(),
+                "machine": platform.machine(),
+                "processor": platform.processor(),
+                "cpus": os.cpu_count(),
+                "sqlite": sqlite3.sqlite_version,
+                "sqlalchemy": sqlalchemy.__version__,
+            },
+            "config": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+            "results": suite.run(args.only),
+        }
+        suite.db.cleanup()
+
+    regressions = compare(report["results"], args.compare, args.threshold) if args.compare else []
+    if args.compare:
+        report["baseline"] = args.compare
+        report["regressions"] = regressions
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    print(text)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than the baseline by more than "
+              f"{args.threshold:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+SMASH Cloud Core - Local stand-ins for Whisper, Piper and Ollama
+
+One small server implementing just enough of each upstream API for smash_core
+to run end to end without models or network access:
+
+  Whisper  POST /transcribe     multipart "file" -> {"text": ...}
+  Piper    POST /synthesize     {"text": ...}    -> audio/wav of a fixed size
+  Ollama   POST /api/generate   NDJSON token stream, or one JSON body with stream=false
+                                (404 for a model not in --models)
+           GET  /api/tags       installed models (health probe)
+           GET  /api/ps         models loaded by a generate call so far
+  all      GET  /health
+
+Each service has its own latency distribution and error rate, so load tests
+can model slow or flaky upstreams. Latency specs (milliseconds):
+
+  50                  fixed 50 ms
+  uniform:20:80       uniform between 20 and 80 ms
+  normal:60:15        normal, mean 60, sd 15 (clamped at 0)
+  lognormal:60:0.5    lognormal with median 60 and sigma 0.5 (long tail)
+  exp:40              exponential with mean 40
+
+Run locally and point smash_core at it:
+  python3 scripts/fake_upstreams.py --port 9100 --stt-latency lognormal:120:0.4 --llm-tokens 60
+  WHISPER_HOST=http://127.0.0.1:9100 PIPER_HOST=http://127.0.0.1:9100 \\
+    OLLAMA_HOST=http://127.0.0.1:9100 uvicorn app:app
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import wave
+from typing import Callable
+
+import uvicorn
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# Filler the fake LLM streams back, one word per token
+LOREM = ("certainly the requested system check completed and every service "
+         "reports nominal status with storage healthy and backups current").split()
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Turn a latency spec into a sampler returning seconds"""
+    kind, _, rest = spec.partition(":")
+    args = [float(value) for value in rest.split(":")] if rest else []
+    if not rest:
+        fixed = float(kind) / 1000
+        return lambda: fixed
+    if kind == "uniform":
+        low, high = args
+        return lambda: random.uniform(low, high) / 1000
+    if kind == "normal":
+        mean, sd = args
+        return lambda: max(random.gauss(mean, sd), 0.0) / 1000
+    if kind == "lognormal":
+        median, sigma = args
+        mu = math.log(median)
+        return lambda: random.lognormvariate(mu, sigma) / 1000
+    if kind == "exp":
+        (mean,) = args
+        return lambda: random.expovariate(1 / mean) / 1000 if mean else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def silent_wav(size: int, sample_rate: int = 22050) -> bytes:
+    """16-bit mono silence, about `size` bytes including the header"""
+    frames = max(size - 44, 0) // 2
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * frames)
+    return buffer.getvalue()
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI(title="SMASH fake upstreams")
+    stt_latency = parse_latency(args.stt_latency)
+    tts_latency = parse_latency(args.tts_latency)
+    llm_latency = parse_latency(args.llm_latency)
+    token_latency = parse_latency(args.llm_token_latency)
+    tts_audio = silent_wav(args.tts_bytes)
+    words = (LOREM * (args.llm_tokens // len(LOREM) + 1))[:args.llm_tokens]
+    models = [model if ":" in model else f"{model}:latest" for model in args.models.split(",") if model]
+    loaded = []
+    counts = {"transcribe": 0, "synthesize": 0, "generate": 0, "errors": 0}
+
+    def failed(rate: float) -> bool:
+        if rate and random.random() < rate:
+            counts["errors"] += 1
+            return True
+        return False
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "requests": counts}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": model} for model in models]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": model} for model in loaded]}
+
+    @app.post("/transcribe")
+    async def transcribe(file: UploadFile = File(...)):
+        counts["transcribe"] += 1
+        await file.read()
+        await asyncio.sleep(stt_latency())
+        if failed(args.stt_error_rate):
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        return {"text": args.stt_text}
+
+    @app.post("/synthesize")
+    async def synthesize(request: Request):
+        counts["synthesize"] += 1
+        await request.body()
+        await asyncio.sleep(tts_latency())
+        if failed(args.tts_error_rate):
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        return Response(tts_audio, media_type="audio/wav")
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        counts["generate"] += 1
+        body = await request.json()
+        model = body.get("model") or ""
+        model = model if ":" in model else f"{model}:latest"
+        if model not in models:
+            return JSONResponse({"error": f"model '{body.get('model')}' not found"}, status_code=404)
+        if model not in loaded:
+            loaded.append(model)
+        if not body.get("prompt"):
+            # Model load (warm-up) request
+            return {"model": body.get("model"), "response": "", "done": True}
+        await asyncio.sleep(llm_latency())
+        if failed(args.llm_error_rate):
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+
+        if not body.get("stream", True):
+            await asyncio.sleep(sum(token_latency() for _ in words))
+            return {"model": body.get("model"), "response": " ".join(words), "done": True}
+
+        async def tokens():
+            for index, word in enumerate(words):
+                if index:
+                    await asyncio.sleep(token_latency())
+                yield json.dumps({"response": (" " if index else "") + word, "done": False}) + "\n"
+            yield json.dumps({"response": "", "done": True, "eval_count": len(words)}) + "\n"
+
+        return StreamingResponse(tokens(), media_type="application/x-ndjson")
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Fake Whisper/Piper/Ollama for offline load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--stt-latency", default="lognormal:120:0.4")
+    parser.add_argument("--stt-error-rate", type=float, default=0.0)
+    parser.add_argument("--stt-text", default="jarvis tell me a story about the server room")
+    parser.add_argument("--tts-latency", default="lognormal:80:0.4")
+    parser.add_argument("--tts-error-rate", type=float, default=0.0)
+    parser.add_argument("--tts-bytes", type=int, default=96000, help="Size of the returned WAV")
+    parser.add_argument("--llm-latency", default="lognormal:150:0.5", help="Time to first token")
+    parser.add_argument("--llm-token-latency", default="exp:15", help="Delay between tokens")
+    parser.add_argument("--llm-tokens", type=int, default=40)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--models", default="llama3:latest", help="Comma-separated Ollama models installed")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,45 @@
 #!/usr/bin/env bash
 # SMASH Cloud Core - Health Check Script
-# Warn if CPU, memory, or disk utilization exceeds 85%
+# Report CPU, memory, disk and temperature; exit 1 while a threshold alert is active
 # Usage: bash scripts/health_check.sh
+#
+# Reads the smash_core host metrics collector (/api/system/metrics), whose
+# alerts already have hysteresis (raise at HOST_ALERT_RAISE, clear below
+# HOST_ALERT_CLEAR). If the API is unreachable it samples locally and compares
+# against THRESHOLD instead.
 
 set -euo pipefail
 
 THRESHOLD=${THRESHOLD:-85}
+SMASH_METRICS_URL=${SMASH_METRICS_URL:-http://127.0.0.1:8000/api/system/metrics}
+
+from_api() {
+  curl -fsS --max-time 3 "$SMASH_METRICS_URL" | python3 -c '
+import json, sys
+try:
+    snapshot = json.load(sys.stdin)
+    if not snapshot.get("available"):
+        sys.exit(2)
+    parts = ["CPU: %.0f%%" % snapshot["cpu"]["percent"], "MEM: %.0f%%" % snapshot["memory"]["percent"]]
+    parts += ["DISK(%s): %.0f%%" % (d["path"], d["percent"]) for d in snapshot["disks"] if "percent" in d]
+    if snapshot.get("temperatures"):
+        parts.append("TEMP: %.0fC" % max(snapshot["temperatures"].values()))
+    alerts = snapshot.get("alerts", [])
+    services = sorted((item for item in snapshot.get("services", {}).items() if item[1]["processes"]),
+                      key=lambda item: item[1]["cpu_percent"], reverse=True)
+except (ValueError, KeyError, TypeError):
+    sys.exit(2)
+print(" | ".join(parts))
+for alert in alerts:
+    print("WARNING: %s at %.0f (raised at %.0f, clears below %.0f)"
+          % (alert["name"], alert["value"], alert["raise_at"], alert["clear_at"]))
+if alerts and services:
+    # Who is using the box: top services by CPU, with their memory
+    print("TOP: " + ", ".join("%s %.0f%% cpu %.0fMB" % (name, service["cpu_percent"], service["rss"] / 1048576)
+                              for name, service in services[:4]))
+sys.exit(1 if alerts else 0)
+'
+}
 
 cpu_usage() {
   # Average CPU usage over 1 second
@@ -20,28 +54,41 @@ disk_usage() {
   df -P / | awk 'END {print $5}' | tr -d '%'
 }
 
-CPU=$(printf '%.0f' "$(cpu_usage)")
-MEM=$(mem_usage)
-DSK=$(disk_usage)
+from_local() {
+  CPU=$(printf '%.0f' "$(cpu_usage)")
+  MEM=$(mem_usage)
+  DSK=$(disk_usage)
 
-echo "CPU: ${CPU}% | MEM: ${MEM}% | DISK(/): ${DSK}%"
+  echo "CPU: ${CPU}% | MEM: ${MEM}% | DISK(/): ${DSK}% (sampled locally; API unreachable)"
 
-status=0
+  status=0
 
-if (( CPU > THRESHOLD )); then
-  echo "WARNING: CPU usage > ${THRESHOLD}%"
-  status=1
-fi
+  if (( CPU > THRESHOLD )); then
+    echo "WARNING: CPU usage > ${THRESHOLD}%"
+    status=1
+  fi
 
-if (( MEM > THRESHOLD )); then
-  echo "WARNING: Memory usage > ${THRESHOLD}%"
-  status=1
-fi
+  if (( MEM > THRESHOLD )); then
+    echo "WARNING: Memory usage > ${THRESHOLD}%"
+    status=1
+  fi
+
+  if (( DSK > THRESHOLD )); then
+    echo "WARNING: Disk usage (/) > ${THRESHOLD}%"
+    status=1
+  fi
 
-if (( DSK > THRESHOLD )); then
-  echo "WARNING: Disk usage (/) > ${THRESHOLD}%"
-  status=1
+  return $status
+}
+
+set +e
+from_api
+status=$?
+set -e
+
+# 0 = healthy, 1 = alert active; anything else means the API could not answer
+if (( status > 1 )); then
+  from_local && status=0 || status=1
 fi
 
 exit $status
-
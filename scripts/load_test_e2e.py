@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+SMASH Cloud Core - End-to-end load test for the Voice AI API
+
+Starts the fake Whisper/Piper/Ollama stand-ins (scripts/fake_upstreams.py) and
+smash_core under uvicorn, then drives each scenario at the target concurrency:
+
+  chat    POST /api/chat/ with prompts that fall through to the LLM
+  listen  POST /api/voice/listen with a short WAV (STT -> LLM -> TTS)
+  ws      /ws/voice, one utterance at a time per connection, timed to "response"
+
+Prints a JSON report (throughput, latency percentiles, error counts and the
+server's own per-stage averages from /metrics) tagged with the git commit, so
+runs on two commits can be diffed. Everything runs offline on one machine.
+
+Options not listed below are passed through to fake_upstreams.py, e.g.
+--llm-latency lognormal:300:0.6 --tts-error-rate 0.02.
+
+Run locally:
+  python3 scripts/load_test_e2e.py --scenarios chat listen ws --concurrency 16 --duration 20
+  python3 scripts/load_test_e2e.py --base http://127.0.0.1:8000 --scenarios chat   # existing server
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+ROOT = Path(__file__).resolve().parent.parent
+SMASH_CORE = ROOT / "smash_core"
+FAKE_UPSTREAMS = Path(__file__).resolve().parent / "fake_upstreams.py"
+
+SCENARIOS = ("chat", "listen", "ws")
+
+# Prompts that miss the built-in intents, so every request reaches the LLM
+PROMPTS = [
+    "tell me a story about the server room",
+    "write a short poem about backups",
+    "explain what a reverse proxy does",
+    "describe your favourite constellation",
+    "summarise the plot of a heist movie",
+]
+
+STAGE_SAMPLE = re.compile(
+    r'^smash_stage_duration_seconds_(sum|count)\{stage="([^"]*)",backend="([^"]*)",outcome="([^"]*)"\} (\S+)$'
+)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(len(ordered) * fraction), len(ordered) - 1)
+    return ordered[index]
+
+
+def utterance_wav(seconds: float = 1.5, sample_rate: int = 16000) -> bytes:
+    """A quiet 220 Hz tone, so pre-processing has real samples to work on"""
+    samples = int(seconds * sample_rate)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"".join(
+            int(3000 * math.sin(2 * math.pi * 220 * i / sample_rate)).to_bytes(2, "little", signed=True)
+            for i in range(samples)
+        ))
+    return buffer.getvalue()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Recorder:
+    """Latencies and error kinds for one scenario"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.first_event: List[float] = []
+        self.errors = Counter()
+        self.measuring = False
+
+    def ok(self, seconds: float, first_event: Optional[float] = None):
+        if self.measuring:
+            self.latencies.append(seconds)
+            if first_event is not None:
+                self.first_event.append(first_event)
+
+    def error(self, kind: str):
+        if self.measuring:
+            self.errors[kind] += 1
+
+    def report(self, elapsed: float) -> Dict:
+        result = {
+            "requests": len(self.latencies),
+            "errors": sum(self.errors.values()),
+            "error_kinds": dict(self.errors),
+            "rps": round(len(self.latencies) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(self.latencies) / len(self.latencies) * 1000, 2) if self.latencies else 0.0,
+            "p50_ms": round(percentile(self.latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(self.latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 2),
+            "max_ms": round(max(self.latencies, default=0.0) * 1000, 2),
+        }
+        if self.first_event:
+            result["first_transcript_p50_ms"] = round(percentile(self.first_event, 0.50) * 1000, 2)
+            result["first_transcript_p95_ms"] = round(percentile(self.first_event, 0.95) * 1000, 2)
+        return result
+
+
+async def chat_client(client: httpx.AsyncClient, base: str, recorder: Recorder, index: int, deadline: float):
+    sent = 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{base}/api/chat/",
+                                         json={"message": PROMPTS[(index + sent) % len(PROMPTS)]})
+            if response.status_code == 200:
+                recorder.ok(time.perf_counter() - started)
+            else:
+                recorder.error(f"http_{response.status_code}")
+        except httpx.HTTPError as e:
+            recorder.error(type(e).__name__)
+        sent += 1
+
+
+async def listen_client(client: httpx.AsyncClient, base: str, recorder: Recorder, audio: bytes, deadline: float):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{base}/api/voice/listen",
+                                         files={"audio_file": ("utterance.wav", audio, "audio/wav")})
+            if response.status_code != 200:
+                recorder.error(f"http_{response.status_code}")
+            elif not response.json().get("success"):
+                recorder.error("unprocessed")
+            else:
+                recorder.ok(time.perf_counter() - started)
+        except httpx.HTTPError as e:
+            recorder.error(type(e).__name__)
+
+
+async def ws_client(base: str, recorder: Recorder, audio: bytes, deadline: float, timeout: float):
+    url = base.replace("http", "ws", 1) + "/ws/voice"
+    while time.monotonic() < deadline:
+        try:
+            async with websockets.connect(url, max_size=None) as ws:
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    await ws.send(audio)
+                    first = None
+                    try:
+                        async with asyncio.timeout(timeout):
+                            while True:
+                                frame = await ws.recv()
+                                if isinstance(frame, bytes):
+                                    continue
+                                kind = json.loads(frame).get("type")
+                                if kind == "transcript" and first is None:
+                                    first = time.perf_counter() - started
+                                elif kind == "response":
+                                    recorder.ok(time.perf_counter() - started, first)
+                                    break
+                                elif kind in ("turn_cancelled", "overflow", "audio_error"):
+                                    recorder.error(kind)
+                                    break
+                    except TimeoutError:
+                        # No frame at all means STT/LLM failed for this turn
+                        recorder.error("timeout")
+        except (OSError, websockets.WebSocketException) as e:
+            recorder.error(type(e).__name__)
+            await asyncio.sleep(0.1)
+
+
+async def server_stages(client: httpx.AsyncClient, base: str) -> Dict[str, List[float]]:
+    """Cumulative (sum seconds, count) per stage/backend/outcome from /metrics"""
+    stages: Dict[str, List[float]] = {}
+    try:
+        text = (await client.get(f"{base}/metrics")).text
+    except httpx.HTTPError:
+        return stages
+    for line in text.splitlines():
+        match = STAGE_SAMPLE.match(line)
+        if match:
+            field, stage, backend, outcome, value = match.groups()
+            entry = stages.setdefault(f"{stage}/{backend}/{outcome}", [0.0, 0.0])
+            entry[0 if field == "sum" else 1] = float(value)
+    return stages
+
+
+def stage_delta(before: Dict[str, List[float]], after: Dict[str, List[float]]) -> Dict[str, Dict]:
+    delta = {}
+    for key, (total, count) in after.items():
+        prev_total, prev_count = before.get(key, (0.0, 0.0))
+        if count > prev_count:
+            delta[key] = {"count": int(count - prev_count),
+                          "avg_ms": round((total - prev_total) / (count - prev_count) * 1000, 3)}
+    return delta
+
+
+async def run_scenario(name: str, base: str, args, audio: bytes) -> Dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        async def phase(seconds: float):
+            deadline = time.monotonic() + seconds
+            if name == "chat":
+                clients = [chat_client(client, base, recorder, i, deadline) for i in range(args.concurrency)]
+            elif name == "listen":
+                clients = [listen_client(client, base, recorder, audio, deadline) for _ in range(args.concurrency)]
+            else:
+                clients = [ws_client(base, recorder, audio, deadline, args.timeout) for _ in range(args.concurrency)]
+            await asyncio.gather(*clients)
+
+        if args.warmup:
+            await phase(args.warmup)
+        before = await server_stages(client, base)
+        recorder.measuring = True
+        started = time.perf_counter()
+        await phase(args.duration)
+        elapsed = time.perf_counter() - started
+        recorder.measuring = False
+        after = await server_stages(client, base)
+
+    result = {"scenario": name, **recorder.report(elapsed), "server_stages": stage_delta(before, after)}
+    print(f"{name}: {result['rps']} req/s, p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+          f"errors {result['errors']}", file=sys.stderr)
+    return result
+
+
+def start_process(command: List[str], cwd: Path, env: Dict) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+async def run(args, upstream_args: List[str]) -> Dict:
+    report = {
+        "commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "warmup_s": args.warmup,
+        "workers": args.workers,
+        "upstream_args": upstream_args,
+        "results": [],
+    }
+    audio = utterance_wav()
+    processes = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            base = args.base
+            if not base:
+                upstream = f"http://127.0.0.1:{args.upstream_port}"
+                processes.append(start_process(
+                    [sys.executable, str(FAKE_UPSTREAMS), "--port", str(args.upstream_port), *upstream_args],
+                    ROOT, dict(os.environ)
+                ))
+                await wait_for(f"{upstream}/health")
+
+                env = dict(os.environ)
+                env.update({
+                    "WHISPER_HOST": upstream,
+                    "PIPER_HOST": upstream,
+                    "OLLAMA_HOST": upstream,
+                    "OPENAI_API_KEY": "",
+                    "ELEVENLABS_API_KEY": "",
+                    "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'smash_ai.db')}",
+                    "AUDIO_STORE_DIR": os.path.join(workdir, "static"),
+                    "STATE_BACKEND": "sqlite" if args.workers > 1 else "memory",
+                    "STATE_URL": os.path.join(workdir, "state.db"),
+                    "TIMESERIES_DIR": os.path.join(workdir, "metrics_history"),
+                    "JOBS_DIR": os.path.join(workdir, "jobs"),
+                    "TRACE_LOG_ENABLED": "false",
+                })
+                processes.append(start_process(
+                    [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.port),
+                     "--workers", str(args.workers), "--log-level", "warning"],
+                    SMASH_CORE, env
+                ))
+                base = f"http://127.0.0.1:{args.port}"
+            await wait_for(f"{base}/ready")
+
+            for name in args.scenarios:
+                report["results"].append(await run_scenario(name, base, args, audio))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="SMASH Voice AI end-to-end load test (unknown options go to fake_upstreams.py)"
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request/turn timeout")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--upstream-port", type=int, default=9100)
+    parser.add_argument("--base", help="Load-test an already running server instead of starting one")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args, upstream_args = parser.parse_known_args()
+
+    report = asyncio.run(run(args, upstream_args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+SMASH Cloud Core - Multi-worker scaling check for the Voice AI API
+
+Starts smash_core under uvicorn with 1, 2, 4... workers on the shared SQLite
+state backend, drives /api/chat/ with concurrent clients and prints a JSON
+report: requests/s, latency percentiles and a cross-worker consistency check
+(listening mode toggled through one worker must be seen by all of them).
+
+Chat messages hit the built-in intents, so no Ollama/Whisper/Piper is needed.
+
+Run locally:
+  python3 scripts/load_test_workers.py --workers 1 2 4 --duration 10 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+SMASH_CORE = Path(__file__).resolve().parent.parent / "smash_core"
+
+MESSAGES = [
+    "system status please",
+    "help me with my files",
+    "what time is it",
+    "hello there",
+    "check user permissions",
+]
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(len(ordered) * fraction), len(ordered) - 1)
+    return ordered[index]
+
+
+def start_server(workers: int, port: int, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "STATE_BACKEND": "sqlite",
+        "STATE_URL": os.path.join(workdir, "state.db"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'smash_ai.db')}",
+        "AUDIO_STORE_DIR": os.path.join(workdir, "static"),
+        "TIMESERIES_DIR": os.path.join(workdir, "metrics_history"),
+        "JOBS_DIR": os.path.join(workdir, "jobs"),
+        "TRACE_LOG_ENABLED": "false",
+        "OLLAMA_HOST": "http://127.0.0.1:9",
+        "PIPER_HOST": "http://127.0.0.1:9",
+        "WHISPER_HOST": "http://127.0.0.1:9",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=SMASH_CORE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_ready(base: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{base}/ready")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def drive(base: str, duration: float, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        async def client_loop(index: int):
+            nonlocal errors
+            sent = 0
+            while time.monotonic() < deadline:
+                message = MESSAGES[(index + sent) % len(MESSAGES)]
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"{base}/api/chat/", json={"message": message})
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                sent += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def check_consistency(base: str, probes: int = 40) -> dict:
+    """Flip listening mode and confirm every probe (spread over workers) agrees"""
+    async with httpx.AsyncClient() as client:
+        results = {}
+        for endpoint, expected in (("activate", True), ("deactivate", False)):
+            await client.post(f"{base}/api/voice/{endpoint}")
+            seen = []
+            for _ in range(probes):
+                # New connection each time so requests land on different workers
+                async with httpx.AsyncClient() as probe:
+                    seen.append((await probe.get(f"{base}/api/voice/status")).json().get("listening"))
+            results[endpoint] = all(value is expected for value in seen)
+    return {"listening_state_consistent": all(results.values()), **results}
+
+
+async def run(args) -> dict:
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "duration_s": args.duration,
+        "concurrency": args.concurrency,
+        "runs": [],
+    }
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as workdir:
+            server = start_server(workers, args.port, workdir)
+            base = f"http://127.0.0.1:{args.port}"
+            try:
+                await wait_ready(base)
+                # Let every worker finish start-up before measuring
+                await asyncio.sleep(1.0)
+                result = await drive(base, args.duration, args.concurrency)
+                result.update(await check_consistency(base))
+                result["workers"] = workers
+                report["runs"].append(result)
+                print(f"workers={workers}: {result['rps']} req/s, p95 {result['p95_ms']} ms", file=sys.stderr)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    baseline = report["runs"][0]["rps"] if report["runs"] else 0
+    for result in report["runs"]:
+        result["speedup"] = round(result["rps"] / baseline, 2) if baseline else 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SMASH Voice AI multi-worker scaling check")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,763 @@
+#!/usr/bin/env python3
+"""
+SMASH Cloud Core - Deduplicating backup engine
+
+Backs up a directory tree (Nextcloud data) plus live SQLite databases into a
+content-addressed repository:
+
+  chunks      Files are cut with content-defined chunking (a rolling hash
+              over a 64-byte window picks the boundaries, ~1 MiB average),
+              so an edit in a large file only stores the chunks around it.
+              Chunks are keyed by SHA-256 and shared by every snapshot.
+  parallel    Files are chunked, hashed and compressed across --jobs worker
+              processes.
+  incremental A file whose size and mtime match the previous snapshot of the
+              same source reuses its chunk list without being read.
+  sqlite      --sqlite DB is copied with the SQLite online backup API, giving
+              a consistent image while the app keeps writing.
+  manifests   One gzip'd JSON manifest per snapshot: every file, directory
+              and symlink with its mode, mtime and chunk list.
+
+Repository layout: <repo>/chunks/ab/<sha256>, <repo>/snapshots/<id>.json.gz.
+Chunk files are never modified after they are written, so the repository
+syncs cheaply offsite (scripts/backup_offsite_rclone.sh).
+
+Requires numpy (vectorized chunking).
+
+Run locally:
+  python3 scripts/smash_backup.py --repo /mnt/smash_data/backups/repo backup /mnt/smash_data/data \\
+      --sqlite smash_core/smash_ai.db
+  python3 scripts/smash_backup.py --repo /mnt/smash_data/backups/repo list
+  python3 scripts/smash_backup.py --repo /mnt/smash_data/backups/repo verify --full
+  python3 scripts/smash_backup.py --repo /mnt/smash_data/backups/repo restore latest /tmp/restore
+  python3 scripts/smash_backup.py --repo /mnt/smash_data/backups/repo prune --keep-last 30
+  python3 scripts/smash_backup.py selftest          # end-to-end run on a scratch directory
+"""
+
+import argparse
+import fnmatch
+import gzip
+import hashlib
+import json
+import os
+import random
+import socket
+import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FORMAT_VERSION = 1
+WINDOW = 64
+MIN_CHUNK = 256 * 1024
+AVG_BITS = 20  # ~1 MiB average chunk
+MAX_CHUNK = 4 * 1024 * 1024
+READ_BLOCK = 1024 * 1024
+# A file modified this close to the previous snapshot may have changed again
+# within the same mtime tick, so it is always re-read
+RACY_SECONDS = 2.0
+
+COMPRESS_PROBE = 64 * 1024
+
+CODEC_RAW = b"0"
+CODEC_ZLIB = b"z"
+
+
+def _gear_table():
+    """Fixed per-byte random values for the rolling hash (must never change)"""
+    import numpy as np
+    values = [int.from_bytes(hashlib.sha256(b"smash-cdc-%d" % byte).digest()[:4], "little")
+              for byte in range(256)]
+    return np.array(values, dtype=np.uint32)
+
+
+class Chunker:
+    """Content-defined chunking over a stream
+
+    The hash at each byte is the wrapping sum of table values over the last
+    WINDOW bytes (a cumulative sum, so it vectorizes); a byte whose hash has
+    its top AVG_BITS bits clear ends a chunk. Chunks are kept between
+    MIN_CHUNK and MAX_CHUNK bytes.
+    """
+
+    def __init__(self):
+        try:
+            import numpy as np
+        except ImportError:
+            sys.exit("smash_backup needs numpy: pip install numpy")
+        self.np = np
+        self.gear = _gear_table()
+        # Top AVG_BITS bits clear <=> below this value
+        self.threshold = np.uint32(1 << (32 - AVG_BITS))
+
+    def _cut_points(self, buffer: bytes, skip: int) -> List[int]:
+        """Offsets just after each boundary byte, for bytes at index >= skip"""
+        np = self.np
+        if len(buffer) <= WINDOW:
+            return []
+        sums = self.gear[np.frombuffer(buffer, dtype=np.uint8)]
+        np.cumsum(sums, dtype=np.uint32, out=sums)
+        window = sums[WINDOW:] - sums[:-WINDOW]
+        ends = np.flatnonzero(window < self.threshold) + WINDOW
+        return [int(end) + 1 for end in ends if end >= skip]
+
+    def chunks(self, handle) -> Iterator[bytes]:
+        pending = bytearray()
+        start = 0        # stream offset where `pending` begins
+        end = 0          # stream offset just past the data read so far
+        context = b""    # last WINDOW bytes, so windows span block edges
+        candidates = deque()
+        while True:
+            data = handle.read(READ_BLOCK)
+            if data:
+                buffer = context + data
+                base = end - len(context)
+                candidates.extend(base + cut for cut in self._cut_points(buffer, len(context)))
+                context = buffer[-WINDOW:]
+                pending += data
+                end += len(data)
+            while True:
+                while candidates and candidates[0] - start < MIN_CHUNK:
+                    candidates.popleft()
+                if candidates and candidates[0] - start <= MAX_CHUNK:
+                    cut = candidates.popleft()
+                elif end - start >= MAX_CHUNK:
+                    cut = start + MAX_CHUNK
+                else:
+                    break
+                yield bytes(pending[:cut - start])
+                del pending[:cut - start]
+                start = cut
+            if not data:
+                if pending:
+                    yield bytes(pending)
+                return
+
+
+class Repository:
+    """Chunk store plus snapshot manifests under one directory"""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.chunk_dir = os.path.join(self.path, "chunks")
+        self.snapshot_dir = os.path.join(self.path, "snapshots")
+        self._lock_handle = None
+
+    def init(self):
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        os.makedirs(os.path.join(self.path, "tmp"), exist_ok=True)
+
+    def lock(self):
+        """Exclusive lock so a backup and a prune never run at once"""
+        self.init()
+        self._lock_handle = open(os.path.join(self.path, "lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                sys.exit(f"Repository {self.path} is locked by another backup or prune")
+
+    def unlock(self):
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+
+    def chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def has_chunk(self, digest: str) -> bool:
+        return os.path.exists(self.chunk_path(digest))
+
+    def write_chunk(self, digest: str, data: bytes, compress: bool) -> int:
+        """Store a chunk unless present; returns the bytes written"""
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return 0
+        payload = CODEC_RAW + data
+        # Already-compressed media (photos, video) is stored as is; a 64 KiB
+        # probe decides without paying to compress the whole chunk
+        if compress and len(zlib.compress(data[:COMPRESS_PROBE], 1)) < min(len(data), COMPRESS_PROBE) * 0.9:
+            packed = zlib.compress(data, 1)
+            if len(packed) < len(data) * 0.9:
+                payload = CODEC_ZLIB + packed
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as handle:
+            handle.write(payload)
+        os.replace(temp, path)
+        return len(payload)
+
+    def read_chunk(self, digest: str) -> bytes:
+        with open(self.chunk_path(digest), "rb") as handle:
+            payload = handle.read()
+        data = zlib.decompress(payload[1:]) if payload[:1] == CODEC_ZLIB else payload[1:]
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"chunk {digest} is corrupt")
+        return data
+
+    def snapshot_ids(self) -> List[str]:
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        return sorted(name[:-len(".json.gz")] for name in os.listdir(self.snapshot_dir)
+                      if name.endswith(".json.gz"))
+
+    def resolve(self, snapshot_id: str) -> str:
+        ids = self.snapshot_ids()
+        if not ids:
+            sys.exit(f"No snapshots in {self.path}")
+        if snapshot_id == "latest":
+            return ids[-1]
+        if snapshot_id not in ids:
+            sys.exit(f"Unknown snapshot {snapshot_id}; see the list command")
+        return snapshot_id
+
+    def load(self, snapshot_id: str) -> Dict:
+        with gzip.open(os.path.join(self.snapshot_dir, f"{snapshot_id}.json.gz"), "rt") as handle:
+            return json.load(handle)
+
+    def save(self, manifest: Dict):
+        path = os.path.join(self.snapshot_dir, f"{manifest['id']}.json.gz")
+        temp = path + ".tmp"
+        with gzip.open(temp, "wt", compresslevel=6) as handle:
+            json.dump(manifest, handle, separators=(",", ":"))
+        os.replace(temp, path)
+
+    def previous(self, source: str) -> Optional[Dict]:
+        """Newest snapshot of the same source, for the mtime/size cache"""
+        for snapshot_id in reversed(self.snapshot_ids()):
+            manifest = self.load(snapshot_id)
+            if manifest["source"] == source:
+                return manifest
+        return None
+
+
+# Worker-process state, set once per process by _init_worker
+_worker: Dict = {}
+
+
+def _init_worker(repo_path: str, compress: bool):
+    _worker["repo"] = Repository(repo_path)
+    _worker["compress"] = compress
+    _worker["chunker"] = Chunker()
+    _worker["known"] = set()
+
+
+def _store_file(task: Tuple[str, str]) -> Dict:
+    """Chunk, hash and store one file (runs in a worker process)"""
+    rel, path = task
+    repo, chunker, known = _worker["repo"], _worker["chunker"], _worker["known"]
+    result = {"path": rel, "chunks": [], "read": 0, "new_chunks": 0, "new_bytes": 0, "error": None}
+    try:
+        before = os.stat(path)
+        with open(path, "rb") as handle:
+            for data in chunker.chunks(handle):
+                digest = hashlib.sha256(data).hexdigest()
+                result["chunks"].append([digest, len(data)])
+                result["read"] += len(data)
+                if digest in known:
+                    continue
+                written = repo.write_chunk(digest, data, _worker["compress"])
+                known.add(digest)
+                if written:
+                    result["new_chunks"] += 1
+                    result["new_bytes"] += written
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+            result["warning"] = "changed while being read"
+        result["size"] = result["read"]
+    except OSError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def scan(source: str, excludes: List[str]) -> Tuple[List[Dict], List[str]]:
+    """Directory entries under source (relative paths), and unreadable paths"""
+    entries, errors = [], []
+
+    def excluded(rel: str) -> bool:
+        return any(fnmatch.fnmatch(rel, pattern) for pattern in excludes)
+
+    def walk(directory: str, rel_dir: str):
+        try:
+            items = sorted(os.scandir(directory), key=lambda item: item.name)
+        except OSError as e:
+            errors.append(f"{rel_dir or '.'}: {e}")
+            return
+        for item in items:
+            rel = f"{rel_dir}/{item.name}" if rel_dir else item.name
+            if excluded(rel):
+                continue
+            try:
+                info = item.stat(follow_symlinks=False)
+            except OSError as e:
+                errors.append(f"{rel}: {e}")
+                continue
+            entry = {"path": rel, "mode": stat.S_IMODE(info.st_mode), "mtime_ns": info.st_mtime_ns}
+            if stat.S_ISLNK(info.st_mode):
+                entries.append({**entry, "type": "symlink", "target": os.readlink(item.path)})
+            elif stat.S_ISDIR(info.st_mode):
+                entries.append({**entry, "type": "dir"})
+                walk(item.path, rel)
+            elif stat.S_ISREG(info.st_mode):
+                entries.append({**entry, "type": "file", "size": info.st_size, "source_path": item.path})
+
+    walk(source, "")
+    return entries, errors
+
+
+def snapshot_sqlite(database: str, target: str) -> float:
+    """Consistent copy of a live SQLite database via the online backup API"""
+    started = time.perf_counter()
+    source = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    destination = sqlite3.connect(target)
+    try:
+        source.backup(destination)
+    finally:
+        destination.close()
+        source.close()
+    return time.perf_counter() - started
+
+
+def run_backup(repo: Repository, source: str, sqlite_paths: List[str], jobs: int,
+               compress: bool, excludes: List[str], use_cache: bool = True) -> Dict:
+    source = os.path.abspath(source)
+    if not os.path.isdir(source):
+        sys.exit(f"Source {source} is not a directory")
+    repo.lock()
+    started_wall = time.time()
+    started = time.perf_counter()
+    snapshot_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+    previous = repo.previous(source) if use_cache else None
+    cache = {entry["path"]: entry for entry in previous["entries"] if entry["type"] == "file"} \
+        if previous else {}
+    cache_cutoff = previous["started"] - RACY_SECONDS if previous else 0
+
+    entries, errors = scan(source, excludes)
+    sqlite_temps = []
+    for database in sqlite_paths:
+        temp = os.path.join(repo.path, "tmp", f"{os.path.basename(database)}.{os.getpid()}")
+        seconds = snapshot_sqlite(database, temp)
+        sqlite_temps.append(temp)
+        info = os.stat(temp)
+        entries.append({"path": f".sqlite/{os.path.basename(database)}", "type": "file",
+                        "mode": 0o644, "mtime_ns": info.st_mtime_ns, "size": info.st_size,
+                        "source_path": temp, "sqlite": os.path.abspath(database),
+                        "sqlite_backup_ms": round(seconds * 1000, 1)})
+
+    tasks, reused = [], 0
+    for entry in entries:
+        if entry["type"] != "file":
+            continue
+        cached = cache.get(entry["path"])
+        if (cached and "sqlite" not in entry and cached["size"] == entry["size"]
+                and cached["mtime_ns"] == entry["mtime_ns"] and entry["mtime_ns"] / 1e9 < cache_cutoff):
+            entry["chunks"] = cached["chunks"]
+            reused += 1
+        else:
+            tasks.append((entry["path"], entry["source_path"]))
+
+    by_path = {entry["path"]: entry for entry in entries}
+    read_bytes = new_chunks = new_bytes = 0
+    warnings = []
+    hash_started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(repo.path, compress)) as pool:
+        for result in pool.map(_store_file, tasks, chunksize=8):
+            entry = by_path[result["path"]]
+            if result["error"]:
+                errors.append(f"{result['path']}: {result['error']}")
+                entry["error"] = result["error"]
+                continue
+            entry["chunks"] = result["chunks"]
+            entry["size"] = result["size"]
+            read_bytes += result["read"]
+            new_chunks += result["new_chunks"]
+            new_bytes += result["new_bytes"]
+            if result.get("warning"):
+                warnings.append(f"{result['path']}: {result['warning']}")
+    hash_seconds = time.perf_counter() - hash_started
+    for temp in sqlite_temps:
+        os.remove(temp)
+
+    kept = []
+    for entry in entries:
+        entry.pop("source_path", None)
+        if entry.get("error"):
+            continue
+        kept.append(entry)
+    files = [entry for entry in kept if entry["type"] == "file"]
+    logical = sum(entry["size"] for entry in files)
+    unique = {}
+    for entry in files:
+        for digest, length in entry["chunks"]:
+            unique[digest] = length
+    unique_bytes = sum(unique.values())
+    elapsed = time.perf_counter() - started
+
+    stats = {
+        "files": len(files),
+        "directories": sum(1 for entry in kept if entry["type"] == "dir"),
+        "symlinks": sum(1 for entry in kept if entry["type"] == "symlink"),
+        "files_unchanged": reused,
+        "files_read": len(tasks),
+        "logical_bytes": logical,
+        "read_bytes": read_bytes,
+        "unique_chunks": len(unique),
+        "unique_bytes": unique_bytes,
+        "new_chunks": new_chunks,
+        "new_stored_bytes": new_bytes,
+        "dedup_ratio": round(logical / unique_bytes, 3) if unique_bytes else None,
+        "seconds": round(elapsed, 3),
+        "read_mb_per_s": round(read_bytes / hash_seconds / 1e6, 1) if hash_seconds and read_bytes else None,
+        "logical_mb_per_s": round(logical / elapsed / 1e6, 1) if elapsed else None,
+        "jobs": jobs,
+        "errors": len(errors),
+    }
+    manifest = {
+        "version": FORMAT_VERSION,
+        "id": snapshot_id,
+        "source": source,
+        "host": socket.gethostname(),
+        "started": started_wall,
+        "finished": time.time(),
+        "parent": previous["id"] if previous else None,
+        "chunking": {"window": WINDOW, "min": MIN_CHUNK, "avg_bits": AVG_BITS, "max": MAX_CHUNK},
+        "stats": stats,
+        "errors": errors,
+        "warnings": warnings,
+        "entries": kept,
+    }
+    repo.save(manifest)
+    return manifest
+
+
+def referenced_chunks(repo: Repository, snapshot_ids: List[str]) -> Dict[str, int]:
+    chunks = {}
+    for snapshot_id in snapshot_ids:
+        for entry in repo.load(snapshot_id)["entries"]:
+            for digest, length in entry.get("chunks", ()):
+                chunks[digest] = length
+    return chunks
+
+
+def run_verify(repo: Repository, snapshot_ids: List[str], full: bool, jobs: int) -> Dict:
+    """Check every referenced chunk exists (and with --full, re-hash it)"""
+    chunks = referenced_chunks(repo, snapshot_ids)
+    started = time.perf_counter()
+    missing, corrupt = [], []
+
+    def check(digest: str) -> int:
+        if not full:
+            if not repo.has_chunk(digest):
+                missing.append(digest)
+            return 0
+        try:
+            return len(repo.read_chunk(digest))
+        except FileNotFoundError:
+            missing.append(digest)
+        except (ValueError, zlib.error):
+            corrupt.append(digest)
+        return 0
+
+    # hashlib and zlib release the GIL on large buffers, so threads scale here
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        checked_bytes = sum(pool.map(check, chunks))
+    elapsed = time.perf_counter() - started
+    return {
+        "snapshots": snapshot_ids,
+        "chunks": len(chunks),
+        "mode": "full" if full else "exists",
+        "missing": missing,
+        "corrupt": corrupt,
+        "ok": not missing and not corrupt,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(checked_bytes / elapsed / 1e6, 1) if full and elapsed else None,
+    }
+
+
+def run_restore(repo: Repository, snapshot_id: str, target: str, prefix: str, jobs: int) -> Dict:
+    manifest = repo.load(snapshot_id)
+    target = os.path.abspath(target)
+    entries = [entry for entry in manifest["entries"]
+               if not prefix or entry["path"] == prefix or entry["path"].startswith(prefix.rstrip("/") + "/")]
+    started = time.perf_counter()
+    os.makedirs(target, exist_ok=True)
+    directories = sorted((entry for entry in entries if entry["type"] == "dir"), key=lambda e: e["path"])
+    for entry in directories:
+        os.makedirs(os.path.join(target, entry["path"]), exist_ok=True)
+
+    def restore_file(entry: Dict) -> int:
+        path = os.path.join(target, entry["path"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + ".restore.tmp"
+        with open(temp, "wb") as handle:
+            for digest, _ in entry["chunks"]:
+                handle.write(repo.read_chunk(digest))
+        os.chmod(temp, entry["mode"])
+        os.replace(temp, path)
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        return entry["size"]
+
+    files = [entry for entry in entries if entry["type"] == "file"]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        restored_bytes = sum(pool.map(restore_file, files))
+    for entry in entries:
+        if entry["type"] == "symlink":
+            path = os.path.join(target, entry["path"])
+            if os.path.lexists(path):
+                os.remove(path)
+            os.symlink(entry["target"], path)
+    # Deepest first, so restoring a child does not bump its parent's mtime afterwards
+    for entry in reversed(directories):
+        path = os.path.join(target, entry["path"])
+        os.chmod(path, entry["mode"])
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    elapsed = time.perf_counter() - started
+    return {
+        "snapshot": snapshot_id,
+        "target": target,
+        "files": len(files),
+        "bytes": restored_bytes,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(restored_bytes / elapsed / 1e6, 1) if elapsed else None,
+    }
+
+
+def run_prune(repo: Repository, keep_last: int) -> Dict:
+    """Drop all but the newest snapshots, then delete chunks nothing references"""
+    repo.lock()
+    ids = repo.snapshot_ids()
+    removed = ids[:-keep_last] if keep_last > 0 else ids
+    for snapshot_id in removed:
+        os.remove(os.path.join(repo.snapshot_dir, f"{snapshot_id}.json.gz"))
+    live = referenced_chunks(repo, repo.snapshot_ids())
+    deleted = freed = 0
+    for prefix in os.listdir(repo.chunk_dir):
+        directory = os.path.join(repo.chunk_dir, prefix)
+        for name in os.listdir(directory):
+            if name not in live:
+                path = os.path.join(directory, name)
+                freed += os.path.getsize(path)
+                os.remove(path)
+                deleted += 1
+    return {"removed_snapshots": removed, "kept_snapshots": len(ids) - len(removed),
+            "deleted_chunks": deleted, "freed_bytes": freed}
+
+
+def format_bytes(num_bytes: float) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(num_bytes) < 1024 or unit == "TB":
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def print_backup(manifest: Dict):
+    stats = manifest["stats"]
+    print(f"Snapshot {manifest['id']} of {manifest['source']}")
+    print(f"  files       {stats['files']} ({stats['files_unchanged']} unchanged, {stats['files_read']} read), "
+          f"{stats['directories']} dirs, {stats['symlinks']} symlinks")
+    print(f"  data        {format_bytes(stats['logical_bytes'])} logical, "
+          f"{format_bytes(stats['read_bytes'])} read at {stats['read_mb_per_s'] or 0} MB/s")
+    print(f"  stored      {stats['new_chunks']} new chunks, {format_bytes(stats['new_stored_bytes'])}; "
+          f"dedup ratio {stats['dedup_ratio']}")
+    print(f"  took        {stats['seconds']}s with {stats['jobs']} jobs")
+    for line in manifest["warnings"]:
+        print(f"  warning     {line}")
+    for line in manifest["errors"]:
+        print(f"  error       {line}", file=sys.stderr)
+
+
+def selftest(jobs: int) -> Dict:
+    """Back up, modify, back up, restore and verify a generated tree"""
+    rng = random.Random(42)
+    checks = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "data")
+        os.makedirs(os.path.join(source, "user/files/photos"))
+        big = rng.randbytes(12 * 1024 * 1024)
+        with open(os.path.join(source, "user/files/big.bin"), "wb") as handle:
+            handle.write(big)
+        for index in range(50):
+            with open(os.path.join(source, f"user/files/note{index}.txt"), "w") as handle:
+                handle.write(f"note {index}\n" * rng.randint(1, 500))
+        with open(os.path.join(source, "user/files/photos/copy.bin"), "wb") as handle:
+            handle.write(big[:6 * 1024 * 1024])
+        os.symlink("files/big.bin", os.path.join(source, "user/link"))
+
+        database = os.path.join(workdir, "smash_ai.db")
+        connection = sqlite3.connect(database)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE conversations (id INTEGER PRIMARY KEY, text TEXT)")
+        connection.executemany("INSERT INTO conversations (text) VALUES (?)",
+                               [(f"message {i}",) for i in range(5000)])
+        connection.commit()
+
+        # Files written within RACY_SECONDS of a backup are always re-read
+        time.sleep(RACY_SECONDS + 0.1)
+
+        # Keep writing to the database while the backup reads it
+        stop = threading.Event()
+
+        def writer():
+            db = sqlite3.connect(database)
+            while not stop.is_set():
+                db.execute("INSERT INTO conversations (text) VALUES ('during backup')")
+                db.commit()
+            db.close()
+
+        repo = Repository(os.path.join(workdir, "repo"))
+        thread = threading.Thread(target=writer)
+        thread.start()
+        first = run_backup(repo, source, [database], jobs, True, [])
+        repo.unlock()
+        stop.set()
+        thread.join()
+        checks["first_backup_errors"] = first["errors"]
+        checks["first_dedup_ratio"] = first["stats"]["dedup_ratio"]
+
+        # Insert 100 bytes into the middle of the big file: only nearby chunks change
+        time.sleep(RACY_SECONDS + 0.1)
+        edited = big[:5_000_000] + rng.randbytes(100) + big[5_000_000:]
+        with open(os.path.join(source, "user/files/big.bin"), "wb") as handle:
+            handle.write(edited)
+        second = run_backup(repo, source, [database], jobs, True, [])
+        repo.unlock()
+        stats = second["stats"]
+        checks["second_files_unchanged"] = stats["files_unchanged"]
+        checks["second_new_chunks"] = stats["new_chunks"]
+        checks["second_new_bytes"] = stats["new_stored_bytes"]
+
+        target = os.path.join(workdir, "restore")
+        restore = run_restore(repo, second["id"], target, "", jobs)
+        checks["restored_files"] = restore["files"]
+        mismatched = []
+        for entry in second["entries"]:
+            if entry["type"] != "file" or entry["path"].startswith(".sqlite/"):
+                continue
+            with open(os.path.join(source, entry["path"]), "rb") as a, \
+                    open(os.path.join(target, entry["path"]), "rb") as b:
+                if a.read() != b.read():
+                    mismatched.append(entry["path"])
+        checks["mismatched_files"] = mismatched
+        checks["symlink_ok"] = os.readlink(os.path.join(target, "user/link")) == "files/big.bin"
+        restored_db = sqlite3.connect(os.path.join(target, ".sqlite/smash_ai.db"))
+        checks["sqlite_integrity"] = restored_db.execute("PRAGMA integrity_check").fetchone()[0]
+        checks["sqlite_rows"] = restored_db.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        restored_db.close()
+        connection.close()
+
+        verify = run_verify(repo, repo.snapshot_ids(), True, jobs)
+        checks["verify_ok"] = verify["ok"]
+        # Corrupt one chunk and make sure verify notices
+        victim = next(entry for entry in second["entries"] if entry.get("chunks"))["chunks"][0][0]
+        with open(repo.chunk_path(victim), "r+b") as handle:
+            handle.seek(5)
+            handle.write(b"\xff\xff")
+        checks["verify_detects_corruption"] = not run_verify(repo, repo.snapshot_ids(), True, jobs)["ok"]
+
+    passed = (not checks["first_backup_errors"] and not checks["mismatched_files"]
+              and checks["symlink_ok"] and checks["sqlite_integrity"] == "ok"
+              and checks["second_files_unchanged"] >= 50
+              and checks["second_new_chunks"] <= 3
+              and checks["verify_ok"] and checks["verify_detects_corruption"])
+    return {"passed": passed, "checks": checks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SMASH Cloud Core deduplicating backups")
+    parser.add_argument("--repo", default=os.getenv("SMASH_BACKUP_REPO", "/mnt/smash_data/backups/repo"),
+                        help="Repository directory (env SMASH_BACKUP_REPO)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes/threads")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backup = commands.add_parser("backup", help="Snapshot a directory (and SQLite databases)")
+    backup.add_argument("source")
+    backup.add_argument("--sqlite", action="append", default=[], metavar="DB",
+                        help="Live SQLite database to capture with the online backup API (repeatable)")
+    backup.add_argument("--exclude", action="append", default=[], metavar="PATTERN",
+                        help="fnmatch pattern on the relative path (repeatable)")
+    backup.add_argument("--no-compress", action="store_true", help="Store chunks uncompressed")
+    backup.add_argument("--no-cache", action="store_true", help="Re-read every file, ignoring mtime/size")
+
+    commands.add_parser("list", help="List snapshots")
+
+    verify = commands.add_parser("verify", help="Check snapshots' chunks exist (or re-hash with --full)")
+    verify.add_argument("snapshot", nargs="?", default="all", help="Snapshot id, latest or all")
+    verify.add_argument("--full", action="store_true", help="Read and re-hash every chunk")
+
+    restore = commands.add_parser("restore", help="Restore a snapshot into a directory")
+    restore.add_argument("snapshot", help="Snapshot id or latest")
+    restore.add_argument("target")
+    restore.add_argument("--path", default="", help="Only restore this file or directory")
+
+    prune = commands.add_parser("prune", help="Keep the newest snapshots and delete unreferenced chunks")
+    prune.add_argument("--keep-last", type=int, required=True)
+
+    commands.add_parser("selftest", help="End-to-end backup/restore/verify on a scratch directory")
+    args = parser.parse_args()
+    jobs = max(args.jobs, 1)
+
+    if args.command == "selftest":
+        result = selftest(jobs)
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result["passed"] else 1)
+
+    repo = Repository(args.repo)
+    if args.command == "backup":
+        manifest = run_backup(repo, args.source, args.sqlite, jobs, not args.no_compress,
+                              args.exclude, use_cache=not args.no_cache)
+        if args.json:
+            print(json.dumps({key: manifest[key] for key in ("id", "source", "stats", "errors", "warnings")},
+                             indent=2))
+        else:
+            print_backup(manifest)
+        sys.exit(1 if manifest["errors"] else 0)
+    if args.command == "list":
+        rows = []
+        for snapshot_id in repo.snapshot_ids():
+            manifest = repo.load(snapshot_id)
+            rows.append({"id": snapshot_id, "source": manifest["source"], **manifest["stats"]})
+        if args.json:
+            print(json.dumps(rows, indent=2))
+            return
+        for row in rows:
+            print(f"{row['id']}  {row['files']:>7} files  {format_bytes(row['logical_bytes']):>10}  "
+                  f"+{format_bytes(row['new_stored_bytes']):>10}  dedup {row['dedup_ratio']}  {row['source']}")
+        return
+    if args.command == "verify":
+        ids = repo.snapshot_ids() if args.snapshot == "all" else [repo.resolve(args.snapshot)]
+        result = run_verify(repo, ids, args.full, jobs)
+        print(json.dumps(result, indent=2) if args.json else
+              f"{'OK' if result['ok'] else 'FAILED'}: {result['chunks']} chunks in {len(ids)} snapshot(s), "
+              f"{len(result['missing'])} missing, {len(result['corrupt'])} corrupt ({result['seconds']}s)")
+        sys.exit(0 if result["ok"] else 1)
+    if args.command == "restore":
+        result = run_restore(repo, repo.resolve(args.snapshot), args.target, args.path, jobs)
+        print(json.dumps(result, indent=2) if args.json else
+              f"Restored {result['files']} files ({format_bytes(result['bytes'])}) from {result['snapshot']} "
+              f"to {result['target']} at {result['mb_per_s']} MB/s")
+        return
+    if args.command == "prune":
+        result = run_prune(repo, args.keep_last)
+        print(json.dumps(result, indent=2) if args.json else
+              f"Removed {len(result['removed_snapshots'])} snapshot(s), {result['deleted_chunks']} chunks, "
+              f"freed {format_bytes(result['freed_bytes'])}")
+
+
+if __name__ == "__main__":
+    main()
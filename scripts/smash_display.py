@@ -2,27 +2,58 @@
 """
 SMASH Cloud Core - System Dashboard
 
-Displays live system statistics using Rich + psutil for a small terminal display.
-Shows: CPU %, per-core load, memory usage, disk usage, network I/O, uptime.
+Displays live system statistics using Rich for a small terminal display.
+Shows: CPU % with per-core load, memory, disk usage, network and disk I/O
+rates, temperatures, per-service CPU/memory/I/O (Whisper, Piper, Ollama,
+Nextcloud, smash_core...; API source only), active alerts, uptime, and
+sparklines of the last few minutes.
+
+Values come from the smash_core host metrics collector (/api/system/metrics),
+so the box is sampled once for every consumer; if the API is down the
+dashboard samples locally with psutil and keeps retrying the API.
+
+Built to stay cheap on a Pi-class box: rates come from counter deltas, history
+lives in fixed-size array ring buffers, the screen is one Text block instead
+of nested tables, and the refresh interval backs off while values are stable.
+The dashboard's own CPU cost is shown in the footer (target: under 1% of a core).
+
+Environment:
+  SMASH_METRICS_URL           collector endpoint (default http://127.0.0.1:8000/api/system/metrics)
+  SMASH_DASH_SOURCE           auto (API, local fallback), api or local (default auto)
+  SMASH_DASH_REFRESH          base refresh interval in seconds (default 1.0)
+  SMASH_DASH_MAX_REFRESH      slowest refresh while values are stable (default 5.0)
+  SMASH_DASH_HISTORY_MINUTES  sparkline window (default 10)
+  SMASH_DASH_SPARK_WIDTH      sparkline points (default 30)
 
 Run locally for testing:
   python3 scripts/smash_display.py
+  python3 scripts/smash_display.py --measure 60   # headless, print CPU cost as JSON
 
 On Ubuntu, the systemd service `smash-display@<user>` will run this at boot
 on /dev/tty1.
 """
 
+import argparse
+import io
+import json
 import os
-import time
-import socket
 import shutil
-import psutil
-from datetime import datetime, timedelta
+import socket
+import time
+import urllib.request
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from rich.align import Align
 from rich.console import Console
 from rich.live import Live
 from rich.panel import Panel
-from rich.table import Table
-from rich.align import Align
+from rich.text import Text
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+DEFAULT_METRICS_URL = "http://127.0.0.1:8000/api/system/metrics"
 
 
 def format_bytes(num_bytes: float) -> str:
@@ -35,71 +66,367 @@ def format_bytes(num_bytes: float) -> str:
     return f"{size:.1f} PB"
 
 
-def get_uptime() -> str:
-    boot_ts = psutil.boot_time()
-    delta = datetime.now() - datetime.fromtimestamp(boot_ts)
-    days = delta.days
-    hours, remainder = divmod(delta.seconds, 3600)
-    minutes, _ = divmod(remainder, 60)
-    return f"{days}d {hours}h {minutes}m"
+def format_duration(seconds: float) -> str:
+    days, remainder = divmod(int(seconds), 86400)
+    hours, remainder = divmod(remainder, 3600)
+    return f"{days}d {hours}h {remainder // 60}m"
+
+
+class RingBuffer:
+    """Fixed-size float ring backed by an array (no per-sample allocation)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._data = array("d", bytes(8 * size))
+        self._head = 0
+        self._count = 0
+
+    def append(self, value: float):
+        self._data[self._head] = value
+        self._head = (self._head + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def replace_last(self, value: float):
+        if self._count:
+            self._data[(self._head - 1) % self.size] = value
+
+    def __len__(self) -> int:
+        return self._count
+
+    def values(self) -> List[float]:
+        """Oldest first"""
+        start = (self._head - self._count) % self.size
+        if start + self._count <= self.size:
+            return self._data[start:start + self._count].tolist()
+        return self._data[start:].tolist() + self._data[:self._head].tolist()
+
+
+class TimeSeries:
+    """A ring of fixed time slots covering the last `minutes`
+
+    Samples within one slot are averaged; slots skipped while the refresh was
+    backed off are filled with the next value, so the sparkline stays aligned
+    to wall time whatever the sampling rate.
+    """
+
+    def __init__(self, minutes: float, points: int):
+        self.slot_seconds = max(minutes * 60 / points, 0.001)
+        self.ring = RingBuffer(points)
+        self._slot: Optional[int] = None
+        self._sum = 0.0
+        self._n = 0
+
+    def add(self, ts: float, value: float):
+        slot = int(ts // self.slot_seconds)
+        if slot == self._slot:
+            self._sum += value
+            self._n += 1
+            self.ring.replace_last(self._sum / self._n)
+            return
+        gap = 1 if self._slot is None else min(slot - self._slot, self.ring.size)
+        for _ in range(gap):
+            self.ring.append(value)
+        self._slot, self._sum, self._n = slot, value, 1
+
+    def sparkline(self, ceiling: Optional[float] = None) -> str:
+        values = self.ring.values()
+        if not values:
+            return ""
+        top = ceiling if ceiling is not None else max(values)
+        if top <= 0:
+            return SPARK_CHARS[0] * len(values)
+        steps = len(SPARK_CHARS) - 1
+        return "".join(SPARK_CHARS[min(int(value / top * steps + 0.5), steps)] for value in values)
 
 
-def render_dashboard() -> Panel:
-    hostname = socket.gethostname()
-    ip_addr = psutil.net_if_addrs()
+class SystemSampler:
+    """Current values and per-second rates from psutil counter deltas (local fallback)"""
 
-    # CPU
-    cpu_percent = psutil.cpu_percent(interval=None)
-    per_core = psutil.cpu_percent(interval=None, percpu=True)
-    load_avg = os.getloadavg() if hasattr(os, "getloadavg") else (0, 0, 0)
+    name = "local"
 
-    # Memory
-    mem = psutil.virtual_memory()
+    def __init__(self, disk_paths: List[str] = ("/",), disk_usage_interval: float = 30.0):
+        import psutil
+        self.psutil = psutil
+        self.disk_paths = [path for path in disk_paths if os.path.isdir(path)]
+        self.disk_usage_interval = disk_usage_interval
+        self.hostname = socket.gethostname()
+        self.boot_time = psutil.boot_time()
+        self._prev_ts = time.monotonic()
+        self._prev_net = psutil.net_io_counters()
+        self._prev_disk = psutil.disk_io_counters()
+        self._disks: Optional[List[Dict]] = None
+        self._disks_at = 0.0
+        # Prime the CPU counters; the first real sample measures from here
+        psutil.cpu_percent(interval=None, percpu=True)
 
-    # Disk
-    root_usage = shutil.disk_usage("/")
-    disk_total = root_usage.total
-    disk_used = root_usage.used
-    disk_free = root_usage.free
+    @staticmethod
+    def _rate(current: int, previous: int, elapsed: float) -> float:
+        return max(current - previous, 0) / elapsed if elapsed > 0 else 0.0
 
-    # Network (aggregate)
-    net = psutil.net_io_counters()
+    def sample(self) -> Dict:
+        psutil = self.psutil
+        now = time.monotonic()
+        elapsed = now - self._prev_ts
+        self._prev_ts = now
 
-    # Uptime
-    uptime = get_uptime()
+        per_core = psutil.cpu_percent(interval=None, percpu=True)
+        net = psutil.net_io_counters()
+        disk = psutil.disk_io_counters()
+        memory = psutil.virtual_memory()
+        values = {
+            "hostname": self.hostname,
+            "cpu_percent": sum(per_core) / len(per_core) if per_core else 0.0,
+            "per_core": per_core,
+            "load": os.getloadavg() if hasattr(os, "getloadavg") else (0.0, 0.0, 0.0),
+            "mem_used": memory.used,
+            "mem_total": memory.total,
+            "mem_percent": memory.percent,
+            "net_rx_rate": self._rate(net.bytes_recv, self._prev_net.bytes_recv, elapsed),
+            "net_tx_rate": self._rate(net.bytes_sent, self._prev_net.bytes_sent, elapsed),
+            "disk_read_rate": 0.0,
+            "disk_write_rate": 0.0,
+            "uptime": time.time() - self.boot_time,
+            "temperatures": {},
+            "alerts": [],
+            "services": {},
+        }
+        if disk is not None and self._prev_disk is not None:
+            values["disk_read_rate"] = self._rate(disk.read_bytes, self._prev_disk.read_bytes, elapsed)
+            values["disk_write_rate"] = self._rate(disk.write_bytes, self._prev_disk.write_bytes, elapsed)
+        self._prev_net, self._prev_disk = net, disk
 
-    table = Table.grid(expand=True)
-    table.add_column(justify="left")
-    table.add_column(justify="right")
+        # Filesystem usage moves slowly; statvfs every few seconds is plenty
+        if self._disks is None or now - self._disks_at >= self.disk_usage_interval:
+            self._disks = []
+            for path in self.disk_paths:
+                usage = shutil.disk_usage(path)
+                self._disks.append({"path": path, "used": usage.used, "total": usage.total,
+                                    "percent": usage.used / (usage.used + usage.free) * 100})
+            self._disks_at = now
+        values["disks"] = self._disks
+        return values
 
-    left = Table.grid(padding=(0, 1))
-    left.add_row("[bold cyan]Host[/]", f"{hostname}")
-    left.add_row("[bold cyan]Uptime[/]", uptime)
-    left.add_row("[bold cyan]CPU[/]", f"{cpu_percent:.0f}% | load {load_avg[0]:.2f} {load_avg[1]:.2f} {load_avg[2]:.2f}")
-    left.add_row("[bold cyan]Cores[/]", " ".join(f"{p:.0f}%" for p in per_core))
-    left.add_row("[bold cyan]Memory[/]", f"{format_bytes(mem.used)} / {format_bytes(mem.total)} ({mem.percent:.0f}%)")
-    left.add_row("[bold cyan]Disk /[/]", f"{format_bytes(disk_used)} / {format_bytes(disk_total)} ({(disk_used/disk_total)*100:.0f}%)")
 
-    right = Table.grid(padding=(0, 1))
-    right.add_row("[bold magenta]Net Sent[/]", format_bytes(net.bytes_sent))
-    right.add_row("[bold magenta]Net Rcvd[/]", format_bytes(net.bytes_recv))
-    right.add_row("[bold yellow]Time[/]", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+class ApiSource:
+    """Reads the smash_core host metrics collector instead of sampling the box"""
 
-    table.add_row(left, right)
+    name = "api"
 
-    return Panel(Align.center(table), title="[bold green]SMASH Cloud Core[/]", border_style="green")
+    def __init__(self, url: str, timeout: float = 1.0):
+        self.url = url
+        self.timeout = timeout
+
+    def sample(self) -> Dict:
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            snapshot = json.load(response)
+        if not snapshot.get("available"):
+            raise RuntimeError(snapshot.get("error", "host metrics not available yet"))
+        cpu, memory = snapshot["cpu"], snapshot["memory"]
+        return {
+            "hostname": snapshot["hostname"],
+            "cpu_percent": cpu["percent"],
+            "per_core": cpu["per_core"],
+            "load": cpu["load"] or (0.0, 0.0, 0.0),
+            "mem_used": memory["used"],
+            "mem_total": memory["total"],
+            "mem_percent": memory["percent"],
+            "net_rx_rate": snapshot["network"]["rx_rate"] or 0.0,
+            "net_tx_rate": snapshot["network"]["tx_rate"] or 0.0,
+            "disk_read_rate": snapshot["disk_io"]["read_rate"] or 0.0,
+            "disk_write_rate": snapshot["disk_io"]["write_rate"] or 0.0,
+            "uptime": snapshot["uptime"],
+            "disks": [disk for disk in snapshot["disks"] if "percent" in disk],
+            "temperatures": snapshot.get("temperatures", {}),
+            "alerts": [alert["name"] for alert in snapshot.get("alerts", [])],
+            "services": snapshot.get("services", {}),
+        }
+
+
+class MetricsSource:
+    """API first (auto), falling back to local sampling and retrying the API periodically"""
+
+    def __init__(self, mode: str = "auto", url: str = DEFAULT_METRICS_URL, retry_seconds: float = 30.0):
+        self.mode = mode
+        self.api = ApiSource(url) if mode in ("auto", "api") else None
+        self.local: Optional[SystemSampler] = None
+        self.retry_seconds = retry_seconds
+        self._api_retry_at = 0.0
+        self.name = "api" if self.api else "local"
+
+    def _local(self) -> SystemSampler:
+        if self.local is None:
+            self.local = SystemSampler(["/", "/mnt/smash_data"])
+        return self.local
+
+    def sample(self) -> Dict:
+        if self.api and time.monotonic() >= self._api_retry_at:
+            try:
+                values = self.api.sample()
+                self.name = "api"
+                return values
+            except (OSError, ValueError, KeyError, RuntimeError):
+                if self.mode == "api":
+                    raise
+                self._api_retry_at = time.monotonic() + self.retry_seconds
+        self.name = "local"
+        return self._local().sample()
+
+
+class Dashboard:
+    """Samples, records history and renders; backs off while nothing changes"""
+
+    SERIES = ("cpu_percent", "mem_percent", "net_rx_rate", "net_tx_rate",
+              "disk_read_rate", "disk_write_rate")
+    MAX_SERVICES = 6
+
+    def __init__(self, source: MetricsSource, refresh: float = 1.0, max_refresh: float = 5.0,
+                 history_minutes: float = 10.0, spark_width: int = 30):
+        self.base_refresh = refresh
+        self.max_refresh = max(max_refresh, refresh)
+        self.interval = refresh
+        self.history_minutes = history_minutes
+        self.source = source
+        self.series = {name: TimeSeries(history_minutes, spark_width) for name in self.SERIES}
+        self.panel = Panel(Text(""), title="[bold green]SMASH Cloud Core[/]", border_style="green")
+        self._last: Optional[Dict] = None
+        self._started_wall = time.monotonic()
+        self._started_cpu = time.process_time()
+        self.refreshes = 0
+        self.cost_ms = 0.0
+
+    def _changed(self, values: Dict) -> bool:
+        """Whether anything moved enough to be worth refreshing quickly for"""
+        last = self._last
+        if last is None:
+            return True
+        if abs(values["cpu_percent"] - last["cpu_percent"]) >= 5:
+            return True
+        if abs(values["mem_percent"] - last["mem_percent"]) >= 1:
+            return True
+        if values["alerts"] != last["alerts"]:
+            return True
+        for key in ("net_rx_rate", "net_tx_rate", "disk_read_rate", "disk_write_rate"):
+            before, after = last[key], values[key]
+            if abs(after - before) > max(before * 0.25, 64 * 1024):
+                return True
+        return False
+
+    def cpu_percent(self) -> float:
+        """This process's CPU time as a share of one core since start"""
+        wall = time.monotonic() - self._started_wall
+        return (time.process_time() - self._started_cpu) / wall * 100 if wall > 0 else 0.0
+
+    def render(self, values: Dict) -> Panel:
+        load = values["load"]
+        series = self.series
+        window = f"{self.history_minutes:g}m"
+
+        lines = [
+            f"[bold cyan]Host[/]    {values['hostname']}   [bold cyan]Uptime[/] {format_duration(values['uptime'])}"
+            f"   [bold yellow]{datetime.now():%Y-%m-%d %H:%M}[/]",
+            f"[bold cyan]CPU[/]     {values['cpu_percent']:3.0f}%  load {load[0]:.2f} {load[1]:.2f} {load[2]:.2f}"
+            f"   [green]{series['cpu_percent'].sparkline(100)}[/] {window}",
+            f"[bold cyan]Cores[/]   " + " ".join(f"{p:3.0f}%" for p in values["per_core"]),
+            f"[bold cyan]Memory[/]  {format_bytes(values['mem_used'])} / {format_bytes(values['mem_total'])}"
+            f" ({values['mem_percent']:.0f}%)   [green]{series['mem_percent'].sparkline(100)}[/]",
+        ]
+        for disk in values["disks"]:
+            lines.append(f"[bold cyan]Disk[/]    {disk['path']}  {format_bytes(disk['used'])} / "
+                         f"{format_bytes(disk['total'])} ({disk['percent']:.0f}%)")
+        lines += [
+            f"[bold magenta]Net[/]     ↓ {format_bytes(values['net_rx_rate'])}/s  ↑ {format_bytes(values['net_tx_rate'])}/s"
+            f"   [magenta]{series['net_rx_rate'].sparkline()}[/]",
+            f"[bold magenta]Disk IO[/] R {format_bytes(values['disk_read_rate'])}/s  W {format_bytes(values['disk_write_rate'])}/s"
+            f"   [magenta]{series['disk_write_rate'].sparkline()}[/]",
+        ]
+        if values["temperatures"]:
+            lines.append("[bold yellow]Temp[/]    " + "  ".join(
+                f"{label} {celsius:.0f}°C" for label, celsius in list(values["temperatures"].items())[:4]))
+        running = sorted(((name, service) for name, service in values["services"].items() if service["processes"]),
+                         key=lambda item: item[1]["cpu_percent"], reverse=True)
+        for name, service in running[:self.MAX_SERVICES]:
+            io = "io n/a" if service["read_rate"] is None else \
+                f"io {format_bytes(service['read_rate'] + service['write_rate'])}/s"
+            latency = f"  req {service['request_ms']:.0f}ms" if service.get("request_ms") is not None else ""
+            lines.append(f"[bold blue]{name[:10]:<10}[/] {service['cpu_percent']:5.1f}%  {format_bytes(service['rss']):>8}"
+                         f"  {service['threads']:3d} thr  {io}{latency}")
+        if values["alerts"]:
+            lines.append("[bold red]ALERT[/]   " + ", ".join(values["alerts"]))
+        # The first refresh has no meaningful wall time to divide by yet
+        cost = f"{self.cpu_percent():.2f}% cpu · {self.cost_ms:.1f} ms/refresh" if self.refreshes else "measuring"
+        lines.append(f"[dim]{self.source.name} · dashboard {cost} · every {self.interval:.1f}s[/]")
+        self.panel.renderable = Align.center(Text.from_markup("\n".join(lines)))
+        return self.panel
+
+    def tick(self) -> Panel:
+        """One refresh: sample, record, adapt the interval and render"""
+        started = time.process_time()
+        values = self.source.sample()
+        now = time.time()
+        for name, ts in self.series.items():
+            ts.add(now, values[name])
+
+        if self._changed(values):
+            self.interval = self.base_refresh
+            self._last = values
+        else:
+            self.interval = min(self.interval * 1.5, self.max_refresh)
+
+        panel = self.render(values)
+        cost = (time.process_time() - started) * 1000
+        self.cost_ms = cost if not self.refreshes else self.cost_ms * 0.8 + cost * 0.2
+        self.refreshes += 1
+        return panel
+
+
+def dashboard_from_env() -> Dashboard:
+    return Dashboard(
+        MetricsSource(os.getenv("SMASH_DASH_SOURCE", "auto"),
+                      os.getenv("SMASH_METRICS_URL", DEFAULT_METRICS_URL)),
+        refresh=float(os.getenv("SMASH_DASH_REFRESH", "1.0")),
+        max_refresh=float(os.getenv("SMASH_DASH_MAX_REFRESH", "5.0")),
+        history_minutes=float(os.getenv("SMASH_DASH_HISTORY_MINUTES", "10")),
+        spark_width=int(os.getenv("SMASH_DASH_SPARK_WIDTH", "30")),
+    )
+
+
+def measure(seconds: float) -> Dict:
+    """Run headless for `seconds` and report the dashboard's own CPU cost"""
+    dashboard = dashboard_from_env()
+    buffer = io.StringIO()
+    console = Console(file=buffer, width=80, force_terminal=True)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        console.print(dashboard.tick())
+        buffer.seek(0)
+        buffer.truncate()
+        time.sleep(dashboard.interval)
+    return {
+        "seconds": seconds,
+        "refreshes": dashboard.refreshes,
+        "avg_cost_ms": round(dashboard.cost_ms, 3),
+        "cpu_percent_of_core": round(dashboard.cpu_percent(), 3),
+        "source": dashboard.source.name,
+        "target_percent": 1.0,
+    }
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="SMASH Cloud Core system dashboard")
+    parser.add_argument("--measure", type=float, metavar="SECONDS",
+                        help="Run headless and print the dashboard's CPU cost as JSON")
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure), indent=2))
+        return
+
+    dashboard = dashboard_from_env()
     console = Console()
-    refresh_seconds = float(os.getenv("SMASH_DASH_REFRESH", "1.0"))
-    with Live(render_dashboard(), console=console, refresh_per_second=max(1, int(1/refresh_seconds))):
+    with Live(dashboard.tick(), console=console, auto_refresh=False) as live:
         while True:
-            time.sleep(refresh_seconds)
-            console.update_live(render_dashboard())
+            time.sleep(dashboard.interval)
+            live.update(dashboard.tick(), refresh=True)
 
 
 if __name__ == "__main__":
     main()
-
-
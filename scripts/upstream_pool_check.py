@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+SMASH Cloud Core - Upstream pool checks against local stand-ins
+
+Starts several fake upstreams (scripts/fake_upstreams.py) with different
+behaviour, points smash_core's Whisper, Piper and Ollama pools at them and
+checks how traffic is spread:
+
+  weights     WHISPER_HOST=fast,fast;weight=3,flaky - the weight-3 endpoint
+              takes at least twice the fast one's share
+  ejection    the flaky Whisper endpoint (every request fails) is ejected and
+              every transcription still succeeds through a retry
+  health      a Piper endpoint with nothing listening fails its health check
+              and gets no traffic once probed
+  latency     a slow Piper endpoint gets fewer requests than a fast one
+  models      Ollama requests for llama3 only reach the endpoint that has it
+  metrics     /metrics exposes per-endpoint series
+
+Everything runs offline on one machine; counts come from the stand-ins'
+own /health counters, not from smash_core.
+
+Run locally:
+  python3 scripts/upstream_pool_check.py
+  python3 scripts/upstream_pool_check.py --requests 300 --concurrency 16 --balance ewma
+"""
+
+import argparse
+import asyncio
+import io
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+SMASH_CORE = ROOT / "smash_core"
+FAKE_UPSTREAMS = Path(__file__).resolve().parent / "fake_upstreams.py"
+
+# name -> fake_upstreams.py options
+STAND_INS = {
+    "fast": ["--stt-latency", "20", "--tts-latency", "20", "--llm-latency", "20", "--llm-tokens", "5",
+             "--models", "llama3:latest"],
+    "heavy": ["--stt-latency", "20", "--tts-latency", "20", "--llm-latency", "20", "--llm-tokens", "5",
+              "--models", "mistral:latest"],
+    "flaky": ["--stt-latency", "5", "--stt-error-rate", "1.0"],
+    "slow": ["--tts-latency", "250"],
+}
+# Falls through the keyword intents, so the reply comes from the LLM
+LLM_PROMPT = "explain what a reverse proxy does"
+
+
+def tone_wav(index: int, seconds: float = 0.5, sample_rate: int = 16000) -> bytes:
+    """A short tone whose pitch varies with index, so no two uploads are alike"""
+    frequency = 200 + index
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"".join(
+            int(3000 * math.sin(2 * math.pi * frequency * i / sample_rate)).to_bytes(2, "little", signed=True)
+            for i in range(int(seconds * sample_rate))
+        ))
+    return buffer.getvalue()
+
+
+def start_process(command: List[str], cwd: Path, env: Dict) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+class PoolCheck:
+    """Drives smash_core and compares the stand-ins' request counts"""
+
+    def __init__(self, base: str, upstreams: Dict[str, str], requests: int, concurrency: int):
+        self.base = base
+        self.upstreams = upstreams
+        self.requests = requests
+        self.concurrency = concurrency
+        self.client = httpx.AsyncClient(timeout=60.0)
+        self.results: List[Dict] = []
+
+    async def check(self, name: str, coro):
+        try:
+            note = await coro
+            status = "pass"
+        except Exception as e:
+            status, note = "fail", f"{type(e).__name__}: {e}"
+        self.results.append({"check": name, "status": status, "note": note})
+        print(f"{'✅' if status == 'pass' else '❌'} {name}" + (f" - {note}" if note else ""))
+
+    async def counts(self) -> Dict[str, Dict[str, int]]:
+        counts = {}
+        for name, url in self.upstreams.items():
+            try:
+                counts[name] = (await self.client.get(f"{url}/health")).json()["requests"]
+            except httpx.HTTPError:
+                counts[name] = {}
+        return counts
+
+    async def fire(self, send) -> List[int]:
+        """Run send(index) requests concurrency at a time; returns the status codes"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(index: int) -> int:
+            async with semaphore:
+                return (await send(index)).status_code
+
+        return await asyncio.gather(*(one(index) for index in range(self.requests)))
+
+    async def pools(self) -> Dict:
+        return (await self.client.get(f"{self.base}/api/system/upstreams")).json()
+
+    def endpoint(self, pools: Dict, service: str, name: str) -> Dict:
+        return next(e for e in pools[service]["endpoints"] if e["url"] == self.upstreams[name])
+
+    async def wait_for_probes(self, timeout: float = 30.0):
+        """Until the dead Piper endpoint is down and Ollama model lists are known"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            pools = await self.pools()
+            if self.endpoint(pools, "piper", "dead")["healthy"] is False and all(
+                    e["models"] is not None for e in pools["ollama"]["endpoints"]):
+                return
+            await asyncio.sleep(0.5)
+        raise RuntimeError("health probes did not complete")
+
+    async def transcription(self):
+        before = await self.counts()
+        statuses = await self.fire(lambda index: self.client.post(
+            f"{self.base}/api/audio/transcribe",
+            files={"audio_file": (f"clip{index}.wav", tone_wav(index), "audio/wav")},
+        ))
+        after = await self.counts()
+        self.stt = {name: after[name].get("transcribe", 0) - before[name].get("transcribe", 0)
+                    for name in ("fast", "heavy", "flaky")}
+        self.stt_statuses = statuses
+
+    async def weights(self):
+        fast, heavy = self.stt["fast"], self.stt["heavy"]
+        ratio = heavy / max(fast, 1)
+        # Not exactly 3x: least_outstanding's (outstanding + 1) / weight leans further
+        # to the heavy endpoint at low concurrency, and ewma also weighs latency
+        assert fast and ratio >= 2.0, f"weight-3 endpoint took {heavy} vs {fast} ({ratio:.2f}x)"
+        return f"fast {fast}, weight 3 {heavy} ({ratio:.2f}x)"
+
+    async def ejection(self):
+        failed = [status for status in self.stt_statuses if status != 200]
+        assert not failed, f"{len(failed)} of {len(self.stt_statuses)} transcriptions failed"
+        flaky = self.endpoint(await self.pools(), "whisper", "flaky")
+        assert flaky["ejections"] >= 1, "flaky endpoint was never ejected"
+        share = self.stt["flaky"] / sum(self.stt.values())
+        assert share < 0.1, f"flaky endpoint still got {share:.0%} of requests"
+        return f"{flaky['ejections']} ejection(s), {self.stt['flaky']} requests reached it, none failed"
+
+    async def synthesis(self):
+        # The start-up greeting may have reached the dead endpoint before its first probe
+        self.dead_before = self.endpoint(await self.pools(), "piper", "dead")["requests"]
+        before = await self.counts()
+        statuses = await self.fire(lambda index: self.client.post(
+            f"{self.base}/api/audio/synthesize", params={"text": f"status report number {index}"}
+        ))
+        after = await self.counts()
+        self.tts = {name: after[name].get("synthesize", 0) - before[name].get("synthesize", 0)
+                    for name in ("fast", "slow")}
+        self.tts_statuses = statuses
+
+    async def health(self):
+        failed = [status for status in self.tts_statuses if status != 200]
+        assert not failed, f"{len(failed)} of {len(self.tts_statuses)} syntheses failed"
+        dead = self.endpoint(await self.pools(), "piper", "dead")
+        assert not dead["available"], "dead endpoint is still in rotation"
+        sent = dead["requests"] - self.dead_before
+        assert sent == 0, f"dead endpoint was sent {sent} requests"
+        return f"out of rotation ({dead['last_error']})"
+
+    async def latency(self):
+        fast, slow = self.tts["fast"], self.tts["slow"]
+        assert slow < fast, f"slow endpoint took {slow} requests, fast {fast}"
+        return f"fast {fast}, slow {slow}"
+
+    async def models(self):
+        before = await self.counts()
+        statuses = await self.fire(lambda index: self.client.post(
+            f"{self.base}/api/chat/", json={"message": f"{LLM_PROMPT} ({index})"}
+        ))
+        after = await self.counts()
+        generated = {name: after[name].get("generate", 0) - before[name].get("generate", 0)
+                     for name in ("fast", "heavy")}
+        assert all(status == 200 for status in statuses), "chat requests failed"
+        assert generated["heavy"] == 0, f"{generated['heavy']} llama3 requests reached the mistral-only endpoint"
+        assert generated["fast"] >= self.requests, f"only {generated['fast']} requests reached Ollama"
+        return f"llama3 endpoint {generated['fast']}, mistral endpoint {generated['heavy']}"
+
+    async def metrics(self):
+        text = (await self.client.get(f"{self.base}/metrics")).text
+        for name in ("smash_upstream_requests_total", "smash_upstream_outstanding",
+                     "smash_upstream_available", "smash_upstream_ejections_total"):
+            assert f'{name}{{service="' in text, f"{name} missing"
+        return None
+
+    async def run(self) -> bool:
+        try:
+            await self.wait_for_probes()
+            await self.transcription()
+            await self.check("weights", self.weights())
+            await self.check("ejection", self.ejection())
+            await self.synthesis()
+            await self.check("health", self.health())
+            await self.check("latency", self.latency())
+            await self.check("models", self.models())
+            await self.check("metrics", self.metrics())
+        finally:
+            await self.client.aclose()
+        failed = [result for result in self.results if result["status"] == "fail"]
+        print(f"{len(self.results) - len(failed)}/{len(self.results)} checks passed")
+        return not failed
+
+
+async def main_async(args) -> bool:
+    processes = []
+    upstreams = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for offset, (name, options) in enumerate(STAND_INS.items()):
+                port = args.upstream_port + offset
+                upstreams[name] = f"http://127.0.0.1:{port}"
+                processes.append(start_process(
+                    [sys.executable, str(FAKE_UPSTREAMS), "--port", str(port), *options], ROOT, dict(os.environ)
+                ))
+            # Nothing listens here
+            upstreams["dead"] = f"http://127.0.0.1:{args.upstream_port + len(STAND_INS)}"
+            for name in STAND_INS:
+                await wait_for(f"{upstreams[name]}/health")
+
+            env = dict(os.environ)
+            env.update({
+                "WHISPER_HOST": f"{upstreams['fast']},{upstreams['heavy']};weight=3,{upstreams['flaky']}",
+                "PIPER_HOST": f"{upstreams['fast']},{upstreams['slow']},{upstreams['dead']}",
+                "OLLAMA_HOST": f"{upstreams['fast']},{upstreams['heavy']}",
+                "OLLAMA_MODEL": "llama3",
+                "UPSTREAM_BALANCE": args.balance,
+                "HEALTH_PROBE_INTERVAL": "1",
+                "STT_CACHE_ENABLED": "false",
+                "OPENAI_API_KEY": "",
+                "ELEVENLABS_API_KEY": "",
+                "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'smash_ai.db')}",
+                "AUDIO_STORE_DIR": os.path.join(workdir, "static"),
+                "STATE_URL": os.path.join(workdir, "state.db"),
+                "TIMESERIES_DIR": os.path.join(workdir, "metrics_history"),
+                "JOBS_DIR": os.path.join(workdir, "jobs"),
+                "TRACE_LOG_ENABLED": "false",
+            })
+            processes.append(start_process(
+                [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.port),
+                 "--log-level", "warning"], SMASH_CORE, env
+            ))
+            base = f"http://127.0.0.1:{args.port}"
+            await wait_for(f"{base}/ready")
+            return await PoolCheck(base, upstreams, args.requests, args.concurrency).run()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check upstream pool balancing against local stand-ins")
+    parser.add_argument("--port", type=int, default=8769)
+    parser.add_argument("--upstream-port", type=int, default=9110, help="First of five consecutive ports")
+    parser.add_argument("--requests", type=int, default=120, help="Requests per service")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--balance", choices=("least_outstanding", "ewma"), default="least_outstanding")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(main_async(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+SMASH Cloud Core - Reference client for the /ws/voice binary protocol
+
+Speaks smash.voice.v1 (smash_core/core/voice_protocol.py): every WebSocket
+message is a msgpack envelope [type, turn, meta, payload] with raw audio in
+the payload. The client negotiates the subprotocol (and permessage-deflate
+unless --no-deflate), streams audio as audio_in chunks under a client turn
+key, and collects each turn's transcript, text deltas, response, speech
+(audio_out) and metrics frames. Several turns can be in flight on one
+connection; frames are routed by turn id.
+
+Commands:
+  say          stream an audio file (WAV is sent as raw PCM chunks, OGG/FLAC as-is)
+  ask          send a final transcript, skipping STT
+  conformance  check a running server against the protocol
+  selftest     start fake upstreams (scripts/fake_upstreams.py) and smash_core,
+               then run the conformance checks against them
+
+Requires websockets and msgpack.
+
+Run locally:
+  python3 scripts/voice_ws_client.py say hello.wav --audio inline --save reply.wav
+  python3 scripts/voice_ws_client.py ask "jarvis, explain what a reverse proxy does"
+  python3 scripts/voice_ws_client.py --url ws://smash.local:8000/ws/voice conformance
+  python3 scripts/voice_ws_client.py selftest
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+SMASH_CORE = ROOT / "smash_core"
+FAKE_UPSTREAMS = Path(__file__).resolve().parent / "fake_upstreams.py"
+
+# The wire format lives next to the server so the two cannot drift
+sys.path.insert(0, str(SMASH_CORE))
+from core import voice_protocol as protocol  # noqa: E402
+
+# 100 ms of 16 kHz mono 16-bit PCM per audio_in frame
+CHUNK_BYTES = 3200
+# Falls through the keyword intents, so the reply comes from the LLM
+LLM_PROMPT = "jarvis, explain what a reverse proxy does"
+
+
+def tone_pcm(seconds: float = 1.0, sample_rate: int = 16000) -> bytes:
+    """A quiet 220 Hz tone as 16-bit little-endian PCM"""
+    return b"".join(
+        int(3000 * math.sin(2 * math.pi * 220 * i / sample_rate)).to_bytes(2, "little", signed=True)
+        for i in range(int(seconds * sample_rate))
+    )
+
+
+def read_audio(path: str):
+    """(audio_format, sample_rate, channels, bytes) for a file to stream"""
+    data = Path(path).read_bytes()
+    if data[:4] == b"RIFF":
+        with wave.open(io.BytesIO(data)) as wav:
+            if wav.getsampwidth() != 2:
+                raise SystemExit("Only 16-bit WAV can be streamed as PCM")
+            return "pcm_s16le", wav.getframerate(), wav.getnchannels(), wav.readframes(wav.getnframes())
+    if data[:4] == b"OggS":
+        return "ogg_opus", 48000, 1, data
+    if data[:4] == b"fLaC":
+        return "flac", 16000, 1, data
+    raise SystemExit(f"{path}: expected WAV, OGG/Opus or FLAC")
+
+
+class Turn:
+    """Everything the server sent for one turn"""
+
+    def __init__(self, turn_id: str):
+        self.turn_id = turn_id
+        self.frames: List[protocol.Frame] = []
+        self.transcript: Optional[str] = None
+        self.deltas: List[str] = []
+        self.response: Optional[Dict] = None
+        self.audio = bytearray()
+        self.audio_type: Optional[str] = None
+        self.audio_end: Optional[Dict] = None
+        self.cancelled: Optional[str] = None
+        self.metrics: Optional[Dict] = None
+        self.done = asyncio.Event()
+
+    def add(self, frame: protocol.Frame):
+        self.frames.append(frame)
+        meta = frame.meta
+        if frame.type == protocol.TRANSCRIPT:
+            self.transcript = meta.get("text")
+        elif frame.type == protocol.TEXT_DELTA:
+            self.deltas.append(meta.get("text", ""))
+        elif frame.type == protocol.RESPONSE:
+            self.response = meta
+        elif frame.type == protocol.AUDIO_OUT:
+            if meta.get("start"):
+                self.audio_type = meta.get("content_type")
+            if frame.payload:
+                self.audio += frame.payload
+            if meta.get("end"):
+                self.audio_end = meta
+        elif frame.type == protocol.CONTROL and meta.get("op") == "turn_cancelled":
+            self.cancelled = meta.get("reason")
+        elif frame.type == protocol.METRICS:
+            # Always the last frame of a turn
+            self.metrics = meta
+            self.done.set()
+
+    def summary(self) -> Dict:
+        return {
+            "turn_id": self.turn_id,
+            "transcript": self.transcript,
+            "response": (self.response or {}).get("text"),
+            "deltas": len(self.deltas),
+            "audio_url": (self.response or {}).get("audio_url"),
+            "audio_bytes": len(self.audio),
+            "audio_type": self.audio_type,
+            "cancelled": self.cancelled,
+            "metrics": self.metrics,
+        }
+
+
+class VoiceClient:
+    """One smash.voice.v1 connection; a reader task routes frames to turns"""
+
+    def __init__(self, url: str, deflate: bool = True):
+        self.url = url
+        self.deflate = deflate
+        self.ws = None
+        self.hello: Dict = {}
+        self.turns: Dict[str, Turn] = {}
+        # Client turn key -> server turn id, from turn_started
+        self.started: Dict[str, asyncio.Future] = {}
+        # Server frames that belong to no turn (hello, pong, error, stats, ...)
+        self.events: asyncio.Queue = asyncio.Queue()
+        self._pending_final: List[asyncio.Future] = []
+        self._reader: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        import websockets
+
+        self.ws = await websockets.connect(self.url, subprotocols=[protocol.SUBPROTOCOL],
+                                           compression="deflate" if self.deflate else None,
+                                           max_size=None)
+        if self.ws.subprotocol != protocol.SUBPROTOCOL:
+            await self.ws.close()
+            raise RuntimeError(f"Server did not accept {protocol.SUBPROTOCOL} (msgpack missing on the server?)")
+        self._reader = asyncio.create_task(self._read())
+        self.hello = (await self.next_event(protocol.HELLO)).meta
+
+    async def close(self):
+        if self._reader:
+            self._reader.cancel()
+        if self.ws:
+            await self.ws.close()
+
+    @property
+    def compressed(self) -> bool:
+        return any(type(extension).__name__ == "PerMessageDeflate" for extension in self.ws.extensions)
+
+    async def send(self, kind: str, turn: Optional[str] = None, meta: Optional[Dict] = None,
+                   payload: Optional[bytes] = None):
+        await self.ws.send(protocol.encode_frame(kind, turn, meta, payload))
+
+    async def _read(self):
+        async for message in self.ws:
+            if isinstance(message, str):
+                raise RuntimeError(f"Text frame on a {protocol.SUBPROTOCOL} connection: {message[:80]}")
+            frame = protocol.decode_frame(message)
+            meta = frame.meta
+            if frame.type == protocol.PING:
+                await self.send(protocol.PONG, meta={"ts": meta.get("ts")})
+                continue
+            if frame.type == protocol.CONTROL and meta.get("op") == "turn_started":
+                self._turn(frame.turn)
+                waiter = self.started.get(meta.get("client_turn"))
+                if waiter and not waiter.done():
+                    waiter.set_result(frame.turn)
+            if frame.turn is None or (frame.type == protocol.ERROR and frame.turn not in self.turns):
+                await self.events.put(frame)
+                continue
+            if frame.type == protocol.TRANSCRIPT and frame.turn not in self.turns and self._pending_final:
+                # A turn started by ask(): the server's transcript echo is its first frame
+                self._pending_final.pop(0).set_result(frame.turn)
+            self._turn(frame.turn).add(frame)
+
+    def _turn(self, turn_id: str) -> Turn:
+        if turn_id not in self.turns:
+            self.turns[turn_id] = Turn(turn_id)
+        return self.turns[turn_id]
+
+    async def next_event(self, kind: str, timeout: float = 10.0, op: Optional[str] = None) -> protocol.Frame:
+        """Next turn-less frame of a type (and control op), skipping others"""
+        async with asyncio.timeout(timeout):
+            while True:
+                frame = await self.events.get()
+                if frame.type == kind and (op is None or frame.meta.get("op") == op):
+                    return frame
+
+    async def configure(self, **options) -> Dict:
+        await self.send(protocol.HELLO, meta=options)
+        frame = await self.next_event(protocol.HELLO)
+        return frame.meta
+
+    async def start_audio(self, key: str) -> asyncio.Future:
+        self.started[key] = asyncio.get_running_loop().create_future()
+        return self.started[key]
+
+    async def say(self, key: str, audio: bytes, chunk_bytes: int = CHUNK_BYTES, pace: float = 0.0) -> str:
+        """Stream one utterance; returns the server turn id"""
+        started = await self.start_audio(key)
+        chunks = [audio[i:i + chunk_bytes] for i in range(0, len(audio), chunk_bytes)] or [b""]
+        for index, chunk in enumerate(chunks):
+            await self.send(protocol.AUDIO_IN, key, {"end": index == len(chunks) - 1}, chunk)
+            if pace:
+                await asyncio.sleep(pace)
+        return await asyncio.wait_for(started, 10.0)
+
+    async def ask(self, text: str) -> str:
+        """Send a final transcript; returns the server turn id"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending_final.append(waiter)
+        await self.send(protocol.TRANSCRIPT, meta={"text": text, "final": True})
+        return await asyncio.wait_for(waiter, 10.0)
+
+    async def wait(self, turn_id: str, timeout: float = 60.0) -> Turn:
+        turn = self._turn(turn_id)
+        await asyncio.wait_for(turn.done.wait(), timeout)
+        return turn
+
+
+class Conformance:
+    """Protocol checks against one server; each check uses its own connection"""
+
+    def __init__(self, url: str, deflate: bool = True, timeout: float = 60.0):
+        self.url = url
+        self.deflate = deflate
+        self.timeout = timeout
+        self.results: List[Dict] = []
+
+    async def check(self, name: str, coro):
+        started = time.perf_counter()
+        try:
+            note = await coro
+            status = "skip" if isinstance(note, str) and note.startswith("skip") else "pass"
+        except Exception as e:
+            status, note = "fail", f"{type(e).__name__}: {e}"
+        self.results.append({"check": name, "status": status, "note": note,
+                             "ms": round((time.perf_counter() - started) * 1000, 1)})
+        icon = {"pass": "✅", "skip": "⏭️ ", "fail": "❌"}[status]
+        print(f"{icon} {name}" + (f" - {note}" if note else ""))
+
+    def client(self) -> VoiceClient:
+        return VoiceClient(self.url, self.deflate)
+
+    async def handshake(self):
+        async with self.client() as client:
+            hello = client.hello
+            assert hello.get("protocol") == protocol.SUBPROTOCOL, hello
+            assert hello.get("version") == protocol.VERSION, hello
+            for key in ("session_id", "frames", "audio_formats", "max_audio_bytes"):
+                assert key in hello, f"hello lacks {key}"
+            if self.deflate:
+                assert client.compressed, "permessage-deflate was offered but not negotiated"
+                assert hello.get("compression") == "permessage-deflate", hello.get("compression")
+            return f"session {hello['session_id']}, compression {hello.get('compression')}"
+
+    async def ping(self):
+        async with self.client() as client:
+            await client.send(protocol.PING, meta={"ts": 1234.5})
+            pong = await client.next_event(protocol.PONG)
+            assert pong.meta.get("ts") == 1234.5, pong.meta
+
+    async def errors(self):
+        async with self.client() as client:
+            await client.ws.send(b"\xc1not msgpack")
+            assert (await client.next_event(protocol.ERROR)).meta["code"] == "malformed"
+            await client.send("bogus_frame")
+            assert (await client.next_event(protocol.ERROR)).meta["code"] == "unknown_frame"
+            await client.send(protocol.AUDIO_IN, None, {"end": True}, b"\0\0")
+            assert (await client.next_event(protocol.ERROR)).meta["code"] == "missing_turn"
+            await client.send(protocol.HELLO, meta={"audio_format": "mp3"})
+            assert (await client.next_event(protocol.ERROR)).meta["code"] == "bad_option"
+            # Still usable afterwards
+            await client.send(protocol.PING, meta={"ts": 1})
+            await client.next_event(protocol.PONG)
+
+    async def text_turn(self):
+        async with self.client() as client:
+            turn = await client.wait(await client.ask(LLM_PROMPT), self.timeout)
+            assert turn.transcript == LLM_PROMPT, turn.transcript
+            assert turn.response, "no response frame"
+            assert turn.deltas, "no text_delta frames"
+            assert "".join(turn.deltas).strip() == turn.response["text"].strip(), "deltas do not add up to the response"
+            assert "llm" in turn.metrics["stages_ms"], turn.metrics
+            assert turn.metrics["outcome"] == "ok", turn.metrics
+            return f"{len(turn.deltas)} deltas, llm {turn.metrics['stages_ms']['llm']} ms"
+
+    async def audio_turn(self):
+        async with self.client() as client:
+            await client.configure(audio_format="pcm_s16le", sample_rate=16000, channels=1)
+            turn = await client.wait(await client.say("a1", tone_pcm(1.0)), self.timeout)
+            assert "stt" in turn.metrics["stages_ms"], turn.metrics
+            if turn.transcript is None:
+                # A real Whisper hears a tone, not the wake word
+                return f"skip: audio not addressed to the assistant (outcome {turn.metrics['outcome']})"
+            assert turn.response, "transcript without a response"
+            return f"heard {turn.transcript!r}"
+
+    async def concurrent_turns(self):
+        async with self.client() as client:
+            await client.configure(barge_in=False)
+            pcm = tone_pcm(0.6)
+            first, second = await client.start_audio("c1"), await client.start_audio("c2")
+            # Interleave the two utterances' chunks on one connection
+            for offset in range(0, len(pcm), CHUNK_BYTES):
+                end = offset + CHUNK_BYTES >= len(pcm)
+                for key in ("c1", "c2"):
+                    await client.send(protocol.AUDIO_IN, key, {"end": end}, pcm[offset:offset + CHUNK_BYTES])
+            ids = [await asyncio.wait_for(first, 10), await asyncio.wait_for(second, 10)]
+            assert ids[0] != ids[1], ids
+            turns = [await client.wait(turn_id, self.timeout) for turn_id in ids]
+            outcomes = [turn.metrics["outcome"] for turn in turns]
+            assert "cancelled" not in outcomes, outcomes
+            return f"turns {ids[0]} and {ids[1]}: {outcomes}"
+
+    async def inline_audio(self):
+        async with self.client() as client:
+            await client.configure(audio="inline")
+            turn = await client.wait(await client.ask(LLM_PROMPT), self.timeout)
+            if turn.audio_end and turn.audio_end.get("error"):
+                return f"skip: server could not synthesize ({turn.audio_end['error']})"
+            assert turn.audio_type, "no audio_out start frame"
+            assert turn.audio, "no audio_out payload"
+            assert turn.audio_end and turn.audio_end.get("bytes") == len(turn.audio), turn.audio_end
+            return f"{len(turn.audio)} bytes of {turn.audio_type}"
+
+    async def cancel(self):
+        async with self.client() as client:
+            turn_id = await client.ask(LLM_PROMPT)
+            await client.send(protocol.CONTROL, turn_id, {"op": "cancel"})
+            turn = await client.wait(turn_id, self.timeout)
+            if turn.cancelled is None:
+                return "skip: the turn finished before the cancel arrived"
+            assert turn.metrics["outcome"] == "cancelled", turn.metrics
+
+    async def stats(self):
+        async with self.client() as client:
+            await client.send(protocol.CONTROL, meta={"op": "stats"})
+            stats = (await client.next_event(protocol.CONTROL, op="stats")).meta
+            assert "frames_in" in stats and "protocol_errors" in stats, stats
+
+    async def run(self) -> bool:
+        await self.check("handshake", self.handshake())
+        await self.check("ping/pong", self.ping())
+        await self.check("errors keep the connection", self.errors())
+        await self.check("text turn streams deltas", self.text_turn())
+        await self.check("chunked PCM turn", self.audio_turn())
+        await self.check("concurrent turns", self.concurrent_turns())
+        await self.check("inline audio_out", self.inline_audio())
+        await self.check("cancel one turn", self.cancel())
+        await self.check("stats", self.stats())
+        failed = [result for result in self.results if result["status"] == "fail"]
+        print(f"{len(self.results) - len(failed)}/{len(self.results)} checks passed")
+        return not failed
+
+
+def start_process(command: List[str], cwd: Path, env: Dict) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for(url: str, timeout: float = 60.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+async def selftest(args) -> bool:
+    processes = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            upstream = f"http://127.0.0.1:{args.upstream_port}"
+            processes.append(start_process(
+                [sys.executable, str(FAKE_UPSTREAMS), "--port", str(args.upstream_port)], ROOT, dict(os.environ)
+            ))
+            await wait_for(f"{upstream}/health")
+            env = dict(os.environ)
+            env.update({
+                "WHISPER_HOST": upstream,
+                "PIPER_HOST": upstream,
+                "OLLAMA_HOST": upstream,
+                "OPENAI_API_KEY": "",
+                "ELEVENLABS_API_KEY": "",
+                "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'smash_ai.db')}",
+                "AUDIO_STORE_DIR": os.path.join(workdir, "static"),
+                "STATE_URL": os.path.join(workdir, "state.db"),
+                "TIMESERIES_DIR": os.path.join(workdir, "metrics_history"),
+                "JOBS_DIR": os.path.join(workdir, "jobs"),
+                "TRACE_LOG_ENABLED": "false",
+            })
+            processes.append(start_process(
+                [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.port),
+                 "--log-level", "warning"], SMASH_CORE, env
+            ))
+            await wait_for(f"http://127.0.0.1:{args.port}/ready")
+            return await Conformance(f"ws://127.0.0.1:{args.port}/ws/voice", not args.no_deflate,
+                                     args.timeout).run()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+async def run_turn(args) -> Dict:
+    async with VoiceClient(args.url, not args.no_deflate) as client:
+        options = {"audio": args.audio}
+        if args.accept_audio:
+            options["accept_audio"] = args.accept_audio
+        if args.command == "say":
+            audio_format, rate, channels, audio = read_audio(args.file)
+            options.update(audio_format=audio_format, sample_rate=rate, channels=channels)
+        await client.configure(**options)
+        if args.command == "say":
+            # Real-time pacing mimics a microphone; --fast sends as quickly as possible
+            pace = 0.0 if args.fast or audio_format != "pcm_s16le" else CHUNK_BYTES / (2 * rate * channels)
+            turn_id = await client.say("t1", audio, pace=pace)
+        else:
+            turn_id = await client.ask(args.text)
+        turn = await client.wait(turn_id, args.timeout)
+        if args.save and turn.audio:
+            Path(args.save).write_bytes(bytes(turn.audio))
+        return turn.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Reference client for /ws/voice ({protocol.SUBPROTOCOL})")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws/voice")
+    parser.add_argument("--no-deflate", action="store_true", help="Do not offer permessage-deflate")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-turn timeout (seconds)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    say = commands.add_parser("say", help="Stream an audio file as one utterance")
+    say.add_argument("file")
+    say.add_argument("--fast", action="store_true", help="Do not pace PCM chunks in real time")
+    ask = commands.add_parser("ask", help="Send a final transcript (skips STT)")
+    ask.add_argument("text")
+    for command in (say, ask):
+        command.add_argument("--audio", choices=("url", "inline"), default="url",
+                             help="Speech as an audio_url or as audio_out frames")
+        command.add_argument("--accept-audio", help="e.g. audio/ogg for Opus speech")
+        command.add_argument("--save", help="Write inline speech to this file")
+
+    commands.add_parser("conformance", help="Check a running server against the protocol")
+    selftest_parser = commands.add_parser("selftest", help="Run the conformance checks on a local stack")
+    selftest_parser.add_argument("--port", type=int, default=8767)
+    selftest_parser.add_argument("--upstream-port", type=int, default=9101)
+    args = parser.parse_args()
+
+    if not protocol.available():
+        raise SystemExit("msgpack is required: pip install msgpack")
+    if args.command in ("say", "ask"):
+        print(json.dumps(asyncio.run(run_turn(args)), indent=2))
+    elif args.command == "conformance":
+        ok = asyncio.run(Conformance(args.url, not args.no_deflate, args.timeout).run())
+        sys.exit(0 if ok else 1)
+    else:
+        sys.exit(0 if asyncio.run(selftest(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
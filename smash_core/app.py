@@ -4,25 +4,46 @@ Real-time voice interaction with adaptive learning capabilities
 """
 
 # Main application entry point
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, File, UploadFile
+from core.startup import startup_report
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, File, UploadFile, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, JSONResponse
 import asyncio
 import os
 from pathlib import Path
 from dotenv import load_dotenv
 
 from core.config import get_settings
-from core.database import init_database
+from core.database import init_database, db_manager
+from core.audio_store import audio_store
+from core.audio_http import audio_file_response
+from core.audio_codec import negotiate_output_codec
+from core.audio_preprocess import audio_preprocessor
 from routes.chat import router as chat_router
 from routes.audio import router as audio_router
 from routes.voice import router as voice_router, set_voice_processor
 from routes.system import router as system_router
+from routes.diagnostics import router as diagnostics_router
+from routes.jobs import router as jobs_router
 from core.greeting import startup_greeting
 from core.voice_processor import VoiceProcessor
+from core.voice_session import VoiceSession
+from core.speculation import Speculator
+from core.metrics import registry, start_trace, CONTENT_TYPE_LATEST
+from core.llm import jarvis_llm
+from core.state import state
+from core.health import health_prober
+from core.diagnostics import loop_monitor
+from core.host_metrics import host_metrics
+from core.timeseries import timeseries
+from core.http_client import close_http_client
+from core.stt_cache import stt_cache
+from core.jobs import job_manager
+from core import voice_protocol
 
 # Load environment variables
 load_dotenv()
+startup_report.mark("imports")
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -40,44 +61,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Static files for audio
-static_dir = Path("static")
-static_dir.mkdir(exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Give every request a trace id (or adopt the caller's X-Trace-Id)"""
+    trace_id = start_trace(request.headers.get("x-trace-id"))
+    response = await call_next(request)
+    response.headers["X-Trace-Id"] = trace_id
+    return response
 
 # Include routers
 app.include_router(chat_router, prefix="/api/chat", tags=["Chat"])
 app.include_router(audio_router, prefix="/api/audio", tags=["Audio"])
 app.include_router(voice_router, prefix="/api/voice", tags=["Voice"])
 app.include_router(system_router, prefix="/api/system", tags=["System"])
+app.include_router(diagnostics_router, prefix="/api/system", tags=["Diagnostics"])
+app.include_router(jobs_router, prefix="/api/jobs", tags=["Jobs"])
 
 # Global voice processor instance
 voice_processor = None
 
+registry.gauge(
+    "smash_voice_turns_in_flight", "Voice turns currently in flight",
+    lambda: len(voice_processor.turns) if voice_processor else 0
+)
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize the system and play startup greeting"""
+    """Initialize the system; greeting and warm-ups run in the background"""
     global voice_processor
+    settings = get_settings()
     
     # Initialize database
-    await init_database()
+    with startup_report.phase("database"):
+        await init_database()
     
-    # Initialize voice processor
-    settings = get_settings()
-    voice_processor = VoiceProcessor(settings)
+    # Initialize voice processor and set it in routes
+    with startup_report.phase("voice_processor"):
+        voice_processor = VoiceProcessor(settings)
+        set_voice_processor(voice_processor)
     
-    # Set voice processor in routes
-    set_voice_processor(voice_processor)
+    # Slow or upstream-dependent work does not hold up readiness
+    await loop_monitor.start()
+    await health_prober.start()
+    await host_metrics.start()
+    startup_report.run_background("audio_store", audio_store.start())
+    startup_report.run_background("jobs", job_manager.start())
+    startup_report.run_background("learned_patterns", asyncio.to_thread(db_manager.warm_up))
+    startup_report.run_background("audio_preprocess", audio_preprocessor.warm_up())
+    startup_report.run_background("llm", jarvis_llm.warm_up())
+    # With several workers only the first one to start plays the greeting
+    if await state.add_async("startup:greeting", os.getpid(), ttl=60):
+        startup_report.run_background("greeting", startup_greeting(voice_processor))
+    if settings.startup_mode == "blocking":
+        await startup_report.wait_background()
     
-    # Play startup greeting
-    await startup_greeting(voice_processor)
+    startup_report.mark_ready()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     global voice_processor
+    await startup_report.stop()
+    await health_prober.stop()
+    await loop_monitor.stop()
+    await host_metrics.stop()
+    timeseries.close()
     if voice_processor:
         await voice_processor.cleanup()
+    await job_manager.stop()
+    await audio_store.stop()
+    await close_http_client()
+    audio_preprocessor.shutdown()
+    stt_cache.close()
+    state.close()
 
 @app.get("/")
 async def root():
@@ -89,26 +145,102 @@ async def root():
         "assistant": "Jarvis-style voice assistant ready"
     }
 
+@app.get("/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 200 once start-up has finished, 503 before"""
+    report = startup_report.snapshot()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint (per-stage latency histograms and counters)"""
+    return Response(registry.render(), media_type=CONTENT_TYPE_LATEST)
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def static_audio(path: str, request: Request):
+    """Serve stored audio with byte ranges, strong ETags and immutable caching"""
+    file_path = await asyncio.to_thread(audio_store.resolve, path)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    return await audio_file_response(request, file_path)
+
 @app.websocket("/ws/voice")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time voice interaction"""
-    await websocket.accept()
+async def websocket_endpoint(websocket: WebSocket, audio: str = "url", accept_audio: str = None,
+                             user_id: str = None):
+    """WebSocket endpoint for real-time voice interaction
+
+    Connect with ?audio=inline to receive speech as binary frames after each
+    response instead of an audio_url, and ?accept_audio=audio/ogg (or
+    audio/flac) to have stored speech compressed, and ?user_id= to use that
+    user's tone, history and voice. Each connection runs its own pipelined
+    session (see core.voice_session).
+
+    Clients that offer the smash.voice.v1 subprotocol get binary msgpack
+    frames (core.voice_protocol); everyone else gets the JSON protocol.
+    """
+    settings = get_settings()
+    wire_protocol = None
+    if voice_protocol.SUBPROTOCOL in websocket.scope.get("subprotocols", []) and voice_protocol.available():
+        wire_protocol = voice_protocol.SUBPROTOCOL
+    await websocket.accept(subprotocol=wire_protocol)
+    if not voice_processor:
+        await websocket.close(code=1013)
+        return
     
+    offered = websocket.headers.get("sec-websocket-extensions", "")
+    session = VoiceSession(
+        websocket,
+        voice_processor,
+        inline_audio=audio == "inline",
+        output_codec=negotiate_output_codec(accept_audio),
+        inbound_size=settings.ws_inbound_queue_size,
+        stage_size=settings.ws_stage_queue_size,
+        overflow_policy=settings.ws_overflow_policy,
+        heartbeat_interval=settings.ws_heartbeat_interval,
+        idle_timeout=settings.ws_idle_timeout,
+        speculator=Speculator(
+            enabled=settings.speculation_enabled,
+            stable_partials=settings.speculation_stable_partials,
+            min_words=settings.speculation_min_words,
+            match_threshold=settings.speculation_match_threshold,
+            max_per_turn=settings.speculation_max_per_turn,
+            max_waste_ratio=settings.speculation_max_waste_ratio,
+            activation_check=voice_processor._is_voice_activated,
+            user_id=user_id
+        ),
+        barge_in=settings.ws_barge_in,
+        user_id=user_id,
+        wire_protocol=wire_protocol,
+        max_audio_bytes=settings.ws_max_audio_bytes,
+        sample_rate=settings.sample_rate,
+        compression="permessage-deflate"
+        if settings.ws_per_message_deflate and "permessage-deflate" in offered else None
+    )
     try:
-        async for data in websocket.iter_bytes():
-            if voice_processor:
-                # Process incoming audio data
-                response = await voice_processor.process_audio_stream(data)
-                if response:
-                    await websocket.send_json({
-                        "type": "response",
-                        "text": response["text"],
-                        "audio_url": response.get("audio_url"),
-                        "timestamp": response["timestamp"]
-                    })
+        await session.run()
     except WebSocketDisconnect:
-        print("Voice WebSocket disconnected")
+        pass
+    print("Voice WebSocket disconnected")
+
+@app.websocket("/ws/metrics")
+async def metrics_websocket(websocket: WebSocket):
+    """Push each host metrics sample (same payload as /api/system/metrics)"""
+    await websocket.accept()
+    queue = host_metrics.subscribe()
+    try:
+        while True:
+            await websocket.send_json(await queue.get())
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        host_metrics.unsubscribe(queue)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True,
+                ws_per_message_deflate=get_settings().ws_per_message_deflate)
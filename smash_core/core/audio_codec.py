@@ -0,0 +1,188 @@
+"""
+Audio transport codecs for SMASH Cloud Voice AI
+Codec detection/negotiation and compression of responses for the client
+"""
+
+# Codec negotiation, decoding/encoding and per-turn transport accounting
+# NumPy/soundfile are imported on first use to keep app start-up fast
+from __future__ import annotations
+
+import io
+import time
+import threading
+import wave
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Output codecs we can produce: name -> (soundfile format, subtype, media type, extension)
+OUTPUT_CODECS = {
+    "opus": ("OGG", "OPUS", "audio/ogg", ".ogg"),
+    "flac": ("FLAC", "PCM_16", "audio/flac", ".flac"),
+    "wav": ("WAV", "PCM_16", "audio/wav", ".wav"),
+}
+
+# Containers detect_codec() recognises -> (media type, extension), for pass-through audio
+DETECTED_MEDIA_TYPES = {
+    "wav": ("audio/wav", ".wav"),
+    "opus": ("audio/ogg", ".ogg"),
+    "ogg": ("audio/ogg", ".ogg"),
+    "flac": ("audio/flac", ".flac"),
+    "webm": ("audio/webm", ".webm"),
+    "mp3": ("audio/mpeg", ".mp3"),
+}
+# Pass-through audio whose container is not recognised is not labelled as any codec
+UNKNOWN_MEDIA_TYPE = ("application/octet-stream", ".bin")
+
+# Media types a client may advertise -> output codec, in server preference order
+ACCEPTED_MEDIA_TYPES = [
+    ("audio/ogg", "opus"),
+    ("audio/opus", "opus"),
+    ("audio/flac", "flac"),
+    ("audio/wav", "wav"),
+]
+
+# Opus only runs at these rates; other inputs are resampled to the nearest above
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def detect_codec(data: bytes) -> str:
+    """Identify the container from magic bytes"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return "wav"
+    if data[:4] == b"OggS":
+        return "opus" if b"OpusHead" in data[:64] else "ogg"
+    if data[:4] == b"fLaC":
+        return "flac"
+    if data[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if data[:3] == b"ID3" or data[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "mp3"
+    return "unknown"
+
+
+def negotiate_output_codec(accept: Optional[str]) -> str:
+    """Pick the most compact codec the client advertised (default: wav)"""
+    if not accept:
+        return "wav"
+    offered = [part.split(";")[0].strip().lower() for part in accept.split(",")]
+    for media_type, codec in ACCEPTED_MEDIA_TYPES:
+        if media_type in offered:
+            return codec
+    return "wav"
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int, channels: int = 1) -> bytes:
+    """Wrap raw 16-bit little-endian PCM in a WAV header"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def resample_linear(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """Vectorized linear-interpolation resampler (adequate for speech)"""
+    import numpy as np
+    
+    if source_rate == target_rate or samples.size == 0:
+        return samples
+    duration = samples.shape[0] / source_rate
+    target_length = max(int(round(duration * target_rate)), 1)
+    source_positions = np.arange(samples.shape[0], dtype=np.float64)
+    target_positions = np.linspace(0, samples.shape[0] - 1, target_length)
+    return np.interp(target_positions, source_positions, samples).astype(np.float32)
+
+
+def encode_pcm(samples: np.ndarray, rate: int, codec: str = "wav") -> bytes:
+    """Encode mono float32 PCM with one of OUTPUT_CODECS"""
+    import soundfile as sf
+    
+    fmt, subtype, _, _ = OUTPUT_CODECS[codec]
+    if codec == "opus" and rate not in OPUS_SAMPLE_RATES:
+        target = next((r for r in OPUS_SAMPLE_RATES if r >= rate), OPUS_SAMPLE_RATES[-1])
+        samples, rate = resample_linear(samples, rate, target), target
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, rate, format=fmt, subtype=subtype)
+    return buffer.getvalue()
+
+
+def transcode_for_client(data: bytes, codec: str) -> Tuple[bytes, str, str, Dict]:
+    """Re-encode WAV speech into the negotiated codec
+
+    Returns (bytes, media type, extension, stats). Non-WAV input (e.g. ElevenLabs MP3)
+    is already compressed and passes through, typed by its detected container.
+    """
+    _, _, media_type, extension = OUTPUT_CODECS.get(codec, OUTPUT_CODECS["wav"])
+    stats = {"response_codec": codec, "synth_bytes": len(data), "encode_cpu_ms": 0.0}
+    if codec == "wav" or detect_codec(data) != "wav":
+        source = detect_codec(data)
+        media_type, extension = DETECTED_MEDIA_TYPES.get(source, UNKNOWN_MEDIA_TYPE)
+        stats["response_codec"] = source
+        stats["response_bytes"] = len(data)
+        return data, media_type, extension, stats
+
+    import soundfile as sf
+    
+    started = time.thread_time()
+    samples, rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    encoded = encode_pcm(mono, rate, codec)
+    stats["encode_cpu_ms"] = round((time.thread_time() - started) * 1000, 3)
+    stats["response_bytes"] = len(encoded)
+    return encoded, media_type, extension, stats
+
+
+class TransportMetrics:
+    """Running totals of bytes on the wire and codec CPU cost"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.upload_bytes = 0
+        self.whisper_bytes = 0
+        self.response_bytes = 0
+        self.synth_bytes = 0
+        self.decode_cpu_ms = 0.0
+        self.encode_cpu_ms = 0.0
+        self.upload_codecs: Dict[str, int] = {}
+        self.response_codecs: Dict[str, int] = {}
+
+    def record(self, stats: Dict):
+        """Fold one turn's transport stats into the totals"""
+        with self._lock:
+            self.turns += 1
+            self.upload_bytes += stats.get("upload_bytes", 0)
+            self.whisper_bytes += stats.get("whisper_bytes", 0)
+            self.response_bytes += stats.get("response_bytes", 0)
+            self.synth_bytes += stats.get("synth_bytes", 0)
+            self.decode_cpu_ms += stats.get("decode_cpu_ms", 0.0)
+            self.encode_cpu_ms += stats.get("encode_cpu_ms", 0.0)
+            for key, counter in (("upload_codec", self.upload_codecs),
+                                 ("response_codec", self.response_codecs)):
+                if stats.get(key):
+                    counter[stats[key]] = counter.get(stats[key], 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            turns = self.turns or 1
+            return {
+                "turns": self.turns,
+                "upload_bytes": self.upload_bytes,
+                "whisper_bytes": self.whisper_bytes,
+                "response_bytes": self.response_bytes,
+                "synth_bytes": self.synth_bytes,
+                "avg_upload_bytes": round(self.upload_bytes / turns),
+                "avg_response_bytes": round(self.response_bytes / turns),
+                "avg_decode_cpu_ms": round(self.decode_cpu_ms / turns, 3),
+                "avg_encode_cpu_ms": round(self.encode_cpu_ms / turns, 3),
+                "upload_codecs": dict(self.upload_codecs),
+                "response_codecs": dict(self.response_codecs),
+            }
+
+
+# Global transport metrics
+transport_metrics = TransportMetrics()
@@ -0,0 +1,220 @@
+"""
+HTTP delivery helpers for audio in SMASH Cloud Voice AI
+Range/ETag-aware file responses and pass-through streaming from TTS upstreams
+"""
+
+# Audio response helpers shared by routes and the app
+import hashlib
+import os
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import anyio
+import httpx
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from .config import get_settings
+from .upstreams import UpstreamPool
+
+settings = get_settings()
+
+# Extension -> content type for everything the audio store may hold
+AUDIO_MEDIA_TYPES = {
+    ".wav": "audio/wav",
+    ".mp3": "audio/mpeg",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".flac": "audio/flac",
+    ".webm": "audio/webm",
+}
+
+# Stored audio never changes once written (unique names, atomic rename)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+# ElevenLabs voice used when the caller does not pick one (Jarvis-like)
+ELEVENLABS_VOICE_ID = "21m00Tcm4TlvDq8ikWAM"
+
+
+def media_type_for(path: Path) -> str:
+    """Content type from the file extension"""
+    return AUDIO_MEDIA_TYPES.get(path.suffix.lower(), "application/octet-stream")
+
+
+def extension_for(media_type: str, default: str = ".wav") -> str:
+    """File extension for an upstream content type"""
+    media_type = (media_type or "").split(";")[0].strip().lower()
+    for extension, known in AUDIO_MEDIA_TYPES.items():
+        if known == media_type:
+            return extension
+    return default
+
+
+def file_etag(path: Path, stat: os.stat_result) -> str:
+    """Strong ETag for an immutable stored file"""
+    digest = hashlib.sha1(
+        f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single 'bytes=start-end' range; None means unsatisfiable"""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        raise ValueError("unsupported range")
+
+    start_text, _, end_text = spec.strip().partition("-")
+    if size == 0:
+        # No byte of an empty file can be addressed
+        return None
+    if start_text == "":
+        # Suffix range: last N bytes
+        length = int(end_text)
+        if length <= 0:
+            return None
+        return max(size - length, 0), size - 1
+
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+async def _iter_file(path: Path, start: int, length: int) -> AsyncIterator[bytes]:
+    # Opens, seeks and reads run in worker threads, as StaticFiles does
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await f.read(min(FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def audio_file_response(request: Request, path: Path) -> Response:
+    """Serve a stored audio file with correct type, ETag, caching and byte ranges"""
+    stat = await anyio.Path(path).stat()
+    size = stat.st_size
+    etag = file_etag(path, stat)
+    headers: Dict[str, str] = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    media_type = media_type_for(path)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            # Malformed or multi-range requests fall through to the full body
+            range_header = None
+
+        if range_header and byte_range is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+        if range_header:
+            start, end = byte_range
+            length = end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(length)
+            return StreamingResponse(
+                _iter_file(path, start, length), status_code=206,
+                media_type=media_type, headers=headers
+            )
+
+    headers["Content-Length"] = str(size)
+    if request.method == "HEAD":
+        return Response(status_code=200, media_type=media_type, headers=headers)
+    return StreamingResponse(_iter_file(path, 0, size), media_type=media_type, headers=headers)
+
+
+def elevenlabs_request(text: str, voice_id: str = ELEVENLABS_VOICE_ID) -> Dict:
+    """Build an ElevenLabs TTS request (shared by the HTTP routes, voice turns and jobs)"""
+    return {
+        "method": "POST",
+        "url": f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+        "headers": {
+            "xi-api-key": settings.elevenlabs_api_key,
+            "Content-Type": "application/json"
+        },
+        "json": {
+            "text": text,
+            "voice_settings": {
+                "stability": 0.75,
+                "similarity_boost": 0.8,
+                "style": 0.0,
+                "use_speaker_boost": True
+            }
+        }
+    }
+
+
+def piper_request(text: str, voice: Optional[str] = None) -> Dict:
+    """Build a Piper TTS request; url is a path on a piper_pool endpoint"""
+    return {
+        "method": "POST",
+        "url": "/synthesize",
+        "json": {"text": text, "voice": voice or settings.voice_id}
+    }
+
+
+async def open_upstream_audio(method: str, url: str, default_media_type: str = "audio/wav",
+                              timeout: float = 30.0, pool: Optional[UpstreamPool] = None,
+                              **request_kwargs) -> Optional[Tuple[str, AsyncIterator[bytes]]]:
+    """Open a streaming upstream TTS request; returns (content type, chunk iterator) or None
+
+    With a pool, url is a path on the endpoint it picks, which stays leased
+    until the relay finishes.
+    """
+    lease = pool.lease() if pool is not None else None
+    if lease is not None:
+        url = f"{lease.url}{url}"
+    client = httpx.AsyncClient(timeout=timeout)
+    try:
+        request = client.build_request(method, url, **request_kwargs)
+        response = await client.send(request, stream=True)
+    except BaseException as e:
+        await client.aclose()
+        if lease is not None:
+            lease.release(e)
+        raise
+    if lease is not None:
+        lease.observe(response)
+
+    if response.status_code != 200:
+        await response.aclose()
+        await client.aclose()
+        if lease is not None:
+            lease.release()
+        return None
+
+    media_type = response.headers.get("content-type", default_media_type).split(";")[0]
+    if not media_type.startswith("audio/"):
+        media_type = default_media_type
+
+    async def relay() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    yield chunk
+        finally:
+            await response.aclose()
+            await client.aclose()
+            if lease is not None:
+                lease.release()
+
+    return media_type, relay()
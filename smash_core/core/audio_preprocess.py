@@ -0,0 +1,313 @@
+"""
+Audio pre-processing for SMASH Cloud Voice AI
+Downmix, resample, trim silence and normalize loudness before Whisper
+"""
+
+# Vectorized NumPy pre-processing run in a process pool
+# NumPy/soundfile are imported on first use to keep app start-up fast
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+from .config import get_settings
+from .audio_codec import detect_codec, encode_pcm
+from .metrics import record_stage
+
+settings = get_settings()
+
+# Analysis frame for silence trimming
+FRAME_MS = 20
+
+# Padding kept around detected speech so word onsets are not clipped
+TRIM_PAD_MS = 150
+
+
+def _lowpass(samples: np.ndarray, cutoff: float, taps: int = 63) -> np.ndarray:
+    """Windowed-sinc FIR low-pass; cutoff is a fraction of the source rate"""
+    import numpy as np
+    
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = np.sinc(2 * cutoff * n) * np.hamming(taps)
+    kernel /= kernel.sum()
+    return np.convolve(samples, kernel.astype(np.float32), mode="same")
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """Anti-aliased resampling: FIR low-pass when downsampling, then linear interpolation"""
+    import numpy as np
+    
+    if source_rate == target_rate or samples.size == 0:
+        return samples
+    if target_rate < source_rate:
+        samples = _lowpass(samples, 0.5 * target_rate / source_rate * 0.9)
+    target_length = max(int(round(samples.shape[0] * target_rate / source_rate)), 1)
+    positions = np.linspace(0, samples.shape[0] - 1, target_length)
+    return np.interp(positions, np.arange(samples.shape[0]), samples).astype(np.float32)
+
+
+def trim_silence(samples: np.ndarray, rate: int, threshold_db: float) -> np.ndarray:
+    """Cut leading/trailing frames quieter than threshold_db below the loudest frame"""
+    import numpy as np
+    
+    frame = max(int(rate * FRAME_MS / 1000), 1)
+    usable = samples.shape[0] // frame * frame
+    if usable == 0:
+        return samples
+
+    frames = samples[:usable].reshape(-1, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1) + 1e-12)
+    level_db = 20 * np.log10(rms / rms.max())
+    voiced = np.flatnonzero(level_db > threshold_db)
+    if voiced.size == 0:
+        return samples
+
+    pad = int(rate * TRIM_PAD_MS / 1000)
+    start = max(voiced[0] * frame - pad, 0)
+    end = min((voiced[-1] + 1) * frame + pad, samples.shape[0])
+    return samples[start:end]
+
+
+def normalize_loudness(samples: np.ndarray, target_rms_db: float, peak_limit: float = 0.99) -> np.ndarray:
+    """Scale to a target RMS level without letting peaks clip"""
+    import numpy as np
+    
+    if samples.size == 0:
+        return samples
+    rms = float(np.sqrt(np.mean(samples ** 2)))
+    if rms < 1e-6:
+        return samples
+    gain = 10 ** (target_rms_db / 20) / rms
+    peak = float(np.max(np.abs(samples))) * gain
+    if peak > peak_limit:
+        gain *= peak_limit / peak
+    return (samples * gain).astype(np.float32)
+
+
+def preprocess_audio(data: bytes, target_rate: int, trim_threshold_db: float,
+                     target_rms_db: float) -> Tuple[bytes, Dict]:
+    """Full pre-processing pipeline; runs inside a worker process
+
+    Returns 16-bit mono WAV at target_rate and per-stage timings in milliseconds.
+    """
+    import soundfile as sf
+    
+    timings = {}
+    clock = time.perf_counter
+
+    started = clock()
+    samples, rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    timings["decode_ms"] = (clock() - started) * 1000
+    input_seconds = samples.shape[0] / rate
+
+    stage = clock()
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    timings["downmix_ms"] = (clock() - stage) * 1000
+
+    stage = clock()
+    mono = resample(mono, rate, target_rate)
+    timings["resample_ms"] = (clock() - stage) * 1000
+
+    stage = clock()
+    mono = trim_silence(mono, target_rate, trim_threshold_db)
+    timings["trim_ms"] = (clock() - stage) * 1000
+
+    stage = clock()
+    mono = normalize_loudness(mono, target_rms_db)
+    timings["normalize_ms"] = (clock() - stage) * 1000
+
+    stage = clock()
+    wav = encode_pcm(mono, target_rate, "wav")
+    timings["encode_ms"] = (clock() - stage) * 1000
+    timings["total_ms"] = (clock() - started) * 1000
+
+    return wav, {
+        "timings": {key: round(value, 3) for key, value in timings.items()},
+        "input_channels": samples.shape[1],
+        "input_rate": rate,
+        "input_seconds": round(input_seconds, 3),
+        "output_seconds": round(mono.shape[0] / target_rate, 3),
+    }
+
+
+def _warm_worker() -> int:
+    """Import the DSP stack so the first real upload does not pay for it"""
+    import numpy  # noqa: F401
+    import soundfile  # noqa: F401
+    return os.getpid()
+
+
+def _audio_duration(data: bytes) -> Optional[float]:
+    """Duration of a libsndfile-readable upload, or None"""
+    try:
+        import soundfile as sf
+        return round(sf.info(io.BytesIO(data)).duration, 3)
+    except Exception:
+        return None
+
+
+class AudioPreprocessor:
+    """Runs preprocess_audio in a process pool and keeps aggregate metrics"""
+
+    def __init__(self, target_rate: int, workers: int = 2, enabled: bool = True,
+                 trim_threshold_db: float = -40.0, target_rms_db: float = -20.0):
+        self.target_rate = target_rate
+        self.workers = workers
+        self.enabled = enabled
+        self.trim_threshold_db = trim_threshold_db
+        self.target_rms_db = target_rms_db
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._metrics = {
+            "processed": 0,
+            "skipped": 0,
+            "failed": 0,
+            "pool_restarts": 0,
+            "input_bytes": 0,
+            "output_bytes": 0,
+            "input_seconds": 0.0,
+            "output_seconds": 0.0,
+            "stage_ms": {},
+        }
+        # Whisper latency per second of submitted audio, with and without pre-processing
+        self._whisper = {"preprocessed": [0, 0.0, 0.0], "raw": [0, 0.0, 0.0]}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor):
+        """Drop a broken pool so the next upload starts a fresh one"""
+        with self._lock:
+            if self._executor is not executor:
+                return  # another call already replaced it
+            self._executor = None
+            self._metrics["pool_restarts"] += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def warm_up(self):
+        """Start the worker processes and load NumPy/soundfile in them and here"""
+        await asyncio.to_thread(_warm_worker)
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, _warm_worker)
+                               for _ in range(self.workers)))
+
+    async def process(self, data: bytes) -> Tuple[bytes, Dict]:
+        """Pre-process an upload; falls back to the original bytes on failure
+
+        The returned stats always carry upload_codec, upload_bytes and whisper_bytes.
+        """
+        started = time.perf_counter()
+        codec = detect_codec(data)
+        stats = {"upload_codec": codec, "upload_bytes": len(data),
+                 "whisper_bytes": len(data), "preprocessed": False}
+
+        # libsndfile cannot read WebM/MP3; Whisper takes those as-is
+        if not self.enabled or codec in ("webm", "mp3", "unknown"):
+            self._count("skipped")
+            if codec not in ("webm", "mp3", "unknown"):
+                duration = await asyncio.to_thread(_audio_duration, data)
+                if duration is not None:
+                    stats["input_seconds"] = duration
+            record_stage("preprocess", time.perf_counter() - started, codec, "skipped")
+            return data, stats
+
+        executor = self._get_executor()
+        try:
+            loop = asyncio.get_running_loop()
+            wav, result = await loop.run_in_executor(
+                executor, preprocess_audio, data, self.target_rate,
+                self.trim_threshold_db, self.target_rms_db
+            )
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (OOM kill, crash); the pool is unusable from now on
+                self._discard_executor(executor)
+            print(f"Audio pre-processing error: {e}")
+            self._count("failed")
+            record_stage("preprocess", time.perf_counter() - started, codec, "error")
+            return data, stats
+
+        stats.update(result)
+        stats.update({"whisper_bytes": len(wav), "preprocessed": True,
+                      "decode_cpu_ms": result["timings"]["total_ms"]})
+        self._record(stats)
+        record_stage("preprocess", time.perf_counter() - started, codec, "ok")
+        return wav, stats
+
+    def _count(self, key: str):
+        with self._lock:
+            self._metrics[key] += 1
+
+    def _record(self, stats: Dict):
+        with self._lock:
+            metrics = self._metrics
+            metrics["processed"] += 1
+            metrics["input_bytes"] += stats["upload_bytes"]
+            metrics["output_bytes"] += stats["whisper_bytes"]
+            metrics["input_seconds"] += stats["input_seconds"]
+            metrics["output_seconds"] += stats["output_seconds"]
+            for stage, value in stats["timings"].items():
+                metrics["stage_ms"][stage] = metrics["stage_ms"].get(stage, 0.0) + value
+
+    def record_whisper(self, preprocessed: bool, audio_seconds: float, latency_ms: float):
+        """Record one Whisper call so latency with/without pre-processing can be compared"""
+        with self._lock:
+            bucket = self._whisper["preprocessed" if preprocessed else "raw"]
+            bucket[0] += 1
+            bucket[1] += latency_ms
+            bucket[2] += audio_seconds
+
+    def get_metrics(self) -> Dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            processed = metrics["processed"] or 1
+            metrics["avg_stage_ms"] = {
+                stage: round(total / processed, 3) for stage, total in metrics.pop("stage_ms").items()
+            }
+            metrics["byte_reduction"] = round(
+                1 - metrics["output_bytes"] / metrics["input_bytes"], 3
+            ) if metrics["input_bytes"] else 0.0
+            metrics["duration_reduction"] = round(
+                1 - metrics["output_seconds"] / metrics["input_seconds"], 3
+            ) if metrics["input_seconds"] else 0.0
+            metrics["whisper"] = {
+                name: {
+                    "calls": calls,
+                    "avg_latency_ms": round(total_ms / calls, 1) if calls else 0.0,
+                    "ms_per_audio_second": round(total_ms / seconds, 1) if seconds else 0.0,
+                }
+                for name, (calls, total_ms, seconds) in self._whisper.items()
+            }
+            return metrics
+
+    def shutdown(self):
+        """Stop worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Global pre-processor
+audio_preprocessor = AudioPreprocessor(
+    target_rate=settings.sample_rate,
+    workers=settings.audio_preprocess_workers,
+    enabled=settings.audio_preprocess_enabled,
+    trim_threshold_db=settings.audio_trim_threshold_db,
+    target_rms_db=settings.audio_target_rms_db,
+)
@@ -0,0 +1,304 @@
+"""
+Audio artifact store for SMASH Cloud Voice AI
+Owns the static/ directory: sharded layout, atomic writes and bounded retention
+"""
+
+# Audio file storage, eviction and background sweeping
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .config import get_settings
+from .state import state
+
+settings = get_settings()
+
+# Suffix used for in-progress writes; anything left with it is an orphan
+PARTIAL_SUFFIX = ".part"
+
+# Prefixes of scratch files written by older builds directly into static/
+LEGACY_TEMP_PREFIXES = ("temp_",)
+
+# Partial/temp files younger than this may still be being written by another worker
+ORPHAN_GRACE_SECONDS = 600
+
+# State key of the lease held by the one worker that recovers and evicts
+SWEEPER_LEASE_KEY = "audio_store:sweeper"
+
+
+class AudioStore:
+    """Bounded, self-cleaning store for generated and uploaded audio
+
+    Every worker writes into the same directory, but only the worker holding
+    the sweeper lease (a state-backend key) indexes the disk, removes orphans
+    and enforces the TTL and size limits. It rescans the directory on every
+    sweep so files written by the other workers count toward the limits; if
+    it exits, another worker takes the lease over.
+    """
+
+    def __init__(self, root: str, url_prefix: str = "/static",
+                 ttl_seconds: int = 86400, max_bytes: int = 512 * 1024 * 1024,
+                 max_files: int = 5000, sweep_interval: int = 300):
+        self.root = Path(root)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.sweep_interval = sweep_interval
+
+        # Oldest first: relative path -> (size, mtime)
+        self._index: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self._owner = uuid.uuid4().hex
+        self._is_sweeper = False
+        self._metrics = {
+            "writes": 0,
+            "bytes_written": 0,
+            "evicted_ttl": 0,
+            "evicted_size": 0,
+            "orphans_recovered": 0,
+            "sweeps": 0,
+            "last_sweep_seconds": 0.0,
+        }
+
+    @staticmethod
+    def _shard_for(token: str) -> str:
+        """Two-character shard (256 buckets for hex tokens) derived from the file token"""
+        shard = token[:2].lower()
+        return shard if len(shard) == 2 and shard.isalnum() else "00"
+
+    def _relative_path(self, filename: str) -> str:
+        """Map a bare filename (prefix_<uuid>.ext) to its sharded location"""
+        stem = filename.rsplit(".", 1)[0]
+        token = stem.rsplit("_", 1)[-1]
+        return f"{self._shard_for(token)}/{filename}"
+
+    def url_for(self, relative_path: str) -> str:
+        """Public URL for a stored file"""
+        return f"{self.url_prefix}/{relative_path}"
+
+    def resolve(self, name: str) -> Optional[Path]:
+        """Resolve a filename or sharded relative path to a file inside the store"""
+        name = name.lstrip("/")
+        candidates = [name] if "/" in name else [self._relative_path(name), name]
+
+        root = self.root.resolve()
+        for candidate in candidates:
+            path = (self.root / candidate).resolve()
+            # Refuse anything that escapes the store root
+            if root not in path.parents:
+                continue
+            if path.is_file():
+                return path
+        return None
+
+    def save(self, data: bytes, prefix: str = "jarvis", extension: str = ".wav") -> str:
+        """Atomically write audio bytes and return its public URL"""
+        token = uuid.uuid4().hex
+        filename = f"{prefix}_{token}{extension}"
+        relative = self._relative_path(filename)
+        final_path = self.root / relative
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a partial file then rename so readers never see half a file
+        partial_path = final_path.with_name(final_path.name + PARTIAL_SUFFIX)
+        with open(partial_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_path, final_path)
+
+        size = len(data)
+        with self._lock:
+            self._metrics["writes"] += 1
+            self._metrics["bytes_written"] += size
+            # Other workers' files are picked up by the sweeper's next rescan
+            indexed = self._is_sweeper
+            if indexed:
+                self._index[relative] = (size, time.time())
+                self._total_bytes += size
+
+        if indexed and self._over_limits():
+            self._evict_for_size()
+
+        return self.url_for(relative)
+
+    async def save_async(self, data: bytes, prefix: str = "jarvis", extension: str = ".wav") -> str:
+        """Write audio off the event loop"""
+        return await asyncio.to_thread(self.save, data, prefix, extension)
+
+    def _over_limits(self) -> bool:
+        return self._total_bytes > self.max_bytes or len(self._index) > self.max_files
+
+    def _remove(self, relative: str) -> int:
+        """Drop a file from disk and index; returns bytes freed"""
+        entry = self._index.pop(relative, None)
+        if entry is None:
+            return 0
+        self._total_bytes -= entry[0]
+        try:
+            (self.root / relative).unlink()
+        except FileNotFoundError:
+            pass
+        return entry[0]
+
+    def _evict_for_size(self) -> int:
+        """Evict oldest files until the store is within its byte/file limits"""
+        evicted = 0
+        with self._lock:
+            while self._index and self._over_limits():
+                oldest = next(iter(self._index))
+                self._remove(oldest)
+                evicted += 1
+            self._metrics["evicted_size"] += evicted
+        return evicted
+
+    def _evict_expired(self, now: float) -> int:
+        """Evict files older than the TTL (index is ordered oldest first)"""
+        evicted = 0
+        cutoff = now - self.ttl_seconds
+        with self._lock:
+            while self._index:
+                oldest, (_, mtime) = next(iter(self._index.items()))
+                if mtime > cutoff:
+                    break
+                self._remove(oldest)
+                evicted += 1
+            self._metrics["evicted_ttl"] += evicted
+        return evicted
+
+    def sweep(self) -> Dict:
+        """Run one eviction pass (TTL then size)"""
+        started = time.perf_counter()
+        expired = self._evict_expired(time.time())
+        oversize = self._evict_for_size()
+        with self._lock:
+            self._metrics["sweeps"] += 1
+            self._metrics["last_sweep_seconds"] = round(time.perf_counter() - started, 6)
+        return {"evicted_ttl": expired, "evicted_size": oversize}
+
+    def _claim_sweeper(self) -> bool:
+        """Take or renew the sweeper lease; True while this worker holds it"""
+        ttl = max(self.sweep_interval * 3, 60)
+        if state.get(SWEEPER_LEASE_KEY) == self._owner:
+            state.set(SWEEPER_LEASE_KEY, self._owner, ttl=ttl)
+            held = True
+        else:
+            held = state.add(SWEEPER_LEASE_KEY, self._owner, ttl=ttl)
+        with self._lock:
+            if not held:
+                self._index.clear()
+                self._total_bytes = 0
+            self._is_sweeper = held
+        return held
+
+    def _release_sweeper(self):
+        if self._is_sweeper and state.get(SWEEPER_LEASE_KEY) == self._owner:
+            state.delete(SWEEPER_LEASE_KEY)
+        self._is_sweeper = False
+
+    def recover(self) -> Dict:
+        """Index the files on disk and remove orphaned temp/partial files"""
+        entries = []
+        orphans = 0
+        migrated = 0
+        orphan_cutoff = time.time() - ORPHAN_GRACE_SECONDS
+
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+
+                if filename.endswith(PARTIAL_SUFFIX) or filename.startswith(LEGACY_TEMP_PREFIXES):
+                    # Recent ones may still be in flight in another worker
+                    if stat.st_mtime < orphan_cutoff:
+                        path.unlink(missing_ok=True)
+                        orphans += 1
+                    continue
+
+                relative = path.relative_to(self.root).as_posix()
+                if "/" not in relative:
+                    # Flat file from before sharding: move it into its shard
+                    target = self.root / self._relative_path(filename)
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(path, target)
+                    relative = target.relative_to(self.root).as_posix()
+                    migrated += 1
+
+                entries.append((stat.st_mtime, relative, stat.st_size))
+
+        with self._lock:
+            # Merge rather than replace: files saved while the walk ran are already indexed
+            merged = dict(self._index)
+            for mtime, rel, size in entries:
+                merged.setdefault(rel, (size, mtime))
+            self._index = OrderedDict(sorted(merged.items(), key=lambda item: item[1][1]))
+            self._total_bytes = sum(size for size, _ in self._index.values())
+            self._metrics["orphans_recovered"] += orphans
+
+        sweep_result = self.sweep()
+        return {"files": len(entries), "orphans": orphans, "migrated": migrated, **sweep_result}
+
+    async def start(self):
+        """Recover on-disk state (if elected) and launch the background sweeper"""
+        await asyncio.to_thread(self.root.mkdir, parents=True, exist_ok=True)
+        if await asyncio.to_thread(self._claim_sweeper):
+            result = await asyncio.to_thread(self.recover)
+            print(f"🗂️  Audio store recovered {result['files']} files, removed {result['orphans']} orphans, "
+                  f"migrated {result['migrated']} legacy files")
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(self._sweeper_loop())
+
+    async def stop(self):
+        """Stop the background sweeper"""
+        if self._sweeper_task and not self._sweeper_task.done():
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+        self._sweeper_task = None
+        await asyncio.to_thread(self._release_sweeper)
+
+    async def _sweeper_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                # Rescan so files written by other workers are indexed before evicting
+                if await asyncio.to_thread(self._claim_sweeper):
+                    await asyncio.to_thread(self.recover)
+            except Exception as e:
+                print(f"❌ Audio store sweep error: {e}")
+
+    def get_metrics(self) -> Dict:
+        """Disk usage and eviction counters"""
+        with self._lock:
+            return {
+                "disk_bytes": self._total_bytes,
+                "file_count": len(self._index),
+                "max_bytes": self.max_bytes,
+                "max_files": self.max_files,
+                "ttl_seconds": self.ttl_seconds,
+                "sweeper": self._is_sweeper,
+                **self._metrics,
+            }
+
+
+# Global audio store
+audio_store = AudioStore(
+    root=settings.audio_store_dir,
+    ttl_seconds=settings.audio_store_ttl_seconds,
+    max_bytes=settings.audio_store_max_bytes,
+    max_files=settings.audio_store_max_files,
+    sweep_interval=settings.audio_store_sweep_interval,
+)
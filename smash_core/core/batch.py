@@ -0,0 +1,56 @@
+"""
+Batch execution helpers for SMASH Cloud Voice AI
+Bounded fan-out with results streamed back as NDJSON in completion order
+"""
+
+# Shared by /api/chat/batch and /api/audio/transcribe/batch
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from fastapi import HTTPException
+
+from .config import get_settings
+
+settings = get_settings()
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def batch_concurrency(requested: int, items: int) -> int:
+    """Validate a batch and pick its concurrency (default BATCH_CONCURRENCY, capped)"""
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch has no items")
+    if items > settings.batch_max_items:
+        raise HTTPException(status_code=413,
+                            detail=f"Batch has {items} items; the limit is {settings.batch_max_items}")
+    return max(1, min(requested or settings.batch_concurrency, settings.batch_max_concurrency, items))
+
+
+async def run_bounded(items: List[Any], worker: Callable[[Any], Awaitable[Any]],
+                      concurrency: int) -> AsyncIterator[Tuple[int, Any, BaseException]]:
+    """Run worker over items, at most `concurrency` at once; yields (index, result, error)
+
+    Results come back as they finish, not in input order. If the consumer
+    stops early (client disconnected), the remaining work is cancelled.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, item: Any):
+        async with semaphore:
+            try:
+                return index, await worker(item), None
+            except Exception as e:
+                return index, None, e
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def ndjson(record: Dict) -> str:
+    return json.dumps(record, default=str) + "\n"
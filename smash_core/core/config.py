@@ -4,6 +4,7 @@ Configuration management for SMASH Cloud Voice AI
 
 # Configuration module for environment variables and settings
 import os
+from functools import lru_cache
 from typing import Optional
 try:
     from pydantic import BaseSettings, Field
@@ -16,10 +17,12 @@ class Settings(BaseSettings):
     openai_api_key: Optional[str] = Field(None, env="OPENAI_API_KEY")
     elevenlabs_api_key: Optional[str] = Field(None, env="ELEVENLABS_API_KEY")
     
-    # Service URLs
+    # Service URLs: each may list several endpoints, comma-separated, optionally
+    # weighted ("http://gpu1:9000;weight=3,http://gpu2:9000"); see core/upstreams.py
     ollama_host: str = Field("http://localhost:11434", env="OLLAMA_HOST")
     whisper_host: str = Field("http://localhost:9000", env="WHISPER_HOST")
     piper_host: str = Field("http://localhost:5002", env="PIPER_HOST")
+    ollama_model: str = Field("llama3", env="OLLAMA_MODEL")
     
     # Assistant Configuration
     assistant_name: str = Field("SMASH", env="ASSISTANT_NAME")
@@ -37,8 +40,138 @@ class Settings(BaseSettings):
     chunk_size: int = Field(1024, env="CHUNK_SIZE")
     recording_duration: int = Field(5, env="RECORDING_DURATION")
     
+    # Audio Pre-processing
+    audio_preprocess_enabled: bool = Field(True, env="AUDIO_PREPROCESS_ENABLED")
+    audio_preprocess_workers: int = Field(2, env="AUDIO_PREPROCESS_WORKERS")
+    audio_trim_threshold_db: float = Field(-40.0, env="AUDIO_TRIM_THRESHOLD_DB")
+    audio_target_rms_db: float = Field(-20.0, env="AUDIO_TARGET_RMS_DB")
+    
+    # STT cache: transcripts keyed by a hash of the pre-processed audio, LRU-bounded
+    # by entries and bytes; STT_CACHE_PATH (SQLite file) keeps them across restarts
+    stt_cache_enabled: bool = Field(True, env="STT_CACHE_ENABLED")
+    stt_cache_size: int = Field(2048, env="STT_CACHE_SIZE")
+    stt_cache_max_bytes: int = Field(4 * 1024 * 1024, env="STT_CACHE_MAX_BYTES")
+    stt_cache_path: str = Field("", env="STT_CACHE_PATH")
+    
+    # Audio Store
+    audio_store_dir: str = Field("static", env="AUDIO_STORE_DIR")
+    audio_store_ttl_seconds: int = Field(86400, env="AUDIO_STORE_TTL_SECONDS")
+    audio_store_max_bytes: int = Field(512 * 1024 * 1024, env="AUDIO_STORE_MAX_BYTES")
+    audio_store_max_files: int = Field(5000, env="AUDIO_STORE_MAX_FILES")
+    audio_store_sweep_interval: int = Field(300, env="AUDIO_STORE_SWEEP_INTERVAL")
+    
+    # Voice WebSocket pipeline
+    ws_inbound_queue_size: int = Field(8, env="WS_INBOUND_QUEUE_SIZE")
+    ws_stage_queue_size: int = Field(4, env="WS_STAGE_QUEUE_SIZE")
+    ws_overflow_policy: str = Field("drop_oldest", env="WS_OVERFLOW_POLICY")  # drop_oldest | reject | block
+    ws_heartbeat_interval: float = Field(15.0, env="WS_HEARTBEAT_INTERVAL")
+    ws_idle_timeout: float = Field(60.0, env="WS_IDLE_TIMEOUT")
+    ws_barge_in: bool = Field(True, env="WS_BARGE_IN")
+    # smash.voice.v1: largest utterance a client may stream, and whether the
+    # server accepts permessage-deflate (uvicorn --ws-per-message-deflate)
+    ws_max_audio_bytes: int = Field(10 * 1024 * 1024, env="WS_MAX_AUDIO_BYTES")
+    ws_per_message_deflate: bool = Field(True, env="WS_PER_MESSAGE_DEFLATE")
+    
+    # Batch endpoints (/api/chat/batch, /api/audio/transcribe/batch) and the
+    # pooled upstream HTTP client they share with single requests
+    batch_max_items: int = Field(100, env="BATCH_MAX_ITEMS")
+    batch_concurrency: int = Field(4, env="BATCH_CONCURRENCY")
+    batch_max_concurrency: int = Field(16, env="BATCH_MAX_CONCURRENCY")
+    upstream_max_connections: int = Field(32, env="UPSTREAM_MAX_CONNECTIONS")
+    upstream_max_keepalive: int = Field(16, env="UPSTREAM_MAX_KEEPALIVE")
+    
+    # Background jobs (/api/jobs): long TTS, transcription and chat batches run in
+    # JOB_WORKERS tasks per process; results are kept JOB_RETENTION seconds
+    jobs_dir: str = Field("./jobs", env="JOBS_DIR")
+    job_workers: int = Field(2, env="JOB_WORKERS")
+    job_queue_size: int = Field(100, env="JOB_QUEUE_SIZE")
+    job_timeout: float = Field(3600.0, env="JOB_TIMEOUT")
+    job_upstream_timeout: float = Field(300.0, env="JOB_UPSTREAM_TIMEOUT")
+    job_retention: float = Field(86400.0, env="JOB_RETENTION")
+    job_max_finished: int = Field(1000, env="JOB_MAX_FINISHED")
+    job_max_upload_bytes: int = Field(200 * 1024 * 1024, env="JOB_MAX_UPLOAD_BYTES")
+    job_max_text_chars: int = Field(200000, env="JOB_MAX_TEXT_CHARS")
+    job_max_items: int = Field(1000, env="JOB_MAX_ITEMS")
+    
+    # Speculative LLM drafting from interim transcripts
+    speculation_enabled: bool = Field(True, env="SPECULATION_ENABLED")
+    speculation_stable_partials: int = Field(2, env="SPECULATION_STABLE_PARTIALS")
+    speculation_min_words: int = Field(3, env="SPECULATION_MIN_WORDS")
+    speculation_match_threshold: float = Field(0.9, env="SPECULATION_MATCH_THRESHOLD")
+    speculation_max_per_turn: int = Field(2, env="SPECULATION_MAX_PER_TURN")
+    speculation_max_waste_ratio: float = Field(0.5, env="SPECULATION_MAX_WASTE_RATIO")
+    
+    # Metrics (/metrics) and per-turn trace logging
+    metrics_enabled: bool = Field(True, env="METRICS_ENABLED")
+    trace_log_enabled: bool = Field(True, env="TRACE_LOG_ENABLED")
+    
+    # Startup: "background" serves immediately and warms up behind it; "blocking" waits
+    startup_mode: str = Field("background", env="STARTUP_MODE")
+    startup_warmup_timeout: float = Field(30.0, env="STARTUP_WARMUP_TIMEOUT")
+    
+    # Background upstream health probes (seconds)
+    health_probe_interval: float = Field(15.0, env="HEALTH_PROBE_INTERVAL")
+    health_probe_timeout: float = Field(3.0, env="HEALTH_PROBE_TIMEOUT")
+    health_max_backoff: float = Field(120.0, env="HEALTH_MAX_BACKOFF")
+    health_history_size: int = Field(60, env="HEALTH_HISTORY_SIZE")
+    
+    # Upstream pools: pick by least outstanding requests or EWMA latency; eject an
+    # endpoint after UPSTREAM_EJECT_FAILURES consecutive failures, for
+    # UPSTREAM_EJECT_SECONDS doubling per repeat up to UPSTREAM_MAX_EJECT_SECONDS
+    upstream_balance: str = Field("least_outstanding", env="UPSTREAM_BALANCE")  # least_outstanding | ewma
+    upstream_retries: int = Field(1, env="UPSTREAM_RETRIES")
+    upstream_eject_failures: int = Field(3, env="UPSTREAM_EJECT_FAILURES")
+    upstream_eject_seconds: float = Field(30.0, env="UPSTREAM_EJECT_SECONDS")
+    upstream_max_eject_seconds: float = Field(300.0, env="UPSTREAM_MAX_EJECT_SECONDS")
+    
+    # Host metrics collector (/api/system/metrics and push streams)
+    host_metrics_interval: float = Field(2.0, env="HOST_METRICS_INTERVAL")
+    host_metrics_disks: str = Field("/,/mnt/smash_data", env="HOST_METRICS_DISKS")
+    host_metrics_history_size: int = Field(300, env="HOST_METRICS_HISTORY_SIZE")
+    # Alerts raise at/above *_RAISE (for HOST_ALERT_SAMPLES samples) and clear below *_CLEAR
+    host_alert_raise: float = Field(85.0, env="HOST_ALERT_RAISE")
+    host_alert_clear: float = Field(75.0, env="HOST_ALERT_CLEAR")
+    host_alert_samples: int = Field(3, env="HOST_ALERT_SAMPLES")
+    host_temp_alert_raise: float = Field(80.0, env="HOST_TEMP_ALERT_RAISE")
+    host_temp_alert_clear: float = Field(70.0, env="HOST_TEMP_ALERT_CLEAR")
+    # Per-service attribution: "service=kind:value|kind:value;..." with kinds
+    # self, name (process name), cmd (command line), container (docker name or
+    # compose service) and cgroup; first match wins, children follow their parent
+    process_metrics_enabled: bool = Field(True, env="PROCESS_METRICS_ENABLED")
+    process_services: str = Field(
+        "smash_core=self|cmd:uvicorn app:app|container:smash-voice-api;"
+        "whisper=container:whisper|name:whisper|cmd:whisper-server;"
+        "piper=container:piper|cmd:piper;"
+        "ollama=container:ollama|name:ollama;"
+        "nextcloud=container:nextcloud|name:php-fpm|name:apache2;"
+        "mariadb=container:mariadb|name:mariadbd|name:mysqld;"
+        "caddy=container:caddy|name:caddy",
+        env="PROCESS_SERVICES",
+    )
+    
+    # Round-robin metric history (/api/system/history): raw samples every
+    # TIMESERIES_STEP seconds for 24 h, then 1 m / 15 m / 1 h min-avg-max
+    timeseries_enabled: bool = Field(True, env="TIMESERIES_ENABLED")
+    timeseries_dir: str = Field("./metrics_history", env="TIMESERIES_DIR")
+    timeseries_step: int = Field(10, env="TIMESERIES_STEP")
+    
+    # Admin diagnostics (/api/system/profile, loop-lag, memory); disabled without a token
+    admin_token: Optional[str] = Field(None, env="ADMIN_TOKEN")
+    loop_lag_interval: float = Field(0.1, env="LOOP_LAG_INTERVAL")
+    loop_stall_threshold: float = Field(0.25, env="LOOP_STALL_THRESHOLD")
+    loop_stalls_kept: int = Field(50, env="LOOP_STALLS_KEPT")
+    profile_max_seconds: float = Field(60.0, env="PROFILE_MAX_SECONDS")
+    
+    # Shared state (conversation history, listening mode, caches):
+    # memory (single worker), sqlite (STATE_URL = file path, workers on one host)
+    # or redis (STATE_URL = redis://..., several hosts)
+    state_backend: str = Field("memory", env="STATE_BACKEND")
+    state_url: str = Field("./smash_state.db", env="STATE_URL")
+    
     # Database
     database_url: str = Field("sqlite:///./smash_ai.db", env="DATABASE_URL")
+    # Rows per cursor partition for /export and per insert transaction for /import
+    export_batch_size: int = Field(1000, env="EXPORT_BATCH_SIZE")
     
     # Jarvis Personality
     jarvis_personality: str = Field("calm, articulate, futuristic", env="JARVIS_PERSONALITY")
@@ -46,10 +179,18 @@ class Settings(BaseSettings):
     learning_enabled: bool = Field(True, env="LEARNING_ENABLED")
     context_memory_size: int = Field(50, env="CONTEXT_MEMORY_SIZE")
     
+    # User profiles: whose preferences apply when a request names no user, and
+    # how long a worker may serve a cached profile another worker has changed
+    default_user_id: str = Field("sudhamsh", env="DEFAULT_USER_ID")
+    profile_cache_ttl: float = Field(60.0, env="PROFILE_CACHE_TTL")
+    profile_cache_size: int = Field(1024, env="PROFILE_CACHE_SIZE")
+    
     class Config:
         env_file = ".env"
 
+@lru_cache()
 def get_settings() -> Settings:
+    """Settings are read from the environment/.env once per process"""
     return Settings()
 
 # Global settings instance
@@ -4,20 +4,36 @@ Adaptive learning and conversation history storage
 """
 
 # Database models and ORM setup
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean
+from sqlalchemy import create_engine, event, insert, select, text, Column, Integer, String, Text, DateTime, Float, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.sql import func
 import asyncio
-from typing import List, Optional
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 from datetime import datetime
 
 from .config import get_settings
+from .metrics import stage_timer
 
 # Database setup
 settings = get_settings()
-engine = create_engine(settings.database_url, echo=False)
+engine = create_engine(
+    settings.database_url, echo=False,
+    # Several workers share the file; wait for the write lock instead of failing
+    connect_args={"timeout": 30} if settings.database_url.startswith("sqlite") else {}
+)
+DB_BACKEND = engine.dialect.name
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+if DB_BACKEND == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL lets readers in every worker proceed while one worker writes"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 Base = declarative_base()
 
 class Conversation(Base):
@@ -72,20 +88,43 @@ class SystemState(Base):
     metrics = Column(Text)  # JSON string of metrics
     notes = Column(Text)
 
+class Job(Base):
+    """Background jobs (/api/jobs): status, progress and where the result is"""
+    __tablename__ = "jobs"
+    
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(32), nullable=False)
+    status = Column(String(16), default="queued", index=True)  # queued, running, succeeded, failed, cancelled
+    progress = Column(Float, default=0.0)  # 0..1
+    message = Column(String(200))  # Latest progress note
+    params = Column(Text)  # JSON string of job parameters
+    result = Column(Text)  # JSON string of the result (or its summary when stored as a file)
+    result_path = Column(String(500))  # Result file, relative to JOBS_DIR
+    result_type = Column(String(100))  # Media type of the result file
+    error = Column(Text)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)  # Refreshed while running; stale means the worker died
+    finished_at = Column(DateTime)
+
 async def init_database():
-    """Initialize database tables"""
+    """Initialize database tables (schema creation and seeding run in a worker thread)"""
+    await asyncio.to_thread(_init_database)
+
+def _init_database():
     Base.metadata.create_all(bind=engine)
     
     # Initialize default user preferences
     db = SessionLocal()
     try:
         existing_user = db.query(UserPreferences).filter(
-            UserPreferences.user_id == "sudhamsh"
+            UserPreferences.user_id == settings.default_user_id
         ).first()
         
         if not existing_user:
             default_prefs = UserPreferences(
-                user_id="sudhamsh",
+                user_id=settings.default_user_id,
                 preferred_tone="jarvis",
                 learning_enabled=True,
                 context_memory_size=50,
@@ -110,63 +149,120 @@ def get_db() -> Session:
 
 # Database utility functions
 class DatabaseManager:
+    """Database operations; each call uses its own short-lived session
+
+    A long-lived shared session would pin an old read snapshot and hide rows
+    written by other workers, so nothing is held open between calls. Returned
+    objects are detached with their attributes loaded.
+    """
+
     def __init__(self):
-        self.session = SessionLocal()
+        # Called with a user_id after that user's preferences change
+        self._preference_listeners: List[Callable[[str], None]] = []
+
+    def add_preferences_listener(self, listener: Callable[[str], None]):
+        self._preference_listeners.append(listener)
+
+    @contextmanager
+    def _session(self) -> Iterator[Session]:
+        session = SessionLocal(expire_on_commit=False)
+        try:
+            yield session
+        finally:
+            session.close()
     
     def save_conversation(self, user_message: str, assistant_response: str, 
-                         context: str = None, confidence: float = 0.0) -> int:
+                         context: str = None, confidence: float = 0.0,
+                         user_id: Optional[str] = None) -> int:
         """Save conversation to database"""
-        conv = Conversation(
-            user_message=user_message,
-            assistant_response=assistant_response,
-            context=context,
-            confidence_score=confidence
-        )
-        self.session.add(conv)
-        self.session.commit()
-        return conv.id
+        with stage_timer("db_write", DB_BACKEND), self._session() as session:
+            conv = Conversation(
+                user_message=user_message,
+                assistant_response=assistant_response,
+                user_id=user_id or settings.default_user_id,
+                context=context,
+                confidence_score=confidence
+            )
+            session.add(conv)
+            session.commit()
+            return conv.id
+    
+    def save_conversations(self, conversations: List[Dict], learning_ids: List[int] = ()) -> List[int]:
+        """Save a batch of conversations and learned-pattern usage in one transaction
+
+        Each conversation is a dict of save_conversation()'s arguments. Either
+        everything is written or nothing is; ids come back in input order.
+        """
+        with stage_timer("db_write", DB_BACKEND), self._session() as session:
+            rows = [Conversation(
+                user_message=conv["user_message"],
+                assistant_response=conv["assistant_response"],
+                user_id=conv.get("user_id") or settings.default_user_id,
+                context=conv.get("context"),
+                confidence_score=conv.get("confidence", 0.0)
+            ) for conv in conversations]
+            session.add_all(rows)
+            for learning_id in learning_ids:
+                session.query(LearningData).filter(LearningData.id == learning_id).update({
+                    LearningData.usage_count: LearningData.usage_count + 1,
+                    LearningData.last_used: datetime.now()
+                })
+            session.commit()
+            return [row.id for row in rows]
     
     def get_recent_conversations(self, limit: int = 10) -> List[Conversation]:
         """Get recent conversation history"""
-        return self.session.query(Conversation).order_by(
-            Conversation.timestamp.desc()
-        ).limit(limit).all()
+        with self._session() as session:
+            return session.query(Conversation).order_by(
+                Conversation.timestamp.desc()
+            ).limit(limit).all()
     
     def save_learning_data(self, pattern: str, response: str, 
                            category: str = "general", confidence: float = 0.5) -> int:
         """Save learned pattern and response"""
-        learning = LearningData(
-            pattern=pattern,
-            response=response,
-            category=category,
-            confidence=confidence
-        )
-        self.session.add(learning)
-        self.session.commit()
-        return learning.id
-    
-    def find_learning_match(self, pattern: str) -> Optional[LearningData]:
+        with stage_timer("db_write", DB_BACKEND), self._session() as session:
+            learning = LearningData(
+                pattern=pattern,
+                response=response,
+                category=category,
+                confidence=confidence
+            )
+            session.add(learning)
+            session.commit()
+            return learning.id
+    
+    def find_learning_match(self, pattern: str, record_usage: bool = True) -> Optional[LearningData]:
         """Find best matching learned response"""
-        # Simple pattern matching - can be enhanced with ML
-        learnings = self.session.query(LearningData).all()
-        
-        best_match = None
-        best_similarity = 0.0
+        with stage_timer("learned_match", DB_BACKEND) as timer, self._session() as session:
+            # Simple pattern matching - can be enhanced with ML
+            learnings = session.query(LearningData).all()
+            
+            best_match = None
+            best_similarity = 0.0
+            
+            for learning in learnings:
+                similarity = self._calculate_similarity(pattern, learning.pattern)
+                if similarity > best_similarity and similarity > 0.7:
+                    best_similarity = similarity
+                    best_match = learning
+            timer.outcome = "hit" if best_match else "miss"
         
-        for learning in learnings:
-            similarity = self._calculate_similarity(pattern, learning.pattern)
-            if similarity > best_similarity and similarity > 0.7:
-                best_similarity = similarity
-                best_match = learning
-        
-        if best_match:
+        if best_match and record_usage:
             # Update usage count and last used
-            best_match.usage_count += 1
-            best_match.last_used = datetime.now()
-            self.session.commit()
+            self.record_learning_usage(best_match.id)
         
         return best_match
     
+    def record_learning_usage(self, learning_id: int):
+        """Bump usage count and last used for a learned pattern"""
+        with stage_timer("db_write", DB_BACKEND), self._session() as session:
+            # Increment in SQL so concurrent workers do not lose updates
+            session.query(LearningData).filter(LearningData.id == learning_id).update({
+                LearningData.usage_count: LearningData.usage_count + 1,
+                LearningData.last_used: datetime.now()
+            })
+            session.commit()
+    
     def _calculate_similarity(self, text1: str, text2: str) -> float:
         """Calculate similarity between two text strings"""
         words1 = set(text1.lower().split())
@@ -180,27 +276,153 @@ class DatabaseManager:
         
         return len(intersection) / len(union) if union else 0.0
     
-    def get_user_preferences(self, user_id: str = "sudhamsh") -> Optional[UserPreferences]:
-        """Get user preferences"""
-        return self.session.query(UserPreferences).filter(
-            UserPreferences.user_id == user_id
-        ).first()
+    def warm_up(self) -> int:
+        """Read learned patterns once so the first match does not hit a cold page cache"""
+        with self._session() as session:
+            return session.query(LearningData).count()
+    
+    def stream_rows(self, model, columns: Sequence[str], filters: Sequence = (),
+                    batch_size: int = 1000) -> Iterator[Tuple[Any, ...]]:
+        """Yield tuples of the given columns in id order through a server-side cursor
+
+        Only batch_size rows are buffered at a time and no ORM objects are
+        built, so memory stays flat however many rows match. The read
+        transaction stays open until the iterator is exhausted or closed.
+        """
+        query = select(*(getattr(model, name) for name in columns)).where(*filters).order_by(model.id)
+        with self._session() as session:
+            result = session.execute(query.execution_options(yield_per=batch_size))
+            for partition in result.partitions():
+                yield from partition
+    
+    def import_rows(self, model, rows: List[Dict]) -> int:
+        """Insert a batch of column dicts in one transaction (bulk INSERT, no ORM objects)"""
+        if not rows:
+            return 0
+        with stage_timer("db_write", DB_BACKEND), self._session() as session:
+            session.execute(insert(model), rows)
+            session.commit()
+        return len(rows)
+    
+    def create_job(self, job_id: str, kind: str, params: str) -> Job:
+        with stage_timer("db_write", DB_BACKEND), self._session() as session:
+            job = Job(id=job_id, kind=kind, status="queued", params=params, created_at=datetime.now())
+            session.add(job)
+            session.commit()
+            return job
+    
+    def get_job(self, job_id: str) -> Optional[Job]:
+        with self._session() as session:
+            return session.get(Job, job_id)
+    
+    def list_jobs(self, status: Optional[str] = None, limit: int = 50) -> List[Job]:
+        with self._session() as session:
+            query = session.query(Job)
+            if status:
+                query = query.filter(Job.status == status)
+            return query.order_by(Job.created_at.desc()).limit(limit).all()
+    
+    def count_jobs(self, status: str) -> int:
+        with self._session() as session:
+            return session.query(Job).filter(Job.status == status).count()
+    
+    def claim_job(self) -> Optional[Job]:
+        """Move the oldest queued job to running; safe with several workers polling
+
+        The conditional UPDATE only succeeds for one claimant, so a job lost
+        to another worker is skipped and the next one tried.
+        """
+        with self._session() as session:
+            for _ in range(5):
+                job_id = session.query(Job.id).filter(Job.status == "queued").order_by(
+                    Job.created_at).limit(1).scalar()
+                if job_id is None:
+                    return None
+                now = datetime.now()
+                claimed = session.query(Job).filter(Job.id == job_id, Job.status == "queued").update({
+                    Job.status: "running",
+                    Job.started_at: now,
+                    Job.heartbeat_at: now,
+                    Job.attempts: Job.attempts + 1,
+                })
+                session.commit()
+                if claimed:
+                    return session.get(Job, job_id)
+            return None
+    
+    def update_job(self, job_id: str, expect_status: Optional[str] = None, **values) -> bool:
+        """Set job columns; with expect_status only if the job is still in that status"""
+        with self._session() as session:
+            query = session.query(Job).filter(Job.id == job_id)
+            if expect_status:
+                query = query.filter(Job.status == expect_status)
+            updated = query.update({getattr(Job, key): value for key, value in values.items()})
+            session.commit()
+            return updated == 1
+    
+    def requeue_stale_jobs(self, stale_before: datetime, max_attempts: int) -> Tuple[int, int]:
+        """Running jobs whose worker stopped heartbeating: queue again, or fail after max_attempts"""
+        with self._session() as session:
+            stale = session.query(Job).filter(Job.status == "running", Job.heartbeat_at < stale_before)
+            failed = stale.filter(Job.attempts >= max_attempts).update({
+                Job.status: "failed", Job.error: "Worker stopped responding", Job.finished_at: datetime.now()
+            })
+            requeued = session.query(Job).filter(Job.status == "running", Job.heartbeat_at < stale_before) \
+                .update({Job.status: "queued", Job.progress: 0.0, Job.message: "Requeued after worker loss"})
+            session.commit()
+            return requeued, failed
+    
+    def expired_jobs(self, finished_before: datetime, keep: int) -> List[Tuple[str, Optional[str]]]:
+        """(id, result_path) of finished jobs past retention or beyond the newest `keep`"""
+        with self._session() as session:
+            finished = session.query(Job.id, Job.result_path).filter(
+                Job.status.in_(("succeeded", "failed", "cancelled")))
+            old = finished.filter(Job.finished_at < finished_before).all()
+            surplus = finished.order_by(Job.finished_at.desc()).offset(keep).all()
+            return list({row[0]: tuple(row) for row in old + surplus}.values())
+    
+    def delete_jobs(self, job_ids: List[str]) -> int:
+        with self._session() as session:
+            deleted = session.query(Job).filter(Job.id.in_(job_ids)).delete(synchronize_session=False)
+            session.commit()
+            return deleted
+    
+    def ping(self):
+        """Round-trip to the database (health checks)"""
+        with self._session() as session:
+            session.execute(text("SELECT 1"))
+    
+    def get_user_preferences(self, user_id: Optional[str] = None) -> Optional[UserPreferences]:
+        """Get user preferences (the default user's when user_id is None)"""
+        user_id = user_id or settings.default_user_id
+        with self._session() as session:
+            return session.query(UserPreferences).filter(
+                UserPreferences.user_id == user_id
+            ).first()
     
-    def update_user_preferences(self, user_id: str, **kwargs) -> bool:
-        """Update user preferences"""
-        prefs = self.get_user_preferences(user_id)
-        if prefs:
-            for key, value in kwargs.items():
-                if hasattr(prefs, key):
-                    setattr(prefs, key, value)
-            prefs.updated_at = datetime.now()
-            self.session.commit()
-            return True
-        return False
+    def update_user_preferences(self, user_id: str, create: bool = False, **kwargs) -> bool:
+        """Update user preferences (creating the row first when create=True)"""
+        with self._session() as session:
+            prefs = session.query(UserPreferences).filter(
+                UserPreferences.user_id == user_id
+            ).first()
+            if not prefs and create:
+                prefs = UserPreferences(user_id=user_id)
+                session.add(prefs)
+            if prefs:
+                for key, value in kwargs.items():
+                    if hasattr(prefs, key):
+                        setattr(prefs, key, value)
+                prefs.updated_at = datetime.now()
+                session.commit()
+                for listener in self._preference_listeners:
+                    listener(user_id)
+                return True
+            return False
     
     def cleanup(self):
-        """Close database session"""
-        self.session.close()
+        """Release pooled database connections"""
+        engine.dispose()
 
 # Global database manager
 db_manager = DatabaseManager()
@@ -0,0 +1,293 @@
+"""
+Runtime diagnostics for SMASH Cloud Voice AI
+Event-loop lag watchdog, on-demand CPU profiling and tracemalloc snapshots
+"""
+
+# Loop-lag monitor, sampling/cProfile profiler and memory snapshots
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter as StackCounter, deque
+from typing import Dict, List, Optional
+
+from .config import get_settings
+from .metrics import registry
+
+settings = get_settings()
+
+# Event-loop lag buckets in seconds
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+loop_lag_seconds = registry.histogram(
+    "smash_event_loop_lag_seconds",
+    "How late the event loop ran a timer scheduled for now",
+    buckets=LAG_BUCKETS,
+)
+loop_stalls_total = registry.counter(
+    "smash_event_loop_stalls_total",
+    "Times a single callback blocked the event loop past the stall threshold",
+)
+
+
+def _format_stack(frame) -> List[str]:
+    return [line.rstrip() for line in traceback.format_stack(frame)]
+
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+
+class LoopLagMonitor:
+    """Measures event-loop lag and captures the stack of long blocking callbacks
+
+    A task sleeps for `interval` and records how late it woke up. A watchdog
+    thread checks the task's heartbeat; when it is older than `threshold` the
+    loop is stuck in one callback, so the thread grabs the loop thread's
+    current stack. Each stall is kept with its final duration once the loop
+    recovers.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, max_stalls: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=max_stalls)
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._current_stall: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(now - expected, 0.0)
+            self.max_lag = max(self.max_lag, lag)
+            if settings.metrics_enabled:
+                loop_lag_seconds.observe(lag)
+            stall = self._current_stall
+            if stall is not None:
+                stall["blocked_ms"] = round(lag * 1000, 1)
+                self._current_stall = None
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked < self.threshold or self._current_stall is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stall = {
+                "at": time.time(),
+                "blocked_ms": round(blocked * 1000, 1),
+                "stack": _format_stack(frame) if frame is not None else [],
+            }
+            self._current_stall = stall
+            self.stalls.append(stall)
+            loop_stalls_total.inc()
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def snapshot(self, stacks: bool = True) -> Dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "lag": loop_lag_seconds.summary().get("", {"count": 0, "avg_ms": 0.0}),
+            "stalls": [stall if stacks else {k: v for k, v in stall.items() if k != "stack"}
+                       for stall in self.stalls],
+        }
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler running in its own thread
+
+    Every `interval` it records the stack of the target thread (or all
+    threads), giving time spent including waits and C calls that cProfile
+    attributes poorly. Output is either top functions or collapsed stacks for
+    flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = StackCounter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            targets = [frames.get(self.thread_id)] if self.thread_id else \
+                [frame for ident, frame in frames.items() if ident != own]
+            for frame in targets:
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_key(frame))
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top(self, limit: int = 30) -> str:
+        own, total = StackCounter(), StackCounter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        samples = max(sum(self.stacks.values()), 1)
+        lines = [f"{self.samples} samples every {self.interval * 1000:.1f}ms",
+                 f"{'own%':>7} {'total%':>7}  function"]
+        for name, count in own.most_common(limit):
+            lines.append(f"{count / samples * 100:7.1f} {total[name] / samples * 100:7.1f}  {name}")
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """Runs one profile capture at a time against the event loop"""
+
+    def __init__(self, max_seconds: float = 60.0):
+        self.max_seconds = max_seconds
+        self._lock = asyncio.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def capture(self, seconds: float, mode: str = "sample", output: str = "text",
+                      limit: int = 30, all_threads: bool = False, interval: float = 0.005) -> str:
+        """Profile for `seconds` and return text (top functions) or collapsed stacks"""
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        async with self._lock:
+            if mode == "cprofile":
+                # The loop thread runs every handler, so profiling it here sees them all
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    profile.disable()
+                buffer = io.StringIO()
+                pstats.Stats(profile, stream=buffer).sort_stats("cumulative").print_stats(limit)
+                return buffer.getvalue()
+
+            sampler = SamplingProfiler(interval, None if all_threads else threading.get_ident())
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                await asyncio.to_thread(sampler.stop)
+            return sampler.collapsed() if output == "collapsed" else sampler.top(limit)
+
+
+class MemoryTracker:
+    """tracemalloc snapshots with a baseline to diff against"""
+
+    def __init__(self):
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.baseline_at: Optional[float] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1) -> Dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        return self.reset_baseline()
+
+    def reset_baseline(self) -> Dict:
+        self.baseline = self._snapshot()
+        self.baseline_at = time.time()
+        return self.status()
+
+    def stop(self) -> Dict:
+        tracemalloc.stop()
+        self.baseline = None
+        self.baseline_at = None
+        return self.status()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def status(self) -> Dict:
+        current, peak = tracemalloc.get_traced_memory() if self.tracing else (0, 0)
+        return {"tracing": self.tracing, "traced_bytes": current, "peak_bytes": peak,
+                "baseline_at": self.baseline_at}
+
+    def top(self, limit: int = 25, group_by: str = "lineno") -> Dict:
+        stats = self._snapshot().statistics(group_by)[:limit]
+        return {**self.status(), "top": [
+            {"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+            for stat in stats
+        ]}
+
+    def diff(self, limit: int = 25, group_by: str = "lineno") -> Dict:
+        """Allocation growth since the baseline, largest first"""
+        baseline = self.baseline  # stop() may clear it while this runs in a thread
+        if baseline is None:
+            return {**self.status(), "diff": []}
+        stats = self._snapshot().compare_to(baseline, group_by)[:limit]
+        return {**self.status(), "diff": [
+            {"location": str(stat.traceback), "size_bytes": stat.size, "size_diff_bytes": stat.size_diff,
+             "count": stat.count, "count_diff": stat.count_diff}
+            for stat in stats
+        ]}
+
+
+# Global diagnostics
+loop_monitor = LoopLagMonitor(
+    interval=settings.loop_lag_interval,
+    threshold=settings.loop_stall_threshold,
+    max_stalls=settings.loop_stalls_kept,
+)
+profiler = Profiler(max_seconds=settings.profile_max_seconds)
+memory_tracker = MemoryTracker()
@@ -0,0 +1,245 @@
+"""
+Streaming export and import for SMASH Cloud Voice AI
+Conversation and learned-pattern rows as NDJSON or CSV, optionally gzipped
+"""
+
+# Constant-memory data transfer: server-side cursors out, batched inserts in
+import asyncio
+import csv
+import io
+import json
+import time
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .config import get_settings
+from .batch import NDJSON_MEDIA_TYPE
+from .database import db_manager, Conversation, LearningData
+
+settings = get_settings()
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": NDJSON_MEDIA_TYPE, "csv": "text/csv"}
+GZIP_MAGIC = b"\x1f\x8b"
+# Export output is handed to the server in chunks of about this many characters
+CHUNK_CHARS = 64 * 1024
+# An import reports this many bad records in full; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+class ExportTable(NamedTuple):
+    model: type
+    columns: Tuple[str, ...]
+    time_column: str
+    required: Tuple[str, ...]
+
+
+TABLES = {
+    "conversations": ExportTable(
+        Conversation,
+        ("id", "user_id", "timestamp", "user_message", "assistant_response",
+         "context", "confidence_score", "learning_tags"),
+        "timestamp",
+        ("user_message", "assistant_response"),
+    ),
+    "learning": ExportTable(
+        LearningData,
+        ("id", "pattern", "response", "category", "confidence", "usage_count",
+         "last_used", "created_at", "is_verified"),
+        "created_at",
+        ("pattern", "response"),
+    ),
+}
+
+
+def export_filename(table: str, fmt: str, compress: bool) -> str:
+    return f"{table}.{fmt}" + (".gz" if compress else "")
+
+
+def export_rows(table: str, fmt: str = "ndjson", compress: bool = False,
+                since: Optional[datetime] = None, until: Optional[datetime] = None,
+                user_id: Optional[str] = None) -> Iterator[bytes]:
+    """Encoded chunks of every matching row, oldest id first
+
+    A plain generator: the server runs it in its thread pool, one chunk at a
+    time, while the database cursor hands over rows in EXPORT_BATCH_SIZE
+    partitions. since/until bound the table's time column (until exclusive).
+    """
+    spec = TABLES[table]
+    time_column = getattr(spec.model, spec.time_column)
+    filters = []
+    if since is not None:
+        filters.append(time_column >= since)
+    if until is not None:
+        filters.append(time_column < until)
+    if user_id is not None and table == "conversations":
+        filters.append(Conversation.user_id == user_id)
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if fmt == "csv" else None
+
+    def drain() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    if writer is not None:
+        writer.writerow(spec.columns)
+    for row in db_manager.stream_rows(spec.model, spec.columns, filters, settings.export_batch_size):
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in row]
+        if writer is not None:
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(spec.columns, values)), ensure_ascii=False))
+            buffer.write("\n")
+        if buffer.tell() >= CHUNK_CHARS:
+            chunk = drain()
+            if chunk:
+                yield chunk
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def _convert(spec: ExportTable, record: Dict) -> Dict:
+    """One exported record -> column values for INSERT; ids are reassigned"""
+    row = {}
+    for name in spec.columns[1:]:
+        value = record.get(name)
+        if value is None or value == "":
+            continue
+        kind = spec.model.__table__.c[name].type.python_type
+        if kind is datetime:
+            value = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+        elif kind is bool:
+            if not isinstance(value, bool):
+                text = str(value).strip().lower()
+                if text not in ("true", "false", "1", "0", "yes", "no"):
+                    raise ValueError(f"{name}: not a boolean: {value!r}")
+                value = text in ("true", "1", "yes")
+        elif kind in (int, float):
+            value = kind(value)
+        elif not isinstance(value, str):
+            # JSON columns (context) exported as objects come back as text
+            value = json.dumps(value)
+        row[name] = value
+    missing = [name for name in spec.required if not row.get(name)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    return row
+
+
+async def _lines(chunks: AsyncIterator[bytes], gzipped: Optional[bool]) -> AsyncIterator[bytes]:
+    """Split a (possibly gzipped) byte stream into lines without reading it all"""
+    decompressor = None
+    head = b""
+    pending = b""
+    async for chunk in chunks:
+        if gzipped is None:
+            # Sniff the gzip magic once two bytes have arrived
+            head += chunk
+            if len(head) < 2:
+                continue
+            gzipped, chunk, head = head[:2] == GZIP_MAGIC, head, b""
+        if gzipped:
+            decompressor = decompressor or zlib.decompressobj(zlib.MAX_WBITS | 16)
+            chunk = decompressor.decompress(chunk)
+        pending += chunk
+        *complete, pending = pending.split(b"\n")
+        for line in complete:
+            yield line
+    pending += head
+    if decompressor is not None:
+        pending += decompressor.flush()
+        if not decompressor.eof:
+            raise ValueError("truncated gzip stream")
+    if pending:
+        yield pending
+
+
+async def _records(lines: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, object]]:
+    """(record number, dict) per record, or (record number, exception) for a bad one"""
+    number = 0
+    if fmt == "ndjson":
+        async for line in lines:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("not a JSON object")
+                yield number, record
+            except ValueError as e:
+                yield number, e
+        return
+
+    header = None
+    parts: List[str] = []
+    quotes = 0
+    async for line in lines:
+        text = line.decode("utf-8", errors="replace")
+        parts.append(text)
+        quotes += text.count('"')
+        if quotes % 2:
+            # Inside a quoted field that spans lines; keep reading
+            parts.append("\n")
+            continue
+        fields = next(csv.reader(io.StringIO("".join(parts))), [])
+        parts, quotes = [], 0
+        if not fields:
+            continue
+        if header is None:
+            header = [field.strip() for field in fields]
+            continue
+        number += 1
+        if len(fields) != len(header):
+            yield number, ValueError(f"expected {len(header)} fields, got {len(fields)}")
+        else:
+            yield number, dict(zip(header, fields))
+    if parts:
+        yield number + 1, ValueError("unterminated quoted field")
+
+
+async def import_rows(table: str, chunks: AsyncIterator[bytes], fmt: str = "ndjson",
+                      gzipped: Optional[bool] = None) -> Dict:
+    """Insert records streamed as NDJSON or CSV; returns counts and the first errors
+
+    gzip is detected from the stream unless gzipped says otherwise. Rows go
+    in EXPORT_BATCH_SIZE at a time, each batch in its own transaction, so a
+    bad record is skipped and reported without aborting the rest.
+    """
+    spec = TABLES[table]
+    started = time.perf_counter()
+    summary = {"table": table, "format": fmt, "imported": 0, "failed": 0, "batches": 0, "errors": []}
+    batch: List[Dict] = []
+
+    async def flush():
+        summary["imported"] += await asyncio.to_thread(db_manager.import_rows, spec.model, batch[:])
+        summary["batches"] += 1
+        batch.clear()
+
+    try:
+        async for number, record in _records(_lines(chunks, gzipped), fmt):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(_convert(spec, record))
+            except (ValueError, TypeError) as e:
+                summary["failed"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                    summary["errors"].append({"record": number, "error": str(e)})
+                continue
+            if len(batch) >= settings.export_batch_size:
+                await flush()
+    except (ValueError, zlib.error) as e:
+        summary["error"] = f"Unreadable input: {e}"
+    if batch:
+        await flush()
+    summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return summary
@@ -0,0 +1,208 @@
+"""
+Upstream health monitoring for SMASH Cloud Voice AI
+Background concurrent probes with jittered backoff and a cached snapshot
+"""
+
+# Health prober feeding /api/system/health, the LLM router and the UI
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from .config import get_settings
+from .database import db_manager
+from .timeseries import timeseries
+from .upstreams import upstream_pools
+
+settings = get_settings()
+
+# Statuses that mean "do not route traffic here"
+DOWN_STATUSES = ("unhealthy", "unreachable")
+
+
+class ServiceHealth:
+    """Probe results and latency history for one upstream"""
+
+    def __init__(self, name: str, history_size: int):
+        self.name = name
+        self.status = "unknown"
+        self.latency_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.last_ok: Optional[float] = None
+        self.consecutive_failures = 0
+        self.next_probe_at = 0.0
+        # (timestamp, latency ms or None when unreachable, ok)
+        self.history = deque(maxlen=history_size)
+
+    def record(self, status: str, latency_ms: Optional[float], error: Optional[str] = None):
+        now = time.time()
+        self.status = status
+        self.latency_ms = latency_ms
+        self.error = error
+        self.checked_at = now
+        ok = status == "healthy"
+        if ok:
+            self.last_ok = now
+            self.consecutive_failures = 0
+        elif status in DOWN_STATUSES:
+            self.consecutive_failures += 1
+        if status != "not_configured":
+            self.history.append((now, latency_ms, ok))
+
+    def summary(self) -> Dict:
+        latencies = sorted(latency for _, latency, ok in self.history if ok)
+        probes = len(self.history)
+        return {
+            "status": self.status,
+            "latency_ms": self.latency_ms,
+            "avg_latency_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "p95_latency_ms": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None,
+            "availability": round(sum(1 for _, _, ok in self.history if ok) / probes, 3) if probes else None,
+            "consecutive_failures": self.consecutive_failures,
+            "checked_at": self.checked_at,
+            "last_ok": self.last_ok,
+            "error": self.error,
+            "history": [[round(ts, 3), latency, ok] for ts, latency, ok in self.history],
+        }
+
+
+class HealthProber:
+    """Probes every upstream concurrently on an interval
+
+    A failing service is re-probed with exponential backoff (capped at
+    max_backoff) and every delay is jittered so workers and services do not
+    probe in lockstep. Readers get the snapshot built after the last round;
+    nothing is probed on the request path.
+    """
+
+    def __init__(self, interval: float = 15.0, timeout: float = 3.0,
+                 max_backoff: float = 120.0, history_size: int = 60):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.history_size = history_size
+        self.services: Dict[str, ServiceHealth] = {}
+        self._probes: Dict[str, Callable[[httpx.AsyncClient], Awaitable[str]]] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._snapshot: Dict = {"overall": "unknown", "services": {}, "timestamp": None}
+
+    def register(self, name: str, probe: Callable[[httpx.AsyncClient], Awaitable[str]]):
+        """Add a probe; it returns a status string or raises when unreachable"""
+        self._probes[name] = probe
+        self.services[name] = ServiceHealth(name, self.history_size)
+
+    def _jitter(self, delay: float) -> float:
+        return delay * random.uniform(0.8, 1.2)
+
+    def _next_delay(self, service: ServiceHealth) -> float:
+        if service.consecutive_failures:
+            return self._jitter(min(self.interval * 2 ** service.consecutive_failures, self.max_backoff))
+        return self._jitter(self.interval)
+
+    async def _probe(self, name: str):
+        service = self.services[name]
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(self._probes[name](self._client), self.timeout)
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            service.record(status, latency_ms if status != "not_configured" else None)
+            if status == "healthy":
+                timeseries.record(f"upstream.{name}.latency", latency_ms)
+        except Exception as e:
+            service.record("unreachable", None, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+        service.next_probe_at = time.monotonic() + self._next_delay(service)
+
+    async def probe_all(self, names=None):
+        """Probe the given (or all) services concurrently and rebuild the snapshot"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        names = list(names or self._probes)
+        await asyncio.gather(*(self._probe(name) for name in names))
+        self._build_snapshot()
+
+    def _build_snapshot(self):
+        services = {name: service.summary() for name, service in self.services.items()}
+        statuses = [entry["status"] for entry in services.values() if entry["status"] != "not_configured"]
+        if any(status in DOWN_STATUSES for status in statuses):
+            overall = "degraded"
+        elif any(status == "unknown" for status in statuses):
+            overall = "unknown"
+        else:
+            overall = "healthy"
+        self._snapshot = {"overall": overall, "services": services, "timestamp": time.time()}
+
+    async def _loop(self):
+        while True:
+            now = time.monotonic()
+            due = [name for name, service in self.services.items() if service.next_probe_at <= now]
+            if due:
+                await self.probe_all(due)
+            next_due = min(service.next_probe_at for service in self.services.values())
+            await asyncio.sleep(max(next_due - time.monotonic(), 0.05))
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(), name="health-prober")
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def snapshot(self, history: bool = True) -> Dict:
+        """Last probe results; cheap enough to serve on every request"""
+        if history:
+            return self._snapshot
+        return {
+            **self._snapshot,
+            "services": {name: {k: v for k, v in entry.items() if k != "history"}
+                         for name, entry in self._snapshot["services"].items()},
+        }
+
+    def is_available(self, name: str) -> bool:
+        """False only when the last probe found the service down (unknown counts as up)"""
+        service = self.services.get(name)
+        return service is None or service.status not in DOWN_STATUSES
+
+
+def _http_status(response: httpx.Response) -> str:
+    return "healthy" if response.status_code < 400 else "unhealthy"
+
+
+async def _probe_elevenlabs(client: httpx.AsyncClient) -> str:
+    if not settings.elevenlabs_api_key:
+        return "not_configured"
+    response = await client.get("https://api.elevenlabs.io/v1/user",
+                                headers={"xi-api-key": settings.elevenlabs_api_key})
+    return _http_status(response)
+
+
+async def _probe_database(client: httpx.AsyncClient) -> str:
+    await asyncio.to_thread(db_manager.ping)
+    return "healthy"
+
+
+# Global prober
+health_prober = HealthProber(
+    interval=settings.health_probe_interval,
+    timeout=settings.health_probe_timeout,
+    max_backoff=settings.health_max_backoff,
+    history_size=settings.health_history_size,
+)
+# Each pool probes all of its endpoints and is healthy while any endpoint is
+for pool in upstream_pools.values():
+    health_prober.register(pool.name, pool.probe)
+health_prober.register("elevenlabs", _probe_elevenlabs)
+health_prober.register("database", _probe_database)
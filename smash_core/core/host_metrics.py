@@ -0,0 +1,301 @@
+"""
+Host metrics collector for SMASH Cloud Voice AI
+One sampler for CPU, memory, disks, network, temperatures and per-service usage, pushed to subscribers
+"""
+
+# Shared host sampler feeding /api/system/metrics, SSE/WebSocket streams and alerts
+import asyncio
+import os
+import shutil
+import socket
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from .config import get_settings
+from .health import health_prober
+from .metrics import registry, stage_seconds, turn_seconds
+from .process_metrics import ProcessAttributor, parse_services
+from .timeseries import timeseries
+
+settings = get_settings()
+
+
+class ThresholdAlert:
+    """Raise after `samples` consecutive readings >= raise_at; clear below clear_at
+
+    The gap between the two thresholds (and the sample count) keeps a value
+    hovering around the limit from flapping the alert on and off.
+    """
+
+    def __init__(self, name: str, raise_at: float, clear_at: float, samples: int = 1):
+        self.name = name
+        self.raise_at = raise_at
+        self.clear_at = min(clear_at, raise_at)
+        self.samples = max(samples, 1)
+        self.active = False
+        self.since: Optional[float] = None
+        self.value: Optional[float] = None
+        self._over = 0
+
+    def update(self, value: float, now: float) -> Optional[str]:
+        """Feed a reading; returns "raised" or "cleared" on a transition"""
+        self.value = value
+        if self.active:
+            if value < self.clear_at:
+                self.active, self.since, self._over = False, now, 0
+                return "cleared"
+            return None
+        self._over = self._over + 1 if value >= self.raise_at else 0
+        if self._over >= self.samples:
+            self.active, self.since = True, now
+            return "raised"
+        return None
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "active": self.active, "value": self.value,
+                "raise_at": self.raise_at, "clear_at": self.clear_at, "since": self.since}
+
+
+class HostMetricsCollector:
+    """Samples the host once per interval and publishes the snapshot
+
+    psutil calls run in a worker thread (a hung network mount must not stall
+    the event loop). Subscribers get a queue holding only the newest
+    snapshot, so a slow client skips samples instead of buffering them.
+    Requires the `psutil` package; without it the snapshot says so.
+    """
+
+    def __init__(self, interval: float = 2.0, disks: List[str] = ("/",), history_size: int = 300,
+                 alert_raise: float = 85.0, alert_clear: float = 75.0, alert_samples: int = 3,
+                 temp_raise: float = 80.0, temp_clear: float = 70.0, services=None):
+        self.interval = interval
+        self.disks = list(disks)
+        self.history = deque(maxlen=history_size)
+        self.alert_raise, self.alert_clear, self.alert_samples = alert_raise, alert_clear, alert_samples
+        self.temp_raise, self.temp_clear = temp_raise, temp_clear
+        self.alerts: Dict[str, ThresholdAlert] = {}
+        self.alert_log = deque(maxlen=100)
+        self.latest: Dict = {"available": False, "ts": None}
+        self.hostname = socket.gethostname()
+        self._subscribers = set()
+        self._task: Optional[asyncio.Task] = None
+        self._prev = None
+        try:
+            import psutil
+            self._psutil = psutil
+        except ImportError:
+            self._psutil = None
+            self.latest["error"] = "psutil is not installed"
+        self._processes = ProcessAttributor(self._psutil, services) if self._psutil and services else None
+
+    def _alert(self, name: str, value: float, now: float, raise_at: float, clear_at: float, samples: int):
+        alert = self.alerts.get(name)
+        if alert is None:
+            alert = self.alerts[name] = ThresholdAlert(name, raise_at, clear_at, samples)
+        transition = alert.update(value, now)
+        if transition:
+            self.alert_log.append({"ts": now, "alert": name, "event": transition, "value": round(value, 1)})
+            print(f"{'⚠️ ' if transition == 'raised' else '✅'} Host alert {name} {transition} ({value:.0f})")
+
+    def _sample(self) -> Dict:
+        """Blocking sample; runs in a worker thread"""
+        psutil = self._psutil
+        now = time.time()
+        mono = time.monotonic()
+        net = psutil.net_io_counters()
+        disk_io = psutil.disk_io_counters()
+        prev = self._prev
+        elapsed = mono - prev["mono"] if prev else 0.0
+
+        def rate(current: int, key: str) -> Optional[float]:
+            if not prev or prev.get(key) is None or elapsed <= 0:
+                return None
+            return round(max(current - prev[key], 0) / elapsed, 1)
+
+        per_core = psutil.cpu_percent(interval=None, percpu=True)
+        memory = psutil.virtual_memory()
+        swap = psutil.swap_memory()
+        disks = []
+        for path in self.disks:
+            if not os.path.isdir(path):
+                disks.append({"path": path, "mounted": False})
+                continue
+            usage = shutil.disk_usage(path)
+            # Same as df: reserved blocks count as neither used nor available
+            usable = usage.used + usage.free
+            disks.append({"path": path, "mounted": os.path.ismount(path), "total": usage.total,
+                          "used": usage.used, "free": usage.free,
+                          "percent": round(usage.used / usable * 100, 1) if usable else 0.0})
+
+        temperatures = {}
+        sensors = getattr(psutil, "sensors_temperatures", None)
+        if sensors:
+            try:
+                for chip, entries in sensors().items():
+                    for index, entry in enumerate(entries):
+                        label = entry.label or (chip if len(entries) == 1 else f"{chip}{index}")
+                        temperatures[label] = entry.current
+            except (OSError, RuntimeError):
+                pass
+
+        self._prev = {
+            "mono": mono,
+            "rx": net.bytes_recv, "tx": net.bytes_sent,
+            "read": disk_io.read_bytes if disk_io else None,
+            "write": disk_io.write_bytes if disk_io else None,
+        }
+        snapshot = {
+            "available": True,
+            "ts": now,
+            "interval": self.interval,
+            "hostname": self.hostname,
+            "uptime": round(now - psutil.boot_time()),
+            "cpu": {
+                "percent": round(sum(per_core) / len(per_core), 1) if per_core else 0.0,
+                "per_core": per_core,
+                "load": list(os.getloadavg()) if hasattr(os, "getloadavg") else None,
+                "count": len(per_core),
+            },
+            "memory": {"total": memory.total, "used": memory.used, "available": memory.available,
+                       "percent": memory.percent, "swap_percent": swap.percent},
+            "disks": disks,
+            "disk_io": {"read_rate": rate(disk_io.read_bytes, "read") if disk_io else None,
+                        "write_rate": rate(disk_io.write_bytes, "write") if disk_io else None},
+            "network": {"rx_rate": rate(net.bytes_recv, "rx"), "tx_rate": rate(net.bytes_sent, "tx"),
+                        "rx_total": net.bytes_recv, "tx_total": net.bytes_sent},
+            "temperatures": temperatures,
+        }
+
+        self._alert("cpu", snapshot["cpu"]["percent"], now,
+                    self.alert_raise, self.alert_clear, self.alert_samples)
+        self._alert("memory", memory.percent, now, self.alert_raise, self.alert_clear, self.alert_samples)
+        for disk in disks:
+            if disk.get("percent") is not None:
+                self._alert(f"disk:{disk['path']}", disk["percent"], now, self.alert_raise, self.alert_clear, 1)
+        if temperatures:
+            self._alert("temperature", max(temperatures.values()), now,
+                        self.temp_raise, self.temp_clear, self.alert_samples)
+        snapshot["alerts"] = [alert.to_dict() for alert in self.alerts.values() if alert.active]
+        if self._processes is not None:
+            snapshot["services"] = self._processes.sample(
+                stage_seconds.summary(), turn_seconds.summary(), health_prober.services)
+        return snapshot
+
+    async def sample_now(self) -> Dict:
+        """Take a sample, publish it and return it"""
+        if self._psutil is None:
+            return self.latest
+        snapshot = await asyncio.to_thread(self._sample)
+        self.latest = snapshot
+        self.history.append({
+            "ts": snapshot["ts"],
+            "cpu": snapshot["cpu"]["percent"],
+            "memory": snapshot["memory"]["percent"],
+            "rx_rate": snapshot["network"]["rx_rate"],
+            "tx_rate": snapshot["network"]["tx_rate"],
+        })
+        self._record_history(snapshot)
+        for queue in list(self._subscribers):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+        return snapshot
+
+    def _record_history(self, snapshot: Dict):
+        """Append the sample to the on-disk round-robin history"""
+        ts = snapshot["ts"]
+        cpu, memory = snapshot["cpu"], snapshot["memory"]
+        timeseries.record("host.cpu", cpu["percent"], ts)
+        timeseries.record("host.memory", memory["percent"], ts)
+        timeseries.record("host.swap", memory["swap_percent"], ts)
+        if cpu["load"]:
+            timeseries.record("host.load1", cpu["load"][0], ts)
+        timeseries.record("host.net_rx", snapshot["network"]["rx_rate"], ts)
+        timeseries.record("host.net_tx", snapshot["network"]["tx_rate"], ts)
+        timeseries.record("host.disk_read", snapshot["disk_io"]["read_rate"], ts)
+        timeseries.record("host.disk_write", snapshot["disk_io"]["write_rate"], ts)
+        for disk in snapshot["disks"]:
+            timeseries.record(f"host.disk:{disk['path']}", disk.get("percent"), ts)
+        if snapshot["temperatures"]:
+            timeseries.record("host.temperature", max(snapshot["temperatures"].values()), ts)
+        for name, service in snapshot.get("services", {}).items():
+            if service["processes"]:
+                timeseries.record(f"service.{name}.cpu", service["cpu_percent"], ts)
+                timeseries.record(f"service.{name}.rss_mb", service["rss"] / 1048576, ts)
+
+    async def _loop(self):
+        # Prime the CPU and I/O counters so the first published sample has rates
+        await asyncio.to_thread(self._sample)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sample_now()
+            except Exception as e:
+                print(f"⚠️  Host metrics sample failed: {e}")
+
+    async def start(self):
+        if self._psutil is None:
+            print("⚠️  Host metrics disabled: psutil is not installed")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(), name="host-metrics")
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue receiving each new snapshot (newest only); starts with the latest"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        if self.latest.get("ts"):
+            queue.put_nowait(self.latest)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def snapshot(self, history: bool = False) -> Dict:
+        result = dict(self.latest)
+        result["subscribers"] = len(self._subscribers)
+        result["alert_log"] = list(self.alert_log)
+        if history:
+            result["history"] = list(self.history)
+        return result
+
+
+def _configured_services():
+    if not settings.process_metrics_enabled:
+        return None
+    try:
+        return parse_services(settings.process_services)
+    except ValueError as e:
+        print(f"⚠️  Per-service metrics disabled: {e}")
+        return None
+
+
+# Global collector
+host_metrics = HostMetricsCollector(
+    interval=settings.host_metrics_interval,
+    disks=[path.strip() for path in settings.host_metrics_disks.split(",") if path.strip()],
+    history_size=settings.host_metrics_history_size,
+    alert_raise=settings.host_alert_raise,
+    alert_clear=settings.host_alert_clear,
+    alert_samples=settings.host_alert_samples,
+    temp_raise=settings.host_temp_alert_raise,
+    temp_clear=settings.host_temp_alert_clear,
+    services=_configured_services(),
+)
+
+registry.gauge("smash_host_cpu_percent", "Host CPU utilisation",
+               lambda: host_metrics.latest["cpu"]["percent"])
+registry.gauge("smash_host_memory_percent", "Host memory utilisation",
+               lambda: host_metrics.latest["memory"]["percent"])
+registry.gauge("smash_host_alerts_active", "Host threshold alerts currently raised",
+               lambda: len(host_metrics.latest["alerts"]))
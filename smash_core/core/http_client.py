@@ -0,0 +1,34 @@
+"""
+Shared upstream HTTP client for SMASH Cloud Voice AI
+One pooled httpx.AsyncClient so repeated upstream calls reuse connections
+"""
+
+# Pooled keep-alive connections to Whisper, Ollama and OpenAI
+from typing import Optional
+
+import httpx
+
+from .config import get_settings
+
+settings = get_settings()
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """The shared client, created on first use (and again after close)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=settings.upstream_max_connections,
+                                max_keepalive_connections=settings.upstream_max_keepalive),
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
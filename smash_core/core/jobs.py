@@ -0,0 +1,577 @@
+"""
+Background jobs for SMASH Cloud Voice AI
+Long TTS, transcription and chat batches that outlive the request that started them
+"""
+
+# Persistent job table, bounded worker pool, progress events and result retention
+import asyncio
+import io
+import json
+import re
+import shutil
+import time
+import uuid
+import wave
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, Dict, List, Optional, Set
+
+from fastapi import HTTPException
+
+from .config import get_settings
+from .database import db_manager, Job
+from .audio_codec import pcm_to_wav
+from .audio_http import elevenlabs_request, extension_for, piper_request
+from .audio_preprocess import audio_preprocessor
+from .batch import run_bounded
+from .http_client import get_http_client
+from .llm import jarvis_llm
+from .metrics import record_turn, registry, stage_timer
+from .profiles import profile_cache
+from .stt_cache import stt_cache
+from .upstreams import piper_pool, whisper_pool
+
+settings = get_settings()
+
+FINISHED = ("succeeded", "failed", "cancelled")
+# Running jobs refresh their heartbeat this often; a job whose heartbeat is
+# older than STALE_SECONDS lost its worker and is queued again (up to MAX_ATTEMPTS)
+HEARTBEAT_SECONDS = 10.0
+STALE_SECONDS = 60.0
+MAX_ATTEMPTS = 3
+# Progress reaches the database (and event streams) at most this often per job
+PROGRESS_INTERVAL = 0.5
+# Idle workers look for jobs queued by other processes this often
+POLL_SECONDS = 1.0
+SWEEP_SECONDS = 60.0
+# Event streams send a keep-alive when nothing changed for this long
+KEEPALIVE_SECONDS = 15.0
+# Text per TTS request and audio per Whisper request (Whisper's own window)
+TTS_CHUNK_CHARS = 400
+STT_SEGMENT_SECONDS = 30
+
+jobs_total = registry.counter(
+    "smash_jobs_total",
+    "Background jobs finished, by kind and final status",
+    ("kind", "status"),
+)
+
+
+class JobCancelled(Exception):
+    """The job was cancelled while it ran"""
+
+
+def split_text(text: str, limit: int = TTS_CHUNK_CHARS) -> List[str]:
+    """Sentence-aligned chunks of at most limit characters (long sentences cut at a space)"""
+    chunks: List[str] = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?;:])\s+|\n\s*\n", text.strip()):
+        sentence = " ".join(sentence.split())
+        while len(sentence) > limit:
+            cut = sentence.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > limit:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def job_to_dict(job: Job) -> Dict:
+    """API view of a job row"""
+    expires_at = job.finished_at + timedelta(seconds=settings.job_retention) if job.finished_at else None
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": round(job.progress or 0.0, 4),
+        "message": job.message,
+        "attempts": job.attempts,
+        "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "result_url": f"/api/jobs/{job.id}/result" if job.status == "succeeded" and job.result_path else None,
+        "result_type": job.result_type,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "expires_at": expires_at.isoformat() if expires_at else None,
+    }
+
+
+class JobContext:
+    """What a job handler sees: its parameters, directory and progress reporting"""
+
+    def __init__(self, manager: "JobManager", job: Job):
+        self.manager = manager
+        self.id = job.id
+        self.kind = job.kind
+        self.params = json.loads(job.params or "{}")
+        self.dir = manager.root / job.id
+        self.input_path = self.dir / "input"
+        self.result_path: Optional[Path] = None
+        self.result_type: Optional[str] = None
+        self._written = 0.0
+
+    async def progress(self, fraction: float, message: Optional[str] = None, force: bool = False):
+        """Record progress (0..1); raises JobCancelled once the job was cancelled"""
+        now = time.monotonic()
+        if not force and now - self._written < PROGRESS_INTERVAL:
+            return
+        self._written = now
+        running = await asyncio.to_thread(
+            db_manager.update_job, self.id, "running",
+            progress=min(max(fraction, 0.0), 1.0), message=message, heartbeat_at=datetime.now()
+        )
+        self.manager.notify(self.id)
+        if not running:
+            raise JobCancelled()
+
+    def set_result_file(self, path: Path, media_type: str):
+        self.result_path, self.result_type = path, media_type
+
+    async def write_json_result(self, result: Dict):
+        path = self.dir / "result.json"
+        await asyncio.to_thread(self.dir.mkdir, parents=True, exist_ok=True)
+        await asyncio.to_thread(path.write_text, json.dumps(result, ensure_ascii=False))
+        self.set_result_file(path, "application/json")
+
+
+class JobManager:
+    """Runs queued jobs from the job table in a fixed pool of worker tasks
+
+    Jobs are claimed from the database, so every process's workers share one
+    queue and a job runs once. Finished jobs and their files are kept for
+    `retention` seconds (at most `max_finished` of them), then swept.
+    """
+
+    def __init__(self, root: str, workers: int = 2, queue_size: int = 100,
+                 timeout: float = 3600.0, retention: float = 86400.0, max_finished: int = 1000):
+        self.root = Path(root)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retention = retention
+        self.max_finished = max_finished
+        self.handlers: Dict[str, Callable] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._watchers: Dict[str, Set[asyncio.Event]] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0,
+                      "requeued": 0, "swept": 0}
+
+    def register(self, kind: str, handler: Callable):
+        """handler(JobContext) -> summary dict; it may set a result file on the context"""
+        self.handlers[kind] = handler
+
+    async def start(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._stopping = False
+        self._wake = asyncio.Event()
+        await asyncio.to_thread(self.sweep)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper_loop()))
+
+    async def stop(self):
+        """Stop the workers; jobs they were running go back to the queue"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, params: Dict, upload: Optional[BinaryIO] = None) -> Job:
+        """Queue a job; upload (a file object) becomes the job's input file"""
+        if kind not in self.handlers:
+            raise HTTPException(status_code=400, detail=f"Unknown job kind {kind!r}; "
+                                                        f"expected one of {', '.join(self.handlers)}")
+        if await asyncio.to_thread(db_manager.count_jobs, "queued") >= self.queue_size:
+            raise HTTPException(status_code=429, detail="Job queue is full; try again later")
+        job_id = uuid.uuid4().hex
+        if upload is not None:
+            await asyncio.to_thread(self._save_input, job_id, upload)
+        job = await asyncio.to_thread(db_manager.create_job, job_id, kind, json.dumps(params))
+        self.stats["submitted"] += 1
+        if self._wake is not None:
+            self._wake.set()
+        return job
+
+    def _save_input(self, job_id: str, upload: BinaryIO):
+        directory = self.root / job_id
+        directory.mkdir(parents=True, exist_ok=True)
+        written = 0
+        with open(directory / "input", "wb") as out:
+            while chunk := upload.read(1024 * 1024):
+                written += len(chunk)
+                if written > settings.job_max_upload_bytes:
+                    out.close()
+                    shutil.rmtree(directory, ignore_errors=True)
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds "
+                                                                f"{settings.job_max_upload_bytes} bytes")
+                out.write(chunk)
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job; finished jobs are returned unchanged"""
+        job = await asyncio.to_thread(db_manager.get_job, job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        # A job running in another process sees the status change at its next heartbeat
+        await asyncio.to_thread(db_manager.update_job, job_id, job.status, status="cancelled",
+                                finished_at=datetime.now(), message="Cancelled")
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        self.notify(job_id)
+        return await asyncio.to_thread(db_manager.get_job, job_id)
+
+    async def delete(self, job_id: str) -> bool:
+        """Remove a finished job and its files before retention would"""
+        await asyncio.to_thread(shutil.rmtree, self.root / job_id, True)
+        return await asyncio.to_thread(db_manager.delete_jobs, [job_id]) == 1
+
+    def notify(self, job_id: str):
+        for event in self._watchers.get(job_id, ()):
+            event.set()
+
+    async def watch(self, job_id: str) -> AsyncIterator[Optional[Dict]]:
+        """Job snapshots whenever status, progress or message change, ending once finished
+
+        Yields None when nothing changed for KEEPALIVE_SECONDS. Jobs run by
+        this process wake the stream immediately; others are polled.
+        """
+        wake = asyncio.Event()
+        self._watchers.setdefault(job_id, set()).add(wake)
+        last, quiet_since = None, time.monotonic()
+        try:
+            while True:
+                job = await asyncio.to_thread(db_manager.get_job, job_id)
+                if job is None:
+                    return
+                key = (job.status, job.progress, job.message)
+                if key != last:
+                    last, quiet_since = key, time.monotonic()
+                    yield job_to_dict(job)
+                elif time.monotonic() - quiet_since >= KEEPALIVE_SECONDS:
+                    quiet_since = time.monotonic()
+                    yield None
+                if job.status in FINISHED:
+                    return
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            watchers = self._watchers.get(job_id)
+            if watchers is not None:
+                watchers.discard(wake)
+                if not watchers:
+                    del self._watchers[job_id]
+
+    def result_file(self, job: Job) -> Optional[Path]:
+        if not job.result_path:
+            return None
+        path = (self.root / job.result_path).resolve()
+        return path if self.root.resolve() in path.parents and path.is_file() else None
+
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(db_manager.claim_job)
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        context = JobContext(self, job)
+        handler = self.handlers.get(job.kind)
+        task = asyncio.create_task(handler(context)) if handler else None
+        if task is None:
+            await self._finish(context, "failed", error=f"No handler for job kind {job.kind!r}")
+            return
+        self._running[job.id] = task
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, task))
+        self.notify(job.id)
+        try:
+            summary = await asyncio.wait_for(task, self.timeout)
+        except (asyncio.CancelledError, JobCancelled):
+            if self._stopping:
+                # Shutting down: the next worker to start picks it up again
+                await asyncio.to_thread(db_manager.update_job, job.id, "running", status="queued",
+                                        progress=0.0, message="Requeued at shutdown")
+                raise
+            await self._finish(context, "cancelled", message="Cancelled")
+        except asyncio.TimeoutError:
+            await self._finish(context, "failed", error=f"Timed out after {self.timeout:.0f} s")
+        except Exception as e:
+            print(f"❌ Job {job.id} ({job.kind}) failed: {e}")
+            await self._finish(context, "failed", error=str(e))
+        else:
+            await self._finish(context, "succeeded", progress=1.0, message="Done",
+                               result=json.dumps(summary, ensure_ascii=False))
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.id, None)
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task):
+        """Keep the job claimed while it runs; stop it if it was cancelled elsewhere"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            if not await asyncio.to_thread(db_manager.update_job, job_id, "running",
+                                           heartbeat_at=datetime.now()):
+                task.cancel()
+                return
+
+    async def _finish(self, context: JobContext, status: str, **values):
+        if context.result_path is not None and status == "succeeded":
+            values.update(result_path=str(context.result_path.relative_to(self.root)),
+                          result_type=context.result_type)
+        await asyncio.to_thread(db_manager.update_job, context.id, "running", status=status,
+                                finished_at=datetime.now(), **values)
+        # Inputs are only needed to retry; results stay until the job expires
+        if status == "succeeded":
+            await asyncio.to_thread(lambda: context.input_path.unlink(missing_ok=True))
+        else:
+            await asyncio.to_thread(shutil.rmtree, context.dir, True)
+        self.stats[status] += 1
+        jobs_total.inc(kind=context.kind, status=status)
+        self.notify(context.id)
+
+    def sweep(self) -> Dict:
+        """Requeue jobs whose worker died and delete expired jobs with their files (blocking)"""
+        now = datetime.now()
+        requeued, failed = db_manager.requeue_stale_jobs(now - timedelta(seconds=STALE_SECONDS), MAX_ATTEMPTS)
+        expired = db_manager.expired_jobs(now - timedelta(seconds=self.retention), self.max_finished)
+        for job_id, _ in expired:
+            shutil.rmtree(self.root / job_id, ignore_errors=True)
+        if expired:
+            db_manager.delete_jobs([job_id for job_id, _ in expired])
+        self.stats["requeued"] += requeued
+        self.stats["swept"] += len(expired)
+        return {"requeued": requeued, "failed": failed, "expired": len(expired)}
+
+    async def _sweeper_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_SECONDS)
+            try:
+                swept = await asyncio.to_thread(self.sweep)
+                if swept["requeued"]:
+                    self._wake.set()
+            except Exception as e:
+                print(f"Job sweep error: {e}")
+
+    async def get_stats(self) -> Dict:
+        queued = await asyncio.to_thread(db_manager.count_jobs, "queued")
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "running": len(self._running),
+            "queued": queued,
+            "queue_size": self.queue_size,
+        }
+
+
+class _AudioAppender:
+    """Concatenates TTS chunks into one file: WAV by frames, anything else by bytes"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.path: Optional[Path] = None
+        self.media_type = "audio/wav"
+        self.frames = 0
+        self.rate = 0
+        self._wav = None
+        self._raw = None
+
+    def append(self, data: bytes, media_type: str):
+        if self.path is None:
+            self.media_type = media_type
+            self.path = self.directory / f"result{extension_for(media_type)}"
+            if media_type == "audio/wav":
+                self._wav = wave.open(str(self.path), "wb")
+            else:
+                self._raw = open(self.path, "wb")
+        if self._wav is not None:
+            with wave.open(io.BytesIO(data)) as chunk:
+                params = chunk.getparams()
+                if self.frames == 0:
+                    self._wav.setparams(params)
+                    self.rate = params.framerate
+                elif (params.nchannels, params.sampwidth, params.framerate) != \
+                        (self._wav.getnchannels(), self._wav.getsampwidth(), self.rate):
+                    raise ValueError("TTS chunks came back in different audio formats")
+                frames = chunk.readframes(params.nframes)
+            self._wav.writeframes(frames)
+            self.frames += len(frames) // (params.nchannels * params.sampwidth)
+        else:
+            self._raw.write(data)
+
+    def close(self):
+        for handle in (self._wav, self._raw):
+            if handle is not None:
+                handle.close()
+
+
+async def tts_job(context: JobContext) -> Dict:
+    """Synthesize a long text chunk by chunk into one audio file"""
+    text = context.params["text"]
+    voice_id = context.params.get("voice_id")
+    voice = context.params.get("voice") or (await profile_cache.get_async(context.params.get("user_id"))).voice
+    backend = "elevenlabs" if settings.elevenlabs_api_key and voice_id else "piper"
+    chunks = split_text(text)
+    context.dir.mkdir(parents=True, exist_ok=True)
+    output = _AudioAppender(context.dir)
+    client = get_http_client()
+    try:
+        for number, chunk in enumerate(chunks, 1):
+            with stage_timer("tts", backend):
+                if backend == "elevenlabs":
+                    response = await client.request(**elevenlabs_request(chunk, voice_id),
+                                                    timeout=settings.job_upstream_timeout)
+                else:
+                    response = await piper_pool.request(**piper_request(chunk, voice),
+                                                        timeout=settings.job_upstream_timeout)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{backend} returned HTTP {response.status_code} for chunk {number}")
+            default = "audio/mpeg" if backend == "elevenlabs" else "audio/wav"
+            media_type = response.headers.get("content-type", default).split(";")[0]
+            await asyncio.to_thread(output.append, response.content,
+                                    media_type if media_type.startswith("audio/") else default)
+            await context.progress(number / len(chunks), f"Synthesized chunk {number}/{len(chunks)}")
+    finally:
+        await asyncio.to_thread(output.close)
+    if output.path is None:
+        raise ValueError("Nothing to synthesize")
+    context.set_result_file(output.path, output.media_type)
+    summary = {"backend": backend, "chunks": len(chunks), "characters": len(text),
+               "bytes": output.path.stat().st_size}
+    if output.rate:
+        summary["duration_seconds"] = round(output.frames / output.rate, 2)
+    return summary
+
+
+def _segments(wav_bytes: bytes, seconds: int = STT_SEGMENT_SECONDS) -> List[Dict]:
+    """Split pre-processed WAV into fixed windows, each a standalone WAV"""
+    with wave.open(io.BytesIO(wav_bytes)) as source:
+        rate, channels = source.getframerate(), source.getnchannels()
+        window = rate * seconds
+        segments = []
+        start = 0
+        while True:
+            frames = source.readframes(window)
+            if not frames:
+                break
+            count = len(frames) // (2 * channels)
+            segments.append({"start": round(start / rate, 2), "end": round((start + count) / rate, 2),
+                             "audio": pcm_to_wav(frames, rate, channels)})
+            start += count
+    return segments
+
+
+async def transcribe_job(context: JobContext) -> Dict:
+    """Transcribe a long recording in Whisper-sized segments (each through the STT cache)"""
+    data = await asyncio.to_thread(context.input_path.read_bytes)
+    await context.progress(0.0, "Pre-processing", force=True)
+    audio, stats = await audio_preprocessor.process(data)
+    del data
+    if stats["preprocessed"]:
+        filename, content_type = "audio.wav", "audio/wav"
+        segments = await asyncio.to_thread(_segments, audio)
+    else:
+        filename = context.params.get("filename") or "audio"
+        content_type = context.params.get("content_type") or "application/octet-stream"
+        segments = [{"start": 0.0, "end": stats.get("input_seconds"), "audio": audio}]
+
+    async def whisper(segment: bytes) -> Dict:
+        with stage_timer("stt", "whisper"):
+            response = await whisper_pool.request(
+                "POST",
+                "/transcribe",
+                files={"file": (filename, segment, content_type)},
+                timeout=settings.job_upstream_timeout
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"Whisper returned HTTP {response.status_code}")
+        result = response.json()
+        return {"text": result.get("text", ""), "confidence": result.get("confidence")}
+
+    transcript = []
+    for number, segment in enumerate(segments, 1):
+        result, source = await stt_cache.transcribe(segment.pop("audio"), whisper)
+        transcript.append({**segment, "text": result["text"].strip(), "stt_source": source})
+        await context.progress(number / len(segments), f"Transcribed segment {number}/{len(segments)}")
+    text = " ".join(segment["text"] for segment in transcript if segment["text"])
+    await context.write_json_result({"text": text, "segments": transcript, "transport": stats})
+    return {"segments": len(transcript), "characters": len(text),
+            "audio_seconds": stats.get("output_seconds", stats.get("input_seconds")),
+            "text_preview": text[:200]}
+
+
+async def chat_batch_job(context: JobContext) -> Dict:
+    """Answer many messages like /api/chat/batch, saving them in one transaction at the end"""
+    items = context.params["items"]
+    concurrency = max(1, min(context.params.get("concurrency") or settings.batch_concurrency,
+                             settings.batch_max_concurrency, len(items)))
+    results: List[Optional[Dict]] = [None] * len(items)
+    drafts: Dict[int, Dict] = {}
+
+    async def draft(item: Dict):
+        started = time.perf_counter()
+        try:
+            result = await jarvis_llm.draft_response(item["message"], item.get("context"), item.get("user_id"))
+        except Exception:
+            record_turn("chat", time.perf_counter() - started, "error")
+            raise
+        record_turn("chat", time.perf_counter() - started, result["source"])
+        return result
+
+    done = 0
+    async for index, result, error in run_bounded(items, draft, concurrency):
+        done += 1
+        if error is not None:
+            results[index] = {"index": index, "ok": False, "error": f"Chat processing error: {error}"}
+        else:
+            drafts[index] = result
+            results[index] = {"index": index, "ok": True, "response": result["response"],
+                              "confidence": result["confidence"], "source": result["source"],
+                              "timestamp": result["timestamp"]}
+        await context.progress(done / len(items) * 0.99, f"Answered {done}/{len(items)}")
+
+    order = sorted(drafts)
+    committed = await asyncio.to_thread(jarvis_llm.commit_responses, [
+        (items[i]["message"], drafts[i], items[i].get("context"), items[i].get("user_id")) for i in order
+    ])
+    conversation_ids = {i: result["conversation_id"] for i, result in zip(order, committed)
+                        if result.get("conversation_id") is not None}
+    await context.write_json_result({"results": results, "conversation_ids": conversation_ids})
+    return {"items": len(items), "ok": len(drafts), "failed": len(items) - len(drafts),
+            "concurrency": concurrency}
+
+
+# Global job manager
+job_manager = JobManager(
+    root=settings.jobs_dir,
+    workers=settings.job_workers,
+    queue_size=settings.job_queue_size,
+    timeout=settings.job_timeout,
+    retention=settings.job_retention,
+    max_finished=settings.job_max_finished,
+)
+job_manager.register("tts", tts_job)
+job_manager.register("transcribe", transcribe_job)
+job_manager.register("chat_batch", chat_batch_job)
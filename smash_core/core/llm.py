@@ -3,88 +3,118 @@ LLM Brain - Jarvis-style AI responses with adaptive learning
 """
 
 # LLM processing and conversation management
+import asyncio
 import httpx
 import json
-from typing import Dict, List, Optional, Tuple
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 
 from .config import get_settings
-from .database import DatabaseManager
+from .database import db_manager
+from .metrics import stage_timer, record_stage, record_ttft
+from .state import state
+from .http_client import get_http_client
+from .profiles import build_system_prompt, profile_cache
+from .health import health_prober
+from .upstreams import ollama_pool
 
 settings = get_settings()
-db_manager = DatabaseManager()
+
+# Set by a caller that wants the reply as it is generated (e.g. /ws/voice
+# smash.voice.v1 text_delta frames); called with each new piece of text
+text_delta_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar("text_delta_sink", default=None)
 
 class JarvisLLM:
     def __init__(self):
-        self.system_prompt = self._build_system_prompt()
-        self.conversation_history = []
+        self.system_prompt = build_system_prompt(settings.jarvis_personality, settings.address_user_as)
+        # History lives in the state backend so every worker sees the same conversation
+        self.history_key = "llm:history"
         self.max_history = settings.context_memory_size
-        
-    def _build_system_prompt(self) -> str:
-        """Build the Jarvis-style system prompt"""
-        user_address = settings.address_user_as
-        personality = settings.jarvis_personality
-        
-        return f"""You are SMASH, an advanced AI assistant built for SMASH Cloud. You embody the {personality} personality style of Jarvis from Iron Man.
+    
+    @property
+    def conversation_history(self) -> List[Dict]:
+        return state.list_range(self.history_key, self.max_history)
 
-Key characteristics:
-- Always address the user as "SIR" or "{user_address}"
-- Speak in a calm, articulate, and futuristic manner
-- Be helpful, intelligent, and efficient
-- Use precise language and avoid unnecessary words
-- Show confidence in your capabilities
-- Adapt and learn from conversations
-- Focus on cloud management, system administration, and user assistance
-
-You have access to:
-- Real-time system monitoring data
-- File management capabilities
-- User administration tools
-- Analytics and reporting
-- Voice interaction capabilities
+    async def process_message(self, user_message: str, context: Dict = None,
+                              user_id: Optional[str] = None) -> Dict:
+        """Process user message and generate Jarvis-style response"""
+        
+        draft = await self.draft_response(user_message, context, user_id)
+        return await asyncio.to_thread(self.commit_response, user_message, draft, context, user_id)
 
-Respond naturally while maintaining your Jarvis persona. Be concise but thorough in your assistance."""
+    async def draft_response(self, user_message: str, context: Dict = None,
+                             user_id: Optional[str] = None) -> Dict:
+        """Produce a response without touching history or the database
 
-    async def process_message(self, user_message: str, context: Dict = None) -> Dict:
-        """Process user message and generate Jarvis-style response"""
+        Safe to run speculatively and cancel; commit_response() applies the side effects.
+        Tone, memory size and learned-pattern use follow the user's cached profile.
+        """
+        profile = await profile_cache.get_async(user_id)
         
         # Check for learned patterns first
-        learned_response = db_manager.find_learning_match(user_message)
+        learned_response = None
+        if profile.learning_enabled:
+            learned_response = db_manager.find_learning_match(user_message, record_usage=False)
         if learned_response:
             return {
                 "response": learned_response.response,
                 "confidence": learned_response.confidence,
                 "source": "learned",
+                "learning_id": learned_response.id,
                 "timestamp": datetime.now().isoformat()
             }
         
-        # Add to conversation history
-        self.conversation_history.append({
+        # History as it will be once this message is recorded
+        history = await state.list_range_async(profile.history_key, profile.memory_size) + [{
             "role": "user",
             "content": user_message,
             "timestamp": datetime.now().isoformat()
-        })
-        
-        # Keep conversation history manageable
-        if len(self.conversation_history) > self.max_history:
-            self.conversation_history = self.conversation_history[-self.max_history:]
+        }]
         
         # Generate response based on message content
-        response = await self._generate_response(user_message, context)
+        response = await self._generate_response(user_message, context, history, profile.system_prompt)
         
-        # Add assistant response to history
-        self.conversation_history.append({
-            "role": "assistant", 
-            "content": response,
+        return {
+            "response": response,
+            "confidence": 0.8,
+            "source": "generated",
             "timestamp": datetime.now().isoformat()
-        })
+        }
+
+    def commit_response(self, user_message: str, draft: Dict, context: Dict = None,
+                        user_id: Optional[str] = None) -> Dict:
+        """Record a drafted response in the user's history and the database"""
+        if draft["source"] == "learned":
+            # Update usage count and last used
+            db_manager.record_learning_usage(draft.pop("learning_id"))
+            return draft
+        
+        response = draft["response"]
+        profile = profile_cache.get(user_id)
+        
+        # Add the exchange to conversation history, capped at the user's memory size
+        state.list_extend(profile.history_key, [
+            {
+                "role": "user",
+                "content": user_message,
+                "timestamp": datetime.now().isoformat()
+            },
+            {
+                "role": "assistant",
+                "content": response,
+                "timestamp": datetime.now().isoformat()
+            }
+        ], max_len=profile.memory_size)
         
         # Save conversation to database
         conv_id = db_manager.save_conversation(
             user_message=user_message,
             assistant_response=response,
             context=json.dumps(context) if context else None,
-            confidence=0.8
+            confidence=0.8,
+            user_id=profile.user_id
         )
         
         return {
@@ -95,11 +125,56 @@ Respond naturally while maintaining your Jarvis persona. Be concise but thorough
             "timestamp": datetime.now().isoformat()
         }
 
-    async def _generate_response(self, user_message: str, context: Dict = None) -> str:
+    def commit_responses(self, turns: List[Tuple[str, Dict, Optional[Dict], Optional[str]]]) -> List[Dict]:
+        """commit_response() for a batch of (user_message, draft, context, user_id)
+
+        History is extended once per user and every conversation row and
+        learned-pattern usage bump is written in a single transaction.
+        """
+        histories: Dict[str, Tuple[int, List[Dict]]] = {}
+        conversations, learning_ids, generated = [], [], []
+        for user_message, draft, context, user_id in turns:
+            if draft["source"] == "learned":
+                learning_ids.append(draft.pop("learning_id"))
+                continue
+            profile = profile_cache.get(user_id)
+            now = datetime.now().isoformat()
+            histories.setdefault(profile.history_key, (profile.memory_size, []))[1].extend([
+                {"role": "user", "content": user_message, "timestamp": now},
+                {"role": "assistant", "content": draft["response"], "timestamp": now}
+            ])
+            conversations.append({
+                "user_message": user_message,
+                "assistant_response": draft["response"],
+                "user_id": profile.user_id,
+                "context": json.dumps(context) if context else None,
+                "confidence": 0.8
+            })
+            generated.append(draft)
+        
+        for key, (max_len, entries) in histories.items():
+            state.list_extend(key, entries, max_len=max_len)
+        if conversations or learning_ids:
+            ids = db_manager.save_conversations(conversations, learning_ids)
+            for draft, conv_id in zip(generated, ids):
+                draft["conversation_id"] = conv_id
+        return [turn[1] for turn in turns]
+
+    async def _generate_response(self, user_message: str, context: Dict = None,
+                                 history: List[Dict] = None, system_prompt: Optional[str] = None) -> str:
         """Generate contextual response based on user input"""
         
-        message_lower = user_message.lower()
-        user_address = settings.address_user_as
+        with stage_timer("intent_routing", "keywords") as timer:
+            response = self._route_intent(user_message.lower(), settings.address_user_as)
+            timer.outcome = "matched" if response else "fallthrough"
+        if response:
+            return response
+        
+        # Default contextual response
+        return await self._contextual_response(user_message, context, history, system_prompt)
+
+    def _route_intent(self, message_lower: str, user_address: str) -> Optional[str]:
+        """Canned reply for recognised intents; None when nothing matches"""
         
         # Voice activation responses
         if any(phrase in message_lower for phrase in ["hey smash", "okay smash", "listen smash"]):
@@ -133,105 +208,155 @@ Respond naturally while maintaining your Jarvis persona. Be concise but thorough
         if any(word in message_lower for word in ["hello", "hi", "good morning", "good afternoon", "good evening"]):
             return f"Good day, {user_address}. SMASH Cloud is operational and ready to assist you. How may I be of service?"
         
-        # Default contextual response
-        return await self._contextual_response(user_message, context)
+        return None
 
-    async def _contextual_response(self, user_message: str, context: Dict = None) -> str:
+    async def _contextual_response(self, user_message: str, context: Dict = None,
+                                   history: List[Dict] = None, system_prompt: Optional[str] = None) -> str:
         """Generate contextual response based on available data and conversation history"""
         user_address = settings.address_user_as
+        if history is None:
+            history = await state.list_range_async(self.history_key, self.max_history)
         
         # Use recent conversation for context
         recent_context = ""
-        if len(self.conversation_history) > 2:
-            recent_context = f" Recent conversation: {self.conversation_history[-2:]}"
+        if len(history) > 2:
+            recent_context = f" Recent conversation: {history[-2:]}"
         
         # Try to use external LLM if available
         try:
             if settings.openai_api_key:
-                response = await self._call_openai_api(user_message, recent_context)
+                with stage_timer("llm", "openai") as timer:
+                    response = await self._call_openai_api(user_message, recent_context, system_prompt)
+                    timer.outcome = "ok" if response else "empty"
                 if response:
                     return response
         except Exception as e:
             print(f"OpenAI API error: {e}")
         
-        # Try Ollama fallback
-        try:
-            response = await self._call_ollama_api(user_message, recent_context)
-            if response:
-                return response
-        except Exception as e:
-            print(f"Ollama API error: {e}")
+        # Try Ollama fallback, unless the health prober last saw it down
+        if health_prober.is_available("ollama"):
+            try:
+                with stage_timer("llm", "ollama") as timer:
+                    response = await self._call_ollama_api(user_message, recent_context, system_prompt)
+                    timer.outcome = "ok" if response else "empty"
+                if response:
+                    return response
+            except Exception as e:
+                print(f"Ollama API error: {e}")
+        else:
+            record_stage("llm", 0.0, "ollama", "skipped_down")
         
         # Default intelligent response
         return f"I understand your query, {user_address}. Based on the current context, I'm processing your request through the available systems. Could you provide more specific details so I can assist you more effectively?"
 
-    async def _call_openai_api(self, message: str, context: str = "") -> Optional[str]:
+    async def _call_openai_api(self, message: str, context: str = "",
+                               system_prompt: Optional[str] = None) -> Optional[str]:
         """Call OpenAI API for advanced responses"""
         if not settings.openai_api_key:
             return None
             
-        prompt = f"{self.system_prompt}{context}\n\nUser: {message}\nSMASH:"
+        prompt = f"{system_prompt or self.system_prompt}{context}\n\nUser: {message}\nSMASH:"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.openai.com/v1/completions",
-                headers={
-                    "Authorization": f"Bearer {settings.openai_api_key}",
-                    "Content-Type": "application/json"
-                },
+        # Non-streaming: the first token arrives with the whole completion
+        started = time.perf_counter()
+        response = await get_http_client().post(
+            "https://api.openai.com/v1/completions",
+            headers={
+                "Authorization": f"Bearer {settings.openai_api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": "gpt-3.5-turbo",
+                "prompt": prompt,
+                "max_tokens": 150,
+                "temperature": 0.7
+            },
+            timeout=30.0
+        )
+        
+        if response.status_code == 200:
+            record_ttft(time.perf_counter() - started, "openai")
+            result = response.json()
+            return result["choices"][0]["text"].strip()
+
+        return None
+
+    async def _call_ollama_api(self, message: str, context: str = "",
+                               system_prompt: Optional[str] = None) -> Optional[str]:
+        """Call local Ollama API
+
+        Streams the NDJSON reply so time-to-first-token can be measured.
+        """
+        prompt = f"{system_prompt or self.system_prompt}{context}\n\nUser: {message}\nSMASH:"
+        
+        started = time.perf_counter()
+        try:
+            # Sent to the least loaded endpoint that has the model installed
+            async with ollama_pool.acquire(settings.ollama_model) as lease, get_http_client().stream(
+                "POST",
+                f"{lease.url}/api/generate",
                 json={
-                    "model": "gpt-3.5-turbo",
+                    "model": settings.ollama_model,
                     "prompt": prompt,
-                    "max_tokens": 150,
-                    "temperature": 0.7
+                    "stream": True,
+                    "options": {
+                        "temperature": 0.7,
+                        "top_p": 0.9
+                    }
                 },
                 timeout=30.0
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result["choices"][0]["text"].strip()
+            ) as response:
+                if lease.observe(response).status_code != 200:
+                    return None
                 
-        return None
-
-    async def _call_ollama_api(self, message: str, context: str = "") -> Optional[str]:
-        """Call local Ollama API"""
-        prompt = f"{self.system_prompt}{context}\n\nUser: {message}\nSMASH:"
-        
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{settings.ollama_host}/api/generate",
-                    json={
-                        "model": "llama3",
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.7,
-                            "top_p": 0.9
-                        }
-                    },
-                    timeout=30.0
-                )
+                parts = []
+                sink = text_delta_sink.get()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("response"):
+                        if not parts:
+                            record_ttft(time.perf_counter() - started, "ollama")
+                        parts.append(chunk["response"])
+                        if sink is not None:
+                            sink(chunk["response"])
+                    if chunk.get("done"):
+                        break
+                return "".join(parts).strip()
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get("response", "").strip()
-                    
-            except Exception as e:
-                print(f"Ollama connection error: {e}")
+        except Exception as e:
+            print(f"Ollama connection error: {e}")
                 
         return None
 
+    async def warm_up(self):
+        """Ask every Ollama endpoint with the model to load it so first replies are not cold starts"""
+        async with httpx.AsyncClient() as client:
+            # A generate call without a prompt only loads the model
+            responses = await asyncio.gather(*(
+                client.post(f"{endpoint.url}/api/generate", json={"model": settings.ollama_model},
+                            timeout=settings.startup_warmup_timeout)
+                for endpoint in ollama_pool.serving(settings.ollama_model)
+            ), return_exceptions=True)
+        # Ready as long as one endpoint can answer; the rest load on first use
+        for response in responses:
+            if isinstance(response, httpx.Response) and response.is_success:
+                return
+        for response in responses:
+            if isinstance(response, BaseException):
+                raise response
+            response.raise_for_status()
+
     def learn_from_conversation(self, pattern: str, response: str, category: str = "general"):
         """Learn new patterns for future responses"""
         if settings.learning_enabled:
             db_manager.save_learning_data(pattern, response, category, 0.7)
             print(f"✅ Learned new pattern: {pattern[:50]}...")
 
-    def get_conversation_context(self, limit: int = 5) -> List[Dict]:
+    def get_conversation_context(self, limit: int = 5, user_id: Optional[str] = None) -> List[Dict]:
         """Get recent conversation context"""
-        return self.conversation_history[-limit:] if self.conversation_history else []
+        return state.list_range(profile_cache.get(user_id).history_key, limit)
 
 # Global LLM instance
 jarvis_llm = JarvisLLM()
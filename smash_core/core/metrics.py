@@ -0,0 +1,309 @@
+"""
+Metrics and tracing for SMASH Cloud Voice AI
+Per-stage latency histograms, counters and per-turn trace ids
+"""
+
+# Prometheus text-format metrics and structured trace logging
+import bisect
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .config import get_settings
+from .timeseries import timeseries
+
+settings = get_settings()
+
+# Latency buckets in seconds: sub-millisecond lookups up to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Trace id of the turn/request being handled; inherited by child tasks
+trace_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+
+trace_logger = logging.getLogger("smash.trace")
+if settings.trace_log_enabled and not trace_logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(_handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id() -> Optional[str]:
+    return trace_id_var.get()
+
+
+def start_trace(trace_id: Optional[str] = None) -> str:
+    """Set the trace id for the current task (and the tasks it creates)
+
+    A caller-supplied id is only adopted if it is short and alphanumeric.
+    """
+    if not trace_id or len(trace_id) > 64 or not trace_id.replace("-", "").isalnum():
+        trace_id = new_trace_id()
+    trace_id_var.set(trace_id)
+    return trace_id
+
+
+def log_event(event: str, **fields):
+    """One JSON line per event, tagged with the current trace id"""
+    if not settings.trace_log_enabled:
+        return
+    record = {"ts": round(time.time(), 3), "event": event, "trace_id": trace_id_var.get()}
+    record.update(fields)
+    trace_logger.info(json.dumps(record, default=str))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge:
+    """Point-in-time value, either set directly or read from a callback
+
+    With labelnames the callback returns {label values tuple: value}, one
+    series per entry.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def collect(self) -> List[str]:
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []
+        if self.labelnames:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(series)}"
+                    for key, series in value.items()]
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values
+
+    Each label set keeps per-bucket counts plus sum and count; observe() is a
+    bisect and three additions under a lock.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def summary(self) -> Dict[str, Dict]:
+        """Count and mean per label set, for JSON status endpoints"""
+        with self._lock:
+            return {
+                "/".join(key): {"count": count, "avg_ms": round(total / count * 1000, 3) if count else 0.0}
+                for key, (_, total, count) in self._series.items()
+            }
+
+
+class MetricsRegistry:
+    """Holds every metric and renders the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], float] = None,
+              labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, function, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+# Global registry
+registry = MetricsRegistry()
+
+# Prometheus text exposition content type
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4"
+
+# Pipeline stages timed by stage_timer()
+STAGES = ("receive", "preprocess", "stt", "learned_match", "intent_routing",
+          "llm", "tts", "db_write")
+
+stage_seconds = registry.histogram(
+    "smash_stage_duration_seconds",
+    "Time spent in each pipeline stage",
+    ("stage", "backend", "outcome"),
+)
+stage_total = registry.counter(
+    "smash_stage_total",
+    "Pipeline stage executions",
+    ("stage", "backend", "outcome"),
+)
+llm_ttft_seconds = registry.histogram(
+    "smash_llm_time_to_first_token_seconds",
+    "Time from sending an LLM request to its first token",
+    ("backend", "outcome"),
+)
+turn_seconds = registry.histogram(
+    "smash_turn_duration_seconds",
+    "End-to-end duration of a chat request or voice turn",
+    ("channel", "outcome"),
+)
+
+
+class StageTimer:
+    """Times one pipeline stage; usable with `with` in sync and async code
+
+    The outcome defaults to "ok" (or "error" if the block raises) and can be
+    set inside the block, e.g. timer.outcome = "miss".
+    """
+
+    __slots__ = ("stage", "backend", "outcome", "started", "seconds")
+
+    def __init__(self, stage: str, backend: str = "", outcome: str = "ok"):
+        self.stage = stage
+        self.backend = backend
+        self.outcome = outcome
+        self.started = 0.0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.started
+        if exc_type is not None:
+            self.outcome = "cancelled" if exc_type.__name__ in ("CancelledError", "TurnCancelled") else "error"
+        record_stage(self.stage, self.seconds, self.backend, self.outcome)
+        return False
+
+
+def stage_timer(stage: str, backend: str = "", outcome: str = "ok") -> StageTimer:
+    return StageTimer(stage, backend, outcome)
+
+
+def record_stage(stage: str, seconds: float, backend: str = "", outcome: str = "ok"):
+    """Record a stage duration measured elsewhere"""
+    if settings.metrics_enabled:
+        stage_seconds.observe(seconds, stage=stage, backend=backend, outcome=outcome)
+        stage_total.inc(stage=stage, backend=backend, outcome=outcome)
+        if outcome == "ok":
+            timeseries.record(f"stage.{stage}", seconds * 1000)
+    log_event("stage", stage=stage, backend=backend, outcome=outcome, ms=round(seconds * 1000, 3))
+
+
+def record_ttft(seconds: float, backend: str, outcome: str = "ok"):
+    if settings.metrics_enabled:
+        llm_ttft_seconds.observe(seconds, backend=backend, outcome=outcome)
+    log_event("llm_first_token", backend=backend, outcome=outcome, ms=round(seconds * 1000, 3))
+
+
+def record_turn(channel: str, seconds: float, outcome: str = "ok", trace_id: Optional[str] = None):
+    if settings.metrics_enabled:
+        turn_seconds.observe(seconds, channel=channel, outcome=outcome)
+        if outcome != "error" and not outcome.startswith("cancelled"):
+            timeseries.record(f"turn.{channel}", seconds * 1000)
+    log_event("turn", trace_id=trace_id or trace_id_var.get(), channel=channel,
+              outcome=outcome, ms=round(seconds * 1000, 3))
@@ -0,0 +1,231 @@
+"""
+Per-service process attribution for SMASH Cloud Voice AI
+Groups host processes and containers into named services and tracks their usage
+"""
+
+# Which service (Whisper, Piper, Ollama, Nextcloud, smash_core...) is using the box
+import os
+import shutil
+import subprocess
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .config import get_settings
+
+settings = get_settings()
+
+# How often `docker ps` is re-read to map container ids to names
+DOCKER_REFRESH_SECONDS = 60.0
+# Matcher kinds accepted in PROCESS_SERVICES
+MATCHER_KINDS = ("self", "name", "cmd", "container", "cgroup")
+
+
+def parse_services(spec: str) -> List[Tuple[str, List[Tuple[str, str]]]]:
+    """"svc=kind:value|kind:value;svc2=..." -> [(svc, [(kind, value), ...]), ...]
+
+    Services are tried in order and the first match wins; a process no
+    matcher claims inherits its parent's service.
+    """
+    services = []
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        name, _, matchers = entry.partition("=")
+        parsed = []
+        for matcher in filter(None, (part.strip() for part in matchers.split("|"))):
+            kind, _, value = matcher.partition(":")
+            if kind not in MATCHER_KINDS:
+                raise ValueError(f"Unknown process matcher {matcher!r} for {name.strip()}")
+            parsed.append((kind, value.strip().lower()))
+        services.append((name.strip(), parsed))
+    return services
+
+
+class DockerNames:
+    """Container id -> {container name, compose service}, refreshed from `docker ps`"""
+
+    def __init__(self, refresh: float = DOCKER_REFRESH_SECONDS):
+        self.refresh = refresh
+        self.available = shutil.which("docker") is not None
+        self.names: Dict[str, Tuple[str, ...]] = {}
+        self._read_at = 0.0
+
+    def lookup(self, container_id: str) -> Tuple[str, ...]:
+        if not self.available:
+            return ()
+        now = time.monotonic()
+        if now - self._read_at >= self.refresh:
+            self._read_at = now
+            try:
+                output = subprocess.run(
+                    ["docker", "ps", "--no-trunc", "--format",
+                     '{{.ID}} {{.Names}} {{.Label "com.docker.compose.service"}}'],
+                    capture_output=True, text=True, timeout=5, check=True,
+                ).stdout
+                self.names = {fields[0]: tuple(name.lower() for name in fields[1:])
+                              for fields in (line.split() for line in output.splitlines()) if fields}
+            except (OSError, subprocess.SubprocessError):
+                # No daemon access (or no daemon): container matchers never match
+                self.names = {}
+        return self.names.get(container_id, ())
+
+
+def _container_id(cgroup: str) -> Optional[str]:
+    """Docker container id from /proc/<pid>/cgroup contents, if any"""
+    for line in cgroup.splitlines():
+        for part in line.rsplit("/", 2)[-2:]:
+            part = part.removeprefix("docker-").removesuffix(".scope")
+            if len(part) == 64 and all(c in "0123456789abcdef" for c in part):
+                return part
+    return None
+
+
+class ProcessAttributor:
+    """Per-service CPU%, RSS, threads and I/O rates from cached psutil handles
+
+    Each pid is classified once, when first seen; after that a sample reads
+    only the counters of processes that belong to a service. CPU% is summed
+    over the service's processes, top-style (100 = one core). I/O counters of
+    other users' processes need root; without it the rates are None.
+    """
+
+    def __init__(self, psutil, services: List[Tuple[str, List[Tuple[str, str]]]]):
+        self.psutil = psutil
+        self.services = services
+        self.own_pid = os.getpid()
+        self.docker = DockerNames()
+        # pid -> [Process, service or None, cpu seconds, read bytes, write bytes]
+        self._procs: Dict[int, list] = {}
+        self._prev_at: Optional[float] = None
+        self._latency_prev: Dict[str, Tuple[int, float]] = {}
+        self._latency: Dict[str, Dict] = {}
+
+    def _matches(self, kind: str, value: str, proc, info: Dict) -> bool:
+        if kind == "self":
+            return proc.pid == self.own_pid
+        if kind == "name":
+            return value in info["name"]
+        if kind == "cmd":
+            return value in info["cmdline"]
+        if info["cgroup"] is None:
+            try:
+                with open(f"/proc/{proc.pid}/cgroup") as handle:
+                    info["cgroup"] = handle.read().lower()
+            except OSError:
+                info["cgroup"] = ""
+        if kind == "cgroup":
+            return value in info["cgroup"]
+        container_id = _container_id(info["cgroup"])
+        return container_id is not None and value in self.docker.lookup(container_id)
+
+    def _classify(self, pid: int, depth: int = 0) -> Optional[str]:
+        entry = self._procs.get(pid)
+        if entry is not None:
+            return entry[1]
+        psutil = self.psutil
+        try:
+            proc = psutil.Process(pid)
+            with proc.oneshot():
+                info = {"name": proc.name().lower(), "cmdline": " ".join(proc.cmdline()).lower(),
+                        "cgroup": None}
+                ppid = proc.ppid()
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return None
+        except psutil.AccessDenied:
+            # Remember it so the same pid is not retried every sample
+            self._procs[pid] = [None, None, None, None, None]
+            return None
+        service = next((name for name, matchers in self.services
+                        if any(self._matches(kind, value, proc, info) for kind, value in matchers)), None)
+        if service is None and ppid > 1 and depth < 16:
+            # Workers, runners and pools count toward whoever started them
+            service = self._classify(ppid, depth + 1)
+        self._procs[pid] = [proc, service, None, None, None]
+        return service
+
+    def _request_latency(self, stage_summary: Dict, turn_summary: Dict) -> Dict[str, Dict]:
+        """Average request latency per service over the last sample interval"""
+        totals: Dict[str, List[float]] = {}
+        for key, entry in stage_summary.items():
+            _, backend, outcome = key.split("/")
+            if outcome == "ok":
+                total = totals.setdefault(backend, [0, 0.0])
+                total[0] += entry["count"]
+                total[1] += entry["avg_ms"] * entry["count"]
+        core = totals.setdefault("smash_core", [0, 0.0])
+        for key, entry in turn_summary.items():
+            outcome = key.rsplit("/", 1)[-1]
+            if outcome != "error" and not outcome.startswith("cancelled"):
+                core[0] += entry["count"]
+                core[1] += entry["avg_ms"] * entry["count"]
+        for name, (count, total_ms) in totals.items():
+            prev_count, prev_total = self._latency_prev.get(name, (0, 0.0))
+            if count > prev_count:
+                self._latency[name] = {"request_ms": round((total_ms - prev_total) / (count - prev_count), 2),
+                                       "requests": count - prev_count}
+            elif name in self._latency:
+                self._latency[name]["requests"] = 0
+            self._latency_prev[name] = (count, total_ms)
+        return self._latency
+
+    def sample(self, stage_summary: Optional[Dict] = None, turn_summary: Optional[Dict] = None,
+               probes: Optional[Dict] = None) -> Dict[str, Dict]:
+        """Blocking; one entry per configured service"""
+        psutil = self.psutil
+        now = time.monotonic()
+        elapsed = now - self._prev_at if self._prev_at else 0.0
+        self._prev_at = now
+
+        pids = set(psutil.pids())
+        for pid in list(self._procs):
+            if pid not in pids:
+                del self._procs[pid]
+        for pid in sorted(pids - self._procs.keys()):
+            self._classify(pid)
+
+        result = {name: {"processes": 0, "cpu_percent": 0.0, "rss": 0, "threads": 0,
+                         "read_rate": 0.0, "write_rate": 0.0, "io_restricted": False}
+                  for name, _ in self.services}
+        for pid, entry in list(self._procs.items()):
+            proc, service = entry[0], entry[1]
+            if service is None:
+                continue
+            try:
+                with proc.oneshot():
+                    times = proc.cpu_times()
+                    rss = proc.memory_info().rss
+                    threads = proc.num_threads()
+                    try:
+                        io = proc.io_counters()
+                    except (psutil.AccessDenied, AttributeError):
+                        io = None
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                del self._procs[pid]
+                continue
+            except psutil.AccessDenied:
+                continue
+            cpu = times.user + times.system
+            totals = result[service]
+            totals["processes"] += 1
+            totals["rss"] += rss
+            totals["threads"] += threads
+            # A process seen for the first time has no previous counters to diff against
+            if entry[2] is not None and elapsed > 0:
+                totals["cpu_percent"] += max(cpu - entry[2], 0.0) / elapsed * 100
+            if io is None:
+                totals["io_restricted"] = True
+            elif entry[3] is not None and elapsed > 0:
+                totals["read_rate"] += max(io.read_bytes - entry[3], 0) / elapsed
+                totals["write_rate"] += max(io.write_bytes - entry[4], 0) / elapsed
+            entry[2] = cpu
+            entry[3], entry[4] = (io.read_bytes, io.write_bytes) if io else (None, None)
+
+        latency = self._request_latency(stage_summary or {}, turn_summary or {})
+        for name, totals in result.items():
+            totals["cpu_percent"] = round(totals["cpu_percent"], 1)
+            totals["read_rate"] = None if totals["io_restricted"] and not totals["read_rate"] \
+                else round(totals["read_rate"], 1)
+            totals["write_rate"] = None if totals["io_restricted"] and not totals["write_rate"] \
+                else round(totals["write_rate"], 1)
+            totals.update(latency.get(name, {"request_ms": None, "requests": 0}))
+            probe = (probes or {}).get(name)
+            totals["probe_ms"] = probe.latency_ms if probe is not None else None
+        return result
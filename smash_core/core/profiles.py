@@ -0,0 +1,164 @@
+"""
+User profiles for SMASH Cloud Voice AI
+Per-user preferences and system prompts, cached in memory
+"""
+
+# Per-user tone, memory size and voice for chat and voice turns
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .config import get_settings
+from .database import db_manager, UserPreferences
+
+settings = get_settings()
+
+# The stock persona; any other preferred_tone is used as the personality text
+DEFAULT_TONE = "jarvis"
+
+
+def build_system_prompt(personality: str, user_address: str) -> str:
+    """The Jarvis-style system prompt for one personality"""
+    return f"""You are SMASH, an advanced AI assistant built for SMASH Cloud. You embody the {personality} personality style of Jarvis from Iron Man.
+
+Key characteristics:
+- Always address the user as "SIR" or "{user_address}"
+- Speak in a calm, articulate, and futuristic manner
+- Be helpful, intelligent, and efficient
+- Use precise language and avoid unnecessary words
+- Show confidence in your capabilities
+- Adapt and learn from conversations
+- Focus on cloud management, system administration, and user assistance
+
+You have access to:
+- Real-time system monitoring data
+- File management capabilities
+- User administration tools
+- Analytics and reporting
+- Voice interaction capabilities
+
+Respond naturally while maintaining your Jarvis persona. Be concise but thorough in your assistance."""
+
+
+class UserProfile:
+    """One user's preferences resolved against the global settings
+
+    Users without a preferences row get the configured defaults.
+    """
+
+    def __init__(self, user_id: str, prefs: Optional[UserPreferences] = None):
+        self.user_id = user_id
+        self.stored = prefs is not None
+        self.tone = (prefs.preferred_tone if prefs else None) or DEFAULT_TONE
+        self.personality = settings.jarvis_personality if self.tone == DEFAULT_TONE else self.tone
+        self.learning_enabled = settings.learning_enabled and (prefs.learning_enabled if prefs else True)
+        self.memory_size = (prefs.context_memory_size if prefs else None) or settings.context_memory_size
+        self.custom_greeting = prefs.custom_greeting if prefs else None
+        try:
+            voice_settings = json.loads(prefs.voice_settings) if prefs and prefs.voice_settings else {}
+        except ValueError:
+            voice_settings = {}
+        self.voice_settings = voice_settings if isinstance(voice_settings, dict) else {}
+        # Piper voice name; "voice" in voice_settings overrides VOICE_ID
+        self.voice = self.voice_settings.get("voice") or settings.voice_id
+        self.system_prompt = build_system_prompt(self.personality, settings.address_user_as)
+        # The default user keeps the original key so existing history carries over
+        self.history_key = "llm:history" if user_id == settings.default_user_id else f"llm:history:{user_id}"
+        self.loaded_at = time.monotonic()
+
+    def to_dict(self) -> Dict:
+        return {
+            "user_id": self.user_id,
+            "stored": self.stored,
+            "preferred_tone": self.tone,
+            "learning_enabled": self.learning_enabled,
+            "context_memory_size": self.memory_size,
+            "custom_greeting": self.custom_greeting,
+            "voice_settings": self.voice_settings,
+            "voice": self.voice
+        }
+
+
+class ProfileCache:
+    """user_id -> UserProfile, loaded from the database on first use
+
+    Preference updates made through db_manager drop the entry in this worker
+    immediately; other workers reload it once it is ttl seconds old. At most
+    max_entries profiles are kept (least recently used go first). A load that
+    races an invalidation is returned but not cached. Async code uses
+    get_async(), which loads misses in a worker thread.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._profiles: "OrderedDict[str, UserProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by invalidate(); a load that saw an older value must not be cached
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0, "stale_loads": 0}
+        db_manager.add_preferences_listener(self.invalidate)
+
+    def _cached(self, user_id: str) -> Tuple[Optional[UserProfile], Tuple[int, int]]:
+        """A fresh cached profile, or None plus the generation to load against"""
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None and time.monotonic() - profile.loaded_at < self.ttl:
+                self._profiles.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return profile, (0, 0)
+            self.stats["misses"] += 1
+            return None, (self._epoch, self._generations.get(user_id, 0))
+
+    def _load(self, user_id: str, generation: Tuple[int, int]) -> UserProfile:
+        profile = UserProfile(user_id, db_manager.get_user_preferences(user_id))
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(user_id, 0)):
+                # Invalidated while loading: the row read may predate the update
+                self.stats["stale_loads"] += 1
+                return profile
+            self._profiles[user_id] = profile
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+                self.stats["evictions"] += 1
+        return profile
+
+    def get(self, user_id: Optional[str] = None) -> UserProfile:
+        user_id = user_id or settings.default_user_id
+        profile, generation = self._cached(user_id)
+        return profile if profile is not None else self._load(user_id, generation)
+
+    async def get_async(self, user_id: Optional[str] = None) -> UserProfile:
+        """get() with the database read on a miss run in a worker thread"""
+        user_id = user_id or settings.default_user_id
+        profile, generation = self._cached(user_id)
+        if profile is not None:
+            return profile
+        return await asyncio.to_thread(self._load, user_id, generation)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Forget one user's profile, or every profile when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._profiles.clear()
+                self._epoch += 1
+            else:
+                self._profiles.pop(user_id, None)
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "cached": len(self._profiles), "ttl_seconds": self.ttl}
+
+
+# Global profile cache
+profile_cache = ProfileCache(
+    ttl=settings.profile_cache_ttl,
+    max_entries=settings.profile_cache_size,
+)
@@ -0,0 +1,269 @@
+"""
+Speculative LLM execution for SMASH Cloud Voice AI
+Starts drafting a reply from a stable interim transcript before the final one arrives
+"""
+
+# Interim-transcript stability tracking, speculative drafts and hit-rate metrics
+import asyncio
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from .llm import jarvis_llm
+
+_WORDS = re.compile(r"[a-z0-9']+")
+
+# The waste ratio only looks at recent work: older seconds fade with this half-life
+WASTE_HALF_LIFE_SECONDS = 120.0
+# Neutral work assumed on top of the recent sums, so a single early miss cannot
+# push the ratio to 1.0 and decayed waste drifts back toward 0
+WASTE_PRIOR_SECONDS = 1.0
+# While throttled, still let one probe draft through this often so the ratio can recover
+PROBE_INTERVAL_SECONDS = 30.0
+
+
+def normalize_transcript(text: str) -> str:
+    """Lowercase words only, so punctuation/case changes do not count as edits"""
+    return " ".join(_WORDS.findall(text.lower()))
+
+
+def transcripts_match(a: str, b: str, threshold: float) -> bool:
+    """True when two transcripts are close enough to reuse a draft"""
+    a, b = normalize_transcript(a), normalize_transcript(b)
+    if a == b:
+        return True
+    words_a, words_b = set(a.split()), set(b.split())
+    if not words_a or not words_b:
+        return False
+    return len(words_a & words_b) / len(words_a | words_b) >= threshold
+
+
+class SpeculationMetrics:
+    """Process-wide speculation counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.abandoned = 0
+        self.throttled = 0
+        self.wasted_seconds = 0.0
+        self.useful_seconds = 0.0
+        self.latency_saved_ms = 0.0
+        self.probes = 0
+        # Exponentially decayed seconds feeding waste_ratio()
+        self._recent_wasted = 0.0
+        self._recent_useful = 0.0
+        self._decayed_at = time.monotonic()
+        self._last_probe = 0.0
+
+    def _decay(self):
+        """Fade the recent sums by the time since the last update (lock held)"""
+        now = time.monotonic()
+        factor = 0.5 ** ((now - self._decayed_at) / WASTE_HALF_LIFE_SECONDS)
+        self._recent_wasted *= factor
+        self._recent_useful *= factor
+        self._decayed_at = now
+
+    def _ratio(self) -> float:
+        total = self._recent_wasted + self._recent_useful + WASTE_PRIOR_SECONDS
+        return self._recent_wasted / total
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def record_throttled(self):
+        with self._lock:
+            self.throttled += 1
+
+    def record_hit(self, saved_ms: float, seconds: float):
+        with self._lock:
+            self._decay()
+            self.hits += 1
+            self.latency_saved_ms += saved_ms
+            self.useful_seconds += seconds
+            self._recent_useful += seconds
+
+    def record_waste(self, seconds: float, miss: bool):
+        with self._lock:
+            self._decay()
+            if miss:
+                self.misses += 1
+            else:
+                self.abandoned += 1
+            self.wasted_seconds += seconds
+            self._recent_wasted += seconds
+
+    def waste_ratio(self) -> float:
+        """Wasted share of recent speculative work (decays toward 0 when idle)"""
+        with self._lock:
+            self._decay()
+            return self._ratio()
+
+    def admit(self, max_waste_ratio: float) -> bool:
+        """Whether a new draft may start under the waste budget
+
+        Over budget, one probe draft is still admitted every
+        PROBE_INTERVAL_SECONDS so a hit can pull the ratio back down.
+        """
+        with self._lock:
+            self._decay()
+            if self._ratio() <= max_waste_ratio:
+                return True
+            now = time.monotonic()
+            if now - self._last_probe >= PROBE_INTERVAL_SECONDS:
+                self._last_probe = now
+                self.probes += 1
+                return True
+            self.throttled += 1
+            return False
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            resolved = self.hits + self.misses
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "misses": self.misses,
+                "abandoned": self.abandoned,
+                "throttled": self.throttled,
+                "probes": self.probes,
+                "hit_rate": round(self.hits / resolved, 3) if resolved else 0.0,
+                "wasted_seconds": round(self.wasted_seconds, 3),
+                "recent_waste_ratio": round(self._ratio(), 3),
+                "avg_latency_saved_ms": round(self.latency_saved_ms / self.hits, 1) if self.hits else 0.0,
+            }
+
+
+# Global speculation metrics
+speculation_metrics = SpeculationMetrics()
+
+
+class Speculator:
+    """Per-session speculative drafting
+
+    Interim transcripts are fed to on_partial(). Once the same normalized text
+    has been seen stable_partials times in a row (and has at least min_words
+    words), a draft is started with jarvis_llm.draft_response(). resolve() then
+    either keeps the draft (final transcript matches) or cancels it and drafts
+    again from the final text. Speculation pauses while the wasted share of
+    speculative work exceeds max_waste_ratio (recent work weighted more, with
+    an occasional probe draft so it can recover), and at most max_per_turn drafts
+    are started per utterance.
+    """
+
+    def __init__(self, enabled: bool = True, stable_partials: int = 2, min_words: int = 3,
+                 match_threshold: float = 0.9, max_per_turn: int = 2,
+                 max_waste_ratio: float = 0.5, activation_check=None, user_id: Optional[str] = None):
+        self.enabled = enabled
+        self.stable_partials = stable_partials
+        self.min_words = min_words
+        self.match_threshold = match_threshold
+        self.max_per_turn = max_per_turn
+        self.max_waste_ratio = max_waste_ratio
+        self.activation_check = activation_check
+        self.user_id = user_id
+
+        self._last_partial = ""
+        self._stable_count = 0
+        self._drafts_this_turn = 0
+        self._task: Optional[asyncio.Task] = None
+        self._text = ""
+        self._started_at = 0.0
+        self._finished_at: Optional[float] = None
+
+    def on_partial(self, text: str):
+        """Track stability of interim transcripts and speculate when stable"""
+        if not self.enabled:
+            return
+        normalized = normalize_transcript(text)
+        if not normalized:
+            return
+
+        if normalized == self._last_partial:
+            self._stable_count += 1
+        else:
+            self._last_partial = normalized
+            self._stable_count = 1
+
+        if self._stable_count < self.stable_partials or len(normalized.split()) < self.min_words:
+            return
+        if self._task and normalize_transcript(self._text) == normalized:
+            return  # already drafting this text
+        if self.activation_check and not self.activation_check(text):
+            return
+        if self._drafts_this_turn >= self.max_per_turn:
+            speculation_metrics.record_throttled()
+            return
+        if not speculation_metrics.admit(self.max_waste_ratio):
+            return
+
+        self._abandon(miss=False)
+        self._start(text)
+
+    def _start(self, text: str):
+        self._text = text
+        self._started_at = time.perf_counter()
+        self._finished_at = None
+        self._drafts_this_turn += 1
+        self._task = asyncio.create_task(jarvis_llm.draft_response(text, user_id=self.user_id))
+        self._task.add_done_callback(self._mark_finished)
+        speculation_metrics.record_start()
+
+    def _mark_finished(self, task: asyncio.Task):
+        self._finished_at = time.perf_counter()
+
+    def _elapsed(self) -> float:
+        end = self._finished_at or time.perf_counter()
+        return end - self._started_at
+
+    def _abandon(self, miss: bool):
+        """Cancel the current draft (if any) and count its cost as waste"""
+        if self._task is None:
+            return
+        if not self._task.done():
+            self._task.cancel()
+        elif not self._task.cancelled():
+            self._task.exception()  # mark any failure as retrieved
+        speculation_metrics.record_waste(self._elapsed(), miss)
+        self._task = None
+
+    async def resolve(self, final_text: str) -> Dict:
+        """Return a draft for the final transcript, reusing the speculative one on a match"""
+        task, spec_text = self._task, self._text
+        self._reset_turn()
+
+        if task is not None and transcripts_match(spec_text, final_text, self.match_threshold):
+            head_start = time.perf_counter() - self._started_at
+            try:
+                draft = await task
+            except Exception as e:
+                print(f"Speculative draft error: {e}")
+                draft = None
+            if draft is not None:
+                # Saved latency: the part of the draft that ran before the final transcript
+                seconds = self._elapsed()
+                saved_ms = min(head_start, seconds) * 1000
+                speculation_metrics.record_hit(saved_ms, seconds)
+                return {**draft, "speculation": {"hit": True, "saved_ms": round(saved_ms, 1)}}
+        elif task is not None:
+            self._task = task
+            self._abandon(miss=True)
+            draft = await jarvis_llm.draft_response(final_text, user_id=self.user_id)
+            return {**draft, "speculation": {"hit": False, "saved_ms": 0.0}}
+
+        return await jarvis_llm.draft_response(final_text, user_id=self.user_id)
+
+    def _reset_turn(self):
+        self._task = None
+        self._last_partial = ""
+        self._stable_count = 0
+        self._drafts_this_turn = 0
+
+    def cancel(self):
+        """Drop any in-flight draft and start the utterance over (stop, barge-in, teardown)"""
+        self._abandon(miss=False)
+        self._reset_turn()
@@ -0,0 +1,99 @@
+"""
+Startup orchestration for SMASH Cloud Voice AI
+Per-phase timing, readiness tracking and background warm-up tasks
+"""
+
+# Startup phases, readiness and warm-up bookkeeping
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Optional
+
+# Module import time; app.py imports this first so "imports" covers the rest
+_IMPORTED_AT = time.perf_counter()
+
+
+class StartupReport:
+    """Times startup phases and tracks background warm-up tasks
+
+    The service is ready once the foreground phases have finished; background
+    tasks (greeting, warm-ups) keep running and report their own status.
+    """
+
+    def __init__(self):
+        self.started = _IMPORTED_AT
+        self.phases: Dict[str, float] = {}
+        self.background: Dict[str, Dict] = {}
+        self.ready = False
+        self.ready_ms: Optional[float] = None
+        self._tasks = set()
+        self._mark = self.started
+
+    def mark(self, name: str):
+        """Record the time since the previous mark as a phase"""
+        now = time.perf_counter()
+        self.phases[name] = round((now - self._mark) * 1000, 3)
+        self._mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block as a named phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._mark = time.perf_counter()
+            self.phases[name] = round((self._mark - started) * 1000, 3)
+
+    def run_background(self, name: str, coro: Awaitable) -> asyncio.Task:
+        """Run a warm-up task without holding up readiness"""
+        self.background[name] = {"status": "running", "ms": None}
+        task = asyncio.create_task(self._track(name, coro), name=f"startup-{name}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _track(self, name: str, coro: Awaitable):
+        started = time.perf_counter()
+        entry = self.background[name]
+        try:
+            await coro
+            entry["status"] = "done"
+        except asyncio.CancelledError:
+            entry["status"] = "cancelled"
+            raise
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+            print(f"⚠️  Startup task {name} failed: {e}")
+        finally:
+            entry["ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    async def wait_background(self):
+        """Wait for every background task (blocking startup mode)"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_ms = round((time.perf_counter() - self.started) * 1000, 3)
+        phases = ", ".join(f"{name} {ms:.0f}ms" for name, ms in self.phases.items())
+        print(f"⏱️  Ready in {self.ready_ms:.0f}ms ({phases})")
+
+    async def stop(self):
+        """Cancel warm-ups still running at shutdown"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def snapshot(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "ready_ms": self.ready_ms,
+            "phases_ms": dict(self.phases),
+            "background": {name: dict(entry) for name, entry in self.background.items()},
+        }
+
+
+# Global startup report
+startup_report = StartupReport()
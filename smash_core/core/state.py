@@ -0,0 +1,330 @@
+"""
+Shared state backends for SMASH Cloud Voice AI
+Session history, voice listening state and caches that every worker must see
+"""
+
+# Key/value + capped list state with in-process, SQLite and Redis implementations
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from .config import get_settings
+
+settings = get_settings()
+
+
+class StateBackend(ABC):
+    """Interface for state shared between requests, workers and replicas
+
+    Values are JSON-serialisable. Lists are capped: list_append() keeps only
+    the newest max_len items. The methods are synchronous; async code uses
+    the *_async variants, which run them in a worker thread for backends that
+    do I/O (a SQLite busy wait or a Redis round trip would stall the loop).
+    """
+
+    name = "base"
+    # Whether calls may block on disk or network (the *_async variants then use a thread)
+    blocking = True
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set only if absent; True if this caller set it (a cheap cross-worker lock)"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def list_extend(self, key: str, items: List[Any], max_len: Optional[int] = None):
+        """Append items atomically (no other writer's items in between)"""
+
+    def list_append(self, key: str, item: Any, max_len: Optional[int] = None):
+        self.list_extend(key, [item], max_len)
+
+    @abstractmethod
+    def list_range(self, key: str, limit: Optional[int] = None) -> List[Any]:
+        """Oldest-first items; with limit, only the newest `limit`"""
+
+    async def _call(self, method, *args, **kwargs):
+        if not self.blocking:
+            return method(*args, **kwargs)
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    async def get_async(self, key: str, default: Any = None) -> Any:
+        return await self._call(self.get, key, default)
+
+    async def set_async(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self._call(self.set, key, value, ttl)
+
+    async def add_async(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        return await self._call(self.add, key, value, ttl)
+
+    async def delete_async(self, key: str):
+        await self._call(self.delete, key)
+
+    async def list_extend_async(self, key: str, items: List[Any], max_len: Optional[int] = None):
+        await self._call(self.list_extend, key, items, max_len)
+
+    async def list_range_async(self, key: str, limit: Optional[int] = None) -> List[Any]:
+        return await self._call(self.list_range, key, limit)
+
+    def close(self):
+        pass
+
+    def get_stats(self) -> Dict:
+        return {"backend": self.name}
+
+
+class MemoryStateBackend(StateBackend):
+    """Process-local state; correct only with a single worker"""
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self):
+        self._values: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._lists: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+            return True
+        return False
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if self._expired(key):
+                return default
+            return self._values.get(key, default)
+
+    def _store(self, key: str, value: Any, ttl: Optional[float]):
+        self._values[key] = value
+        if ttl:
+            self._expires[key] = time.time() + ttl
+        else:
+            self._expires.pop(key, None)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        # Check and insert under one lock hold, or two callers could both win
+        with self._lock:
+            if key in self._values and not self._expired(key):
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+            self._lists.pop(key, None)
+
+    def list_extend(self, key: str, items: List[Any], max_len: Optional[int] = None):
+        with self._lock:
+            stored = self._lists.setdefault(key, [])
+            stored.extend(items)
+            if max_len and len(stored) > max_len:
+                del stored[:len(stored) - max_len]
+
+    def list_range(self, key: str, limit: Optional[int] = None) -> List[Any]:
+        with self._lock:
+            items = self._lists.get(key, [])
+            return list(items[-limit:] if limit else items)
+
+
+class SQLiteStateBackend(StateBackend):
+    """State in a WAL-mode SQLite file shared by every worker on the host
+
+    Each thread gets its own connection; writers wait on the busy timeout
+    rather than failing when another worker holds the lock.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        conn.executescript("""
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS list_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_list_items_key ON list_items (key, id);
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection; the file and schema are created on first use, not at import"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self._connect().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                         (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + ttl if ttl else None)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        conn = self._connect()
+        conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        conn.execute("DELETE FROM list_items WHERE key = ?", (key,))
+
+    def list_extend(self, key: str, items: List[Any], max_len: Optional[int] = None):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT INTO list_items (key, value) VALUES (?, ?)",
+                             [(key, json.dumps(item)) for item in items])
+            if max_len:
+                conn.execute(
+                    "DELETE FROM list_items WHERE key = ? AND id <= ("
+                    "SELECT id FROM list_items WHERE key = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (key, key, max_len)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def list_range(self, key: str, limit: Optional[int] = None) -> List[Any]:
+        rows = self._connect().execute(
+            "SELECT value FROM (SELECT id, value FROM list_items WHERE key = ? "
+            "ORDER BY id DESC LIMIT ?) ORDER BY id",
+            (key, limit or -1)
+        ).fetchall()
+        return [json.loads(value) for (value,) in rows]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def get_stats(self) -> Dict:
+        return {"backend": self.name, "path": self.path}
+
+
+class RedisStateBackend(StateBackend):
+    """State in a Redis-compatible server (Redis, Valkey, KeyDB), for multiple hosts
+
+    Requires the optional `redis` package.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "smash:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis requires the 'redis' package") from e
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._client.get(self._key(key))
+        return json.loads(value) if value is not None else default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._client.set(self._key(key), json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        return bool(self._client.set(self._key(key), json.dumps(value), nx=True,
+                                     px=int(ttl * 1000) if ttl else None))
+
+    def delete(self, key: str):
+        self._client.delete(self._key(key))
+
+    def list_extend(self, key: str, items: List[Any], max_len: Optional[int] = None):
+        pipe = self._client.pipeline()
+        pipe.rpush(self._key(key), *[json.dumps(item) for item in items])
+        if max_len:
+            pipe.ltrim(self._key(key), -max_len, -1)
+        pipe.execute()
+
+    def list_range(self, key: str, limit: Optional[int] = None) -> List[Any]:
+        start = -limit if limit else 0
+        return [json.loads(value) for value in self._client.lrange(self._key(key), start, -1)]
+
+    def close(self):
+        self._client.close()
+
+    def get_stats(self) -> Dict:
+        return {"backend": self.name, "url": self.url.split("@")[-1]}
+
+
+def create_state_backend(backend: str, url: str = "") -> StateBackend:
+    """Build the configured backend: memory, sqlite (url = file path) or redis (url = redis://...)"""
+    if backend == "memory":
+        return MemoryStateBackend()
+    if backend == "sqlite":
+        return SQLiteStateBackend(url or "./smash_state.db")
+    if backend == "redis":
+        return RedisStateBackend(url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown state backend: {backend}")
+
+
+# Global state backend
+state = create_state_backend(settings.state_backend, settings.state_url)
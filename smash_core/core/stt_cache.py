@@ -0,0 +1,270 @@
+"""
+Speech-to-text result cache for SMASH Cloud Voice AI
+Whisper transcripts keyed by a hash of the pre-processed audio
+"""
+
+# UI retries, duplicate uploads and replayed commands skip the Whisper pass
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from .config import get_settings
+from .metrics import record_stage, registry
+
+settings = get_settings()
+
+# Hashing runs in a thread above this size so large uploads do not stall the loop
+THREAD_HASH_BYTES = 256 * 1024
+# Bytes charged per entry on top of its text (key, dict and OrderedDict overhead)
+ENTRY_OVERHEAD = 256
+# The persistent file is trimmed back to max_entries once every this many writes
+PRUNE_EVERY = 64
+# Lookup outcomes, counted in stats and smash_stt_cache_total
+OUTCOMES = ("hit", "disk_hit", "shared", "miss")
+
+stt_cache_total = registry.counter(
+    "smash_stt_cache_total",
+    "Transcriptions answered by the STT cache (hit, disk_hit, shared) or by Whisper (miss)",
+    ("outcome",),
+)
+
+
+class _LeaderCancelled(Exception):
+    """The request making the shared Whisper call was cancelled"""
+
+
+def fingerprint(audio: bytes) -> str:
+    """BLAKE2b-128 of the audio exactly as it would be sent to Whisper
+
+    Pre-processed audio is 16-bit mono WAV at a fixed rate behind a fixed
+    header, so the key depends only on the normalized PCM; uploads that are
+    not pre-processed (WebM, MP3) are keyed by their raw bytes.
+    """
+    return hashlib.blake2b(audio, digest_size=16).hexdigest()
+
+
+class SttCache:
+    """fingerprint -> {"text", "confidence"}, bounded by entries and bytes
+
+    Least recently used entries are evicted first. With a path, results are
+    also written to a WAL-mode SQLite file that survives restarts and is
+    shared by every worker on the host; a memory miss looks there before
+    calling Whisper. Concurrent requests for the same audio wait for one
+    Whisper call instead of each making their own.
+    """
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 4 * 1024 * 1024,
+                 path: str = "", enabled: bool = True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.enabled = enabled and max_entries > 0
+        self._entries: "OrderedDict[str, Tuple[Dict, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conns = []
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._writes = 0
+        self.stats = {**dict.fromkeys(OUTCOMES, 0), "stores": 0, "evictions": 0, "disk_errors": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection; the file and table are created on first use, not at import"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # One connection per thread; check_same_thread is off only so close() can reach them all
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stt_cache (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    confidence REAL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _remember(self, key: str, result: Dict):
+        size = len(key) + len(result["text"].encode()) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.stats["evictions"] += 1
+
+    async def _lookup(self, key: str) -> Tuple[Optional[Dict], str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0], "hit"
+        if not self.path:
+            return None, "miss"
+        result = await asyncio.to_thread(self._disk_get, key)
+        if result is None:
+            return None, "miss"
+        self._remember(key, result)
+        return result, "disk_hit"
+
+    def _disk_get(self, key: str) -> Optional[Dict]:
+        """Read one entry from the persistent file (runs in a worker thread)"""
+        try:
+            row = self._connect().execute(
+                "SELECT text, confidence FROM stt_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"STT cache read error: {e}")
+            self._count("disk_errors")
+            return None
+        return {"text": row[0], "confidence": row[1]} if row is not None else None
+
+    def _disk_put(self, key: str, result: Dict):
+        """Persist one entry, pruning the file now and then (runs in a worker thread)"""
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO stt_cache (key, text, confidence, stored_at) VALUES (?, ?, ?, ?)",
+                (key, result["text"], result.get("confidence"), time.time())
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % PRUNE_EVERY == 0
+            if prune:
+                conn.execute(
+                    "DELETE FROM stt_cache WHERE key IN (SELECT key FROM stt_cache "
+                    "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            print(f"STT cache write error: {e}")
+            self._count("disk_errors")
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+        if key in OUTCOMES:
+            stt_cache_total.inc(outcome=key)
+
+    async def transcribe(self, audio: bytes,
+                         whisper: Callable[[bytes], Awaitable[Optional[Dict]]]) -> Tuple[Optional[Dict], str]:
+        """Cached transcription of audio; returns (result, source)
+
+        whisper(audio) makes the real call and returns {"text", "confidence"},
+        or None for a failure that should not be cached; its exceptions reach
+        every caller waiting on it. source is "hit", "disk_hit", "shared" or
+        "miss" ("off" when the cache is disabled).
+        """
+        if not self.enabled:
+            return await whisper(audio), "off"
+
+        started = time.perf_counter()
+        if len(audio) > THREAD_HASH_BYTES:
+            key = await asyncio.to_thread(fingerprint, audio)
+        else:
+            key = fingerprint(audio)
+
+        while True:
+            result, source = await self._lookup(key)
+            if result is None and key in self._in_flight:
+                try:
+                    result, source = await asyncio.shield(self._in_flight[key]), "shared"
+                except _LeaderCancelled:
+                    # The caller making the Whisper call went away; try again ourselves
+                    continue
+                if result is None:
+                    return None, source
+            if result is not None:
+                self._count(source)
+                record_stage("stt", time.perf_counter() - started, "cache", source)
+                return dict(result), source
+            break
+
+        self._count("miss")
+        pending = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = pending
+        try:
+            result = await whisper(audio)
+        except BaseException as e:
+            pending.set_exception(e if isinstance(e, Exception) else _LeaderCancelled())
+            # Retrieved here so a failure nobody else waited for is not logged
+            pending.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+        if result is not None:
+            result = {"text": result.get("text", ""), "confidence": result.get("confidence")}
+            self._remember(key, result)
+            self._count("stores")
+        # Waiters get the result before it is persisted
+        pending.set_result(result)
+        if result is not None and self.path:
+            await asyncio.to_thread(self._disk_put, key, result)
+        return (dict(result) if result is not None else None), "miss"
+
+    def entry_count(self) -> int:
+        """Entries held in memory"""
+        return len(self._entries)
+
+    def clear(self):
+        """Forget every entry, in memory and on disk (blocking; async callers use a thread)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.path:
+            self._connect().execute("DELETE FROM stt_cache")
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            entries, size = len(self._entries), self._bytes
+        lookups = sum(stats[outcome] for outcome in OUTCOMES)
+        saved = lookups - stats["miss"]
+        return {
+            **stats,
+            "enabled": self.enabled,
+            "hit_rate": round(saved / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "persistent": bool(self.path),
+            "in_flight": len(self._in_flight),
+        }
+
+
+# Global STT cache
+stt_cache = SttCache(
+    max_entries=settings.stt_cache_size,
+    max_bytes=settings.stt_cache_max_bytes,
+    path=settings.stt_cache_path,
+    enabled=settings.stt_cache_enabled,
+)
+
+registry.gauge("smash_stt_cache_entries", "Transcripts held in the in-memory STT cache",
+               lambda: stt_cache.entry_count())
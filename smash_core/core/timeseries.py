@@ -0,0 +1,287 @@
+"""
+Time-series history for SMASH Cloud Voice AI
+Fixed-size, memory-mapped round-robin archives of host and service metrics
+"""
+
+# Round-robin store behind /api/system/history and the UI's history charts
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from .config import get_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process only
+    fcntl = None
+
+settings = get_settings()
+
+MAGIC = b"SMTS"
+VERSION = 1
+NAME_BYTES = 96
+# magic, version, archive count, series name
+HEADER = struct.Struct(f"<4sHH{NAME_BYTES}s")
+# step seconds, rows, byte offset of the archive's columns
+ARCHIVE_HEADER = struct.Struct("<IIQ")
+# Per row (one typed column each): slot number, sample count, min, max, sum
+COLUMNS = (("slot", "q"), ("count", "I"), ("min", "f"), ("max", "f"), ("sum", "d"))
+
+
+def archive_layout(step: int) -> Tuple[Tuple[str, int, int], ...]:
+    """(name, step seconds, rows) for each archive, finest first
+
+    raw keeps 24 h at `step`, then 7 d of 1-minute, 90 d of 15-minute and
+    a year of 1-hour aggregates.
+    """
+    return (
+        ("raw", step, 86400 // step),
+        ("1m", 60, 7 * 1440),
+        ("15m", 900, 90 * 96),
+        ("1h", 3600, 365 * 24),
+    )
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def file_layout(layout) -> Tuple[List[int], int]:
+    """Byte offset of each archive's columns, and the total file size"""
+    offsets, offset = [], _align(HEADER.size + ARCHIVE_HEADER.size * len(layout))
+    for _, _, rows in layout:
+        offsets.append(offset)
+        for _, code in COLUMNS:
+            offset = _align(offset + array(code).itemsize * rows)
+    return offsets, offset
+
+
+class Archive:
+    """One ring of consolidated rows; row = slot % rows"""
+
+    def __init__(self, name: str, step: int, rows: int, buffer: memoryview, offset: int):
+        self.name = name
+        self.step = step
+        self.rows = rows
+        for column, code in COLUMNS:
+            size = array(code).itemsize * rows
+            setattr(self, column, buffer[offset:offset + size].cast(code))
+            offset = _align(offset + size)
+
+    def update(self, slot: int, value: float):
+        i = slot % self.rows
+        if self.slot[i] != slot:
+            # The row still holds data from one lap ago: start it over
+            self.slot[i] = slot
+            self.count[i] = 1
+            self.min[i] = self.max[i] = self.sum[i] = value
+            return
+        self.count[i] += 1
+        self.sum[i] += value
+        if value < self.min[i]:
+            self.min[i] = value
+        if value > self.max[i]:
+            self.max[i] = value
+
+    def points(self, first_slot: int, last_slot: int) -> List[List[float]]:
+        """[ts, min, avg, max] for every filled slot in the range, oldest first"""
+        first_slot = max(first_slot, last_slot - self.rows + 1)
+        result = []
+        for slot in range(first_slot, last_slot + 1):
+            i = slot % self.rows
+            if self.slot[i] == slot and self.count[i]:
+                result.append([slot * self.step, round(self.min[i], 3),
+                               round(self.sum[i] / self.count[i], 3), round(self.max[i], 3)])
+        return result
+
+    def release(self):
+        for column, _ in COLUMNS:
+            getattr(self, column).release()
+
+
+class Series:
+    """A metric's archives in one preallocated, memory-mapped file
+
+    Every write touches one row per archive, so it is O(1) and the file
+    never grows. Writes go to the page cache; the kernel flushes them, so
+    a crashed process loses nothing (a crashed host loses what was not yet
+    written back). With several workers each write holds an flock on the
+    file so concurrent updates to the same row are not lost.
+    """
+
+    def __init__(self, path: str, name: str, layout):
+        self.path = path
+        self.name = name
+        offsets, size = file_layout(layout)
+        expected = HEADER.pack(MAGIC, VERSION, len(layout), name.encode()[:NAME_BYTES]) + b"".join(
+            ARCHIVE_HEADER.pack(step, rows, archive_offset)
+            for (_, step, rows), archive_offset in zip(layout, offsets))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                # Another worker may be creating the same file right now
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size:
+                current = os.pread(fd, len(expected), 0)
+                if current != expected:
+                    # Different step or format: keep the old file aside and start over
+                    os.close(fd)
+                    os.replace(path, path + ".old")
+                    print(f"⚠️  {os.path.basename(path)} had another layout; moved to .old")
+                    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+                os.pwrite(fd, expected, 0)
+            self._fd = fd
+            self._mmap = mmap.mmap(fd, size)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        except Exception:
+            os.close(fd)
+            raise
+        self._buffer = memoryview(self._mmap)
+        self.archives = [Archive(archive_name, step, rows, self._buffer, archive_offset)
+                         for (archive_name, step, rows), archive_offset in zip(layout, offsets)]
+        self.size = size
+
+    def update(self, ts: float, value: float):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for archive in self.archives:
+                archive.update(int(ts // archive.step), value)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def pick_archive(self, start: float, end: float, max_points: int) -> Archive:
+        """Finest archive that still covers `start` without exceeding max_points"""
+        now = time.time()
+        for archive in self.archives:
+            if now - start <= archive.step * archive.rows and (end - start) / archive.step <= max_points:
+                return archive
+        return self.archives[-1]
+
+    def query(self, start: float, end: float, max_points: int = 1500,
+              resolution: Optional[str] = None) -> Dict:
+        archive = next((a for a in self.archives if a.name == resolution), None) \
+            or self.pick_archive(start, end, max_points)
+        return {
+            "series": self.name,
+            "resolution": archive.name,
+            "step": archive.step,
+            "start": start,
+            "end": end,
+            "columns": ["ts", "min", "avg", "max"],
+            "points": archive.points(int(start // archive.step), int(end // archive.step)),
+        }
+
+    def close(self):
+        for archive in self.archives:
+            archive.release()
+        self._buffer.release()
+        self._mmap.flush()
+        self._mmap.close()
+        os.close(self._fd)
+
+
+class TimeSeriesStore:
+    """Directory of Series files, opened on first write or read"""
+
+    def __init__(self, directory: str, step: int = 10, enabled: bool = True):
+        self.directory = directory
+        self.step = max(int(step), 1)
+        self.layout = archive_layout(self.step)
+        self.enabled = enabled
+        self._series: Dict[str, Series] = {}
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    @staticmethod
+    def _filename(name: str) -> str:
+        return re.sub(r"[^A-Za-z0-9._-]", "_", name) + ".rrd"
+
+    def _open(self, name: str, create: bool = True) -> Optional[Series]:
+        series = self._series.get(name)
+        if series is not None:
+            return series
+        path = os.path.join(self.directory, self._filename(name))
+        if not create and not os.path.exists(path):
+            return None
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                os.makedirs(self.directory, exist_ok=True)
+                series = self._series[name] = Series(path, name, self.layout)
+        return series
+
+    def record(self, name: str, value: Optional[float], ts: Optional[float] = None):
+        """Add a sample; never raises, a broken store just stops recording"""
+        if not self.enabled or value is None:
+            return
+        try:
+            self._open(name).update(time.time() if ts is None else ts, float(value))
+        except Exception as e:
+            self.errors += 1
+            if self.errors == 1:
+                print(f"⚠️  Time-series write failed for {name}: {e}")
+
+    def query(self, name: str, start: float, end: float, max_points: int = 1500,
+              resolution: Optional[str] = None) -> Optional[Dict]:
+        series = self._open(name, create=False)
+        return series.query(start, end, max_points, resolution) if series else None
+
+    def list_series(self) -> List[str]:
+        """Series names, read from the file headers (other workers' series included)"""
+        names = set(self._series)
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(".rrd"):
+                    continue
+                with open(entry.path, "rb") as handle:
+                    header = handle.read(HEADER.size)
+                if len(header) == HEADER.size:
+                    magic, _, _, name = HEADER.unpack(header)
+                    if magic == MAGIC:
+                        names.add(name.rstrip(b"\0").decode(errors="replace"))
+        return sorted(names)
+
+    def info(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "archives": [{"name": name, "step": step, "rows": rows, "span_seconds": step * rows}
+                         for name, step, rows in self.layout],
+            "bytes_per_series": file_layout(self.layout)[1],
+            "series": self.list_series(),
+            "write_errors": self.errors,
+        }
+
+    def close(self):
+        with self._lock:
+            for series in self._series.values():
+                series.close()
+            self._series.clear()
+
+
+def parse_duration(value: str) -> float:
+    """"90s", "15m", "24h", "7d" -> seconds"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}; use e.g. 30m, 24h, 7d")
+    return float(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+
+
+# Global store
+timeseries = TimeSeriesStore(
+    directory=settings.timeseries_dir,
+    step=settings.timeseries_step,
+    enabled=settings.timeseries_enabled,
+)
@@ -0,0 +1,390 @@
+"""
+Upstream service pools for SMASH Cloud Voice AI
+Weighted Whisper, Piper and Ollama endpoints with load-aware picking and outlier ejection
+"""
+
+# Spread upstream calls over every machine running a service
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+import httpx
+
+from .config import get_settings
+from .http_client import get_http_client
+from .metrics import registry
+
+settings = get_settings()
+
+BALANCE_MODES = ("least_outstanding", "ewma")
+# Weight of the newest sample in an endpoint's latency average
+EWMA_ALPHA = 0.3
+# Cost multiplier for an Ollama endpoint that has the model installed but not in memory
+COLD_MODEL_PENALTY = 4.0
+# Responses at or above this status count against the endpoint (and are retried)
+FAILURE_STATUS = 500
+# Share of HEALTH_PROBE_TIMEOUT one endpoint's probe may take, so a hung endpoint
+# is marked down on its own instead of timing out the whole pool's probe
+PROBE_TIMEOUT_SHARE = 0.8
+
+upstream_requests_total = registry.counter(
+    "smash_upstream_requests_total",
+    "Requests sent to each upstream endpoint, by outcome (ok, error, cancelled)",
+    ("service", "endpoint", "outcome"),
+)
+upstream_seconds = registry.histogram(
+    "smash_upstream_response_seconds",
+    "Time from sending an upstream request to its response headers",
+    ("service", "endpoint"),
+)
+upstream_ejections_total = registry.counter(
+    "smash_upstream_ejections_total",
+    "Endpoints taken out of rotation, by reason (failures, health)",
+    ("service", "endpoint", "reason"),
+)
+
+
+def parse_endpoints(spec: str) -> List[Tuple[str, float]]:
+    """'http://a:9000;weight=2,http://b:9000' -> [(url, weight), ...]"""
+    endpoints = []
+    for entry in spec.split(","):
+        url, *options = [part.strip() for part in entry.split(";")]
+        if not url:
+            continue
+        weight = 1.0
+        for option in options:
+            key, _, value = option.partition("=")
+            if key.strip() != "weight":
+                raise ValueError(f"Unknown upstream option {option!r} in {entry.strip()!r}")
+            weight = float(value)
+            if weight <= 0:
+                raise ValueError(f"Upstream weight must be positive: {entry.strip()!r}")
+        endpoints.append((url.rstrip("/"), weight))
+    return endpoints
+
+
+def model_name(name: str) -> str:
+    """Ollama's default tag makes "llama3" and "llama3:latest" the same model"""
+    return name if ":" in name else f"{name}:latest"
+
+
+def _model_set(payload: Dict) -> Set[str]:
+    """Model names from an Ollama /api/tags or /api/ps reply"""
+    return {model_name(model.get("name") or model.get("model", "")) for model in payload.get("models", [])}
+
+
+class Endpoint:
+    """One machine serving an upstream, with its load, latency and health"""
+
+    def __init__(self, service: str, url: str, weight: float = 1.0):
+        self.service = service
+        self.url = url
+        self.weight = weight
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ewma_ms: Optional[float] = None
+        self.ejections = 0
+        self.eject_streak = 0
+        self.ejected_until = 0.0
+        # Last health probe: None until the first one completes
+        self.healthy: Optional[bool] = None
+        self.last_error: Optional[str] = None
+        # Ollama only: installed and in-memory models, None while unknown
+        self.models: Optional[Set[str]] = None
+        self.loaded: Optional[Set[str]] = None
+
+    def available(self, now: float) -> bool:
+        return self.healthy is not False and now >= self.ejected_until
+
+    def record_latency(self, seconds: float):
+        ms = seconds * 1000
+        self.ewma_ms = ms if self.ewma_ms is None else self.ewma_ms + EWMA_ALPHA * (ms - self.ewma_ms)
+        upstream_seconds.observe(seconds, service=self.service, endpoint=self.url)
+
+    def summary(self, now: float) -> Dict:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "available": self.available(now),
+            "healthy": self.healthy,
+            "ejected_for_s": round(max(self.ejected_until - now, 0.0), 1),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+            "ewma_ms": round(self.ewma_ms, 2) if self.ewma_ms is not None else None,
+            "models": sorted(self.models) if self.models is not None else None,
+            "loaded": sorted(self.loaded) if self.loaded is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class Lease:
+    """One request's hold on an endpoint; release() it when the request is done"""
+
+    __slots__ = ("pool", "endpoint", "url", "model", "started", "status", "released")
+
+    def __init__(self, pool: "UpstreamPool", endpoint: Endpoint, model: Optional[str]):
+        self.pool = pool
+        self.endpoint = endpoint
+        self.url = endpoint.url
+        self.model = model
+        self.started = time.perf_counter()
+        self.status: Optional[int] = None
+        self.released = False
+
+    def observe(self, response: httpx.Response) -> httpx.Response:
+        """Note the response's status and time to headers; returns it"""
+        if self.status is None:
+            self.status = response.status_code
+            self.endpoint.record_latency(time.perf_counter() - self.started)
+            if self.status == 404 and self.model and self.endpoint.models is not None:
+                # Ollama answers 404 for a model it does not have; stop sending it there
+                self.endpoint.models.discard(self.model)
+        return response
+
+    def release(self, error: Optional[BaseException] = None):
+        if not self.released:
+            self.released = True
+            self.pool._release(self, error)
+
+
+class UpstreamPool:
+    """The endpoints serving one upstream service
+
+    pick() chooses among available endpoints (not ejected, not failing health
+    probes) by cost: outstanding requests per unit of weight, ties going to
+    the lower latency ("least_outstanding"), or EWMA latency times
+    outstanding requests per weight ("ewma"). eject_failures consecutive
+    failures take an endpoint out for eject_seconds, doubling on each repeat
+    up to max_eject_seconds; one more failure after it returns ejects it
+    again, a success restores it fully. When nothing is available every
+    endpoint is tried rather than failing outright. With model_aware (Ollama)
+    a request only goes where its model is installed, preferring endpoints
+    that already have it in memory.
+    """
+
+    def __init__(self, name: str, spec: str, health_path: str = "/health",
+                 balance: str = "least_outstanding", retries: int = 1, eject_failures: int = 3,
+                 eject_seconds: float = 30.0, max_eject_seconds: float = 300.0,
+                 probe_timeout: float = 3.0, model_aware: bool = False):
+        if balance not in BALANCE_MODES:
+            raise ValueError(f"Unknown upstream balance mode {balance!r}; expected one of {', '.join(BALANCE_MODES)}")
+        self.name = name
+        self.endpoints = [Endpoint(name, url, weight) for url, weight in parse_endpoints(spec)]
+        if not self.endpoints:
+            raise ValueError(f"No {name} endpoints configured")
+        self.health_path = health_path
+        self.balance = balance
+        self.retries = max(retries, 0)
+        self.eject_failures = max(eject_failures, 1)
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.probe_timeout = probe_timeout
+        self.model_aware = model_aware
+
+    @property
+    def urls(self) -> List[str]:
+        return [endpoint.url for endpoint in self.endpoints]
+
+    def _cost(self, endpoint: Endpoint, model: Optional[str]) -> float:
+        if self.balance == "ewma":
+            known = [other.ewma_ms for other in self.endpoints if other.ewma_ms is not None]
+            # An endpoint without samples is assumed average, so it gets tried
+            latency = endpoint.ewma_ms if endpoint.ewma_ms is not None else (sum(known) / len(known) if known else 1.0)
+            cost = latency * (endpoint.outstanding + 1) / endpoint.weight
+        else:
+            cost = (endpoint.outstanding + 1) / endpoint.weight
+        if model and endpoint.loaded is not None and model not in endpoint.loaded:
+            cost *= COLD_MODEL_PENALTY
+        return cost
+
+    def serving(self, model: Optional[str] = None) -> List[Endpoint]:
+        """Endpoints that have (or may have) the model; all of them if none do"""
+        if not model or not self.model_aware:
+            return list(self.endpoints)
+        model = model_name(model)
+        with_model = [endpoint for endpoint in self.endpoints
+                      if endpoint.models is None or model in endpoint.models]
+        return with_model or list(self.endpoints)
+
+    def pick(self, model: Optional[str] = None, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        model = model_name(model) if model and self.model_aware else None
+        excluded = set(map(id, exclude))
+        candidates = [endpoint for endpoint in self.serving(model) if id(endpoint) not in excluded] \
+            or self.serving(model)
+        now = time.monotonic()
+        # Nothing available: spread over everything rather than refuse to try
+        candidates = [endpoint for endpoint in candidates if endpoint.available(now)] or candidates
+        return min(candidates, key=lambda endpoint: (self._cost(endpoint, model),
+                                                     endpoint.ewma_ms or 0.0, random.random()))
+
+    def lease(self, model: Optional[str] = None, exclude: Iterable[Endpoint] = ()) -> Lease:
+        """Pick an endpoint and count a request against it until released"""
+        endpoint = self.pick(model, exclude)
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return Lease(self, endpoint, model_name(model) if model and self.model_aware else None)
+
+    @asynccontextmanager
+    async def acquire(self, model: Optional[str] = None) -> AsyncIterator[Lease]:
+        """A lease for the duration of the block; an exception counts as a failure"""
+        lease = self.lease(model)
+        try:
+            yield lease
+        except BaseException as e:
+            lease.release(e)
+            raise
+        lease.release()
+
+    async def request(self, method: str, url: str, model: Optional[str] = None,
+                      **kwargs) -> httpx.Response:
+        """Send a request (url is a path) to the best endpoint over the shared client
+
+        A transport error or 5xx response is retried on another endpoint, up to
+        retries times; the last response is returned or the last error raised.
+        """
+        tried: List[Endpoint] = []
+        while True:
+            lease = self.lease(model, exclude=tried)
+            tried.append(lease.endpoint)
+            retry = len(tried) <= self.retries and len(tried) < len(self.endpoints)
+            try:
+                response = lease.observe(
+                    await get_http_client().request(method, f"{lease.url}{url}", **kwargs)
+                )
+            except httpx.TransportError as e:
+                lease.release(e)
+                if retry:
+                    continue
+                raise
+            except BaseException as e:
+                lease.release(e)
+                raise
+            lease.release()
+            if response.status_code >= FAILURE_STATUS and retry:
+                continue
+            return response
+
+    def _release(self, lease: Lease, error: Optional[BaseException]):
+        endpoint = lease.endpoint
+        endpoint.outstanding -= 1
+        if isinstance(error, asyncio.CancelledError):
+            outcome = "cancelled"
+        elif error is not None or (lease.status or 0) >= FAILURE_STATUS:
+            outcome = "error"
+        else:
+            outcome = "ok"
+        upstream_requests_total.inc(service=self.name, endpoint=endpoint.url, outcome=outcome)
+        if outcome == "error":
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            endpoint.last_error = (f"{type(error).__name__}: {error}" if str(error) else type(error).__name__) \
+                if error is not None else f"HTTP {lease.status}"
+            if endpoint.consecutive_failures >= self.eject_failures and time.monotonic() >= endpoint.ejected_until:
+                self._eject(endpoint, "failures")
+        elif outcome == "ok":
+            if lease.status is None:
+                endpoint.record_latency(time.perf_counter() - lease.started)
+            endpoint.consecutive_failures = 0
+            endpoint.eject_streak = 0
+
+    def _eject(self, endpoint: Endpoint, reason: str):
+        seconds = min(self.eject_seconds * 2 ** endpoint.eject_streak, self.max_eject_seconds)
+        endpoint.ejected_until = time.monotonic() + seconds
+        endpoint.eject_streak += 1
+        endpoint.ejections += 1
+        upstream_ejections_total.inc(service=self.name, endpoint=endpoint.url, reason=reason)
+        print(f"⚠️  {self.name} endpoint {endpoint.url} ejected for {seconds:.0f}s "
+              f"after {endpoint.consecutive_failures} failures ({endpoint.last_error})")
+
+    def _set_health(self, endpoint: Endpoint, healthy: bool, error: Optional[str] = None):
+        if healthy and endpoint.healthy is False:
+            print(f"✅ {self.name} endpoint {endpoint.url} is healthy again")
+        elif not healthy and endpoint.healthy is not False:
+            upstream_ejections_total.inc(service=self.name, endpoint=endpoint.url, reason="health")
+            print(f"⚠️  {self.name} endpoint {endpoint.url} failed its health check ({error})")
+        endpoint.healthy = healthy
+        if error:
+            endpoint.last_error = error
+
+    async def _probe_endpoint(self, client: httpx.AsyncClient, endpoint: Endpoint) -> bool:
+        try:
+            response = await asyncio.wait_for(client.get(f"{endpoint.url}{self.health_path}"), self.probe_timeout)
+            healthy = response.status_code < 400
+            if healthy and self.model_aware:
+                # /api/tags (the health path) lists installed models, /api/ps the loaded ones
+                endpoint.models = _model_set(response.json())
+                try:
+                    loaded = await asyncio.wait_for(client.get(f"{endpoint.url}/api/ps"), self.probe_timeout)
+                    endpoint.loaded = _model_set(loaded.json()) if loaded.status_code == 200 else None
+                except Exception:
+                    # Older Ollama without /api/ps: no cold-start preference
+                    endpoint.loaded = None
+        except Exception as e:
+            self._set_health(endpoint, False, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+            raise
+        self._set_health(endpoint, healthy, None if healthy else f"health check returned HTTP {response.status_code}")
+        return healthy
+
+    async def probe(self, client: httpx.AsyncClient) -> str:
+        """Health-check every endpoint; the service is healthy while any endpoint is
+
+        Raises (unreachable) only when no endpoint answered at all.
+        """
+        results = await asyncio.gather(*(self._probe_endpoint(client, endpoint) for endpoint in self.endpoints),
+                                       return_exceptions=True)
+        if any(result is True for result in results):
+            return "healthy"
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if len(errors) == len(results):
+            raise errors[0]
+        return "unhealthy"
+
+    def get_stats(self) -> Dict:
+        now = time.monotonic()
+        endpoints = [endpoint.summary(now) for endpoint in self.endpoints]
+        return {
+            "balance": self.balance,
+            "available": sum(1 for endpoint in endpoints if endpoint["available"]),
+            "endpoints": endpoints,
+        }
+
+
+def _pool(name: str, spec: str, health_path: str = "/health", model_aware: bool = False) -> UpstreamPool:
+    return UpstreamPool(
+        name, spec, health_path,
+        balance=settings.upstream_balance,
+        retries=settings.upstream_retries,
+        eject_failures=settings.upstream_eject_failures,
+        eject_seconds=settings.upstream_eject_seconds,
+        max_eject_seconds=settings.upstream_max_eject_seconds,
+        probe_timeout=settings.health_probe_timeout * PROBE_TIMEOUT_SHARE,
+        model_aware=model_aware,
+    )
+
+
+# Global pools
+whisper_pool = _pool("whisper", settings.whisper_host)
+piper_pool = _pool("piper", settings.piper_host)
+ollama_pool = _pool("ollama", settings.ollama_host, "/api/tags", model_aware=True)
+upstream_pools = {pool.name: pool for pool in (whisper_pool, piper_pool, ollama_pool)}
+
+
+def _endpoint_gauge(value):
+    return lambda: {(pool.name, endpoint.url): value(endpoint)
+                    for pool in upstream_pools.values() for endpoint in pool.endpoints}
+
+
+registry.gauge("smash_upstream_outstanding", "In-flight requests per upstream endpoint",
+               _endpoint_gauge(lambda endpoint: endpoint.outstanding), ("service", "endpoint"))
+registry.gauge("smash_upstream_available", "1 while an upstream endpoint is in rotation",
+               _endpoint_gauge(lambda endpoint: int(endpoint.available(time.monotonic()))),
+               ("service", "endpoint"))
+registry.gauge("smash_upstream_latency_ewma_seconds", "Moving average of each endpoint's response time",
+               _endpoint_gauge(lambda endpoint: (endpoint.ewma_ms or 0.0) / 1000), ("service", "endpoint"))
@@ -4,154 +4,411 @@ Voice Processing Core - Real-time STT/TTS with Jarvis voice
 
 # Voice processing and audio stream handling
 import asyncio
+import contextvars
 import io
+import time
 import uuid
-from pathlib import Path
-from typing import Dict, Optional, AsyncGenerator
+from typing import Dict, List, Optional, AsyncGenerator, AsyncIterator, Tuple
 import httpx
 import json
 from datetime import datetime
 
 from .config import Settings
 from .llm import jarvis_llm
+from .profiles import profile_cache
 from .database import db_manager
+from .audio_store import audio_store
+from .audio_http import elevenlabs_request, extension_for, open_upstream_audio, piper_request
+from .audio_codec import transcode_for_client, transport_metrics
+from .audio_preprocess import audio_preprocessor
+from .stt_cache import stt_cache
+from .upstreams import piper_pool, whisper_pool
+from .state import state
+from .health import health_prober
+from .metrics import stage_timer, record_turn, trace_id_var, current_trace_id, new_trace_id
+
+# Pipeline stages a turn moves through, in order
+TURN_STAGES = ("stt", "llm", "tts")
+
+class TurnCancelled(Exception):
+    """Raised inside a turn's stage once the turn has been cancelled"""
+
+class TurnMetrics:
+    """Stage duration averages and the work avoided by cancelling turns
+
+    Saved seconds are estimated from each stage's EWMA duration: the unfinished
+    remainder of the running stage plus every stage the turn never reached.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.stage_seconds: Dict[str, float] = {}
+        self.completed = 0
+        self.cancelled: Dict[str, int] = {}
+        self.saved_seconds = 0.0
+        self.saved_by_stage: Dict[str, float] = {}
+
+    def observe(self, stage: str, seconds: float):
+        previous = self.stage_seconds.get(stage)
+        self.stage_seconds[stage] = seconds if previous is None else \
+            previous + self.alpha * (seconds - previous)
+
+    def expected(self, stage: str) -> float:
+        return self.stage_seconds.get(stage, 0.0)
+
+    def record_cancel(self, reason: str, saved: Dict[str, float]):
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+        for stage, seconds in saved.items():
+            self.saved_seconds += seconds
+            self.saved_by_stage[stage] = self.saved_by_stage.get(stage, 0.0) + seconds
+
+    def snapshot(self) -> Dict:
+        return {
+            "completed": self.completed,
+            "cancelled": dict(self.cancelled),
+            "saved_seconds": round(self.saved_seconds, 3),
+            "saved_by_stage": {k: round(v, 3) for k, v in self.saved_by_stage.items()},
+            "avg_stage_seconds": {k: round(v, 3) for k, v in self.stage_seconds.items()},
+        }
+
+# Global turn metrics
+turn_metrics = TurnMetrics()
+
+class VoiceTurn:
+    """One utterance's journey through STT, LLM and TTS
+
+    Stage work runs as child tasks registered on the turn, so cancel() stops
+    in-flight upstream requests (Whisper, Ollama, Piper) immediately; httpx
+    closes the connection when its task is cancelled. Child tasks run with the
+    turn's trace id set, so their metrics and logs are tagged with it.
+    """
+
+    def __init__(self, turn_id: str, owner: str, trace_id: Optional[str] = None):
+        self.turn_id = turn_id
+        self.owner = owner
+        self.trace_id = trace_id or new_trace_id()
+        self.channel = owner.split("-", 1)[0]
+        self.created = time.perf_counter()
+        self.cancelled = False
+        self.stage: Optional[str] = None
+        self.stage_started = 0.0
+        # Seconds spent in each finished stage
+        self.timings: Dict[str, float] = {}
+        self.tasks = set()
+
+    async def run(self, stage: str, coro):
+        """Run one stage of the turn as a cancellable child task"""
+        if self.cancelled:
+            coro.close()
+            raise TurnCancelled(self.turn_id)
+        
+        context = contextvars.copy_context()
+        context.run(trace_id_var.set, self.trace_id)
+        task = asyncio.create_task(coro, context=context)
+        self.tasks.add(task)
+        self.stage, self.stage_started = stage, time.perf_counter()
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            # Only translate our own cancellation; the caller being cancelled must propagate
+            if self.cancelled and not asyncio.current_task().cancelling():
+                raise TurnCancelled(self.turn_id) from None
+            raise
+        finally:
+            self.tasks.discard(task)
+        elapsed = time.perf_counter() - self.stage_started
+        self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+        turn_metrics.observe(stage, elapsed)
+        return result
+
+    def cancel(self, reason: str) -> float:
+        """Cancel in-flight stage work; returns the estimated seconds saved"""
+        if self.cancelled:
+            return 0.0
+        self.cancelled = True
+        
+        saved = {}
+        if self.stage is not None:
+            elapsed = time.perf_counter() - self.stage_started
+            saved[self.stage] = max(turn_metrics.expected(self.stage) - elapsed, 0.0)
+        if self.stage is None:
+            remaining = TURN_STAGES
+        elif self.stage in TURN_STAGES:
+            remaining = TURN_STAGES[TURN_STAGES.index(self.stage) + 1:]
+        else:
+            remaining = ()
+        for stage in remaining:
+            saved[stage] = turn_metrics.expected(stage)
+        
+        for task in list(self.tasks):
+            task.cancel()
+        turn_metrics.record_cancel(reason, saved)
+        record_turn(self.channel, time.perf_counter() - self.created, f"cancelled_{reason}", self.trace_id)
+        return sum(saved.values())
 
 class VoiceProcessor:
     def __init__(self, settings: Settings):
         self.settings = settings
-        self.is_listening = False
         self.is_speaking = False
-        self.audio_queue = asyncio.Queue()
-        self.processor_tasks = []
+        # Tasks owned by live voice sessions and turns; cancelled on shutdown
+        self.processor_tasks = set()
+        # In-flight turns by id
+        self.turns: Dict[str, VoiceTurn] = {}
+
+    async def get_listening(self) -> bool:
+        """Listening mode is shared by every worker through the state backend"""
+        return bool(await state.get_async("voice:listening", False))
+
+    def begin_turn(self, owner: str, trace_id: Optional[str] = None) -> VoiceTurn:
+        """Register a new turn for a session (or request)"""
+        turn = VoiceTurn(uuid.uuid4().hex[:12], owner, trace_id)
+        self.turns[turn.turn_id] = turn
+        return turn
+
+    def end_turn(self, turn: VoiceTurn, outcome: str = "ok"):
+        """Forget a finished or cancelled turn"""
+        if self.turns.pop(turn.turn_id, None) is not None and not turn.cancelled:
+            turn_metrics.completed += 1
+            record_turn(turn.channel, time.perf_counter() - turn.created, outcome, turn.trace_id)
+
+    def cancel_turns(self, owner: str, reason: str, keep: Optional[VoiceTurn] = None,
+                     turn_id: Optional[str] = None) -> List[str]:
+        """Cancel every in-flight turn of an owner except `keep` (or only `turn_id`)"""
+        cancelled = []
+        saved = 0.0
+        for turn in list(self.turns.values()):
+            if turn.owner != owner or turn is keep or turn.cancelled:
+                continue
+            if turn_id is not None and turn.turn_id != turn_id:
+                continue
+            saved += turn.cancel(reason)
+            self.turns.pop(turn.turn_id, None)
+            cancelled.append(turn.turn_id)
+        if cancelled:
+            print(f"✋ Cancelled {len(cancelled)} turn(s) ({reason}), ~{saved:.2f}s of upstream work saved")
+        return cancelled
+
+    async def run_turn(self, coro, owner: str, is_disconnected=None):
+        """Run a whole request as one cancellable turn
+
+        is_disconnected is polled (e.g. Request.is_disconnected) so the turn is
+        cancelled as soon as the HTTP client goes away.
+        """
+        turn = self.begin_turn(owner, current_trace_id())
+        task = asyncio.create_task(turn.run("turn", coro))
+        self.processor_tasks.add(task)
+        try:
+            while is_disconnected is not None:
+                done, _ = await asyncio.wait({task}, timeout=0.25)
+                if done:
+                    break
+                if await is_disconnected():
+                    self.cancel_turns(owner, "disconnect")
+                    break
+            return await task
+        except TurnCancelled:
+            return None
+        finally:
+            self.processor_tasks.discard(task)
+            self.end_turn(turn)
         
-    async def process_audio_stream(self, audio_data: bytes) -> Optional[Dict]:
-        """Process incoming audio stream and return response"""
+    async def process_audio_stream(self, audio_data: bytes, synthesize: bool = True,
+                                   output_codec: str = "wav", user_id: Optional[str] = None) -> Optional[Dict]:
+        """Process incoming audio stream and return response
+
+        With synthesize=False the caller streams the speech itself via stream_speech().
+        Uploads (WAV, Opus/OGG, FLAC) are pre-processed to normalized mono WAV at
+        sample_rate for Whisper, and Piper speech is re-encoded with output_codec before it is stored.
+        """
+        transport = {"upload_bytes": len(audio_data)}
         try:
-            # Convert audio to text
-            text = await self._speech_to_text(audio_data)
-            if not text or len(text.strip()) < 2:
-                return None
-            
-            # Check for voice activation
-            if not self._is_voice_activated(text):
+            text = await self.transcribe(audio_data, transport)
+            if not text:
                 return None
             
-            print(f"🎤 Heard: {text}")
-            
-            # Process with LLM
-            response_data = await jarvis_llm.process_message(text)
-            response_text = response_data["response"]
+            response_data = await self.respond(text, user_id)
             
-            print(f"🤖 Response: {response_text}")
+            # Convert response to speech in the user's voice
+            audio_url = None
+            if synthesize:
+                audio_url = await self._text_to_speech(response_data["response"], output_codec, transport,
+                                                       voice=(await profile_cache.get_async(user_id)).voice)
             
-            # Convert response to speech
-            audio_url = await self._text_to_speech(response_text)
-            
-            return {
-                "text": response_text,
-                "audio_url": audio_url,
-                "timestamp": datetime.now().isoformat(),
-                "confidence": response_data.get("confidence", 0.8)
-            }
+            return self.build_response(response_data, audio_url, transport)
             
         except Exception as e:
             print(f"❌ Voice processing error: {e}")
             return None
+        finally:
+            transport_metrics.record(transport)
 
-    async def _speech_to_text(self, audio_data: bytes) -> str:
-        """Convert speech to text using Whisper"""
-        try:
-            # Save audio to temporary file
-            temp_file = Path("static") / f"temp_{uuid.uuid4()}.wav"
-            temp_file.parent.mkdir(exist_ok=True)
-            temp_file.write_bytes(audio_data)
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                with open(temp_file, "rb") as f:
-                    files = {"file": ("audio.wav", f, "audio/wav")}
-                    response = await client.post(
-                        f"{self.settings.whisper_host}/transcribe",
-                        files=files
+    async def transcribe(self, audio_data: bytes, transport: Dict) -> Optional[str]:
+        """STT stage: pre-process, transcribe and check activation; None if not addressed to us"""
+        # Downmix, resample, trim and normalize in the process pool
+        audio_data, prep_stats = await audio_preprocessor.process(audio_data)
+        transport.update(prep_stats)
+        
+        # Convert audio to text (repeated audio is answered by the STT cache)
+        text, transport["stt_source"] = await self._speech_to_text(
+            audio_data, prep_stats["preprocessed"], prep_stats.get("input_seconds", 0.0)
+        )
+        if not text or len(text.strip()) < 2:
+            return None
+        
+        # Check for voice activation
+        if not self._is_voice_activated(text):
+            return None
+        
+        print(f"🎤 Heard: {text}")
+        return text
+
+    async def respond(self, text: str, user_id: Optional[str] = None) -> Dict:
+        """LLM stage"""
+        response_data = await jarvis_llm.process_message(text, user_id=user_id)
+        print(f"🤖 Response: {response_data['response']}")
+        return response_data
+
+    async def commit(self, text: str, draft: Dict, user_id: Optional[str] = None) -> Dict:
+        """LLM stage for a response drafted elsewhere (e.g. speculatively)"""
+        response_data = await asyncio.to_thread(jarvis_llm.commit_response, text, draft, user_id=user_id)
+        print(f"🤖 Response: {response_data['response']}")
+        return response_data
+
+    def build_response(self, response_data: Dict, audio_url: Optional[str], transport: Dict) -> Dict:
+        """Shape a finished turn for API and WebSocket clients"""
+        return {
+            "text": response_data["response"],
+            "audio_url": audio_url,
+            "timestamp": datetime.now().isoformat(),
+            "confidence": response_data.get("confidence", 0.8),
+            "transport": transport,
+            "trace_id": current_trace_id()
+        }
+
+    async def _speech_to_text(self, audio_data: bytes, preprocessed: bool = False,
+                              audio_seconds: float = 0.0) -> Tuple[str, str]:
+        """Convert speech to text using Whisper; returns (text, STT cache source)"""
+        async def whisper(audio: bytes) -> Optional[Dict]:
+            started = time.perf_counter()
+            with stage_timer("stt", "whisper", outcome="error") as timer:
+                try:
+                    # Send audio straight from memory; nothing is written to static/
+                    files = {"file": ("audio.wav", audio, "audio/wav")}
+                    response = await whisper_pool.request(
+                        "POST",
+                        "/transcribe",
+                        files=files,
+                        timeout=30.0
                     )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    text = result.get("text", "").strip()
-                    # Clean up temp file
-                    temp_file.unlink(missing_ok=True)
-                    return text
                     
-        except Exception as e:
-            print(f"STT Error: {e}")
-            
-        return ""
+                    if response.status_code == 200:
+                        result = response.json()
+                        text = result.get("text", "").strip()
+                        timer.outcome = "ok" if text else "empty"
+                        return {"text": text, "confidence": result.get("confidence")}
+                        
+                except Exception as e:
+                    print(f"STT Error: {e}")
+                finally:
+                    audio_preprocessor.record_whisper(
+                        preprocessed, audio_seconds, (time.perf_counter() - started) * 1000
+                    )
+            return None
+        
+        result, source = await stt_cache.transcribe(audio_data, whisper)
+        return (result["text"].strip() if result else ""), source
+
+    def _tts_backend(self) -> str:
+        """ElevenLabs when configured and not marked down by the health prober, else Piper"""
+        if self.settings.elevenlabs_api_key and health_prober.is_available("elevenlabs"):
+            return "elevenlabs"
+        return "piper"
 
-    async def _text_to_speech(self, text: str) -> str:
+    async def _text_to_speech(self, text: str, codec: str = "wav", transport: Optional[Dict] = None,
+                              voice: Optional[str] = None) -> str:
         """Convert text to speech using Piper or ElevenLabs"""
-        try:
-            if self.settings.elevenlabs_api_key:
-                return await self._elevenlabs_tts(text)
-            else:
-                return await self._piper_tts(text)
-                
-        except Exception as e:
-            print(f"TTS Error: {e}")
-            return ""
+        backend = self._tts_backend()
+        with stage_timer("tts", backend) as timer:
+            try:
+                if backend == "elevenlabs":
+                    audio_url = await self._elevenlabs_tts(text, transport)
+                else:
+                    audio_url = await self._piper_tts(text, codec, transport, voice)
+                timer.outcome = "ok" if audio_url else "error"
+                return audio_url
+                    
+            except Exception as e:
+                print(f"TTS Error: {e}")
+                timer.outcome = "error"
+                return ""
 
-    async def _elevenlabs_tts(self, text: str) -> str:
+    async def _elevenlabs_tts(self, text: str, transport: Optional[Dict] = None) -> str:
         """Use ElevenLabs for high-quality Jarvis voice"""
-        voice_id = "21m00Tcm4TlvDq8ikWAM"  # Jarvis-like voice
-        
         async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-                headers={
-                    "xi-api-key": self.settings.elevenlabs_api_key,
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "text": text,
-                    "voice_settings": {
-                        "stability": 0.75,
-                        "similarity_boost": 0.8,
-                        "style": 0.0,
-                        "use_speaker_boost": True
-                    }
-                }
-            )
+            response = await client.request(**elevenlabs_request(text))
             
             if response.status_code == 200:
+                # Already compressed (MP3); record it as sent
+                if transport is not None:
+                    transport.update({"response_codec": "mp3",
+                                      "synth_bytes": len(response.content),
+                                      "response_bytes": len(response.content)})
                 # Save audio file
-                filename = f"jarvis_{uuid.uuid4()}.mp3"
-                filepath = Path("static") / filename
-                filepath.parent.mkdir(exist_ok=True)
-                filepath.write_bytes(response.content)
-                return f"/static/{filename}"
+                extension = extension_for(response.headers.get("content-type"), default=".mp3")
+                return await audio_store.save_async(response.content, prefix="jarvis", extension=extension)
                 
         return ""
 
-    async def _piper_tts(self, text: str) -> str:
+    async def _piper_tts(self, text: str, codec: str = "wav", transport: Optional[Dict] = None,
+                         voice: Optional[str] = None) -> str:
         """Use Piper for local TTS"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.settings.piper_host}/synthesize",
-                    json={"text": text, "voice": self.settings.voice_id}
-                )
+            response = await piper_pool.request(**piper_request(text, voice), timeout=30.0)
+            
+            if response.status_code == 200:
+                audio = response.content
+                extension = extension_for(response.headers.get("content-type"), default=".wav")
+                
+                # Compress for the client when it advertised support
+                if codec != "wav":
+                    audio, _, extension, stats = await asyncio.to_thread(
+                        transcode_for_client, audio, codec
+                    )
+                else:
+                    stats = {"response_codec": "wav", "synth_bytes": len(audio),
+                             "response_bytes": len(audio)}
+                if transport is not None:
+                    transport.update(stats)
                 
-                if response.status_code == 200:
-                    # Save audio file
-                    filename = f"jarvis_{uuid.uuid4()}.wav"
-                    filepath = Path("static") / filename
-                    filepath.parent.mkdir(exist_ok=True)
-                    filepath.write_bytes(response.content)
-                    return f"/static/{filename}"
+                # Save audio file
+                return await audio_store.save_async(audio, prefix="jarvis", extension=extension)
                     
         except Exception as e:
             print(f"Piper TTS Error: {e}")
             
         return ""
 
+    async def stream_speech(self, text: str, voice: Optional[str] = None) -> Optional[Tuple[str, AsyncIterator[bytes]]]:
+        """Synthesize speech and relay upstream chunks as they arrive (nothing is stored)
+
+        The tts stage is timed until the upstream response starts (outcome "stream").
+        """
+        backend = self._tts_backend()
+        with stage_timer("tts", backend) as timer:
+            try:
+                if backend == "elevenlabs":
+                    opened = await open_upstream_audio(default_media_type="audio/mpeg",
+                                                       **elevenlabs_request(text))
+                else:
+                    opened = await open_upstream_audio(default_media_type="audio/wav", pool=piper_pool,
+                                                       **piper_request(text, voice))
+                timer.outcome = "stream" if opened else "error"
+                return opened
+            except Exception as e:
+                print(f"TTS Stream Error: {e}")
+                timer.outcome = "error"
+                return None
+
     def _is_voice_activated(self, text: str) -> bool:
         """Check if text contains voice activation phrases"""
         activation_phrases = [
@@ -164,26 +421,34 @@ class VoiceProcessor:
 
     async def start_listening(self):
         """Start continuous listening mode"""
-        self.is_listening = True
+        await state.set_async("voice:listening", True)
         print("🎤 Voice listening activated - say 'Hey SMASH' to interact")
         
     async def stop_listening(self):
         """Stop listening mode"""
-        self.is_listening = False
+        await state.set_async("voice:listening", False)
         print("🔇 Voice listening deactivated")
 
-    async def speak_response(self, text: str) -> str:
-        """Direct speech synthesis"""
-        return await self._text_to_speech(text)
+    async def speak_response(self, text: str, codec: str = "wav", transport: Optional[Dict] = None,
+                             voice: Optional[str] = None) -> str:
+        """Direct speech synthesis (Piper voice defaults to VOICE_ID)"""
+        return await self._text_to_speech(text, codec, transport, voice)
 
     async def cleanup(self):
         """Cleanup voice processor resources"""
-        self.is_listening = False
+        # Listening mode is shared state; other workers keep serving it
         self.is_speaking = False
         
+        # Cancel in-flight turns before their session tasks
+        for owner in {turn.owner for turn in self.turns.values()}:
+            self.cancel_turns(owner, "shutdown")
+        
         # Cancel any running tasks
-        for task in self.processor_tasks:
+        for task in list(self.processor_tasks):
             if not task.done():
                 task.cancel()
+        if self.processor_tasks:
+            await asyncio.gather(*self.processor_tasks, return_exceptions=True)
+        self.processor_tasks.clear()
         
         print("🧹 Voice processor cleaned up")
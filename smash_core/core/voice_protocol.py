@@ -0,0 +1,110 @@
+"""
+Binary framing for the /ws/voice WebSocket (subprotocol smash.voice.v1)
+Typed msgpack envelopes with raw audio payloads, several turns per connection
+"""
+
+# Wire format shared by core.voice_session and scripts/voice_ws_client.py
+# msgpack is imported on first use; without it only the JSON protocol is offered
+from typing import Any, Dict, NamedTuple, Optional
+
+SUBPROTOCOL = "smash.voice.v1"
+VERSION = 1
+
+# Frame types (c = client -> server, s = server -> client)
+HELLO = "hello"            # c: input format / options; s: version, session and limits
+AUDIO_IN = "audio_in"      # c: a chunk of one utterance; meta {end}; payload audio bytes
+TRANSCRIPT = "transcript"  # c: {text, final} interim (speculation) or final (skips STT); s: {text, final}
+CONTROL = "control"        # c: {op: stop|cancel|stats}; s: {op: turn_started|turn_cancelled|overflow|stopped|stats}
+TEXT_DELTA = "text_delta"  # s: {text} next piece of the reply as the LLM produces it
+RESPONSE = "response"      # s: the full reply {text, audio_url, timestamp, ...}
+AUDIO_OUT = "audio_out"    # s: {content_type} start, payload chunks, then {end, bytes} (or {error})
+METRICS = "metrics"        # s: per-turn stage timings once the turn ends
+PING = "ping"              # c/s: {ts}
+PONG = "pong"              # c/s: {ts}
+ERROR = "error"            # s: {code, message}; the connection stays open
+
+CLIENT_FRAMES = (HELLO, AUDIO_IN, TRANSCRIPT, CONTROL, PING, PONG)
+SERVER_FRAMES = (HELLO, TRANSCRIPT, CONTROL, TEXT_DELTA, RESPONSE, AUDIO_OUT, METRICS, PING, PONG, ERROR)
+
+# AUDIO_IN formats: raw 16-bit little-endian PCM (rate/channels from HELLO) or a container
+AUDIO_FORMATS = ("pcm_s16le", "wav", "ogg_opus", "flac")
+
+# Session events carried as CONTROL frames, by their JSON-protocol "type"
+CONTROL_EVENTS = ("turn_started", "turn_cancelled", "overflow", "stopped", "stats")
+
+
+class ProtocolError(ValueError):
+    """A frame that is not a valid smash.voice.v1 envelope"""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class Frame(NamedTuple):
+    """[type, turn_id, meta, payload] on the wire"""
+    type: str
+    turn: Optional[str] = None
+    meta: Dict[str, Any] = {}
+    payload: Optional[bytes] = None
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise RuntimeError("msgpack is required for smash.voice.v1: pip install msgpack") from None
+    return msgpack
+
+
+def available() -> bool:
+    """Whether the binary protocol can be offered"""
+    try:
+        _msgpack()
+        return True
+    except RuntimeError:
+        return False
+
+
+def encode_frame(kind: str, turn: Optional[str] = None, meta: Optional[Dict] = None,
+                 payload: Optional[bytes] = None) -> bytes:
+    return _msgpack().packb([kind, turn, meta or {}, payload], use_bin_type=True)
+
+
+def decode_frame(data: bytes) -> Frame:
+    """Parse one binary message; raises ProtocolError"""
+    try:
+        envelope = _msgpack().unpackb(data, raw=False)
+    except ValueError as e:
+        raise ProtocolError("malformed", f"Not a msgpack envelope: {e}") from None
+    if not isinstance(envelope, (list, tuple)) or len(envelope) != 4:
+        raise ProtocolError("malformed", "Envelope must be [type, turn, meta, payload]")
+    kind, turn, meta, payload = envelope
+    if not isinstance(kind, str):
+        raise ProtocolError("malformed", "Frame type must be a string")
+    if turn is not None and not isinstance(turn, (str, int)):
+        raise ProtocolError("malformed", "Turn id must be a string, integer or nil")
+    if meta is None:
+        meta = {}
+    if not isinstance(meta, dict):
+        raise ProtocolError("malformed", "Meta must be a map")
+    if payload is not None and not isinstance(payload, (bytes, bytearray)):
+        raise ProtocolError("malformed", "Payload must be binary or nil")
+    return Frame(kind, None if turn is None else str(turn), meta, payload)
+
+
+def encode_event(message: Dict) -> bytes:
+    """Translate a session event (the JSON protocol's dict) into a v1 frame"""
+    meta = {key: value for key, value in message.items() if key not in ("type", "turn_id")}
+    kind, turn = message["type"], message.get("turn_id")
+    if kind == "transcript":
+        meta.setdefault("final", True)
+    elif kind == "audio_start":
+        kind, meta = AUDIO_OUT, {"start": True, **meta}
+    elif kind == "audio_end":
+        kind, meta = AUDIO_OUT, {"end": True, **meta}
+    elif kind == "audio_error":
+        kind, meta = AUDIO_OUT, {"end": True, "error": meta.get("message")}
+    elif kind in CONTROL_EVENTS:
+        kind, meta = CONTROL, {"op": kind, **meta}
+    return encode_frame(kind, turn, meta)
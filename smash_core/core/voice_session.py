@@ -0,0 +1,536 @@
+"""
+Per-connection voice pipeline for the /ws/voice WebSocket
+Receiver -> STT -> LLM -> TTS -> sender, connected by bounded queues
+"""
+
+# Pipelined voice session with backpressure, heartbeats and clean teardown
+import asyncio
+import json
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from .audio_codec import negotiate_output_codec, pcm_to_wav, transport_metrics
+from .llm import text_delta_sink
+from .metrics import record_stage, trace_id_var
+from .voice_processor import VoiceProcessor, VoiceTurn, TurnCancelled
+from .profiles import profile_cache
+from .speculation import Speculator
+from . import voice_protocol as protocol
+
+# What the receiver does when the inbound audio queue is full
+OVERFLOW_POLICIES = ("drop_oldest", "reject", "block")
+
+
+class VoiceSession:
+    """One WebSocket's voice pipeline
+
+    Each stage is a task reading from the previous stage's bounded queue, so STT
+    for the next utterance overlaps LLM/TTS for the current one. When a stage
+    falls behind, its input queue fills and the stage before it waits
+    (backpressure); the receiver applies the overflow policy instead of letting
+    audio pile up in the socket buffer.
+
+    Besides binary audio, clients may send JSON text frames:
+    {"type": "ping"}, {"type": "partial", "text": ...} (interim transcript, used
+    for speculative drafting), {"type": "final", "text": ...} (skip STT) and
+    {"type": "stop"} (cancel in-flight turns).
+
+    Every utterance is a VoiceTurn whose turn_id and trace_id are carried on its
+    frames; the trace id also tags the turn's metrics and structured logs. With
+    barge-in enabled, new speech (audio or a partial transcript) cancels the
+    earlier turns still in flight, and a disconnect cancels all of them.
+
+    With the smash.voice.v1 subprotocol every message is a binary envelope
+    (see core.voice_protocol): audio arrives in chunks tagged with a client
+    turn key, the reply is streamed as text_delta frames, speech comes back
+    as audio_out frames and each turn ends with a metrics frame.
+    """
+
+    def __init__(self, websocket: WebSocket, processor: VoiceProcessor,
+                 inline_audio: bool = False, output_codec: str = "wav",
+                 inbound_size: int = 8, stage_size: int = 4,
+                 overflow_policy: str = "drop_oldest",
+                 heartbeat_interval: float = 15.0, idle_timeout: float = 60.0,
+                 speculator: Speculator = None, barge_in: bool = True,
+                 user_id: Optional[str] = None, wire_protocol: Optional[str] = None,
+                 max_audio_bytes: int = 10 * 1024 * 1024, sample_rate: int = 16000,
+                 compression: Optional[str] = None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self.websocket = websocket
+        self.processor = processor
+        self.inline_audio = inline_audio
+        self.output_codec = output_codec
+        self.overflow_policy = overflow_policy
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.speculator = speculator
+        self.barge_in = barge_in
+        self.user_id = user_id
+        self.session_id = f"ws-{id(self):x}"
+        # None = JSON text frames + raw binary audio; else protocol.SUBPROTOCOL
+        self.wire_protocol = wire_protocol
+        self.binary = wire_protocol == protocol.SUBPROTOCOL
+        self.max_audio_bytes = max_audio_bytes
+        self.compression = compression
+        self.audio_format = "pcm_s16le"
+        self.audio_rate = sample_rate
+        self.audio_channels = 1
+        # Client turn key -> (turn, audio received so far) for utterances still arriving
+        self._assembling: Dict[str, Tuple[VoiceTurn, bytearray]] = {}
+
+        self.inbound: asyncio.Queue = asyncio.Queue(maxsize=inbound_size)
+        self.transcripts: asyncio.Queue = asyncio.Queue(maxsize=stage_size)
+        self.responses: asyncio.Queue = asyncio.Queue(maxsize=stage_size)
+        self.outbound: asyncio.Queue = asyncio.Queue(maxsize=stage_size * 4)
+
+        self.tasks = []
+        self.last_seen = time.monotonic()
+        # Only clients known to answer pings are held to the idle timeout;
+        # legacy JSON clients never did, and may sit silent between utterances
+        self.answers_pings = self.binary
+        self.stats = {"frames_in": 0, "dropped": 0, "rejected": 0, "turns": 0,
+                      "cancelled": 0, "errors": 0, "protocol_errors": 0}
+
+    async def run(self):
+        """Run the pipeline until the client disconnects or goes idle"""
+        stages = {
+            "receiver": self._receiver(),
+            "stt": self._stt_worker(),
+            "llm": self._llm_worker(),
+            "tts": self._tts_worker(),
+            "sender": self._sender(),
+            "heartbeat": self._heartbeat(),
+        }
+        for name, coro in stages.items():
+            task = asyncio.create_task(coro, name=f"voice-session-{name}")
+            self.tasks.append(task)
+            self.processor.processor_tasks.add(task)
+        if self.binary:
+            await self.outbound.put(self._hello())
+
+        try:
+            # The session ends as soon as the receiver, sender or heartbeat stops
+            done, _ = await asyncio.wait(
+                [self.tasks[0], self.tasks[4], self.tasks[5]],
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if not task.cancelled() and task.exception() and \
+                        not isinstance(task.exception(), WebSocketDisconnect):
+                    print(f"❌ Voice session error: {task.exception()}")
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Cancel every stage and release the tasks"""
+        if self.speculator:
+            self.speculator.cancel()
+        self._cancel_turns("disconnect")
+        self._assembling.clear()
+        for task in self.tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for task in self.tasks:
+            self.processor.processor_tasks.discard(task)
+        self.tasks.clear()
+        print(f"🔌 Voice session closed: {self.get_stats()}")
+
+    async def _receiver(self):
+        """Read frames from the socket; audio goes to the inbound queue"""
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            self.last_seen = time.monotonic()
+
+            if message.get("text") is not None:
+                await self._handle_control(message["text"])
+                continue
+
+            data = message.get("bytes")
+            if not data:
+                continue
+            self.stats["frames_in"] += 1
+            if self.binary:
+                await self._handle_frame(data)
+                continue
+            turn = self._begin_turn()
+            await self._enqueue_audio(turn, data)
+
+    def _begin_turn(self) -> VoiceTurn:
+        """Start a turn for new speech, barging in on earlier ones if enabled"""
+        turn = self.processor.begin_turn(self.session_id)
+        if self.barge_in:
+            self._cancel_turns("barge_in", keep=turn)
+        return turn
+
+    def _cancel_turns(self, reason: str, keep: VoiceTurn = None, turn_id: Optional[str] = None):
+        cancelled = self.processor.cancel_turns(self.session_id, reason, keep=keep, turn_id=turn_id)
+        self.stats["cancelled"] += len(cancelled)
+        for cancelled_id in cancelled:
+            self._send_nowait({"type": "turn_cancelled", "turn_id": cancelled_id, "reason": reason})
+        if cancelled and self._assembling:
+            # Audio still arriving for a cancelled turn is discarded
+            self._assembling = {key: entry for key, entry in self._assembling.items()
+                                if not entry[0].cancelled}
+        return cancelled
+
+    async def _enqueue_audio(self, turn: VoiceTurn, data: bytes):
+        """Apply the overflow policy when the inbound queue is full"""
+        if self.overflow_policy == "block" or not self.inbound.full():
+            await self.inbound.put((turn, data))
+            return
+
+        if self.overflow_policy == "drop_oldest":
+            try:
+                dropped, _ = self.inbound.get_nowait()
+                self.inbound.task_done()
+                self.processor.end_turn(dropped, "dropped")
+            except asyncio.QueueEmpty:
+                pass
+            self.stats["dropped"] += 1
+            self.inbound.put_nowait((turn, data))
+            self._send_nowait({"type": "overflow", "policy": "drop_oldest",
+                               "dropped": self.stats["dropped"]})
+        else:
+            self.processor.end_turn(turn, "rejected")
+            self.stats["rejected"] += 1
+            self._send_nowait({"type": "overflow", "policy": "reject",
+                               "rejected": self.stats["rejected"]})
+
+    async def _handle_control(self, text: str):
+        """Text frames carry JSON control messages (ping, partial, final)"""
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = {"type": text.strip()}
+        await self._handle_message(message)
+
+    async def _handle_message(self, message: Dict):
+        kind = message.get("type")
+        if kind == "ping":
+            await self.outbound.put({"type": "pong", "ts": message.get("ts")})
+        elif kind == "pong":
+            self.answers_pings = True
+        elif kind == "partial":
+            # The user is speaking again
+            if self.barge_in and self._cancel_turns("barge_in") and self.speculator:
+                self.speculator.cancel()  # starting over: drop the stale draft
+            if self.speculator:
+                self.speculator.on_partial(message.get("text", ""))
+        elif kind == "final":
+            transcript = message.get("text", "").strip()
+            if len(transcript) >= 2 and self.processor._is_voice_activated(transcript):
+                turn = self._begin_turn()
+                await self.outbound.put({"type": "transcript", "text": transcript,
+                                         "turn_id": turn.turn_id, "trace_id": turn.trace_id})
+                await self.transcripts.put((turn, transcript, {}))
+        elif kind == "stop":
+            cancelled = self._cancel_turns("stop")
+            if self.speculator:
+                self.speculator.cancel()
+            await self.outbound.put({"type": "stopped", "turn_ids": cancelled})
+
+    def _hello(self) -> Dict:
+        return {
+            "type": "hello",
+            "protocol": protocol.SUBPROTOCOL,
+            "version": protocol.VERSION,
+            "session_id": self.session_id,
+            "frames": list(protocol.SERVER_FRAMES),
+            "audio_formats": list(protocol.AUDIO_FORMATS),
+            "audio_format": self.audio_format,
+            "sample_rate": self.audio_rate,
+            "channels": self.audio_channels,
+            "audio": "inline" if self.inline_audio else "url",
+            "output_codec": self.output_codec,
+            "barge_in": self.barge_in,
+            "max_audio_bytes": self.max_audio_bytes,
+            "heartbeat_interval": self.heartbeat_interval,
+            "compression": self.compression,
+        }
+
+    def _protocol_error(self, code: str, message: str, turn_id: Optional[str] = None):
+        """Report a bad frame; the connection stays open"""
+        self.stats["protocol_errors"] += 1
+        self._send_nowait({"type": "error", "turn_id": turn_id, "code": code, "message": message})
+
+    async def _handle_frame(self, data: bytes):
+        """Dispatch one smash.voice.v1 envelope"""
+        try:
+            frame = protocol.decode_frame(data)
+        except protocol.ProtocolError as e:
+            self._protocol_error(e.code, str(e))
+            return
+
+        if frame.type == protocol.AUDIO_IN:
+            await self._audio_frame(frame)
+        elif frame.type == protocol.TRANSCRIPT:
+            await self._handle_message({"type": "final" if frame.meta.get("final") else "partial",
+                                        "text": str(frame.meta.get("text", ""))})
+        elif frame.type == protocol.CONTROL:
+            op = frame.meta.get("op")
+            if op == "stop":
+                await self._handle_message({"type": "stop"})
+            elif op == "cancel":
+                self._cancel_turns("client", turn_id=frame.turn)
+            elif op == "stats":
+                await self.outbound.put({"type": "stats", **self.get_stats()})
+            else:
+                self._protocol_error("unknown_op", f"Unknown control op {op!r}", frame.turn)
+        elif frame.type == protocol.PING:
+            await self.outbound.put({"type": "pong", "ts": frame.meta.get("ts")})
+        elif frame.type == protocol.PONG:
+            self.answers_pings = True
+        elif frame.type == protocol.HELLO:
+            self._configure(frame.meta)
+        else:
+            self._protocol_error("unknown_frame", f"Unknown frame type {frame.type!r}", frame.turn)
+
+    def _configure(self, options: Dict):
+        """Apply a client hello (input format, output mode, barge-in) and echo the result"""
+        audio_format = options.get("audio_format", self.audio_format)
+        if audio_format not in protocol.AUDIO_FORMATS:
+            self._protocol_error("bad_option", f"audio_format must be one of {', '.join(protocol.AUDIO_FORMATS)}")
+            return
+        try:
+            rate = int(options.get("sample_rate", self.audio_rate))
+            channels = int(options.get("channels", self.audio_channels))
+        except (TypeError, ValueError):
+            rate = channels = 0
+        if not 8000 <= rate <= 48000 or channels not in (1, 2):
+            self._protocol_error("bad_option", "sample_rate must be 8000-48000 and channels 1 or 2")
+            return
+        self.audio_format, self.audio_rate, self.audio_channels = audio_format, rate, channels
+        if "audio" in options:
+            self.inline_audio = options["audio"] == "inline"
+        if options.get("accept_audio"):
+            self.output_codec = negotiate_output_codec(str(options["accept_audio"]))
+        if "barge_in" in options:
+            self.barge_in = bool(options["barge_in"])
+        self._send_nowait(self._hello())
+
+    async def _audio_frame(self, frame: protocol.Frame):
+        """Collect an utterance's chunks; it enters the pipeline once {end: true} arrives"""
+        key = frame.turn
+        if key is None:
+            self._protocol_error("missing_turn", "audio_in frames need a turn key")
+            return
+        entry = self._assembling.get(key)
+        if entry is None:
+            if len(self._assembling) >= self.inbound.maxsize:
+                self._protocol_error("too_many_turns", "Too many utterances in progress", key)
+                return
+            # The turn starts with its first chunk, so barge-in is as early as with JSON clients
+            turn = self._begin_turn()
+            entry = self._assembling[key] = (turn, bytearray())
+            self._send_nowait({"type": "turn_started", "turn_id": turn.turn_id,
+                               "client_turn": key, "trace_id": turn.trace_id})
+        turn, buffer = entry
+        if turn.cancelled:
+            self._assembling.pop(key, None)
+            return
+        if frame.payload:
+            buffer += frame.payload
+        if len(buffer) > self.max_audio_bytes:
+            del self._assembling[key]
+            self.processor.end_turn(turn, "rejected")
+            self._protocol_error("too_large", f"Utterance exceeds {self.max_audio_bytes} bytes", turn.turn_id)
+            return
+        if not frame.meta.get("end"):
+            return
+
+        del self._assembling[key]
+        data = bytes(buffer)
+        if self.audio_format == "pcm_s16le":
+            data = pcm_to_wav(data, self.audio_rate, self.audio_channels)
+        await self._enqueue_audio(turn, data)
+
+    def _finish_turn(self, turn: VoiceTurn, outcome: str, transport: Dict):
+        """Record a turn's end; v1 clients also get its stage timings"""
+        self.processor.end_turn(turn, outcome)
+        transport_metrics.record(transport)
+        if self.binary:
+            self._send_nowait({
+                "type": "metrics",
+                "turn_id": turn.turn_id,
+                "trace_id": turn.trace_id,
+                "outcome": "cancelled" if turn.cancelled else outcome,
+                "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in turn.timings.items()},
+                "total_ms": round((time.perf_counter() - turn.created) * 1000, 1),
+                "transport": transport,
+            })
+
+    async def _stt_worker(self):
+        while True:
+            turn, data = await self.inbound.get()
+            trace_id_var.set(turn.trace_id)
+            # Time from frame arrival until STT picks it up
+            record_stage("receive", time.perf_counter() - turn.created, "ws")
+            transport = {"upload_bytes": len(data)}
+            text = None
+            outcome = "ignored"
+            try:
+                text = await turn.run("stt", self.processor.transcribe(data, transport))
+            except TurnCancelled:
+                pass
+            except Exception as e:
+                print(f"❌ STT stage error: {e}")
+                self.stats["errors"] += 1
+                outcome = "error"
+            finally:
+                self.inbound.task_done()
+
+            if text and not turn.cancelled:
+                await self.outbound.put({"type": "transcript", "text": text,
+                                         "turn_id": turn.turn_id, "trace_id": turn.trace_id})
+                await self.transcripts.put((turn, text, transport))
+            else:
+                self._finish_turn(turn, outcome, transport)
+
+    async def _llm_worker(self):
+        while True:
+            turn, text, transport = await self.transcripts.get()
+            trace_id_var.set(turn.trace_id)
+            deltas = []
+            if self.binary:
+                # Forward the reply as the LLM generates it (Ollama streams tokens)
+                def send_delta(delta: str, turn_id: str = turn.turn_id):
+                    deltas.append(delta)
+                    self._send_nowait({"type": "text_delta", "turn_id": turn_id, "text": delta})
+                delta_token = text_delta_sink.set(send_delta)
+            try:
+                if self.speculator:
+                    draft = await turn.run("llm", self.speculator.resolve(text))
+                    if "speculation" in draft:
+                        transport["speculation"] = draft.pop("speculation")
+                    # Nothing is written to history/DB until the draft survives
+                    response_data = await self.processor.commit(text, draft, self.user_id)
+                else:
+                    response_data = await turn.run("llm", self.processor.respond(text, self.user_id))
+            except Exception as e:
+                if not isinstance(e, TurnCancelled):
+                    print(f"❌ LLM stage error: {e}")
+                    self.stats["errors"] += 1
+                self._finish_turn(turn, "error", transport)
+                continue
+            finally:
+                if self.binary:
+                    text_delta_sink.reset(delta_token)
+            if self.binary and not deltas:
+                # Learned, canned or speculative replies arrive whole
+                await self.outbound.put({"type": "text_delta", "turn_id": turn.turn_id,
+                                         "text": response_data["response"]})
+            await self.responses.put((turn, response_data, transport))
+
+    async def _tts_worker(self):
+        while True:
+            turn, response_data, transport = await self.responses.get()
+            trace_id_var.set(turn.trace_id)
+            outcome = "ok"
+            try:
+                audio_url = None
+                if not self.inline_audio:
+                    audio_url = await turn.run("tts", self.processor.speak_response(
+                        response_data["response"], self.output_codec, transport,
+                        voice=(await profile_cache.get_async(self.user_id)).voice
+                    ))
+                response = self.processor.build_response(response_data, audio_url, transport)
+                frame = {
+                    "type": "response",
+                    "turn_id": turn.turn_id,
+                    "trace_id": turn.trace_id,
+                    "text": response["text"],
+                    "audio_url": response.get("audio_url"),
+                    "timestamp": response["timestamp"]
+                }
+                if "speculation" in transport:
+                    frame["speculation"] = transport["speculation"]
+                await self.outbound.put(frame)
+                if self.inline_audio:
+                    await turn.run("tts", self._relay_inline_audio(turn, response["text"]))
+                self.stats["turns"] += 1
+            except TurnCancelled:
+                pass
+            except Exception as e:
+                print(f"❌ TTS stage error: {e}")
+                self.stats["errors"] += 1
+                outcome = "error"
+            finally:
+                self._finish_turn(turn, outcome, transport)
+
+    async def _relay_inline_audio(self, turn: VoiceTurn, text: str):
+        """Queue synthesized speech as binary frames bracketed by JSON markers"""
+        voice = (await profile_cache.get_async(self.user_id)).voice
+        opened = await self.processor.stream_speech(text, voice=voice)
+        if not opened:
+            await self.outbound.put({"type": "audio_error", "turn_id": turn.turn_id,
+                                     "message": "Could not generate speech"})
+            return
+
+        media_type, chunks = opened
+        await self.outbound.put({"type": "audio_start", "turn_id": turn.turn_id,
+                                 "content_type": media_type})
+        sent = 0
+        try:
+            async for chunk in chunks:
+                await self.outbound.put((turn.turn_id, chunk))
+                sent += len(chunk)
+        finally:
+            # Closes the upstream stream when the turn is cancelled mid-relay
+            await chunks.aclose()
+        await self.outbound.put({"type": "audio_end", "turn_id": turn.turn_id, "bytes": sent})
+
+    async def _sender(self):
+        """Single writer to the socket; the outbound queue bounds memory
+
+        Items are event dicts or (turn_id, audio chunk) tuples.
+        """
+        while True:
+            item = await self.outbound.get()
+            if self.binary:
+                if isinstance(item, tuple):
+                    await self.websocket.send_bytes(protocol.encode_frame(protocol.AUDIO_OUT, item[0], None, item[1]))
+                else:
+                    await self.websocket.send_bytes(protocol.encode_event(item))
+            elif isinstance(item, tuple):
+                await self.websocket.send_bytes(item[1])
+            else:
+                await self.websocket.send_json(item)
+
+    def _send_nowait(self, message: Dict):
+        """Best-effort control frame; dropped if the sender is saturated"""
+        try:
+            self.outbound.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+    async def _heartbeat(self):
+        """Ping idle clients and end the session when they stop answering
+
+        The idle timeout applies once a client has shown it answers pings
+        (smash.voice.v1, or a JSON "pong"); other connections are left to the
+        server's WebSocket protocol-level ping for liveness.
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            idle = time.monotonic() - self.last_seen
+            if self.answers_pings and idle > self.idle_timeout:
+                print("⏱️  Voice session idle timeout")
+                await self.websocket.close(code=1001)
+                return
+            self._send_nowait({"type": "ping", "ts": time.time()})
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "inbound_depth": self.inbound.qsize(),
+            "transcript_depth": self.transcripts.qsize(),
+            "response_depth": self.responses.qsize(),
+            "outbound_depth": self.outbound.qsize(),
+        }
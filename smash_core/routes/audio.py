@@ -4,103 +4,165 @@ Audio processing routes for STT/TTS operations
 
 # Audio transcription and synthesis endpoints
 from fastapi import APIRouter, File, UploadFile, HTTPException
-from typing import Dict
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Optional
 import httpx
-import uuid
-from pathlib import Path
+import time
 
 from core.config import get_settings
+from core.audio_store import audio_store
+from core.audio_http import elevenlabs_request, extension_for, open_upstream_audio, piper_request
+from core.audio_preprocess import audio_preprocessor
+from core.stt_cache import stt_cache
+from core.metrics import stage_timer, current_trace_id
+from core.batch import NDJSON_MEDIA_TYPE, batch_concurrency, ndjson, run_bounded
+from core.upstreams import piper_pool, whisper_pool
 
 router = APIRouter()
 settings = get_settings()
 
+async def _transcribe_bytes(content: bytes, filename: str, content_type: str) -> Dict:
+    """Pre-process one upload and send it to Whisper over the pooled client
+
+    Audio already transcribed (same pre-processed PCM) is answered from the STT cache.
+    """
+    # Pre-process (decode, downmix, resample, trim, normalize) for Whisper
+    whisper_audio, decode_stats = await audio_preprocessor.process(content)
+    if decode_stats["preprocessed"]:
+        filename, content_type = "audio.wav", "audio/wav"
+    
+    async def whisper(audio: bytes) -> Dict:
+        # Send to Whisper service straight from memory
+        with stage_timer("stt", "whisper") as timer:
+            files = {"file": (filename, audio, content_type)}
+            response = await whisper_pool.request(
+                "POST",
+                "/transcribe",
+                files=files,
+                timeout=30.0
+            )
+            timer.outcome = "ok" if response.status_code == 200 else "error"
+        
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail="Transcription failed")
+        result = response.json()
+        return {"text": result.get("text", ""), "confidence": result.get("confidence", 0.8)}
+    
+    result, decode_stats["stt_source"] = await stt_cache.transcribe(whisper_audio, whisper)
+    return {
+        "text": result["text"],
+        "confidence": result["confidence"],
+        "transport": decode_stats
+    }
+
 @router.post("/transcribe")
 async def transcribe_audio(audio_file: UploadFile = File(...)):
     """Convert speech to text using Whisper"""
     try:
-        # Save uploaded file temporarily
-        temp_filename = f"temp_{uuid.uuid4()}.wav"
-        temp_path = Path("static") / temp_filename
-        temp_path.parent.mkdir(exist_ok=True)
-        
-        content = await audio_file.read()
-        temp_path.write_bytes(content)
-        
-        # Send to Whisper service
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            with open(temp_path, "rb") as f:
-                files = {"file": (audio_file.filename, f, audio_file.content_type)}
-                response = await client.post(
-                    f"{settings.whisper_host}/transcribe",
-                    files=files
-                )
-        
-        # Clean up temp file
-        temp_path.unlink(missing_ok=True)
-        
-        if response.status_code == 200:
-            result = response.json()
-            return {
-                "success": True,
-                "text": result.get("text", ""),
-                "confidence": result.get("confidence", 0.8)
-            }
-        else:
-            raise HTTPException(status_code=500, detail="Transcription failed")
+        with stage_timer("receive", "http"):
+            content = await audio_file.read()
+        result = await _transcribe_bytes(content, audio_file.filename, audio_file.content_type)
+        return {"success": True, **result, "trace_id": current_trace_id()}
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Transcription error: {str(e)}")
 
+@router.post("/transcribe/batch")
+async def transcribe_batch(audio_files: List[UploadFile] = File(...), concurrency: Optional[int] = None):
+    """Transcribe several uploads, streaming NDJSON results as each completes
+
+    Files are sent to Whisper `concurrency` at a time (default
+    BATCH_CONCURRENCY); every line carries the file's index and name.
+    """
+    concurrency = batch_concurrency(concurrency, len(audio_files))
+    trace_id = current_trace_id()
+    # Read every upload now: the form's temp files are closed once this returns
+    uploads = []
+    with stage_timer("receive", "http"):
+        for audio_file in audio_files:
+            uploads.append((audio_file.filename, audio_file.content_type, await audio_file.read()))
+    
+    async def transcribe(upload):
+        filename, content_type, content = upload
+        started = time.perf_counter()
+        result = await _transcribe_bytes(content, filename, content_type)
+        return result, time.perf_counter() - started
+    
+    async def results():
+        started = time.perf_counter()
+        succeeded = 0
+        async for index, outcome, error in run_bounded(uploads, transcribe, concurrency):
+            line = {"type": "result", "index": index, "filename": uploads[index][0]}
+            if error is not None:
+                detail = error.detail if isinstance(error, HTTPException) else str(error)
+                line.update(ok=False, error=f"Transcription error: {detail}")
+            else:
+                result, elapsed = outcome
+                succeeded += 1
+                line.update(ok=True, **result, elapsed_ms=round(elapsed * 1000, 1))
+            yield ndjson(line)
+        yield ndjson({"type": "summary", "items": len(uploads), "ok": succeeded,
+                      "failed": len(uploads) - succeeded, "concurrency": concurrency,
+                      "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                      "trace_id": trace_id})
+    
+    return StreamingResponse(results(), media_type=NDJSON_MEDIA_TYPE,
+                             headers={"Cache-Control": "no-store"})
+
+async def _stream_synthesis(text: str, voice_id: str = None) -> StreamingResponse:
+    """Relay synthesized audio straight from the upstream as it arrives"""
+    opened = None
+    if settings.elevenlabs_api_key and voice_id:
+        opened = await open_upstream_audio(default_media_type="audio/mpeg",
+                                           **elevenlabs_request(text, voice_id))
+    if not opened:
+        opened = await open_upstream_audio(default_media_type="audio/wav", pool=piper_pool,
+                                           **piper_request(text))
+    if not opened:
+        raise HTTPException(status_code=500, detail="Speech synthesis failed")
+    
+    media_type, chunks = opened
+    return StreamingResponse(chunks, media_type=media_type, headers={"Cache-Control": "no-store"})
+
 @router.post("/synthesize")
-async def synthesize_speech(text: str, voice_id: str = None):
-    """Convert text to speech"""
+async def synthesize_speech(text: str, voice_id: str = None, stream: bool = False):
+    """Convert text to speech
+
+    With stream=true the audio bytes are returned inline instead of an audio_url.
+    """
     try:
+        if stream:
+            return await _stream_synthesis(text, voice_id)
+        
         if settings.elevenlabs_api_key and voice_id:
             # Use ElevenLabs
             async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-                    headers={
-                        "xi-api-key": settings.elevenlabs_api_key,
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "text": text,
-                        "voice_settings": {
-                            "stability": 0.75,
-                            "similarity_boost": 0.8
-                        }
-                    }
-                )
+                response = await client.request(**elevenlabs_request(text, voice_id))
                 
                 if response.status_code == 200:
-                    filename = f"tts_{uuid.uuid4()}.mp3"
-                    filepath = Path("static") / filename
-                    filepath.write_bytes(response.content)
+                    extension = extension_for(response.headers.get("content-type"), default=".mp3")
+                    audio_url = await audio_store.save_async(response.content, prefix="tts", extension=extension)
                     return {
                         "success": True,
-                        "audio_url": f"/static/{filename}",
+                        "audio_url": audio_url,
                         "text": text
                     }
         
         # Fallback to Piper
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{settings.piper_host}/synthesize",
-                json={"text": text, "voice": settings.voice_id}
-            )
-            
-            if response.status_code == 200:
-                filename = f"tts_{uuid.uuid4()}.wav"
-                filepath = Path("static") / filename
-                filepath.write_bytes(response.content)
-                return {
-                    "success": True,
-                    "audio_url": f"/static/{filename}",
-                    "text": text
-                }
+        response = await piper_pool.request(**piper_request(text), timeout=30.0)
+        
+        if response.status_code == 200:
+            extension = extension_for(response.headers.get("content-type"), default=".wav")
+            audio_url = await audio_store.save_async(response.content, prefix="tts", extension=extension)
+            return {
+                "success": True,
+                "audio_url": audio_url,
+                "text": text
+            }
         
         raise HTTPException(status_code=500, detail="Speech synthesis failed")
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Speech synthesis error: {str(e)}")
@@ -3,20 +3,31 @@ Chat API routes for SMASH Cloud Voice AI
 """
 
 # Chat endpoint handlers
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List
+from datetime import datetime
+import asyncio
 import json
+import time
 
 from core.llm import jarvis_llm
 from core.database import db_manager
+from core.metrics import current_trace_id, record_turn
+from core.batch import NDJSON_MEDIA_TYPE, batch_concurrency, ndjson, run_bounded
+from core.export import FORMATS, MEDIA_TYPES, export_filename, export_rows, import_rows
 
 router = APIRouter()
 
 class ChatMessage(BaseModel):
     message: str
     context: Optional[Dict] = None
-    user_id: str = "sudhamsh"
+    user_id: Optional[str] = None  # DEFAULT_USER_ID when omitted
+
+class ChatBatch(BaseModel):
+    items: List[ChatMessage]
+    concurrency: Optional[int] = None
 
 class ChatResponse(BaseModel):
     response: str
@@ -24,27 +35,89 @@ class ChatResponse(BaseModel):
     source: str
     timestamp: str
     conversation_id: Optional[int] = None
+    trace_id: Optional[str] = None
 
 @router.post("/", response_model=ChatResponse)
 async def chat(message: ChatMessage):
     """Handle chat messages and return Jarvis-style responses"""
+    started = time.perf_counter()
     try:
         result = await jarvis_llm.process_message(
             user_message=message.message,
-            context=message.context
+            context=message.context,
+            user_id=message.user_id
         )
+        record_turn("chat", time.perf_counter() - started, result["source"])
         
         return ChatResponse(
             response=result["response"],
             confidence=result["confidence"],
             source=result["source"],
             timestamp=result["timestamp"],
-            conversation_id=result.get("conversation_id")
+            conversation_id=result.get("conversation_id"),
+            trace_id=current_trace_id()
         )
         
     except Exception as e:
+        record_turn("chat", time.perf_counter() - started, "error")
         raise HTTPException(status_code=500, detail=f"Chat processing error: {str(e)}")
 
+@router.post("/batch")
+async def chat_batch(batch: ChatBatch):
+    """Answer many messages at once, streaming NDJSON results as each completes
+
+    Drafts run `concurrency` at a time (default BATCH_CONCURRENCY); lines
+    arrive in completion order and carry the item's index. Once every draft
+    is done the exchanges are saved in one transaction and a final summary
+    line lists the conversation ids by index.
+    """
+    concurrency = batch_concurrency(batch.concurrency, len(batch.items))
+    trace_id = current_trace_id()
+    
+    async def draft(item: ChatMessage):
+        started = time.perf_counter()
+        try:
+            result = await jarvis_llm.draft_response(item.message, item.context, item.user_id)
+        except Exception:
+            record_turn("chat", time.perf_counter() - started, "error")
+            raise
+        record_turn("chat", time.perf_counter() - started, result["source"])
+        return result, time.perf_counter() - started
+    
+    async def results():
+        started = time.perf_counter()
+        drafts: Dict[int, Dict] = {}
+        async for index, outcome, error in run_bounded(batch.items, draft, concurrency):
+            if error is not None:
+                yield ndjson({"type": "result", "index": index, "ok": False,
+                              "error": f"Chat processing error: {error}"})
+                continue
+            result, elapsed = outcome
+            drafts[index] = result
+            yield ndjson({"type": "result", "index": index, "ok": True,
+                          "response": result["response"], "confidence": result["confidence"],
+                          "source": result["source"], "timestamp": result["timestamp"],
+                          "elapsed_ms": round(elapsed * 1000, 1)})
+        
+        summary = {"type": "summary", "items": len(batch.items), "ok": len(drafts),
+                   "failed": len(batch.items) - len(drafts), "concurrency": concurrency,
+                   "conversation_ids": {}, "trace_id": trace_id}
+        try:
+            order = sorted(drafts)
+            committed = await asyncio.to_thread(jarvis_llm.commit_responses, [
+                (batch.items[i].message, drafts[i], batch.items[i].context, batch.items[i].user_id)
+                for i in order])
+            summary["conversation_ids"] = {i: result["conversation_id"]
+                                           for i, result in zip(order, committed)
+                                           if result.get("conversation_id") is not None}
+        except Exception as e:
+            summary["error"] = f"Saving conversations failed: {e}"
+        summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield ndjson(summary)
+    
+    return StreamingResponse(results(), media_type=NDJSON_MEDIA_TYPE,
+                             headers={"Cache-Control": "no-store"})
+
 @router.get("/history")
 async def get_chat_history(limit: int = 20):
     """Get recent chat history"""
@@ -65,6 +138,57 @@ async def get_chat_history(limit: int = 20):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving chat history: {str(e)}")
 
+def _export(table: str, format: str, gzip: bool, since: Optional[datetime],
+            until: Optional[datetime], user_id: Optional[str] = None) -> StreamingResponse:
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    filename = export_filename(table, format, gzip)
+    return StreamingResponse(
+        export_rows(table, format, gzip, since, until, user_id),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                 "Cache-Control": "no-store"},
+    )
+
+async def _import(table: str, request: Request, format: Optional[str]) -> Dict:
+    format = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    gzipped = True if request.headers.get("content-encoding") == "gzip" else None
+    try:
+        return await import_rows(table, request.stream(), format, gzipped)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Import error: {str(e)}")
+
+@router.get("/export")
+async def export_conversations(format: str = "ndjson", gzip: bool = False, since: Optional[datetime] = None,
+                               until: Optional[datetime] = None, user_id: Optional[str] = None):
+    """Stream conversations as NDJSON or CSV (optionally gzipped) in constant memory
+
+    since/until (ISO 8601) bound the conversation timestamp; until is exclusive.
+    """
+    return _export("conversations", format, gzip, since, until, user_id)
+
+@router.post("/import")
+async def import_conversations(request: Request, format: Optional[str] = None):
+    """Bulk-load conversations from a streamed NDJSON or CSV body (gzip detected)
+
+    Accepts the export format; ids are reassigned. Rows are inserted in
+    batches as they arrive and bad records are skipped and reported.
+    """
+    return await _import("conversations", request, format)
+
+@router.get("/learn/export")
+async def export_learning(format: str = "ndjson", gzip: bool = False, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None):
+    """Stream learned patterns as NDJSON or CSV; since/until bound created_at"""
+    return _export("learning", format, gzip, since, until)
+
+@router.post("/learn/import")
+async def import_learning(request: Request, format: Optional[str] = None):
+    """Bulk-load learned patterns from a streamed NDJSON or CSV body (gzip detected)"""
+    return await _import("learning", request, format)
+
 @router.post("/learn")
 async def learn_pattern(question: str, answer: str, category: str = "general"):
     """Teach the AI a new pattern"""
@@ -0,0 +1,93 @@
+"""
+Admin diagnostics routes for SMASH Cloud Voice AI
+"""
+
+# Event-loop lag, CPU profiling and memory snapshot endpoints, STT cache reset
+import asyncio
+import hmac
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from core.config import get_settings
+from core.diagnostics import loop_monitor, profiler, memory_tracker
+from core.stt_cache import stt_cache
+
+settings = get_settings()
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Diagnostics need ADMIN_TOKEN set and sent back as X-Admin-Token"""
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="Diagnostics disabled: set ADMIN_TOKEN")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/loop-lag")
+async def loop_lag(stacks: bool = True):
+    """Event-loop lag summary and recent stalls with the blocking stack"""
+    return loop_monitor.snapshot(stacks=stacks)
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(seconds: float = 5.0, mode: str = "sample", format: str = "text",
+                  limit: int = 30, threads: str = "loop"):
+    """Profile the running server for N seconds
+
+    mode=sample (wall-clock stack sampling) or cprofile; format=text (top
+    functions) or collapsed (flamegraph.pl / speedscope input, sample mode only).
+    """
+    if mode not in ("sample", "cprofile"):
+        raise HTTPException(status_code=400, detail="mode must be sample or cprofile")
+    if format not in ("text", "collapsed") or (format == "collapsed" and mode != "sample"):
+        raise HTTPException(status_code=400, detail="format must be text, or collapsed with mode=sample")
+    if threads not in ("loop", "all"):
+        raise HTTPException(status_code=400, detail="threads must be loop or all")
+    if profiler.busy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return await profiler.capture(seconds, mode=mode, output=format, limit=limit,
+                                  all_threads=threads == "all")
+
+@router.post("/memory/start")
+async def memory_start(frames: int = 1):
+    """Start tracemalloc (if needed) and take the baseline snapshot"""
+    # Snapshots walk every traced allocation, so keep them off the event loop
+    return await asyncio.to_thread(memory_tracker.start, max(1, min(frames, 25)))
+
+@router.post("/memory/baseline")
+async def memory_baseline():
+    if not memory_tracker.tracing:
+        raise HTTPException(status_code=409, detail="Memory tracing is not running")
+    return await asyncio.to_thread(memory_tracker.reset_baseline)
+
+@router.get("/memory/snapshot")
+async def memory_snapshot(limit: int = 25, group_by: str = "lineno"):
+    """Largest live allocations by line (or file/traceback)"""
+    if not memory_tracker.tracing:
+        raise HTTPException(status_code=409, detail="Memory tracing is not running")
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    return await asyncio.to_thread(memory_tracker.top, limit, group_by)
+
+@router.get("/memory/diff")
+async def memory_diff(limit: int = 25, group_by: str = "lineno"):
+    """Allocation growth since the baseline"""
+    if not memory_tracker.tracing or memory_tracker.baseline is None:
+        raise HTTPException(status_code=409, detail="Memory tracing is not running")
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    return await asyncio.to_thread(memory_tracker.diff, limit, group_by)
+
+@router.post("/memory/stop")
+async def memory_stop():
+    """Stop tracemalloc and drop the baseline"""
+    return memory_tracker.stop()
+
+@router.delete("/stt-cache")
+async def stt_cache_clear():
+    """Drop cached transcripts (e.g. after changing the Whisper model); this worker and the shared file"""
+    await asyncio.to_thread(stt_cache.clear)
+    return stt_cache.get_stats()
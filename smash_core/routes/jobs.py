@@ -0,0 +1,147 @@
+"""
+Background job routes for SMASH Cloud Voice AI
+"""
+
+# Submit, follow, fetch and cancel long-running TTS, transcription and chat batches
+import asyncio
+import json
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from core.config import get_settings
+from core.audio_http import audio_file_response
+from core.jobs import FINISHED, job_manager, job_to_dict
+from core.database import db_manager
+
+router = APIRouter()
+settings = get_settings()
+
+class TtsJob(BaseModel):
+    text: str
+    voice: Optional[str] = None  # Piper voice; the user's profile voice when omitted
+    voice_id: Optional[str] = None  # ElevenLabs voice, used when ELEVENLABS_API_KEY is set
+    user_id: Optional[str] = None
+
+class ChatJobItem(BaseModel):
+    message: str
+    context: Optional[Dict] = None
+    user_id: Optional[str] = None
+
+class ChatBatchJob(BaseModel):
+    items: List[ChatJobItem]
+    concurrency: Optional[int] = None
+
+class JobRequest(BaseModel):
+    kind: str
+    params: Dict = {}
+
+async def _job_or_404(job_id: str):
+    job = await asyncio.to_thread(db_manager.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _validate(kind: str, params: Dict) -> Dict:
+    """Check a JSON job's parameters and its size limits"""
+    try:
+        if kind == "tts":
+            parsed = TtsJob(**params)
+            if not parsed.text.strip():
+                raise HTTPException(status_code=400, detail="text is empty")
+            if len(parsed.text) > settings.job_max_text_chars:
+                raise HTTPException(status_code=413, detail=f"text is longer than "
+                                                            f"{settings.job_max_text_chars} characters")
+        elif kind == "chat_batch":
+            parsed = ChatBatchJob(**params)
+            if not parsed.items:
+                raise HTTPException(status_code=400, detail="Batch has no items")
+            if len(parsed.items) > settings.job_max_items:
+                raise HTTPException(status_code=413, detail=f"Batch has {len(parsed.items)} items; "
+                                                            f"the limit is {settings.job_max_items}")
+        elif kind == "transcribe":
+            raise HTTPException(status_code=400, detail="transcribe jobs take a multipart upload "
+                                                        "(audio_file, kind=transcribe)")
+        else:
+            return params
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+    return parsed.dict()
+
+@router.post("", status_code=202)
+async def submit_job(request: Request):
+    """Queue a background job and return it immediately
+
+    JSON {"kind": "tts" | "chat_batch", "params": {...}}, or a multipart
+    upload with audio_file (and optionally kind=transcribe, user_id) for a
+    transcription. Follow it with GET /api/jobs/{id} or its /events stream.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        audio_file = form.get("audio_file")
+        if audio_file is None or isinstance(audio_file, str):
+            raise HTTPException(status_code=400, detail="audio_file is required")
+        kind = form.get("kind") or "transcribe"
+        params = {"filename": audio_file.filename, "content_type": audio_file.content_type,
+                  "user_id": form.get("user_id")}
+        job = await job_manager.submit(kind, params, upload=audio_file.file)
+    else:
+        try:
+            body = JobRequest(**await request.json())
+        except (ValueError, ValidationError, TypeError):
+            raise HTTPException(status_code=400, detail='Expected JSON {"kind": ..., "params": {...}}')
+        job = await job_manager.submit(body.kind, _validate(body.kind, body.params))
+    return JSONResponse(job_to_dict(job), status_code=202, headers={"Location": f"/api/jobs/{job.id}"})
+
+@router.get("")
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    """Most recent jobs, newest first, with worker pool stats"""
+    jobs = await asyncio.to_thread(db_manager.list_jobs, status, max(1, min(limit, 500)))
+    return {"jobs": [job_to_dict(job) for job in jobs], "stats": await job_manager.get_stats()}
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Status, progress and result location of one job"""
+    return job_to_dict(await _job_or_404(job_id))
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: "progress" on every change, then "done" with the finished job"""
+    await _job_or_404(job_id)
+
+    async def events():
+        async for snapshot in job_manager.watch(job_id):
+            if snapshot is None:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            event = "done" if snapshot["status"] in FINISHED else "progress"
+            yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/{job_id}/result")
+async def job_result(job_id: str, request: Request):
+    """The finished job's output: synthesized audio (Range-capable) or JSON"""
+    job = await _job_or_404(job_id)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    path = await asyncio.to_thread(job_manager.result_file, job)
+    if path is None:
+        raise HTTPException(status_code=410, detail="Job result is no longer available")
+    if (job.result_type or "").startswith("audio/"):
+        return await audio_file_response(request, path)
+    return FileResponse(path, media_type=job.result_type or "application/octet-stream",
+                        headers={"Cache-Control": "no-store"})
+
+@router.delete("/{job_id}")
+async def delete_job(job_id: str):
+    """Cancel a queued or running job; remove a finished one and its result"""
+    job = await _job_or_404(job_id)
+    if job.status in FINISHED:
+        await job_manager.delete(job_id)
+        return {"id": job_id, "deleted": True}
+    return job_to_dict(await job_manager.cancel(job_id))
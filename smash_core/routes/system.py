@@ -4,22 +4,41 @@ System management routes for SMASH Cloud Voice AI
 
 # System status and health check endpoints
 from fastapi import APIRouter, HTTPException, Depends
-from typing import Dict, List
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Dict, List, Optional
 import asyncio
-import httpx
+import json
+import time
 
 from core.config import get_settings
 from core.database import db_manager
+from core.audio_store import audio_store
+from core.startup import startup_report
+from core.state import state
+from core.health import health_prober
+from core.host_metrics import host_metrics
+from core.timeseries import timeseries, parse_duration
+from core.profiles import profile_cache
+from core.jobs import job_manager
+from core.upstreams import upstream_pools
 
 router = APIRouter()
 settings = get_settings()
 
+class PreferencesUpdate(BaseModel):
+    preferred_tone: Optional[str] = None
+    learning_enabled: Optional[bool] = None
+    context_memory_size: Optional[int] = None
+    custom_greeting: Optional[str] = None
+    voice_settings: Optional[Dict] = None
+
 @router.get("/status")
 async def system_status():
     """Get overall system status"""
     try:
-        # Get user preferences
-        user_prefs = db_manager.get_user_preferences()
+        # Default user's preferences, from the profile cache
+        profile = await profile_cache.get_async()
         
         return {
             "status": "online",
@@ -27,54 +46,114 @@ async def system_status():
             "voice_mode": settings.voice_mode,
             "learning_enabled": settings.learning_enabled,
             "user_preferences": {
-                "preferred_tone": user_prefs.preferred_tone if user_prefs else "jarvis",
-                "learning_enabled": user_prefs.learning_enabled if user_prefs else True,
+                "preferred_tone": profile.tone,
+                "learning_enabled": profile.learning_enabled,
                 "address_as": settings.address_user_as
             },
+            "profiles": profile_cache.get_stats(),
             "services": {
                 "whisper": settings.whisper_host,
                 "piper": settings.piper_host,
                 "ollama": settings.ollama_host,
                 "elevenlabs": "configured" if settings.elevenlabs_api_key else "not_configured"
-            }
+            },
+            "state": state.get_stats(),
+            "jobs": await job_manager.get_stats()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Status check error: {str(e)}")
 
 @router.get("/health")
-async def health_check():
-    """Health check for all services"""
-    health_status = {
-        "overall": "healthy",
-        "services": {},
-        "timestamp": asyncio.get_event_loop().time()
-    }
-    
-    # Check Whisper
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{settings.whisper_host}/health")
-            health_status["services"]["whisper"] = "healthy" if response.status_code == 200 else "unhealthy"
-    except:
-        health_status["services"]["whisper"] = "unreachable"
+async def health_check(history: bool = True):
+    """Health of every upstream, from the background prober's last round"""
+    return health_prober.snapshot(history=history)
+
+@router.get("/upstreams")
+async def upstream_pools_status():
+    """Every Whisper, Piper and Ollama endpoint: load, latency, ejection and models"""
+    return {name: pool.get_stats() for name, pool in upstream_pools.items()}
+
+@router.get("/metrics")
+async def host_metrics_snapshot(history: bool = False):
+    """Latest host sample (CPU, memory, disks, network, temperatures, alerts)"""
+    return host_metrics.snapshot(history=history)
+
+@router.get("/metrics/stream")
+async def host_metrics_stream():
+    """Server-sent events: one "metrics" event per host sample"""
+    async def events():
+        queue = host_metrics.subscribe()
+        try:
+            while True:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=15.0)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: metrics\ndata: {json.dumps(snapshot)}\n\n"
+        finally:
+            host_metrics.unsubscribe(queue)
     
-    # Check Piper
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/history")
+async def history_series():
+    """Recorded metric series and the archive resolutions kept for each"""
+    return timeseries.info()
+
+@router.get("/history/{name:path}")
+async def history_query(name: str, range: str = "24h", start: Optional[float] = None,
+                        end: Optional[float] = None, points: int = 1500,
+                        resolution: Optional[str] = None):
+    """min/avg/max points for one series over `range` (e.g. 24h, 7d, 90d) or start..end
+
+    The finest archive covering the window within `points` is used unless
+    `resolution` (raw, 1m, 15m, 1h) is given.
+    """
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{settings.piper_host}/health")
-            health_status["services"]["piper"] = "healthy" if response.status_code == 200 else "unhealthy"
-    except:
-        health_status["services"]["piper"] = "unreachable"
-    
-    # Check database
+        end = end or time.time()
+        start = start or end - parse_duration(range)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if resolution and resolution not in [archive for archive, _, _ in timeseries.layout]:
+        raise HTTPException(status_code=400, detail="resolution must be raw, 1m, 15m or 1h")
+    result = await asyncio.to_thread(timeseries.query, name, start, end, max(points, 1), resolution)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No history for {name}")
+    return result
+
+@router.get("/startup")
+async def startup_timings():
+    """Per-phase start-up timings and background warm-up status"""
+    return startup_report.snapshot()
+
+@router.get("/audio-store")
+async def audio_store_metrics():
+    """Get audio store disk usage and eviction metrics"""
+    return audio_store.get_metrics()
+
+@router.get("/preferences/{user_id}")
+async def get_preferences(user_id: str):
+    """A user's effective preferences (stored values over the configured defaults)"""
+    return (await profile_cache.get_async(user_id)).to_dict()
+
+@router.patch("/preferences/{user_id}")
+async def update_preferences(user_id: str, update: PreferencesUpdate):
+    """Change a user's preferences; the next chat or voice turn uses them"""
+    changes = update.dict(exclude_unset=True)
+    if "context_memory_size" in changes and not 1 <= (changes["context_memory_size"] or 0) <= 1000:
+        raise HTTPException(status_code=400, detail="context_memory_size must be between 1 and 1000")
+    if "voice_settings" in changes:
+        changes["voice_settings"] = json.dumps(changes["voice_settings"]) if changes["voice_settings"] else None
     try:
-        # Simple database test
-        convs = db_manager.get_recent_conversations(1)
-        health_status["services"]["database"] = "healthy"
-    except:
-        health_status["services"]["database"] = "unhealthy"
-    
-    return health_status
+        await asyncio.to_thread(db_manager.update_user_preferences, user_id, create=True, **changes)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Preferences update error: {str(e)}")
+    return (await profile_cache.get_async(user_id)).to_dict()
 
 @router.get("/learning/stats")
 async def learning_stats():
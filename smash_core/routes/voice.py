@@ -3,14 +3,22 @@ Voice API routes for real-time voice interaction
 """
 
 # Voice processing and TTS endpoints
-from fastapi import APIRouter, File, UploadFile, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, File, UploadFile, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi.responses import StreamingResponse
 import asyncio
 import io
+import uuid
 from typing import Dict, Optional
 
 from core.config import get_settings
-from core.voice_processor import VoiceProcessor
+from core.voice_processor import VoiceProcessor, turn_metrics
+from core.audio_store import audio_store
+from core.audio_http import audio_file_response
+from core.audio_codec import negotiate_output_codec, transport_metrics
+from core.audio_preprocess import audio_preprocessor
+from core.stt_cache import stt_cache
+from core.speculation import speculation_metrics
+from core.metrics import stage_timer, current_trace_id
 
 router = APIRouter()
 settings = get_settings()
@@ -23,43 +31,77 @@ def set_voice_processor(vp: VoiceProcessor):
     global voice_processor
     voice_processor = vp
 
+def client_audio_codec(request: Request) -> str:
+    """Codec the client can play, from X-Accept-Audio (JSON endpoints) or Accept"""
+    return negotiate_output_codec(
+        request.headers.get("x-accept-audio") or request.headers.get("accept")
+    )
+
 @router.post("/listen")
-async def process_voice_input(audio_file: UploadFile = File(...)):
-    """Process uploaded audio file for voice commands"""
+async def process_voice_input(request: Request, audio_file: UploadFile = File(...),
+                              user_id: Optional[str] = None):
+    """Process uploaded audio file for voice commands
+
+    Accepts WAV, Opus/OGG or FLAC uploads. Send X-Accept-Audio: audio/ogg (or
+    audio/flac) to receive compressed speech, and user_id to answer with that
+    user's tone, history and voice. The request runs as one
+    cancellable turn: if the client disconnects, upstream STT/LLM/TTS work stops.
+    """
     if not voice_processor:
         raise HTTPException(status_code=503, detail="Voice processor not initialized")
     
     try:
         # Read audio data
-        audio_data = await audio_file.read()
+        with stage_timer("receive", "http"):
+            audio_data = await audio_file.read()
         
-        # Process the audio
-        result = await voice_processor.process_audio_stream(audio_data)
+        # Process the audio as a turn that is cancelled if the client goes away
+        result = await voice_processor.run_turn(
+            voice_processor.process_audio_stream(
+                audio_data, output_codec=client_audio_codec(request), user_id=user_id
+            ),
+            owner=f"http-{uuid.uuid4().hex[:8]}",
+            is_disconnected=request.is_disconnected
+        )
         
         if result:
             return {
                 "success": True,
                 "response": result["text"],
                 "audio_url": result.get("audio_url"),
-                "timestamp": result["timestamp"]
+                "timestamp": result["timestamp"],
+                "transport": result.get("transport"),
+                "trace_id": result.get("trace_id")
             }
         else:
             return {
                 "success": False,
-                "message": "Could not process voice input"
+                "message": "Could not process voice input",
+                "trace_id": current_trace_id()
             }
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Voice processing error: {str(e)}")
 
 @router.post("/speak")
-async def text_to_speech(text: str):
-    """Convert text to speech"""
+async def text_to_speech(request: Request, text: str, stream: bool = False):
+    """Convert text to speech
+
+    With stream=true the synthesized audio is relayed back inline as it is generated.
+    """
     if not voice_processor:
         raise HTTPException(status_code=503, detail="Voice processor not initialized")
     
+    if stream:
+        opened = await voice_processor.stream_speech(text)
+        if not opened:
+            raise HTTPException(status_code=502, detail="Could not generate speech")
+        media_type, chunks = opened
+        return StreamingResponse(chunks, media_type=media_type,
+                                 headers={"Cache-Control": "no-store"})
+    
     try:
-        audio_url = await voice_processor.speak_response(text)
+        audio_url = await voice_processor.speak_response(text, client_audio_codec(request))
         
         if audio_url:
             return {
@@ -73,14 +115,13 @@ async def text_to_speech(text: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Speech generation error: {str(e)}")
 
-@router.get("/audio/{filename}")
-async def get_audio_file(filename: str):
-    """Serve audio files"""
-    file_path = f"static/{filename}"
-    try:
-        return FileResponse(file_path, media_type="audio/wav")
-    except FileNotFoundError:
+@router.api_route("/audio/{filename:path}", methods=["GET", "HEAD"])
+async def get_audio_file(filename: str, request: Request):
+    """Serve audio files with byte ranges, ETags and immutable caching"""
+    file_path = await asyncio.to_thread(audio_store.resolve, filename)
+    if not file_path:
         raise HTTPException(status_code=404, detail="Audio file not found")
+    return await audio_file_response(request, file_path)
 
 @router.post("/activate")
 async def activate_voice():
@@ -113,9 +154,14 @@ async def voice_status():
     
     return {
         "status": "active",
-        "listening": voice_processor.is_listening,
+        "listening": await voice_processor.get_listening(),
         "speaking": voice_processor.is_speaking,
         "ready": True,
         "voice_mode": settings.voice_mode,
-        "assistant_name": settings.assistant_name
+        "assistant_name": settings.assistant_name,
+        "transport": transport_metrics.snapshot(),
+        "preprocessing": audio_preprocessor.get_metrics(),
+        "stt_cache": stt_cache.get_stats(),
+        "speculation": speculation_metrics.snapshot(),
+        "turns": {**turn_metrics.snapshot(), "in_flight": len(voice_processor.turns)}
     }
@@ -2,7 +2,7 @@
 import { useState, useEffect } from "react";
 import { motion } from "framer-motion";
 import { Cpu, MemoryStick, HardDrive, FolderOpen, Bot, Settings, Clock, Activity, Cloud, Thermometer, Shield, Edit, Trash2, X, Monitor, Database, Bell, Palette, Wifi, Lock, Download, Upload, RefreshCw, User as UserIcon, ChevronDown, LogOut } from "lucide-react";
-import { PieChart, Pie, Cell, ResponsiveContainer, Tooltip } from "recharts";
+import { PieChart, Pie, Cell, ResponsiveContainer, Tooltip, AreaChart, Area, XAxis, YAxis } from "recharts";
 import { authService, type User } from "./lib/auth";
 import { fileDatabaseService } from "./lib/fileDatabase";
 import LoginScreen from "./components/LoginScreen";
@@ -22,25 +22,24 @@ interface FileItem {
 import AdminPanel from "./components/AdminPanel";
 import AiConsole from "./components/AiConsole";
 
-// Stable stats generation
-let baseStats = {
-  cpu: 25,
-  ram: 52,
-  disk: 12
-};
-
-function generateRandomStats() {
-  // Add small realistic variations
-  const cpuVariation = (Math.random() - 0.5) * 6; // +/- 3%
-  const ramVariation = (Math.random() - 0.5) * 8; // +/- 4%
-  
-  baseStats.cpu = Math.max(15, Math.min(35, baseStats.cpu + cpuVariation));
-  baseStats.ram = Math.max(40, Math.min(65, baseStats.ram + ramVariation));
-  
+// Host stats pushed by smash_core's metrics collector
+interface HostStats {
+  cpu: number;
+  ram: number;
+  disk: number;
+}
+
+const EMPTY_STATS: HostStats = { cpu: 0, ram: 0, disk: 0 };
+
+function statsFromSnapshot(snapshot: any): HostStats | null {
+  if (!snapshot?.available) return null;
+  // Prefer the data disk when it is mounted, otherwise the root filesystem
+  const disks = (snapshot.disks || []).filter((disk: any) => disk.percent !== undefined);
+  const disk = disks.find((d: any) => d.path === '/mnt/smash_data') || disks[0];
   return {
-    cpu: Math.floor(baseStats.cpu),
-    ram: Math.floor(baseStats.ram),
-    disk: baseStats.disk
+    cpu: Math.round(snapshot.cpu.percent),
+    ram: Math.round(snapshot.memory.percent),
+    disk: disk ? Math.round(disk.percent) : 0
   };
 }
 
@@ -492,6 +491,91 @@ function StoragePie({ diskUsed }: { diskUsed: number }) {
   );
 }
 
+// History Chart Component (server-side round-robin history)
+const HISTORY_SERIES = [
+  { key: 'host.cpu', label: 'CPU', unit: '%' },
+  { key: 'host.memory', label: 'Memory', unit: '%' },
+  { key: 'upstream.ollama.latency', label: 'Ollama', unit: 'ms' },
+];
+const HISTORY_RANGES = ['24h', '7d', '90d'];
+
+function HistoryChart() {
+  const [series, setSeries] = useState(HISTORY_SERIES[0]);
+  const [range, setRange] = useState('24h');
+  const [points, setPoints] = useState<{ ts: number; min: number; avg: number; max: number }[]>([]);
+
+  useEffect(() => {
+    let cancelled = false;
+    const load = () => {
+      fetch(`/api/system/history/${series.key}?range=${range}&points=500`)
+        .then(response => response.ok ? response.json() : { points: [] })
+        .then(data => {
+          if (!cancelled) {
+            setPoints(data.points.map(([ts, min, avg, max]: number[]) => ({ ts: ts * 1000, min, avg, max })));
+          }
+        })
+        .catch(() => !cancelled && setPoints([]));
+    };
+    load();
+    const timer = setInterval(load, 60000);
+    return () => { cancelled = true; clearInterval(timer); };
+  }, [series, range]);
+
+  const formatTime = (ts: number) => range === '24h'
+    ? new Date(ts).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
+    : new Date(ts).toLocaleDateString([], { month: 'short', day: 'numeric' });
+
+  const buttonStyle = (active: boolean) => ({
+    padding: '4px 10px',
+    borderRadius: '6px',
+    border: active ? '1px solid var(--accent-primary)' : '1px solid var(--border-primary)',
+    background: active ? 'var(--accent-bg)' : 'transparent',
+    color: active ? 'var(--text-primary)' : 'var(--text-secondary)',
+    fontSize: '12px',
+    cursor: 'pointer'
+  });
+
+  return (
+    <div className="glass card-hover" style={{ padding: '24px' }}>
+      <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '16px' }}>
+        <h3 style={{ fontSize: '18px', fontWeight: '600', color: 'var(--text-primary)' }}>History</h3>
+        <div style={{ display: 'flex', gap: '6px' }}>
+          {HISTORY_RANGES.map(option => (
+            <button key={option} style={buttonStyle(option === range)} onClick={() => setRange(option)}>{option}</button>
+          ))}
+        </div>
+      </div>
+      <div style={{ display: 'flex', gap: '6px', marginBottom: '16px' }}>
+        {HISTORY_SERIES.map(option => (
+          <button key={option.key} style={buttonStyle(option.key === series.key)} onClick={() => setSeries(option)}>
+            {option.label}
+          </button>
+        ))}
+      </div>
+      <div style={{ height: '200px' }}>
+        {points.length ? (
+          <ResponsiveContainer width="100%" height="100%">
+            <AreaChart data={points}>
+              <XAxis dataKey="ts" tickFormatter={formatTime} stroke="var(--text-secondary)" fontSize={11} minTickGap={40} />
+              <YAxis stroke="var(--text-secondary)" fontSize={11} width={40} />
+              <Tooltip
+                labelFormatter={(ts) => new Date(Number(ts)).toLocaleString()}
+                formatter={(value) => `${Number(value).toFixed(1)}${series.unit}`}
+              />
+              <Area type="monotone" dataKey="max" stroke="#8b5cf6" fill="#8b5cf6" fillOpacity={0.15} />
+              <Area type="monotone" dataKey="avg" stroke="#3b82f6" fill="#3b82f6" fillOpacity={0.3} />
+            </AreaChart>
+          </ResponsiveContainer>
+        ) : (
+          <div style={{ height: '100%', display: 'flex', alignItems: 'center', justifyContent: 'center', color: 'var(--text-secondary)', fontSize: '14px' }}>
+            No history recorded yet
+          </div>
+        )}
+      </div>
+    </div>
+  );
+}
+
 // File Manager Component with Real-time Database
 function FileManager({ currentUser }: { currentUser: User | null }) {
   const [files, setFiles] = useState<FileItem[]>([]);
@@ -1847,7 +1931,7 @@ function SettingsPanel({ settings, onSettingsChange }: SettingsPanelProps) {
 }
 
 export default function App() {
-  const [stats, setStats] = useState(generateRandomStats());
+  const [stats, setStats] = useState<HostStats>(EMPTY_STATS);
   const [currentView, setCurrentView] = useState('dashboard');
   const [showAdminPanel, setShowAdminPanel] = useState(false);
   const [notification, setNotification] = useState<{ message: string; type: 'success' | 'error' } | null>(null);
@@ -1921,12 +2005,15 @@ export default function App() {
     root.style.fontSize = fontSizeMap[settings.fontSize as keyof typeof fontSizeMap] || '16px';
   }, [settings.theme, settings.fontSize]);
 
+  // One push stream instead of polling; EventSource reconnects on its own
   useEffect(() => {
-    const interval = setInterval(() => {
-      setStats(generateRandomStats());
-    }, 3000);
+    const source = new EventSource('/api/system/metrics/stream');
+    source.addEventListener('metrics', (event) => {
+      const next = statsFromSnapshot(JSON.parse((event as MessageEvent).data));
+      if (next) setStats(next);
+    });
 
-    return () => clearInterval(interval);
+    return () => source.close();
   }, []);
 
   // Settings change handler
@@ -2091,6 +2178,17 @@ export default function App() {
               <StoragePie diskUsed={stats.disk} />
             </motion.div>
 
+            {/* Metric History */}
+            {settings.showSystemStats && (
+              <motion.div
+                initial={{ opacity: 0 }}
+                animate={{ opacity: 1 }}
+                transition={{ duration: 0.5, delay: 0.35 }}
+              >
+                <HistoryChart />
+              </motion.div>
+            )}
+
             {/* AI Console - Dashboard View (Chat Mode) */}
             <motion.div
               initial={{ opacity: 0 }}
@@ -2,6 +2,12 @@ import React, { useState, useRef, useEffect } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { Mic, MicOff, Volume2, Loader } from 'lucide-react';
 
+// Upload/playback codecs the voice API can negotiate, most compact first
+const RECORDING_MIME_TYPES = ['audio/ogg;codecs=opus', 'audio/ogg'];
+const PLAYBACK_ACCEPT = ['audio/ogg', 'audio/flac', 'audio/wav']
+  .filter(type => typeof Audio === 'undefined' || new Audio().canPlayType(type) !== '')
+  .join(', ');
+
 interface VoiceMicButtonProps {
   onTranscript?: (text: string) => void;
   onResponse?: (response: string) => void;
@@ -78,7 +84,9 @@ export default function VoiceMicButton({
   const startCustomRecording = async () => {
     try {
       const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-      mediaRecorderRef.current = new MediaRecorder(stream);
+      // Prefer compressed Opus/OGG uploads; the server decodes them for Whisper
+      const mimeType = RECORDING_MIME_TYPES.find(type => MediaRecorder.isTypeSupported(type));
+      mediaRecorderRef.current = mimeType ? new MediaRecorder(stream, { mimeType }) : new MediaRecorder(stream);
       audioChunksRef.current = [];
 
       mediaRecorderRef.current.ondataavailable = (event) => {
@@ -86,7 +94,7 @@ export default function VoiceMicButton({
       };
 
       mediaRecorderRef.current.onstop = async () => {
-        const audioBlob = new Blob(audioChunksRef.current, { type: 'audio/wav' });
+        const audioBlob = new Blob(audioChunksRef.current, { type: mimeType || 'audio/wav' });
         await processAudioBlob(audioBlob);
         stream.getTracks().forEach(track => track.stop());
       };
@@ -114,10 +122,12 @@ export default function VoiceMicButton({
   const processAudioBlob = async (audioBlob: Blob) => {
     try {
       const formData = new FormData();
-      formData.append('audio_file', audioBlob, 'recording.wav');
+      const extension = audioBlob.type.startsWith('audio/ogg') ? 'ogg' : 'wav';
+      formData.append('audio_file', audioBlob, `recording.${extension}`);
 
       const response = await fetch('/api/voice/listen', {
         method: 'POST',
+        headers: { 'X-Accept-Audio': PLAYBACK_ACCEPT },
         body: formData,
       });
 